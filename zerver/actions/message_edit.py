@@ -26,8 +26,10 @@ from zerver.actions.message_send import (
 from zerver.actions.uploads import AttachmentChangeResult, check_attachment_reference_change
 from zerver.actions.user_topics import bulk_do_set_user_topic_visibility_policy
 from zerver.lib import utils
+from zerver.lib.cache import flush_search_result_generations
 from zerver.lib.exceptions import (
     JsonableError,
+    MarkdownRenderingError,
     MessageMoveError,
     MessagesNotAllowedInEmptyTopicError,
     PreviousMessageContentMismatchedError,
@@ -37,6 +39,7 @@ from zerver.lib.exceptions import (
 )
 from zerver.lib.markdown import MessageRenderingResult, topic_links
 from zerver.lib.markdown import version as markdown_version
+from zerver.lib.markdown.incremental import render_edited_message_markdown
 from zerver.lib.mention import MentionBackend, MentionData, silent_mention_syntax_for_user
 from zerver.lib.message import (
     access_message,
@@ -82,6 +85,7 @@ from zerver.lib.topic import (
 )
 from zerver.lib.topic_link_util import get_stream_topic_link_syntax
 from zerver.lib.types import DirectMessageEditRequest, EditHistoryEvent, StreamMessageEditRequest
+from zerver.lib.unread_conversations import add_unread_conversation_messages
 from zerver.lib.url_encoding import stream_message_url
 from zerver.lib.user_message import bulk_insert_all_ums
 from zerver.lib.user_topics import get_users_with_user_topic_visibility_policy
@@ -742,6 +746,7 @@ def do_update_message(
             save_message_for_edit_use_case(message=target_message)
 
             event["message_ids"] = sorted(update_message_cache([target_message]))
+            flush_search_result_generations([target_message.realm_id])
             users_to_be_notified = list(map(user_info, ums))
             send_event_on_commit(user_profile.realm, event, users_to_be_notified)
 
@@ -950,8 +955,15 @@ def do_update_message(
     # freshly-fetched-from-the-database changed messages.
     changed_messages = save_changes_for_propagation_mode()
 
+    if message_edit_request.is_message_moved:
+        # The moved messages' UnreadConversation rows for the original
+        # conversation are left stale, which is safe; the new one needs
+        # them added.
+        add_unread_conversation_messages(changed_message_ids)
+
     realm_id = target_message.realm_id
     event["message_ids"] = sorted(update_message_cache(changed_messages, realm_id))
+    flush_search_result_generations([realm_id])
 
     # The following blocks arranges that users who are subscribed to a
     # stream and can see history from before they subscribed get
@@ -1637,12 +1649,22 @@ def check_update_message(
         # the cross-realm bots never edit messages, this should be
         # always correct.
         # Note: If rendering fails, the called code will raise a JsonableError.
-        rendering_result = render_incoming_message(
-            message,
-            message_edit_request.content,
-            user_profile.realm,
-            mention_data=mention_data,
-        )
+        try:
+            rendering_result = render_edited_message_markdown(
+                message,
+                message_edit_request.content,
+                user_profile.realm,
+                mention_data,
+            )
+        except MarkdownRenderingError:
+            raise JsonableError(_("Unable to render message"))
+        if rendering_result is None:
+            rendering_result = render_incoming_message(
+                message,
+                message_edit_request.content,
+                user_profile.realm,
+                mention_data=mention_data,
+            )
         links_for_embed |= rendering_result.links_for_preview
 
         if message.is_channel_message and rendering_result.mentions_stream_wildcard:
@@ -18,7 +18,18 @@ from zerver.lib.message import (
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.stream_subscription import get_subscribed_stream_recipient_ids_for_user
 from zerver.lib.topic import filter_by_topic_name_via_message
-from zerver.lib.user_message import DEFAULT_HISTORICAL_FLAGS, create_historical_user_messages
+from zerver.lib.unread_conversations import (
+    add_unread_conversation_messages,
+    delete_unread_summary,
+    remove_unread_conversation_messages,
+)
+from zerver.lib.user_message import (
+    DEFAULT_HISTORICAL_FLAGS,
+    create_historical_user_messages,
+    get_sparse_unread_messages,
+    mark_all_sparse_messages_as_read,
+    mark_sparse_messages_as_read,
+)
 from zerver.models import Message, PushDevice, PushDeviceToken, Recipient, UserMessage, UserProfile
 from zerver.tornado.django_api import send_event_on_commit, send_event_rollback_unsafe
 
@@ -90,6 +101,13 @@ def do_mark_all_as_read(user_profile: UserProfile, *, timeout: float | None = No
             if updated_count < batch_size:
                 break
 
+    with transaction.atomic(durable=True):
+        count += mark_all_sparse_messages_as_read(user_profile)
+
+    # Rather than tracking each batch above, we drop the user's
+    # summary; it would now be nearly empty.
+    delete_unread_summary(user_profile)
+
     event = asdict(
         ReadMessagesEvent(
             messages=[],  # we don't send messages, since the client reloads anyway
@@ -124,12 +142,21 @@ def do_mark_stream_messages_as_read(
 
     message_ids = list(query.values_list("message_id", flat=True))
 
-    if len(message_ids) == 0:
+    sparse_query = get_sparse_unread_messages(user_profile).filter(recipient_id=stream_recipient_id)
+    if topic_name:
+        sparse_query = sparse_query.filter(subject__iexact=topic_name)
+    sparse_read_message_ids = mark_sparse_messages_as_read(
+        user_profile, list(sparse_query.values_list("id", flat=True))
+    )
+
+    if len(message_ids) == 0 and len(sparse_read_message_ids) == 0:
         return 0
 
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
-    )
+    ) + len(sparse_read_message_ids)
+    remove_unread_conversation_messages(user_profile, message_ids)
+    message_ids.extend(sparse_read_message_ids)
 
     event = asdict(
         ReadMessagesEvent(
@@ -173,6 +200,7 @@ def do_mark_muted_user_messages_as_read(
     count = query.update(
         flags=F("flags").bitor(UserMessage.flags.read),
     )
+    remove_unread_conversation_messages(user_profile, message_ids)
 
     event = asdict(
         ReadMessagesEvent(
@@ -365,6 +393,32 @@ def do_update_message_flags(
             )
         }
 
+        # In streams using sparse_user_messages, messages without a
+        # UserMessage row may nonetheless be unread, rather than
+        # having the read | historical flags of other rowless messages.
+        rowless_message_ids = [message_id for message_id in messages if message_id not in ums]
+        sparse_unread_message_ids: set[int] = set()
+        if rowless_message_ids:
+            sparse_unread_message_ids = set(
+                get_sparse_unread_messages(user_profile)
+                .filter(id__in=rowless_message_ids)
+                .values_list("id", flat=True)
+            )
+
+        sparse_read_message_ids: list[int] = []
+        if flag == "read" and is_adding and sparse_unread_message_ids:
+            sparse_read_message_ids = mark_sparse_messages_as_read(
+                user_profile, sparse_unread_message_ids
+            )
+            sparse_unread_message_ids -= set(sparse_read_message_ids)
+
+        def current_flags(message_id: int) -> int:
+            if message_id in ums:
+                return int(ums[message_id].flags)
+            if message_id in sparse_unread_message_ids:
+                return 0
+            return DEFAULT_HISTORICAL_FLAGS
+
         # Filter out rows that already have the desired flag.  We do
         # this here, rather than in the original database query,
         # because not all flags have database indexes and we want to
@@ -372,10 +426,9 @@ def do_update_message_flags(
         messages = [
             message_id
             for message_id in messages
-            if (int(ums[message_id].flags) if message_id in ums else DEFAULT_HISTORICAL_FLAGS)
-            & flagattr
-            != flag_target
+            if current_flags(message_id) & flagattr != flag_target
         ]
+        messages.extend(sparse_read_message_ids)
         count = len(messages)
 
         if DEFAULT_HISTORICAL_FLAGS & flagattr != flag_target:
@@ -406,21 +459,40 @@ def do_update_message_flags(
             if len(historical_messages) != len(historical_message_ids):
                 raise JsonableError(_("Invalid message(s)"))
 
+            sparse_message_ids = historical_message_ids & sparse_unread_message_ids
             create_historical_user_messages(
                 user_id=user_profile.id,
-                message_ids=list(historical_message_ids),
+                message_ids=list(historical_message_ids - sparse_message_ids),
                 flagattr=flagattr,
                 flag_target=flag_target,
             )
+            if sparse_message_ids:
+                # These keep being unread, now via their UserMessage row.
+                create_historical_user_messages(
+                    user_id=user_profile.id,
+                    message_ids=list(sparse_message_ids),
+                    flagattr=flagattr,
+                    flag_target=flag_target,
+                    base_flags=0,
+                )
+                add_unread_conversation_messages(list(sparse_message_ids), [user_profile.id])
 
+        # The existing rows whose flag actually changes in this update.
+        updated_message_ids = set(messages) & set(ums.keys())
         to_update = UserMessage.objects.filter(
-            user_profile=user_profile, message_id__in=set(messages) & set(ums.keys())
+            user_profile=user_profile, message_id__in=updated_message_ids
         )
         if is_adding:
             to_update.update(flags=F("flags").bitor(flagattr))
         else:
             to_update.update(flags=F("flags").bitand(~flagattr))
 
+        if flag == "read":
+            if is_adding:
+                remove_unread_conversation_messages(user_profile, updated_message_ids)
+            else:
+                add_unread_conversation_messages(messages, [user_profile.id])
+
         event = {
             "type": "update_message_flags",
             "op": operation,
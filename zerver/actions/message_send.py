@@ -2,6 +2,7 @@ import logging
 from collections import defaultdict
 from collections.abc import Callable, Collection, Sequence
 from collections.abc import Set as AbstractSet
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import timedelta
 from email.headerregistry import Address
@@ -10,8 +11,9 @@ from typing import Any, TypedDict, cast
 import orjson
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 from django.db.models import Exists, F, OuterRef, Q, QuerySet
+from django.utils import translation
 from django.utils.html import escape
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
@@ -41,6 +43,7 @@ from zerver.lib.exceptions import (
 )
 from zerver.lib.markdown import MessageRenderingResult, render_message_markdown
 from zerver.lib.markdown import version as markdown_version
+from zerver.lib.markdown.rendering_context import get_realm_rendering_context
 from zerver.lib.mention import MentionBackend, MentionData, silent_mention_syntax_for_user
 from zerver.lib.message import (
     SendMessageRequest,
@@ -752,15 +755,12 @@ def build_message_send_dict(
     # For persona mentions, add the persona owner to the mentioned users
     # so they receive notifications
     if rendering_result.mentions_persona_ids:
-        from zerver.models.personas import UserPersona
-
-        persona_owner_ids = set(
-            UserPersona.objects.filter(
-                id__in=rendering_result.mentions_persona_ids,
-                is_active=True,
-            ).values_list("user_id", flat=True)
+        mention_index = get_realm_rendering_context(realm.id).get_mention_index(
+            message.recipient.type_id if message.is_channel_message else None
+        )
+        rendering_result.mentions_user_ids.update(
+            mention_index.get_persona_owner_ids(rendering_result.mentions_persona_ids)
         )
-        rendering_result.mentions_user_ids.update(persona_owner_ids)
 
     # Only send data to Tornado about stream or topic wildcard mentions if message
     # rendering determined the message had an actual stream or topic wildcard
@@ -850,6 +850,7 @@ def create_user_messages(
     mark_as_read_user_ids: set[int],
     limit_unread_user_ids: set[int] | None,
     topic_participant_user_ids: set[int],
+    sparse_user_messages: bool = False,
 ) -> list[UserMessageLite]:
     # These properties on the Message are set via
     # render_message_markdown by code in the Markdown inline patterns
@@ -881,6 +882,12 @@ def create_user_messages(
     #
     # See https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html#soft-deactivation
     # for details on this system.
+    #
+    # Streams using sparse_user_messages get the same treatment for
+    # all of their subscribers, not just long_term_idle ones; there,
+    # the missing rows are never created, and unread state comes from
+    # Subscription.sparse_read_message_id instead.  Whispers are never
+    # sparse, since only some subscribers can see them.
     user_messages = []
     for user_profile_id in um_eligible_user_ids:
         flags = base_flags
@@ -899,7 +906,7 @@ def create_user_messages(
             flags |= UserMessage.flags.topic_wildcard_mentioned
 
         if (
-            user_profile_id in long_term_idle_user_ids
+            (sparse_user_messages or user_profile_id in long_term_idle_user_ids)
             and user_profile_id not in stream_push_user_ids
             and user_profile_id not in stream_email_user_ids
             and user_profile_id not in followed_topic_push_user_ids
@@ -967,6 +974,58 @@ def get_active_presence_idle_user_ids(
     return filter_presence_idle_user_ids(user_ids)
 
 
+# Batches smaller than this are prepared serially, since starting
+# threads and opening their database connections costs more than
+# it saves.
+PARALLEL_PREP_MIN_BATCH_SIZE = 20
+PARALLEL_PREP_MAX_WORKERS = 4
+
+
+def prep_messages_in_parallel(
+    prep_message_functions: Sequence[Callable[[], SendMessageRequest | None]],
+) -> list[SendMessageRequest | None]:
+    """Runs a batch of message-preparation calls (check_message or the
+    internal_prep_* functions, bound with functools.partial) and
+    returns their results in order, for passing to do_send_messages.
+
+    Preparing a message -- rendering it and resolving its recipients
+    -- is the bulk of the cost of sending a batch, and is mostly
+    read-only database work, so for large batches we spread it over a
+    few threads.  Each thread uses its own database connection,
+    which it closes once its share of the batch is done; only the
+    writes in do_send_messages happen inside a transaction.
+
+    Those connections cannot see uncommitted writes, so if the caller
+    is inside a transaction, we prepare the messages serially in
+    this thread instead.
+    """
+    if len(prep_message_functions) < PARALLEL_PREP_MIN_BATCH_SIZE or connection.in_atomic_block:
+        return [prep_message() for prep_message in prep_message_functions]
+
+    language = translation.get_language()
+
+    def prep_chunk(
+        chunk: Sequence[Callable[[], SendMessageRequest | None]],
+    ) -> list[SendMessageRequest | None]:
+        try:
+            with override_language(language):
+                return [prep_message() for prep_message in chunk]
+        finally:
+            connection.close()
+
+    chunk_size = -(-len(prep_message_functions) // PARALLEL_PREP_MAX_WORKERS)
+    chunks = [
+        prep_message_functions[i : i + chunk_size]
+        for i in range(0, len(prep_message_functions), chunk_size)
+    ]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        return [
+            send_request
+            for chunk_send_requests in executor.map(prep_chunk, chunks)
+            for send_request in chunk_send_requests
+        ]
+
+
 @transaction.atomic(savepoint=False)
 def do_send_messages(
     send_message_requests_maybe_none: Sequence[SendMessageRequest | None],
@@ -1059,6 +1118,9 @@ def do_send_messages(
             mark_as_read_user_ids=mark_as_read_user_ids,
             limit_unread_user_ids=send_request.limit_unread_user_ids,
             topic_participant_user_ids=send_request.topic_participant_user_ids,
+            sparse_user_messages=send_request.stream is not None
+            and send_request.stream.uses_sparse_user_messages()
+            and send_request.message.whisper_recipients is None,
         )
 
         for um in user_messages:
@@ -66,9 +66,14 @@ def register_stream_puppet(
     return puppet
 
 
-def get_stream_puppets(stream: Stream) -> list[dict[str, str | int | None]]:
-    """Get all puppet names registered in a stream for autocomplete."""
+def get_stream_puppets(
+    stream: Stream, puppet_ids: list[int] | None = None
+) -> list[dict[str, str | int | None]]:
+    """Get the puppets registered in a stream for autocomplete; all of
+    them, or only those in puppet_ids."""
     puppets = StreamPuppet.objects.filter(stream=stream).order_by("-last_used")
+    if puppet_ids is not None:
+        puppets = puppets.filter(id__in=puppet_ids)
     return [
         {
             "id": puppet.id,
@@ -14,12 +14,7 @@ from zerver.actions.default_streams import (
     do_remove_streams_from_default_stream_group,
 )
 from zerver.actions.message_send import maybe_send_channel_events_notice
-from zerver.lib.cache import (
-    cache_delete_many,
-    cache_set,
-    display_recipient_cache_key,
-    to_dict_cache_key_id,
-)
+from zerver.lib.cache import cache_set, display_recipient_cache_key, flush_message_dicts
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.mention import silent_mention_syntax_for_user, silent_mention_syntax_for_user_group
 from zerver.lib.message import get_last_message_id
@@ -58,6 +53,7 @@ from zerver.lib.user_groups import (
     get_group_setting_value_for_audit_log_data,
     update_or_create_user_group_for_setting,
 )
+from zerver.lib.user_message import materialize_sparse_unread_user_messages
 from zerver.lib.users import (
     all_users_accessible_by_everyone_in_realm,
     get_subscribers_of_target_user_subscriptions,
@@ -265,7 +261,7 @@ def do_unarchive_stream(stream: Stream, new_name: str, *, acting_user: UserProfi
         realm_id=realm.id,
         recipient_id=stream.recipient_id,
     ).only("id")
-    cache_delete_many(to_dict_cache_key_id(message.id) for message in messages)
+    flush_message_dicts(message.id for message in messages)
 
     # Unset the is_web_public and is_realm_public cache on attachments,
     # since the stream is now private.
@@ -321,8 +317,7 @@ def bulk_delete_cache_keys(message_ids_to_clear: list[int]) -> None:
     while len(message_ids_to_clear) > 0:
         batch = message_ids_to_clear[0:5000]
 
-        keys_to_delete = [to_dict_cache_key_id(message_id) for message_id in batch]
-        cache_delete_many(keys_to_delete)
+        flush_message_dicts(batch)
 
         message_ids_to_clear = message_ids_to_clear[5000:]
 
@@ -504,13 +499,26 @@ def bulk_add_subs_to_db_with_logging(
     subs_to_add: list[SubInfo],
     subs_to_activate: list[SubInfo],
 ) -> None:
+    event_last_message_id = get_last_message_id()
+
+    # In streams using sparse_user_messages, messages sent before the
+    # user (re)subscribed must not count as unread.
+    for info in subs_to_add:
+        if info.stream.uses_sparse_user_messages():
+            info.sub.sparse_read_message_id = event_last_message_id
     Subscription.objects.bulk_create(info.sub for info in subs_to_add)
     sub_ids = [info.sub.id for info in subs_to_activate]
     Subscription.objects.filter(id__in=sub_ids).update(active=True)
+    sparse_sub_ids = [
+        info.sub.id for info in subs_to_activate if info.stream.uses_sparse_user_messages()
+    ]
+    if sparse_sub_ids:
+        Subscription.objects.filter(id__in=sparse_sub_ids).update(
+            sparse_read_message_id=event_last_message_id
+        )
 
     # Log subscription activities in RealmAuditLog
     event_time = timezone_now()
-    event_last_message_id = get_last_message_id()
 
     all_subscription_logs = [
         RealmAuditLog(
@@ -1528,7 +1536,7 @@ def do_rename_stream(stream: Stream, new_name: str, user_profile: UserProfile) -
     # Delete cache entries for everything else, which is cheaper and
     # clearer than trying to set them. display_recipient is the out of
     # date field in all cases.
-    cache_delete_many(to_dict_cache_key_id(message.id) for message in messages)
+    flush_message_dicts(message.id for message in messages)
 
     # We want to key these updates by id, not name, since id is
     # the immutable primary key, and obviously name is not.
@@ -1716,6 +1724,26 @@ def do_change_stream_message_retention_days(
     )
 
 
+@transaction.atomic(durable=True)
+def do_change_stream_sparse_user_messages(stream: Stream, sparse_user_messages: bool) -> None:
+    if stream.sparse_user_messages == sparse_user_messages:
+        return
+
+    assert stream.recipient_id is not None
+    if sparse_user_messages:
+        # Every existing message already has a UserMessage row for
+        # each subscriber who received it, so only messages sent from
+        # now on can be unread without one.
+        Subscription.objects.filter(recipient_id=stream.recipient_id).update(
+            sparse_read_message_id=get_last_message_id()
+        )
+    elif stream.uses_sparse_user_messages():
+        materialize_sparse_unread_user_messages(stream.recipient_id, stream.realm_id)
+
+    stream.sparse_user_messages = sparse_user_messages
+    stream.save(update_fields=["sparse_user_messages"])
+
+
 @transaction.atomic(durable=True)
 def do_set_stream_property(stream: Stream, name: str, value: Any, acting_user: UserProfile) -> None:
     old_value = getattr(stream, name)
@@ -1,7 +1,7 @@
 from django.utils.translation import gettext as _
 
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
-from zerver.lib.cache import cache_delete, to_dict_cache_key_id
+from zerver.lib.cache import flush_message_dicts
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message import (
     event_recipient_ids_for_action_on_messages,
@@ -64,7 +64,7 @@ def do_add_submessage(
     submessage.save()
 
     # Invalidate the message cache since submessages are cached with the message
-    cache_delete(to_dict_cache_key_id(message_id))
+    flush_message_dicts([message_id])
 
     # Determine and set the visibility_policy depending on 'automatically_follow_topics_policy'
     # and 'automatically_unmute_topics_policy'.
@@ -150,7 +150,7 @@ def do_delete_submessage(
         submessage.save(update_fields=["visible_to"])
 
     # Invalidate the message cache since submessages are cached with the message
-    cache_delete(to_dict_cache_key_id(message_id))
+    flush_message_dicts([message_id])
 
     # Send event to notify the user
     event = dict(
@@ -16,6 +16,7 @@ from bmemcached.exceptions import MemcachedException
 from django.conf import settings
 from django.core.cache import caches
 from django.core.cache.backends.base import BaseCache
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from typing_extensions import ParamSpec
 
@@ -544,6 +545,43 @@ def realm_user_dicts_cache_key(realm_id: int) -> str:
     return f"realm_user_dicts:{realm_id}"
 
 
+# The fields of UserProfile in a realm's user display table; see
+# zerver/lib/user_display_table.py.
+user_display_table_fields: list[str] = [
+    "id",
+    "full_name",
+    "email",
+    "delivery_email",
+    "recipient",
+    "avatar_source",
+    "avatar_version",
+    "is_mirror_dummy",
+    "email_address_visibility",
+]
+
+
+def user_display_table_cache_key(realm_id: int) -> str:
+    return f"user_display_table:{realm_id}"
+
+
+def user_display_table_generation_cache_key(realm_id: int) -> str:
+    # Process-local copies of a realm's user display table are
+    # validated against this generation token, which is flushed
+    # whenever a user in the realm changes one of its fields.
+    return f"user_display_table_generation:{realm_id}"
+
+
+def realm_state_section_cache_key(realm_id: int, section: str) -> str:
+    return f"realm_state_section:{realm_id}:{section}"
+
+
+def realm_state_section_generation_cache_key(realm_id: int, section: str) -> str:
+    # A realm's cached copy of a section of the initial state is
+    # validated against this generation token, which is flushed
+    # whenever an event changing the section is sent.
+    return f"realm_state_section_generation:{realm_id}:{section}"
+
+
 def get_muting_users_cache_key(muted_user_id: int) -> str:
     return f"muting_users_list:{muted_user_id}"
 
@@ -642,9 +680,14 @@ def bulk_flush_users(
     if changed(update_fields, realm_user_dict_fields):
         cache_keys_to_delete.add(realm_user_dicts_cache_key(realm.id))
 
+    if changed(update_fields, user_display_table_fields):
+        cache_keys_to_delete.add(user_display_table_generation_cache_key(realm.id))
+
     if changed(update_fields, ["is_active"]):
         cache_keys_to_delete.add(active_user_ids_cache_key(realm.id))
         cache_keys_to_delete.add(active_non_guest_user_ids_cache_key(realm.id))
+        # Personas of deactivated users are not mentionable.
+        cache_keys_to_delete.add(realm_rendering_context_version_cache_key(realm.id))
 
     if changed(update_fields, ["role"]):
         cache_keys_to_delete.add(active_non_guest_user_ids_cache_key(realm.id))
@@ -706,6 +749,8 @@ def flush_realm(
         cache_delete(realm_alert_words_cache_key(realm.id))
         cache_delete(realm_alert_words_automaton_cache_key(realm.id))
         cache_delete(active_non_guest_user_ids_cache_key(realm.id))
+        cache_delete(user_display_table_generation_cache_key(realm.id))
+        flush_realm_state_sections(realm.id)
         cache_delete(realm_rendered_description_cache_key(realm))
         cache_delete(realm_text_description_cache_key(realm))
     elif changed(update_fields, ["description"]):
@@ -713,6 +758,15 @@ def flush_realm(
         cache_delete(realm_text_description_cache_key(realm))
 
 
+def flush_realm_state_sections(realm_id: int) -> None:
+    from zerver.lib.realm_state import realm_state_sections
+
+    cache_delete_many(
+        realm_state_section_generation_cache_key(realm_id, section)
+        for section in realm_state_sections
+    )
+
+
 def realm_alert_words_cache_key(realm_id: int) -> str:
     return f"realm_alert_words:{realm_id}"
 
@@ -721,6 +775,25 @@ def realm_alert_words_automaton_cache_key(realm_id: int) -> str:
     return f"realm_alert_words_automaton:{realm_id}"
 
 
+def realm_rendering_context_version_cache_key(realm_id: int) -> str:
+    return f"realm_rendering_context_version:{realm_id}"
+
+
+def flush_realm_rendering_context(realm_id: int) -> None:
+    # Markdown processes memoize a RealmRenderingContext per realm,
+    # tagged with the version stored under this key; deleting it makes
+    # every process reload its snapshot on the next render.
+    #
+    # This is called from model save hooks, inside the writer's
+    # transaction; another process could reload from the old data
+    # before the commit, and memoize that under the new version.  So
+    # we delete the version again once the transaction commits; the
+    # immediate delete is for the rest of the writer's transaction.
+    key = realm_rendering_context_version_cache_key(realm_id)
+    cache_delete(key)
+    transaction.on_commit(lambda: cache_delete(key))
+
+
 def realm_rendered_description_cache_key(realm: "Realm") -> str:
     return f"realm_rendered_description:{realm.string_id}"
 
@@ -749,6 +822,9 @@ def flush_stream(
     ):
         cache_delete(bot_dicts_in_realm_cache_key(stream.realm_id))
 
+    if update_fields is not None and "enable_puppet_mode" in update_fields:
+        flush_realm_rendering_context(stream.realm_id)
+
 
 def flush_used_upload_space_cache(
     *,
@@ -770,6 +846,43 @@ def to_dict_cache_key(message: "Message", realm_id: int | None = None) -> str:
     return to_dict_cache_key_id(message.id)
 
 
+def message_dict_generation_cache_key(message_id: int) -> str:
+    # Process-local copies of message dicts are validated against a
+    # generation token shared by a block of consecutive message IDs,
+    # so that a fetch of recent messages checks only one or two keys.
+    return f"message_dict_generation:{message_id // 1000}"
+
+
+def flush_message_dict_generations(message_ids: Iterable[int]) -> None:
+    cache_delete_many({message_dict_generation_cache_key(message_id) for message_id in message_ids})
+
+
+def search_result_generation_cache_key(realm_id: int) -> str:
+    # Cached search results are validated against a generation token
+    # for the realm, which is flushed whenever a message in it is
+    # edited, since an edit can add a message to a search's results.
+    return f"search_result_generation:{realm_id}"
+
+
+def flush_search_result_generations(realm_ids: Iterable[int]) -> None:
+    cache_delete_many({search_result_generation_cache_key(realm_id) for realm_id in realm_ids})
+
+
+def search_result_cache_key(key_hash: str) -> str:
+    return f"search_result:{key_hash}"
+
+
+def flush_message_dicts(message_ids: Iterable[int]) -> None:
+    """Deletes messages from the to_dict cache, along with any copies
+    of them held in process-local caches."""
+    keys: list[str] = []
+    generation_keys: set[str] = set()
+    for message_id in message_ids:
+        keys.append(to_dict_cache_key_id(message_id))
+        generation_keys.add(message_dict_generation_cache_key(message_id))
+    cache_delete_many([*keys, *generation_keys])
+
+
 def open_graph_description_cache_key(content: bytes, request_url: str) -> str:
     return f"open_graph_description_path:{hashlib.sha1(request_url.encode()).hexdigest()}"
 
@@ -784,7 +897,7 @@ def flush_zoom_server_access_token_cache(account_id: str) -> None:
 
 def flush_message(*, instance: "Message", **kwargs: object) -> None:
     message = instance
-    cache_delete(to_dict_cache_key_id(message.id))
+    flush_message_dicts([message.id])
 
 
 def flush_submessage(*, instance: "SubMessage", **kwargs: object) -> None:
@@ -792,7 +905,7 @@ def flush_submessage(*, instance: "SubMessage", **kwargs: object) -> None:
     # submessages are not cached directly, they are part of their
     # parent messages
     message_id = submessage.message_id
-    cache_delete(to_dict_cache_key_id(message_id))
+    flush_message_dicts([message_id])
 
 
 class IgnoreUnhashableLruCacheWrapper(Generic[ParamT, ReturnT]):
@@ -0,0 +1,164 @@
+from collections.abc import Iterator
+from typing import Any
+
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.sql import Select, and_, column, literal, literal_column, select, table
+from sqlalchemy.types import Integer
+
+from zerver.lib.markdown import version as markdown_version
+from zerver.lib.message import get_first_visible_message_id
+from zerver.lib.message_cache import save_message_rendered_content
+from zerver.lib.narrow import get_whisper_visibility_condition_for_user
+from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
+from zerver.lib.streams import can_access_stream_history
+from zerver.lib.timestamp import datetime_to_timestamp
+from zerver.lib.topic import TOPIC_NAME
+from zerver.lib.topic_sqlalchemy import topic_id_match_sa
+from zerver.models import Message, Stream, SubMessage, UserProfile
+
+# Messages fetched per query.  Each batch is a range scan on the
+# message ID, starting after the last message of the previous one, so
+# the cost per batch does not grow as the export proceeds.
+CHANNEL_HISTORY_BATCH_SIZE = 1000
+
+CHANNEL_HISTORY_COLUMNS = [
+    "sender_id",
+    "subject",
+    "content",
+    "rendered_content",
+    "rendered_content_version",
+    "date_sent",
+    "last_edit_time",
+    "puppet_display_name",
+    "puppet_avatar_url",
+    "puppet_color",
+    "persona_id",
+    "persona_display_name",
+    "persona_avatar_url",
+    "persona_color",
+]
+
+
+def get_channel_history_query(
+    user_profile: UserProfile, stream: Stream, topic_name: str | None
+) -> Select:
+    message_id_col = literal_column("zerver_message.id", Integer)
+    query = (
+        select(message_id_col.label("id"), *map(column, CHANNEL_HISTORY_COLUMNS))
+        .select_from(table("zerver_message"))
+        .where(
+            column("realm_id", Integer) == literal(stream.realm_id),
+            column("recipient_id", Integer) == literal(stream.recipient_id),
+            get_whisper_visibility_condition_for_user(user_profile),
+        )
+    )
+    if topic_name is not None:
+        query = query.where(topic_id_match_sa(stream.realm_id, topic_name))
+
+    if not can_access_stream_history(user_profile, stream):
+        # Without access to the channel's history, the user can only
+        # see the messages they received.
+        query = query.join(
+            table("zerver_usermessage"),
+            and_(
+                literal_column("zerver_usermessage.message_id", Integer) == message_id_col,
+                literal_column("zerver_usermessage.user_profile_id", Integer)
+                == literal(user_profile.id),
+            ),
+        )
+    return query
+
+
+def iter_channel_history(
+    user_profile: UserProfile,
+    stream: Stream,
+    *,
+    topic_name: str | None,
+    after_message_id: int,
+    limit: int | None,
+    apply_markdown: bool,
+) -> Iterator[dict[str, Any]]:
+    """Yields the messages in a channel, or one of its topics, which the
+    user can see, in increasing order of ID, starting after
+    after_message_id.
+
+    Unlike the message dictionaries returned by GET /messages, these
+    contain just the fields needed to replay the channel's history;
+    the caller must already have checked that the user can access
+    the channel.
+    """
+    query = get_channel_history_query(user_profile, stream, topic_name)
+    message_id_col = literal_column("zerver_message.id", Integer)
+    # Messages before the realm's first visible message are hidden
+    # from everyone.
+    last_message_id = max(after_message_id, get_first_visible_message_id(stream.realm) - 1)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch_size = CHANNEL_HISTORY_BATCH_SIZE
+        if remaining is not None:
+            batch_size = min(batch_size, remaining)
+        batch_query = (
+            query.where(message_id_col > literal(last_message_id))
+            .order_by(message_id_col.asc())
+            .limit(batch_size)
+        )
+        with get_sqlalchemy_connection() as sa_conn:
+            rows = list(sa_conn.execute(batch_query).mappings())
+        if not rows:
+            return
+
+        submessages: dict[int, list[dict[str, Any]]] = {}
+        for submessage in SubMessage.get_raw_db_rows([row["id"] for row in rows]):
+            visible_to = submessage.pop("visible_to")
+            if visible_to is None or user_profile.id in visible_to:
+                submessages.setdefault(submessage["message_id"], []).append(submessage)
+
+        for row in rows:
+            yield build_channel_history_dict(row, submessages.get(row["id"], []), apply_markdown)
+
+        last_message_id = rows[-1]["id"]
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < batch_size:
+            return
+
+
+def build_channel_history_dict(
+    row: RowMapping, submessages: list[dict[str, Any]], apply_markdown: bool
+) -> dict[str, Any]:
+    obj: dict[str, Any] = dict(
+        id=row["id"],
+        sender_id=row["sender_id"],
+        timestamp=datetime_to_timestamp(row["date_sent"]),
+    )
+    obj[TOPIC_NAME] = row["subject"]
+
+    if apply_markdown:
+        rendered_content = row["rendered_content"]
+        if Message.need_to_render_content(
+            rendered_content, row["rendered_content_version"], markdown_version
+        ):
+            message = Message.objects.select_related("sender").get(id=row["id"])
+            rendered_content = save_message_rendered_content(message, row["content"])
+        obj["content"] = rendered_content
+        obj["content_type"] = "text/html"
+    else:
+        obj["content"] = row["content"]
+        obj["content_type"] = "text/x-markdown"
+
+    if row["last_edit_time"] is not None:
+        obj["last_edit_timestamp"] = datetime_to_timestamp(row["last_edit_time"])
+
+    if row["puppet_display_name"] is not None:
+        obj["puppet_display_name"] = row["puppet_display_name"]
+        obj["puppet_avatar_url"] = row["puppet_avatar_url"]
+        obj["puppet_color"] = row["puppet_color"]
+
+    if row["persona_display_name"] is not None:
+        obj["persona_id"] = row["persona_id"]
+        obj["persona_display_name"] = row["persona_display_name"]
+        obj["persona_avatar_url"] = row["persona_avatar_url"]
+        obj["persona_color"] = row["persona_color"]
+
+    obj["submessages"] = submessages
+    return obj
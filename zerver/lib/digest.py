@@ -214,14 +214,15 @@ def get_recent_topics(
         )
     )
 
-    digest_topic_map: dict[TopicKey, DigestTopic] = {}
+    # Grouping by topic ID merges the different casings of a topic's
+    # name, which are all the same topic; the first message's casing
+    # is displayed.
+    digest_topic_map: dict[int | None, DigestTopic] = {}
     for message in messages:
-        topic_key = (stream_id, message.topic_name())
+        if message.topic_id not in digest_topic_map:
+            digest_topic_map[message.topic_id] = DigestTopic((stream_id, message.topic_name()))
 
-        if topic_key not in digest_topic_map:
-            digest_topic_map[topic_key] = DigestTopic(topic_key)
-
-        digest_topic_map[topic_key].add_message(message)
+        digest_topic_map[message.topic_id].add_message(message)
 
     topics = list(digest_topic_map.values())
 
@@ -132,10 +132,14 @@ def bulk_fetch_stream_names(
 
 def bulk_fetch_user_display_recipients(
     recipient_tuples: set[tuple[int, int, int]],
+    realm_ids: set[int] | None = None,
 ) -> dict[int, list[UserDisplayRecipient]]:
     """
     Takes set of tuples of the form (recipient_id, recipient_type, recipient_type_id)
     Returns dict mapping recipient_id to corresponding display_recipient
+
+    If realm_ids, the realms the recipients are expected to be in, is
+    passed, users are looked up in those realms' user display tables.
     """
 
     from zerver.models import Recipient
@@ -169,7 +173,20 @@ def bulk_fetch_user_display_recipients(
         user_ids_to_fetch |= direct_message_group_user_ids
 
     # Fetch the needed user dictionaries.
-    user_display_recipients = bulk_fetch_single_user_display_recipients(list(user_ids_to_fetch))
+    if realm_ids is not None:
+        from zerver.lib.user_display_table import bulk_fetch_user_display_rows
+
+        user_display_recipients = {
+            row.id: UserDisplayRecipient(
+                id=row.id,
+                email=row.email,
+                full_name=row.full_name,
+                is_mirror_dummy=row.is_mirror_dummy,
+            )
+            for row in bulk_fetch_user_display_rows(user_ids_to_fetch, realm_ids).values()
+        }
+    else:
+        user_display_recipients = bulk_fetch_single_user_display_recipients(list(user_ids_to_fetch))
 
     result = {}
 
@@ -187,6 +204,7 @@ def bulk_fetch_user_display_recipients(
 
 def bulk_fetch_display_recipients(
     recipient_tuples: set[tuple[int, int, int]],
+    realm_ids: set[int] | None = None,
 ) -> dict[int, DisplayRecipientT]:
     """
     Takes set of tuples of the form (recipient_id, recipient_type, recipient_type_id)
@@ -202,7 +220,7 @@ def bulk_fetch_display_recipients(
 
     stream_display_recipients = bulk_fetch_stream_names(stream_recipients)
     direct_message_display_recipients = bulk_fetch_user_display_recipients(
-        direct_message_recipients
+        direct_message_recipients, realm_ids
     )
 
     # Glue the dicts together and return:
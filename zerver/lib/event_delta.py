@@ -0,0 +1,54 @@
+from collections.abc import Mapping, Sequence
+from typing import Any
+
+# Keys that are never elided, so that clients can always tell which
+# event they are looking at without decoding the batch first.
+ALWAYS_SENT_KEYS = frozenset(["id", "type"])
+
+
+def delta_encode_events(events: Sequence[Mapping[str, Any]]) -> list[dict[str, Any]]:
+    """Delta-encode a batch of events for the `delta_encoded_events`
+    client capability.
+
+    Consecutive events of the same type frequently repeat most of
+    their top-level fields (e.g. `op`, `stream_id`, `property`).  For
+    each event with the same type as the event before it in the batch,
+    any top-level key whose value equals that previous event's value
+    is omitted, and its name is listed in `repeated_keys`; the
+    receiver recovers it from the previous (decoded) event.  The first
+    event of a batch, and every event whose type differs from its
+    predecessor, is sent unchanged.
+    """
+    encoded_events: list[dict[str, Any]] = []
+    previous_event: Mapping[str, Any] | None = None
+    for event in events:
+        encoded_event = dict(event)
+        if previous_event is not None and previous_event["type"] == event["type"]:
+            repeated_keys = [
+                key
+                for key, value in event.items()
+                if key not in ALWAYS_SENT_KEYS
+                and key in previous_event
+                and previous_event[key] == value
+            ]
+            if repeated_keys:
+                for key in repeated_keys:
+                    del encoded_event[key]
+                encoded_event["repeated_keys"] = repeated_keys
+        encoded_events.append(encoded_event)
+        previous_event = event
+    return encoded_events
+
+
+def delta_decode_events(events: Sequence[Mapping[str, Any]]) -> list[dict[str, Any]]:
+    """Inverse of delta_encode_events."""
+    decoded_events: list[dict[str, Any]] = []
+    for event in events:
+        if "repeated_keys" not in event:
+            decoded_events.append(dict(event))
+            continue
+        previous_event = decoded_events[-1]
+        decoded_event = {key: previous_event[key] for key in event["repeated_keys"]}
+        decoded_event.update((key, value) for key, value in event.items() if key != "repeated_keys")
+        decoded_events.append(decoded_event)
+    return decoded_events
@@ -11,7 +11,6 @@ from django.utils.translation import gettext as _
 from typing_extensions import NotRequired, TypedDict
 
 from version import API_FEATURE_LEVEL, ZULIP_MERGE_BASE, ZULIP_VERSION
-from zerver.actions.default_streams import default_stream_groups_to_dicts_sorted
 from zerver.actions.realm_settings import (
     do_set_realm_property,
     get_realm_authentication_methods_for_page_params_api,
@@ -57,6 +56,7 @@ from zerver.lib.presence import get_presence_for_user, get_presences_for_realm
 from zerver.lib.push_notifications import get_push_devices
 from zerver.lib.realm_icon import realm_icon_url
 from zerver.lib.realm_logo import get_realm_logo_source, get_realm_logo_url
+from zerver.lib.realm_state import fetch_realm_state_sections, realm_state_sections
 from zerver.lib.scheduled_messages import (
     get_undelivered_reminders,
     get_undelivered_scheduled_messages,
@@ -101,7 +101,6 @@ from zerver.models import (
     Message,
     NamedUserGroup,
     Realm,
-    RealmUserDefault,
     Recipient,
     Stream,
     Subscription,
@@ -110,17 +109,11 @@ from zerver.models import (
     UserTopic,
 )
 from zerver.models.constants import MAX_TOPIC_NAME_LENGTH
-from zerver.models.custom_profile_fields import custom_profile_fields_for_realm
-from zerver.models.linkifiers import linkifiers_for_realm
-from zerver.models.realm_emoji import get_all_custom_emoji_for_realm
-from zerver.models.realm_playgrounds import get_realm_playgrounds
 from zerver.models.realms import (
     MessageEditHistoryVisibilityPolicyEnum,
     RealmTopicsPolicyEnum,
     get_corresponding_policy_value_for_group_setting,
-    get_realm_domains,
 )
-from zerver.models.streams import get_default_stream_groups
 from zerver.models.users import ResolvedTopicNoticeAutoReadPolicyEnum
 from zerver.tornado.django_api import get_user_events, request_event_queue
 from zproject.backends import email_auth_enabled, password_auth_enabled
@@ -183,6 +176,7 @@ def fetch_initial_state_data(
     include_deactivated_groups: bool = False,
     archived_channels: bool = False,
     simplified_presence_events: bool = False,
+    include_realm_state_versions: bool = False,
 ) -> dict[str, Any]:
     """When `event_types` is None, fetches the core data powering the
     web app's `page_params` and `/api/v1/register` (for mobile/terminal
@@ -268,6 +262,26 @@ def fetch_initial_state_data(
                 direct_subgroups=value["direct_subgroups"],
             )
 
+    # The realm-wide sections of the state are fetched together, from
+    # blobs shared by every user in the realm.
+    skipped_realm_state_sections = set()
+    if user_profile is None:
+        skipped_realm_state_sections.add("custom_profile_fields")
+    if settings_user.is_guest:
+        skipped_realm_state_sections.add("default_stream_groups")
+    if not linkifier_url_template:
+        skipped_realm_state_sections.add("realm_linkifiers")
+    realm_state, realm_state_versions = fetch_realm_state_sections(
+        realm,
+        [
+            name
+            for name in realm_state_sections
+            if want(name) and name not in skipped_realm_state_sections
+        ],
+    )
+    if include_realm_state_versions:
+        state["realm_state_versions"] = realm_state_versions
+
     if want("alert_words"):
         state["alert_words"] = [] if user_profile is None else user_alert_words(user_profile)
 
@@ -277,8 +291,7 @@ def fetch_initial_state_data(
             # personal settings, so we send an empty list.
             state["custom_profile_fields"] = []
         else:
-            fields = custom_profile_fields_for_realm(realm.id)
-            state["custom_profile_fields"] = [f.as_dict() for f in fields]
+            state["custom_profile_fields"] = realm_state["custom_profile_fields"]
         state["custom_profile_field_types"] = {
             item[4]: {"id": item[0], "name": str(item[1])}
             for item in CustomProfileField.ALL_FIELD_TYPES
@@ -339,19 +352,7 @@ def fetch_initial_state_data(
         )
 
     if want("bot_commands"):
-        from zerver.models.bots import get_bot_commands_for_realm
-
-        state["bot_commands"] = [
-            {
-                "id": cmd.id,
-                "name": cmd.name,
-                "description": cmd.description,
-                "options": cmd.options_schema,
-                "bot_id": cmd.bot_profile_id,
-                "bot_name": cmd.bot_profile.full_name,
-            }
-            for cmd in get_bot_commands_for_realm(realm.id)
-        ]
+        state["bot_commands"] = realm_state["bot_commands"]
 
     if want("reminders"):
         state["reminders"] = [] if user_profile is None else get_undelivered_reminders(user_profile)
@@ -661,34 +662,17 @@ def fetch_initial_state_data(
         )
 
     if want("realm_user_settings_defaults"):
-        realm_user_default = RealmUserDefault.objects.get(realm=realm)
-        state["realm_user_settings_defaults"] = {}
-        for property_name in RealmUserDefault.property_types:
-            state["realm_user_settings_defaults"][property_name] = getattr(
-                realm_user_default, property_name
-            )
-
-        state["realm_user_settings_defaults"]["emojiset_choices"] = (
-            RealmUserDefault.emojiset_choices()
-        )
-        state["realm_user_settings_defaults"]["available_notification_sounds"] = (
-            get_available_notification_sounds()
-        )
-        state["realm_user_settings_defaults"]["resolved_topic_notice_auto_read_policy"] = (
-            ResolvedTopicNoticeAutoReadPolicyEnum(
-                realm_user_default.resolved_topic_notice_auto_read_policy
-            ).name
-        )
+        state["realm_user_settings_defaults"] = realm_state["realm_user_settings_defaults"]
 
     if want("realm_domains"):
-        state["realm_domains"] = get_realm_domains(realm)
+        state["realm_domains"] = realm_state["realm_domains"]
 
     if want("realm_emoji"):
-        state["realm_emoji"] = get_all_custom_emoji_for_realm(realm.id)
+        state["realm_emoji"] = realm_state["realm_emoji"]
 
     if want("realm_linkifiers"):
         if linkifier_url_template:
-            state["realm_linkifiers"] = linkifiers_for_realm(realm.id)
+            state["realm_linkifiers"] = realm_state["realm_linkifiers"]
         else:
             # When URL template is not supported by the client, return an empty list
             # because the new format is incompatible with the old URL format strings
@@ -703,7 +687,7 @@ def fetch_initial_state_data(
         state["realm_filters"] = []
 
     if want("realm_playgrounds"):
-        state["realm_playgrounds"] = get_realm_playgrounds(realm)
+        state["realm_playgrounds"] = realm_state["realm_playgrounds"]
 
     if want("realm_billing"):
         state["realm_billing"] = {}
@@ -911,9 +895,7 @@ def fetch_initial_state_data(
         if settings_user.is_guest:
             state["realm_default_stream_groups"] = []
         else:
-            state["realm_default_stream_groups"] = default_stream_groups_to_dicts_sorted(
-                get_default_stream_groups(realm)
-            )
+            state["realm_default_stream_groups"] = realm_state["default_stream_groups"]
 
     if want("stop_words"):
         state["stop_words"] = read_stop_words()
@@ -2045,6 +2027,7 @@ class ClientCapabilities(TypedDict):
     archived_channels: NotRequired[bool]
     empty_topic_name: NotRequired[bool]
     simplified_presence_events: NotRequired[bool]
+    delta_encoded_events: NotRequired[bool]
     # Deprecated and no longer has any effect
     user_settings_object: NotRequired[bool]
 
@@ -2052,6 +2035,29 @@ class ClientCapabilities(TypedDict):
 DEFAULT_CLIENT_CAPABILITIES = ClientCapabilities(notification_settings_null=False)
 
 
+class ResumeState(TypedDict):
+    # Values from the response to the client's previous registration.
+    presence_last_update_id: NotRequired[int]
+    realm_state_versions: NotRequired[dict[str, str]]
+
+
+def omit_unchanged_realm_state_sections(
+    state: dict[str, Any], resume: ResumeState, events: list[dict[str, Any]]
+) -> None:
+    """Omits the realm-wide sections of the state which a resuming
+    client already has: those whose version it presented is current,
+    and which no event applied to the state changed."""
+    client_versions = resume.get("realm_state_versions", {})
+    event_types = {event["type"] for event in events}
+    unchanged_sections = []
+    for name, version in state["realm_state_versions"].items():
+        section = realm_state_sections[name]
+        if client_versions.get(name) == version and section.event_types.isdisjoint(event_types):
+            del state[section.state_key]
+            unchanged_sections.append(name)
+    state["unchanged_realm_state_sections"] = sorted(unchanged_sections)
+
+
 def do_events_register(
     user_profile: UserProfile | None,
     realm: Realm,
@@ -2071,6 +2077,7 @@ def do_events_register(
     fetch_event_types: Collection[str] | None = None,
     spectator_requested_language: str | None = None,
     pronouns_field_type_supported: bool = True,
+    resume: ResumeState | None = None,
 ) -> dict[str, Any]:
     # Technically we don't need to check this here because
     # build_narrow_predicate will check it, but it's nicer from an error
@@ -2089,6 +2096,10 @@ def do_events_register(
     archived_channels = client_capabilities.get("archived_channels", False)
     empty_topic_name = client_capabilities.get("empty_topic_name", False)
     simplified_presence_events = client_capabilities.get("simplified_presence_events", False)
+    delta_encoded_events = client_capabilities.get("delta_encoded_events", False)
+
+    if resume is not None and "presence_last_update_id" in resume:
+        presence_last_update_id_fetched_by_client = resume["presence_last_update_id"]
 
     if fetch_event_types is not None:
         event_types_set: set[str] | None = set(fetch_event_types)
@@ -2124,7 +2135,10 @@ def do_events_register(
             spectator_requested_language=spectator_requested_language,
             include_deactivated_groups=include_deactivated_groups,
             simplified_presence_events=simplified_presence_events,
+            include_realm_state_versions=resume is not None,
         )
+        if resume is not None:
+            omit_unchanged_realm_state_sections(ret, resume, [])
 
         post_process_state(
             user_profile,
@@ -2160,6 +2174,7 @@ def do_events_register(
         archived_channels=archived_channels,
         empty_topic_name=empty_topic_name,
         simplified_presence_events=simplified_presence_events,
+        delta_encoded_events=delta_encoded_events,
     )
 
     if queue_id is None:
@@ -2183,6 +2198,7 @@ def do_events_register(
         include_deactivated_groups=include_deactivated_groups,
         archived_channels=archived_channels,
         simplified_presence_events=simplified_presence_events,
+        include_realm_state_versions=resume is not None,
     )
 
     # Apply events that came in while we were fetching initial data
@@ -2200,6 +2216,8 @@ def do_events_register(
         include_deactivated_groups=include_deactivated_groups,
         simplified_presence_events=simplified_presence_events,
     )
+    if resume is not None:
+        omit_unchanged_realm_state_sections(ret, resume, events)
 
     post_process_state(
         user_profile, ret, notification_settings_null, allow_empty_topic_name=empty_topic_name
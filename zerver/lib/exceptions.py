@@ -67,6 +67,7 @@ class ErrorCode(Enum):
     FAILED_TO_CONNECT_BOUNCER = auto()
     INTERNAL_SERVER_ERROR_ON_BOUNCER = auto()
     ADMIN_ACTION_REQUIRED = auto()
+    MARKDOWN_RENDERING_BUSY = auto()
 
 
 class JsonableError(Exception):
@@ -400,6 +401,23 @@ class MarkdownRenderingError(Exception):
     pass
 
 
+class MarkdownRenderingBusyError(JsonableError):
+    """The Markdown rendering service refused to render a message
+    because it is overloaded; unlike MarkdownRenderingError, sending
+    the message again later will likely work."""
+
+    code = ErrorCode.MARKDOWN_RENDERING_BUSY
+    http_status_code = 503
+
+    def __init__(self) -> None:
+        pass
+
+    @staticmethod
+    @override
+    def msg_format() -> str:
+        return _("The server is too busy to render this message; please try again shortly.")
+
+
 class InvalidAPIKeyError(JsonableError):
     code = ErrorCode.INVALID_API_KEY
     http_status_code = 401
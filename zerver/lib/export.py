@@ -295,6 +295,12 @@ NON_EXPORTED_TABLES = {
     # ChannelEmailAddress entries are low value to export since
     # channel email addresses include the server's hostname.
     "zerver_channelemailaddress",
+    # Unread summaries are derived from zerver_usermessage, and are
+    # rebuilt on demand.
+    "zerver_unreadconversation",
+    "zerver_unreadsummary",
+    # Topics are derived from zerver_message by a database trigger.
+    "zerver_topic",
     # For any tables listed below here, it's a bug that they are not present in the export.
 }
 
@@ -1956,8 +1962,11 @@ def write_message_partials(
     for message_id_chunk in message_id_chunks:
         # Uses index: zerver_message_pkey
         actual_query = Message.objects.filter(id__in=message_id_chunk).order_by("id")
+        # Topic IDs are assigned by a database trigger when the
+        # messages are imported.
         message_chunk = [
-            floatify_datetime_fields(r, "zerver_message") for r in make_raw(actual_query.iterator())
+            floatify_datetime_fields(r, "zerver_message")
+            for r in make_raw(actual_query.iterator(), exclude=["topic"])
         ]
 
         for row in message_chunk:
@@ -1,11 +1,12 @@
 # Zulip's main Markdown implementation.  See docs/subsystems/markdown.md for
 # detailed documentation on our Markdown syntax.
+import hashlib
 import logging
 import re
 import time
 from collections import deque
 from collections.abc import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 from email.message import EmailMessage
 from functools import lru_cache
@@ -31,18 +32,21 @@ import requests
 import uri_template
 import urllib3.exceptions
 from django.conf import settings
+from django.db import connection
 from markdown.blockparser import BlockParser
 from markdown.extensions import codehilite, nl2br, sane_lists, tables
 from tlds import tld_set
 from typing_extensions import NotRequired, Self, override
 
 from zerver.lib import mention
+from zerver.lib.cache import cache_get, cache_set
 from zerver.lib.camo import get_camo_url
 from zerver.lib.emoji import EMOTICON_RE, codepoint_to_name, name_to_codepoint, translate_emoticons
 from zerver.lib.emoji_utils import emoji_to_hex_codepoint, unqualify_emoji
 from zerver.lib.exceptions import MarkdownRenderingError
 from zerver.lib.markdown import fenced_code
 from zerver.lib.markdown.fenced_code import FENCE_RE
+from zerver.lib.markdown.rendering_context import MentionIndex, get_realm_rendering_context
 from zerver.lib.mention import (
     BEFORE_MENTION_ALLOWED_REGEX,
     ChannelTopicInfo,
@@ -67,7 +71,7 @@ from zerver.lib.url_encoding import encode_channel, encode_hash_component
 from zerver.lib.url_preview.types import UrlEmbedData, UrlOEmbedData
 from zerver.models import Message, Realm, Recipient, UserProfile
 from zerver.models.linkifiers import linkifiers_for_realm
-from zerver.models.realm_emoji import EmojiInfo, get_name_keyed_dict_for_active_realm_emoji
+from zerver.models.realm_emoji import EmojiInfo
 
 ReturnT = TypeVar("ReturnT")
 
@@ -135,9 +139,18 @@ class DbData:
     user_upload_previews: AttachmentData
     # For puppet mention support - the stream we're sending to (if any)
     sending_stream_id: int | None = None
-    puppet_names: set[str] | None = None
-    # For persona mention support - maps lowercase name to (persona_id, owner_user_id)
-    persona_data: dict[str, tuple[int, int]] | None = None
+    # Puppet and persona names; None if the content has no mentions.
+    mention_index: MentionIndex | None = None
+
+
+@dataclass
+class CachedMessageRendering:
+    rendering_result: MessageRenderingResult
+    # The preprocessed, lowercased content scanned for alert words,
+    # since the set of alert words may have changed since rendering.
+    alert_word_content: str
+    has_link: bool
+    has_image: bool
 
 
 # Format version of the Markdown rendering; stored along with rendered
@@ -1772,9 +1785,13 @@ class UserMentionPattern(CompiledInlineProcessor):
                 name = user.full_name
                 user_id = str(user.id)
             else:
+                mention_target = (
+                    db_data.mention_index.lookup(name)
+                    if db_data.mention_index is not None
+                    else None
+                )
                 # Check if this is a puppet mention (character name, stream-specific)
-                puppet_names = db_data.puppet_names
-                if puppet_names is not None and name.lower() in {p.lower() for p in puppet_names}:
+                if mention_target is not None and mention_target.kind == "puppet":
                     # This is a puppet mention - render with puppet-mention class
                     el = Element("span")
                     el.set("class", "puppet-mention" + (" silent" if silent else ""))
@@ -1784,9 +1801,8 @@ class UserMentionPattern(CompiledInlineProcessor):
                     return el, m.start(), m.end()
 
                 # Check if this is a persona mention (user-owned character, realm-wide)
-                persona_data = db_data.persona_data
-                if persona_data is not None and name.lower() in persona_data:
-                    persona_id, owner_user_id = persona_data[name.lower()]
+                if mention_target is not None and mention_target.kind == "persona":
+                    persona_id = mention_target.id
                     # Track the persona mention for notifications
                     if not silent:
                         self.zmd.zulip_rendering_result.mentions_persona_ids.add(persona_id)
@@ -2018,16 +2034,30 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
         super().__init__(zmd)
         self.zmd = zmd
 
-    def check_valid_start_position(self, content: str, index: int) -> bool:
-        if index <= 0 or content[index] in self.allowed_before_punctuation:
+    @classmethod
+    def check_valid_start_position(cls, content: str, index: int) -> bool:
+        if index <= 0 or content[index] in cls.allowed_before_punctuation:
             return True
         return False
 
-    def check_valid_end_position(self, content: str, index: int) -> bool:
-        if index >= len(content) or content[index] in self.allowed_after_punctuation:
+    @classmethod
+    def check_valid_end_position(cls, content: str, index: int) -> bool:
+        if index >= len(content) or content[index] in cls.allowed_after_punctuation:
             return True
         return False
 
+    @classmethod
+    def get_user_ids_with_alert_words(
+        cls, realm_alert_words_automaton: ahocorasick.Automaton, content: str
+    ) -> set[int]:
+        user_ids_with_alert_words: set[int] = set()
+        for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(content):
+            if cls.check_valid_start_position(
+                content, end_index - len(original_value)
+            ) and cls.check_valid_end_position(content, end_index + 1):
+                user_ids_with_alert_words.update(user_ids)
+        return user_ids_with_alert_words
+
     @override
     def run(self, lines: list[str]) -> list[str]:
         db_data: DbData | None = self.zmd.zulip_db_data
@@ -2038,18 +2068,19 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
             # Our caller passes in the list of possible_words.  We
             # don't do any special rendering; we just append the alert words
             # we find to the set self.zmd.zulip_rendering_result.user_ids_with_alert_words.
+            #
+            # The text we scan is saved so that a cached rendering of
+            # this content can be checked against the alert words
+            # current at the time it is reused.
+            content = "\n".join(lines).lower()
+            self.zmd.zulip_alert_word_content = content
 
             realm_alert_words_automaton = db_data.realm_alert_words_automaton
 
             if realm_alert_words_automaton is not None:
-                content = "\n".join(lines).lower()
-                for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(
-                    content
-                ):
-                    if self.check_valid_start_position(
-                        content, end_index - len(original_value)
-                    ) and self.check_valid_end_position(content, end_index + 1):
-                        self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(user_ids)
+                self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(
+                    self.get_user_ids_with_alert_words(realm_alert_words_automaton, content)
+                )
         return lines
 
 
@@ -2268,6 +2299,7 @@ class ZulipMarkdown(markdown.Markdown):
     zulip_realm: Realm | None
     zulip_db_data: DbData | None
     zulip_rendering_result: MessageRenderingResult
+    zulip_alert_word_content: str
     image_preview_enabled: bool
     url_embed_preview_enabled: bool
     url_embed_data: dict[str, UrlEmbedData | None] | None
@@ -2638,6 +2670,104 @@ def privacy_clean_markdown(content: str) -> str:
     return repr(_privacy_re.sub("x", content))
 
 
+# Content made only of these characters contains none of the syntax
+# the Markdown processor transforms (mentions, emoji, links, spoilers,
+# emphasis, code, etc.); "." and ":" are only allowed before
+# whitespace, to rule out bare domain autolinks and emoji syntax.
+PLAIN_TEXT_RE = re.compile(r"""(?:[A-Za-z0-9 \n,!?'"();\-]|[.:](?=[ \n]|\Z))+""")
+# Line starts and ends that the block processors treat specially:
+# indented code, unordered and ordered lists, horizontal rules, and
+# trailing whitespace.
+PLAIN_TEXT_BLOCK_SYNTAX_RE = re.compile(r"^[ \-]|^\d+[.)]| $", re.MULTILINE)
+
+
+def is_plain_text_content(content: str, linkifiers: list[LinkifierDict]) -> bool:
+    """Cheaply check whether the Markdown processor would render this
+    content as nothing but escaped paragraphs and line breaks.  False
+    negatives are fine; false positives are rendering bugs."""
+    if PLAIN_TEXT_RE.fullmatch(content) is None or content.strip() == "":
+        return False
+    if PLAIN_TEXT_BLOCK_SYNTAX_RE.search(content) is not None:
+        return False
+    return not any(
+        get_compiled_linkifier_regex(linkifier["pattern"]).search(content) is not None
+        for linkifier in linkifiers
+    )
+
+
+def can_skip_markdown(content: str, linkifiers_key: int, translate_emoticons: bool) -> bool:
+    return (
+        settings.PLAIN_TEXT_PRESCAN_ENABLED
+        and not translate_emoticons
+        and is_plain_text_content(content, linkifiers_for_realm(linkifiers_key))
+    )
+
+
+def render_plain_text_content(content: str) -> str:
+    # Equivalent to what the paragraph and nl2br processors produce;
+    # PLAIN_TEXT_RE excludes every character that needs HTML escaping.
+    paragraphs = re.split(r"\n{2,}", content.strip("\n"))
+    return "\n".join("<p>" + paragraph.replace("\n", "<br>\n") + "</p>" for paragraph in paragraphs)
+
+
+MESSAGE_RENDERING_CACHE_TIMEOUT = 3600
+
+
+def get_message_rendering_cache_key(
+    content: str, md_engine: "ZulipMarkdown", user_upload_previews: AttachmentData
+) -> str | None:
+    """Bots frequently send the same templated content to many topics
+    and channels; for those, we cache the rendering under a key
+    covering the content and every piece of database state that
+    do_convert fetched to render it, so that a later send of the same
+    content skips Markdown entirely.  Since the key includes that
+    state, edits to e.g. linkifiers, custom emoji, or a mentioned
+    user's name simply result in a cache miss.
+
+    Returns None for messages we do not cache: those from humans,
+    re-renders with URL embed data, and messages whose rendering
+    depends on state not captured in the key (uploaded files, whose
+    thumbnails change over time, and user group mentions, which
+    depend on the group's mention permissions).
+    """
+    db_data = md_engine.zulip_db_data
+    if (
+        db_data is None
+        or not db_data.sent_by_bot
+        or md_engine.zulip_message is None
+        or md_engine.url_embed_data is not None
+        or user_upload_previews.audio_path_ids
+        or user_upload_previews.image_metadata
+        or db_data.mention_data.user_group_name_info
+    ):
+        return None
+
+    mention_data = db_data.mention_data
+    fingerprint = (
+        version,
+        content,
+        md_engine.linkifiers_key,
+        [(linkifier["pattern"], linkifier["url_template"]) for linkifier in md_engine.linkifiers],
+        md_engine.email_gateway,
+        md_engine.image_preview_enabled,
+        md_engine.url_embed_preview_enabled,
+        db_data.realm_url,
+        db_data.sent_by_bot,
+        db_data.translate_emoticons,
+        sorted(db_data.active_realm_emoji.items()),
+        sorted(
+            (user.id, user.full_name, user.is_active) for user in mention_data.user_id_info.values()
+        ),
+        sorted(db_data.stream_names.items()),
+        sorted(
+            (channel_topic.channel_name, channel_topic.topic_name, message_id)
+            for channel_topic, message_id in db_data.topic_info.items()
+        ),
+        db_data.mention_index.fingerprint() if db_data.mention_index is not None else None,
+    )
+    return "message_rendering:" + hashlib.sha256(repr(fingerprint).encode()).hexdigest()
+
+
 def do_convert(
     content: str,
     realm_alert_words_automaton: ahocorasick.Automaton | None = None,
@@ -2663,6 +2793,13 @@ def do_convert(
     else:
         linkifiers_key = message_realm.id
 
+    if can_skip_markdown(content, linkifiers_key, translate_emoticons):
+        return do_convert_plain_text(
+            content,
+            realm_alert_words_automaton if message_realm is not None else None,
+            message,
+        )
+
     if message and hasattr(message, "id") and message.id:
         logging_message_id = "id# " + str(message.id)
     else:
@@ -2689,6 +2826,7 @@ def do_convert(
     md_engine.zulip_rendering_result = rendering_result
     md_engine.zulip_realm = message_realm
     md_engine.zulip_db_data = None  # for now
+    md_engine.zulip_alert_word_content = ""
     md_engine.image_preview_enabled = image_preview_enabled(message, message_realm, no_previews)
     md_engine.url_embed_preview_enabled = url_embed_preview_enabled(
         message, message_realm, no_previews
@@ -2723,16 +2861,19 @@ def do_convert(
             linked_stream_topic_data, acting_user=acting_user
         )
 
+        # Realm-wide data is memoized across renders in a versioned
+        # snapshot; we only ask it for what this message's syntax needs.
+        rendering_context = get_realm_rendering_context(message_realm.id)
+
         if content_has_emoji_syntax(content):
-            active_realm_emoji = get_name_keyed_dict_for_active_realm_emoji(message_realm.id)
+            active_realm_emoji = rendering_context.get_active_realm_emoji()
         else:
             active_realm_emoji = {}
 
         user_upload_previews = manifest_and_get_user_upload_previews(message_realm.id, content)
 
-        # Get puppet names for the stream if this is a stream message with puppet mode enabled
         sending_stream_id: int | None = None
-        puppet_names: set[str] | None = None
+        mention_index: MentionIndex | None = None
         # Check if message has a recipient - in preview mode the recipient may not be set
         if (
             message is not None
@@ -2740,30 +2881,9 @@ def do_convert(
             and message.recipient.type == Recipient.STREAM
         ):
             sending_stream_id = message.recipient.type_id
-            from zerver.models.streams import Stream, StreamPuppet
 
-            try:
-                stream = Stream.objects.get(id=sending_stream_id)
-                if stream.enable_puppet_mode:
-                    puppet_names = set(
-                        StreamPuppet.objects.filter(stream_id=sending_stream_id).values_list(
-                            "name", flat=True
-                        )
-                    )
-            except Stream.DoesNotExist:
-                pass
-
-        # Get persona data for the realm (realm-wide, not stream-specific)
-        persona_data: dict[str, tuple[int, int]] | None = None
-        from zerver.models.personas import UserPersona
-
-        personas = UserPersona.objects.filter(
-            user__realm=message_realm,
-            user__is_active=True,
-            is_active=True,
-        ).values_list("id", "name", "user_id")
-        if personas:
-            persona_data = {name.lower(): (persona_id, user_id) for persona_id, name, user_id in personas}
+        if "@" in content:
+            mention_index = rendering_context.get_mention_index(sending_stream_id)
 
         md_engine.zulip_db_data = DbData(
             realm_alert_words_automaton=realm_alert_words_automaton,
@@ -2776,10 +2896,30 @@ def do_convert(
             translate_emoticons=translate_emoticons,
             user_upload_previews=user_upload_previews,
             sending_stream_id=sending_stream_id,
-            puppet_names=puppet_names,
-            persona_data=persona_data,
+            mention_index=mention_index,
         )
 
+    rendering_cache_key = None
+    if user_upload_previews is not None:
+        rendering_cache_key = get_message_rendering_cache_key(
+            content, md_engine, user_upload_previews
+        )
+    if rendering_cache_key is not None:
+        cached_value = cache_get(rendering_cache_key)
+        if cached_value is not None:
+            markdown_stats_cache_hit()
+            cached_rendering: CachedMessageRendering = cached_value[0]
+            assert message is not None
+            message.has_link = cached_rendering.has_link
+            message.has_image = cached_rendering.has_image
+            if realm_alert_words_automaton is not None:
+                cached_rendering.rendering_result.user_ids_with_alert_words = (
+                    AlertWordNotificationProcessor.get_user_ids_with_alert_words(
+                        realm_alert_words_automaton, cached_rendering.alert_word_content
+                    )
+                )
+            return cached_rendering.rendering_result
+
     try:
         # Spend at most 5 seconds rendering; this protects the backend
         # from being overloaded by bugs (e.g. Markdown logic that is
@@ -2805,6 +2945,19 @@ def do_convert(
             raise MarkdownRenderingError(
                 f"Rendered content exceeds {MAX_MESSAGE_LENGTH * 100} characters (message {logging_message_id})"
             )
+
+        if rendering_cache_key is not None:
+            assert message is not None
+            cache_set(
+                rendering_cache_key,
+                CachedMessageRendering(
+                    rendering_result=replace(rendering_result, user_ids_with_alert_words=set()),
+                    alert_word_content=md_engine.zulip_alert_word_content,
+                    has_link=message.has_link,
+                    has_image=message.has_image,
+                ),
+                timeout=MESSAGE_RENDERING_CACHE_TIMEOUT,
+            )
         return rendering_result
     except Exception:
         cleaned = privacy_clean_markdown(content)
@@ -2817,9 +2970,42 @@ def do_convert(
         raise MarkdownRenderingError
 
 
+def do_convert_plain_text(
+    content: str,
+    realm_alert_words_automaton: ahocorasick.Automaton | None,
+    message: Message | None,
+) -> MessageRenderingResult:
+    """The do_convert fast path for content that passes
+    is_plain_text_content, which has no mentions, links, or
+    attachments to report."""
+    user_ids_with_alert_words: set[int] = set()
+    if realm_alert_words_automaton is not None:
+        user_ids_with_alert_words = AlertWordNotificationProcessor.get_user_ids_with_alert_words(
+            realm_alert_words_automaton, content.lower()
+        )
+    if message is not None:
+        message.has_link = False
+        message.has_image = False
+
+    return MessageRenderingResult(
+        rendered_content=render_plain_text_content(content),
+        mentions_topic_wildcard=False,
+        mentions_stream_wildcard=False,
+        mentions_user_ids=set(),
+        mentions_user_group_ids=set(),
+        mentions_persona_ids=set(),
+        alert_words=set(),
+        links_for_preview=set(),
+        user_ids_with_alert_words=user_ids_with_alert_words,
+        potential_attachment_path_ids=[],
+        thumbnail_spinners=set(),
+    )
+
+
 markdown_time_start = 0.0
 markdown_total_time = 0.0
 markdown_total_requests = 0
+markdown_total_cache_hits = 0
 
 
 def get_markdown_time() -> float:
@@ -2830,6 +3016,10 @@ def get_markdown_requests() -> int:
     return markdown_total_requests
 
 
+def get_markdown_cache_hits() -> int:
+    return markdown_total_cache_hits
+
+
 def markdown_stats_start() -> None:
     global markdown_time_start
     markdown_time_start = time.time()
@@ -2841,6 +3031,11 @@ def markdown_stats_finish() -> None:
     markdown_total_time += time.time() - markdown_time_start
 
 
+def markdown_stats_cache_hit() -> None:
+    global markdown_total_cache_hits
+    markdown_total_cache_hits += 1
+
+
 def markdown_convert(
     content: str,
     realm_alert_words_automaton: ahocorasick.Automaton | None = None,
@@ -2894,6 +3089,34 @@ def render_message_markdown(
     sent_by_bot = sender.is_bot
     translate_emoticons = sender.translate_emoticons
 
+    # Messages that need the Markdown processor are rendered in the
+    # separate rendering service, when there is one, so that expensive
+    # content cannot tie up this process.  Re-renders with URL embed
+    # data come from a queue worker, and the service cannot see data
+    # from an uncommitted transaction.
+    if (
+        settings.MARKDOWN_SERVER
+        and url_embed_data is None
+        and not connection.in_atomic_block
+        and not can_skip_markdown(content, realm.id, translate_emoticons)
+    ):
+        from zerver.lib.markdown.render_server import render_message_remotely
+
+        markdown_stats_start()
+        remote_rendering_result = render_message_remotely(
+            message,
+            content,
+            realm_id=realm.id,
+            alert_words=realm_alert_words_automaton is not None,
+            mention_data=mention_data,
+            email_gateway=email_gateway,
+            no_previews=no_previews,
+            acting_user_id=acting_user.id if acting_user is not None else None,
+        )
+        markdown_stats_finish()
+        if remote_rendering_result is not None:
+            return remote_rendering_result
+
     rendering_result = markdown_convert(
         content,
         realm_alert_words_automaton=realm_alert_words_automaton,
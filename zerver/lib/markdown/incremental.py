@@ -0,0 +1,225 @@
+import re
+from collections import Counter
+from dataclasses import replace
+from html.parser import HTMLParser
+
+from typing_extensions import override
+
+from zerver.lib.alert_words import get_alert_word_automaton
+from zerver.lib.emoji import EMOTICON_RE
+from zerver.lib.markdown import (
+    AlertWordNotificationProcessor,
+    MessageRenderingResult,
+    get_compiled_linkifier_regex,
+    render_message_markdown,
+)
+from zerver.lib.markdown import version as markdown_version
+from zerver.lib.mention import MentionData
+from zerver.lib.types import LinkifierDict
+from zerver.models import Message, Realm
+from zerver.models.linkifiers import linkifiers_for_realm
+
+# Profiling counters: "blocks.reused" and "blocks.rendered" for
+# incremental renders, and "fallback" for edits rendered in full.
+incremental_rendering_stats: Counter[str] = Counter()
+
+# Syntax that ties top-level blocks together, so that they cannot be
+# rendered independently: fenced code, indented code and list
+# continuations, list items (which merge into one list across blank
+# lines), block quotes, reference-style link definitions, and the
+# whitespace that the Markdown processor normalizes.
+BLOCK_COUPLING_RE = re.compile(
+    r"```|~~~|^[ >]|^[*+-](?: |$)|^\d+[.)]|^\[[^\]]*\]:|[\t\r]", re.MULTILINE
+)
+# Syntax whose rendering depends on realm data that may have changed
+# since the previous render: mentions, channel and topic links, and
+# custom emoji.
+REALM_DEPENDENT_SYNTAX_RE = re.compile(r"@|#\*\*|:[^:\s]+:")
+# Rendered elements that carry data about the message beyond its HTML
+# (links, previews, attachments, mentions), or reflect the sender's
+# emoticon setting.
+METADATA_HTML_RE = re.compile(r"<(?:a|img|video|audio)\b|mention|emoji")
+EMOTICON_REGEX = re.compile(EMOTICON_RE)
+VOID_ELEMENTS = {"br", "hr", "img", "input", "wbr", "source", "track", "col", "embed"}
+
+
+def split_into_blocks(content: str) -> list[str] | None:
+    """Splits content into the top-level blocks the Markdown processor
+    renders independently of each other, or returns None if it has
+    syntax that could make one block's rendering depend on another's."""
+    if BLOCK_COUPLING_RE.search(content) is not None or content.strip() == "":
+        return None
+    return re.split(r"\n{2,}", content.strip("\n"))
+
+
+class TopLevelElementParser(HTMLParser):
+    def __init__(self, html: str) -> None:
+        super().__init__(convert_charrefs=False)
+        self.html = html
+        self.line_offsets = [0]
+        for line in html.split("\n"):
+            self.line_offsets.append(self.line_offsets[-1] + len(line) + 1)
+        self.depth = 0
+        self.element_start = 0
+        self.elements: list[str] = []
+        self.valid = True
+
+    def offset(self) -> int:
+        lineno, column = self.getpos()
+        return self.line_offsets[lineno - 1] + column
+
+    @override
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if self.depth == 0:
+            self.element_start = self.offset()
+            if tag in VOID_ELEMENTS:
+                tag_text = self.get_starttag_text()
+                assert tag_text is not None
+                self.elements.append(self.html[self.element_start : self.offset() + len(tag_text)])
+                return
+        if tag not in VOID_ELEMENTS:
+            self.depth += 1
+
+    @override
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if self.depth == 0:
+            tag_text = self.get_starttag_text()
+            assert tag_text is not None
+            start = self.offset()
+            self.elements.append(self.html[start : start + len(tag_text)])
+
+    @override
+    def handle_endtag(self, tag: str) -> None:
+        self.depth -= 1
+        if self.depth == 0:
+            end = self.html.index(">", self.offset()) + 1
+            self.elements.append(self.html[self.element_start : end])
+        elif self.depth < 0:
+            self.valid = False
+
+    @override
+    def handle_data(self, data: str) -> None:
+        if self.depth == 0 and data.strip() != "":
+            self.valid = False
+
+
+def split_rendered_content(rendered_content: str) -> list[str] | None:
+    """Splits rendered content into its top-level elements, or returns
+    None if it is not made of elements separated by newlines."""
+    parser = TopLevelElementParser(rendered_content)
+    parser.feed(rendered_content)
+    parser.close()
+    if not parser.valid or parser.depth != 0:
+        return None
+    if "\n".join(parser.elements) != rendered_content:
+        return None
+    return parser.elements
+
+
+def can_reuse_block(
+    block: str, rendered_block: str, linkifiers: list[LinkifierDict], translate_emoticons: bool
+) -> bool:
+    if METADATA_HTML_RE.search(rendered_block) is not None:
+        return False
+    if REALM_DEPENDENT_SYNTAX_RE.search(block) is not None:
+        return False
+    if translate_emoticons and EMOTICON_REGEX.search(block) is not None:
+        return False
+    return not any(
+        get_compiled_linkifier_regex(linkifier["pattern"]).search(block) is not None
+        for linkifier in linkifiers
+    )
+
+
+def render_edited_message_markdown(
+    message: Message,
+    content: str,
+    realm: Realm,
+    mention_data: MentionData,
+) -> MessageRenderingResult | None:
+    """Renders the new content of an edited message by re-rendering
+    only the top-level blocks that changed, reusing the rest from the
+    message's current rendered_content.
+
+    Only blocks whose rendering carries no data about the message, and
+    cannot have been changed by realm data, are reused, so the
+    rendering result of the changed blocks describes the whole
+    message.  Returns None, for the caller to render the message in
+    full, when the content's blocks cannot be rendered independently,
+    nothing can be reused, or the rendering doesn't split into blocks
+    as expected (e.g. because of inline previews).
+    """
+    if message.rendered_content is None or message.rendered_content_version != markdown_version:
+        return None
+
+    prior_blocks = split_into_blocks(message.content)
+    blocks = split_into_blocks(content)
+    prior_rendered_blocks = split_rendered_content(message.rendered_content)
+    if (
+        prior_blocks is None
+        or blocks is None
+        or prior_rendered_blocks is None
+        or len(prior_blocks) != len(prior_rendered_blocks)
+    ):
+        incremental_rendering_stats["fallback"] += 1
+        return None
+
+    linkifiers = linkifiers_for_realm(realm.id)
+    translate_emoticons = message.sender.translate_emoticons
+    reusable_blocks = {
+        block: rendered_block
+        for block, rendered_block in zip(prior_blocks, prior_rendered_blocks, strict=True)
+        if can_reuse_block(block, rendered_block, linkifiers, translate_emoticons)
+    }
+    changed_blocks = [block for block in blocks if block not in reusable_blocks]
+    if len(changed_blocks) == len(blocks):
+        incremental_rendering_stats["fallback"] += 1
+        return None
+
+    rendering_result = MessageRenderingResult(
+        rendered_content="",
+        mentions_topic_wildcard=False,
+        mentions_stream_wildcard=False,
+        mentions_user_ids=set(),
+        mentions_user_group_ids=set(),
+        mentions_persona_ids=set(),
+        alert_words=set(),
+        links_for_preview=set(),
+        user_ids_with_alert_words=set(),
+        potential_attachment_path_ids=[],
+        thumbnail_spinners=set(),
+    )
+    changed_rendered_blocks: list[str] = []
+    if changed_blocks:
+        # Alert words are matched against the whole content below.
+        rendering_result = render_message_markdown(
+            message, "\n\n".join(changed_blocks), realm, mention_data=mention_data
+        )
+        split_blocks = split_rendered_content(rendering_result.rendered_content)
+        if split_blocks is None or len(split_blocks) != len(changed_blocks):
+            incremental_rendering_stats["fallback"] += 1
+            return None
+        changed_rendered_blocks = split_blocks
+    else:
+        message.has_link = False
+        message.has_image = False
+
+    rendered_blocks = iter(changed_rendered_blocks)
+    rendered_content = "\n".join(
+        reusable_blocks[block] if block in reusable_blocks else next(rendered_blocks)
+        for block in blocks
+    )
+    incremental_rendering_stats["blocks.reused"] += len(blocks) - len(changed_blocks)
+    incremental_rendering_stats["blocks.rendered"] += len(changed_blocks)
+
+    user_ids_with_alert_words: set[int] = set()
+    realm_alert_words_automaton = get_alert_word_automaton(realm)
+    if realm_alert_words_automaton is not None:
+        user_ids_with_alert_words = AlertWordNotificationProcessor.get_user_ids_with_alert_words(
+            realm_alert_words_automaton, content.lower()
+        )
+    return replace(
+        rendering_result,
+        rendered_content=rendered_content,
+        user_ids_with_alert_words=user_ids_with_alert_words,
+    )
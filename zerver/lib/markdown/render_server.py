@@ -0,0 +1,249 @@
+import logging
+from typing import Any
+
+import orjson
+import requests
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from zerver.lib.alert_words import get_alert_word_automaton
+from zerver.lib.exceptions import MarkdownRenderingBusyError, MarkdownRenderingError
+from zerver.lib.markdown import MessageRenderingResult, markdown_convert
+from zerver.lib.mention import FullNameInfo, MentionBackend, MentionData
+from zerver.lib.outgoing_http import OutgoingSession
+from zerver.models import Message, NamedUserGroup, UserProfile
+from zerver.models.realms import get_realm_by_id
+from zerver.models.users import get_user_profile_by_id
+
+# do_convert gives up on a message after 5 seconds; leave some room
+# for the request to wait for a free rendering process.
+MARKDOWN_SERVER_TIMEOUT = 10
+
+
+class MarkdownServerSession(OutgoingSession):
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(role="markdown", timeout=MARKDOWN_SERVER_TIMEOUT, **kwargs)
+
+
+class RenderingAdmission:
+    """Admission control for the Markdown rendering service.
+
+    Bounds the number of renders queued or running across all realms,
+    and for any single realm, so that a burst of expensive messages
+    from one organization is refused instead of delaying everyone
+    else's.  The service is single-threaded, so no locking is needed.
+    """
+
+    def __init__(self, max_pending: int, max_pending_per_realm: int) -> None:
+        self.max_pending = max_pending
+        self.max_pending_per_realm = max_pending_per_realm
+        self.pending = 0
+        self.pending_by_realm: dict[int, int] = {}
+
+    def try_admit(self, realm_id: int) -> bool:
+        realm_pending = self.pending_by_realm.get(realm_id, 0)
+        if self.pending >= self.max_pending or realm_pending >= self.max_pending_per_realm:
+            return False
+        self.pending += 1
+        self.pending_by_realm[realm_id] = realm_pending + 1
+        return True
+
+    def release(self, realm_id: int) -> None:
+        self.pending -= 1
+        self.pending_by_realm[realm_id] -= 1
+        if self.pending_by_realm[realm_id] == 0:
+            del self.pending_by_realm[realm_id]
+
+
+def rendering_result_to_dict(
+    rendering_result: MessageRenderingResult, message: Message
+) -> dict[str, Any]:
+    return {
+        "rendered_content": rendering_result.rendered_content,
+        "mentions_topic_wildcard": rendering_result.mentions_topic_wildcard,
+        "mentions_stream_wildcard": rendering_result.mentions_stream_wildcard,
+        "mentions_user_ids": sorted(rendering_result.mentions_user_ids),
+        "mentions_user_group_ids": sorted(rendering_result.mentions_user_group_ids),
+        "mentions_persona_ids": sorted(rendering_result.mentions_persona_ids),
+        "alert_words": sorted(rendering_result.alert_words),
+        "links_for_preview": sorted(rendering_result.links_for_preview),
+        "user_ids_with_alert_words": sorted(rendering_result.user_ids_with_alert_words),
+        "potential_attachment_path_ids": rendering_result.potential_attachment_path_ids,
+        "thumbnail_spinners": sorted(rendering_result.thumbnail_spinners),
+        "has_link": message.has_link,
+        "has_image": message.has_image,
+    }
+
+
+def rendering_result_from_dict(data: dict[str, Any], message: Message) -> MessageRenderingResult:
+    message.has_link = data["has_link"]
+    message.has_image = data["has_image"]
+    return MessageRenderingResult(
+        rendered_content=data["rendered_content"],
+        mentions_topic_wildcard=data["mentions_topic_wildcard"],
+        mentions_stream_wildcard=data["mentions_stream_wildcard"],
+        mentions_user_ids=set(data["mentions_user_ids"]),
+        mentions_user_group_ids=set(data["mentions_user_group_ids"]),
+        mentions_persona_ids=set(data["mentions_persona_ids"]),
+        alert_words=set(data["alert_words"]),
+        links_for_preview=set(data["links_for_preview"]),
+        user_ids_with_alert_words=set(data["user_ids_with_alert_words"]),
+        potential_attachment_path_ids=data["potential_attachment_path_ids"],
+        thumbnail_spinners=set(data["thumbnail_spinners"]),
+    )
+
+
+def mention_data_to_dict(mention_data: MentionData) -> dict[str, Any]:
+    return {
+        "users": [
+            [row.id, row.full_name, row.is_active] for row in mention_data.user_id_info.values()
+        ],
+        "user_group_ids": [group.id for group in mention_data.user_group_name_info.values()],
+        "user_group_members": [
+            [group_id, sorted(member_ids)]
+            for group_id, member_ids in mention_data.user_group_members.items()
+        ],
+        "has_stream_wildcards": mention_data.has_stream_wildcards,
+        "has_topic_wildcards": mention_data.has_topic_wildcards,
+    }
+
+
+def mention_data_from_dict(data: dict[str, Any], realm_id: int, sender: UserProfile) -> MentionData:
+    user_groups = list(
+        NamedUserGroup.objects.filter(realm_for_sharding_id=realm_id, id__in=data["user_group_ids"])
+    )
+    return MentionData.from_fetched_data(
+        MentionBackend(realm_id),
+        sender,
+        users=[
+            FullNameInfo(id=user_id, full_name=full_name, is_active=is_active)
+            for user_id, full_name, is_active in data["users"]
+        ],
+        user_groups=user_groups,
+        user_group_members={
+            group_id: set(member_ids) for group_id, member_ids in data["user_group_members"]
+        },
+        has_stream_wildcards=data["has_stream_wildcards"],
+        has_topic_wildcards=data["has_topic_wildcards"],
+    )
+
+
+def render_message_remotely(
+    message: Message,
+    content: str,
+    *,
+    realm_id: int,
+    alert_words: bool,
+    mention_data: MentionData | None,
+    email_gateway: bool,
+    no_previews: bool,
+    acting_user_id: int | None,
+) -> MessageRenderingResult | None:
+    """Render a message in the Markdown rendering service
+    (runmarkdownserver), returning None if the service is not
+    reachable, in which case the caller renders it in-process.
+
+    The service reads the message's realm and sender, and any mention
+    data the caller has not already fetched, from the database itself,
+    so this must not be called with uncommitted changes those depend
+    on.  If the service is
+    overloaded, raises MarkdownRenderingBusyError, which tells the
+    client to try again.
+    """
+    request = {
+        "content": content,
+        "realm_id": realm_id,
+        "sender_id": message.sender_id,
+        "recipient_id": message.recipient_id,
+        "message_id": message.id,
+        "alert_words": alert_words,
+        "mention_data": mention_data_to_dict(mention_data) if mention_data is not None else None,
+        "email_gateway": email_gateway,
+        "no_previews": no_previews,
+        "acting_user_id": acting_user_id,
+        "shared_secret": settings.SHARED_SECRET,
+    }
+    try:
+        resp = MarkdownServerSession().post(
+            # As with KaTeX, we explicitly disable the Smokescreen
+            # proxy for this call to our own local service.
+            f"http://localhost:{settings.MARKDOWN_SERVER_PORT}/",
+            data=orjson.dumps(request),
+            headers={"Content-Type": "application/json"},
+            proxies={"http": ""},
+        )
+    except requests.exceptions.Timeout:
+        logging.warning(
+            "Markdown rendering service timed out with %d byte long input", len(content)
+        )
+        raise MarkdownRenderingError
+    except requests.exceptions.RequestException as e:
+        logging.warning("Markdown rendering service failed: %s", type(e).__name__)
+        return None
+
+    if resp.status_code in (429, 503):
+        # Admission control refused the render; rendering it here
+        # instead would defeat the point of isolating it.  The content
+        # is fine, so let the client retry rather than failing it.
+        logging.warning("Markdown rendering service refused render for realm %d", realm_id)
+        raise MarkdownRenderingBusyError
+    if resp.status_code != 200:
+        logging.warning(
+            "Markdown rendering service failed: (%s) %s", resp.status_code, resp.content.decode()
+        )
+        return None
+
+    data = orjson.loads(resp.content)
+    if data["result"] != "success":
+        raise MarkdownRenderingError
+    return rendering_result_from_dict(data["rendering_result"], message)
+
+
+def check_render_request_secret(request: dict[str, Any]) -> bool:
+    return constant_time_compare(request.get("shared_secret", ""), settings.SHARED_SECRET)
+
+
+def render_message_request(request: dict[str, Any]) -> dict[str, Any]:
+    """Runs in a rendering process of runmarkdownserver."""
+    realm = get_realm_by_id(request["realm_id"])
+    sender = get_user_profile_by_id(request["sender_id"])
+    message = Message(
+        id=request["message_id"],
+        sender=sender,
+        realm=realm,
+        recipient_id=request["recipient_id"],
+    )
+    acting_user = None
+    if request["acting_user_id"] is not None:
+        acting_user = get_user_profile_by_id(request["acting_user_id"])
+    mention_data = None
+    if request["mention_data"] is not None:
+        mention_data = mention_data_from_dict(request["mention_data"], realm.id, sender)
+
+    try:
+        rendering_result = markdown_convert(
+            request["content"],
+            realm_alert_words_automaton=(
+                get_alert_word_automaton(realm) if request["alert_words"] else None
+            ),
+            message=message,
+            message_realm=realm,
+            mention_data=mention_data,
+            sent_by_bot=sender.is_bot,
+            translate_emoticons=sender.translate_emoticons,
+            email_gateway=request["email_gateway"],
+            no_previews=request["no_previews"],
+            acting_user=acting_user,
+        )
+    except MarkdownRenderingError:
+        return {"result": "error"}
+    return {
+        "result": "success",
+        "rendering_result": rendering_result_to_dict(rendering_result, message),
+    }
+
+
+def warm_up_rendering_process() -> None:
+    """Pre-warms a rendering process, so the first message it renders
+    does not pay for compiling the Markdown processor's regexes."""
+    markdown_convert("**Warm** up with https://zulip.com, `code` and :smile:\n\n* a list")
@@ -0,0 +1,176 @@
+import secrets
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+
+from zerver.lib.cache import cache_get, cache_set, realm_rendering_context_version_cache_key
+from zerver.models.personas import UserPersona
+from zerver.models.realm_emoji import EmojiInfo, get_name_keyed_dict_for_active_realm_emoji
+from zerver.models.streams import Stream, StreamPuppet
+
+# Profiling counters for each sub-lookup, keyed by "<lookup>.hit" and
+# "<lookup>.load"; see get_rendering_context_stats.
+rendering_context_stats: Counter[str] = Counter()
+
+
+@dataclass(frozen=True)
+class MentionTarget:
+    # "puppet" or "persona"
+    kind: str
+    id: int
+    # The persona's owner, who is notified when it is mentioned.
+    owner_user_id: int | None = None
+
+
+class MentionIndex:
+    """The puppet and persona names that can be @-mentioned in a
+    channel (or, for direct messages, just the realm's personas),
+    case-folded once so that each lookup is a single dict access.
+
+    Users and user groups are not included: the Markdown processor
+    fetches only those named in the message, via MentionData, which
+    is much cheaper than indexing every user in a large realm.
+    """
+
+    def __init__(
+        self, puppets: list[tuple[int, str]], personas: list[tuple[int, str, int]]
+    ) -> None:
+        self.targets: dict[str, MentionTarget] = {}
+        # A puppet shadows a persona with the same name in its channel.
+        for persona_id, name, owner_user_id in personas:
+            self.targets[name.casefold()] = MentionTarget("persona", persona_id, owner_user_id)
+        for puppet_id, name in puppets:
+            self.targets[name.casefold()] = MentionTarget("puppet", puppet_id)
+        self.sorted_names = sorted(self.targets)
+        self.persona_owner_ids = {
+            persona_id: owner_user_id for persona_id, _name, owner_user_id in personas
+        }
+
+    def lookup(self, name: str) -> MentionTarget | None:
+        return self.targets.get(name.casefold())
+
+    def search_prefix(self, prefix: str, kind: str) -> list[int]:
+        """IDs of the targets of the given kind whose names start with
+        prefix, ignoring case, in name order."""
+        prefix = prefix.casefold()
+        ids = []
+        for name in self.sorted_names[bisect_left(self.sorted_names, prefix) :]:
+            if not name.startswith(prefix):
+                break
+            target = self.targets[name]
+            if target.kind == kind:
+                ids.append(target.id)
+        return ids
+
+    def get_persona_owner_ids(self, persona_ids: set[int]) -> set[int]:
+        return {
+            self.persona_owner_ids[persona_id]
+            for persona_id in persona_ids
+            if persona_id in self.persona_owner_ids
+        }
+
+    def fingerprint(self) -> list[tuple[str, MentionTarget]]:
+        return sorted(self.targets.items())
+
+
+class RealmRenderingContext:
+    """Realm-wide data the Markdown processor needs to render a message,
+    memoized in the process across renders.
+
+    Each piece is loaded lazily, the first time a message whose syntax
+    needs it is rendered. The snapshot is tagged with a version token
+    stored in memcached; flush_realm_rendering_context invalidates it
+    (from the model save hooks for personas, puppets, channels, users
+    and custom emoji), and get_realm_rendering_context replaces the
+    snapshot on the next render in every process.
+    """
+
+    def __init__(self, realm_id: int, version: str) -> None:
+        self.realm_id = realm_id
+        self.version = version
+        self._active_realm_emoji: dict[str, EmojiInfo] | None = None
+        self._personas: list[tuple[int, str, int]] | None = None
+        # Maps a channel ID to its puppets, which is empty if the channel
+        # does not exist or has puppet mode disabled.
+        self._puppets: dict[int, list[tuple[int, str]]] = {}
+        self._mention_indexes: dict[int | None, MentionIndex] = {}
+
+    def get_active_realm_emoji(self) -> dict[str, EmojiInfo]:
+        if self._active_realm_emoji is None:
+            rendering_context_stats["emoji.load"] += 1
+            self._active_realm_emoji = get_name_keyed_dict_for_active_realm_emoji(self.realm_id)
+        else:
+            rendering_context_stats["emoji.hit"] += 1
+        return self._active_realm_emoji
+
+    def get_personas(self) -> list[tuple[int, str, int]]:
+        """(persona_id, name, owner_user_id) for each active persona."""
+        if self._personas is None:
+            rendering_context_stats["personas.load"] += 1
+            self._personas = list(
+                UserPersona.objects.filter(
+                    user__realm_id=self.realm_id,
+                    user__is_active=True,
+                    is_active=True,
+                ).values_list("id", "name", "user_id")
+            )
+        else:
+            rendering_context_stats["personas.hit"] += 1
+        return self._personas
+
+    def get_puppets(self, stream_id: int) -> list[tuple[int, str]]:
+        if stream_id not in self._puppets:
+            rendering_context_stats["puppets.load"] += 1
+            puppets: list[tuple[int, str]] = []
+            try:
+                stream = Stream.objects.get(id=stream_id)
+                if stream.enable_puppet_mode:
+                    puppets = list(
+                        StreamPuppet.objects.filter(stream_id=stream_id).values_list("id", "name")
+                    )
+            except Stream.DoesNotExist:
+                pass
+            self._puppets[stream_id] = puppets
+        else:
+            rendering_context_stats["puppets.hit"] += 1
+        return self._puppets[stream_id]
+
+    def get_mention_index(self, stream_id: int | None) -> MentionIndex:
+        """The mention index for messages sent to a channel, or, with
+        stream_id None, for direct messages."""
+        if stream_id not in self._mention_indexes:
+            rendering_context_stats["mention_index.load"] += 1
+            puppets = self.get_puppets(stream_id) if stream_id is not None else []
+            self._mention_indexes[stream_id] = MentionIndex(puppets, self.get_personas())
+        else:
+            rendering_context_stats["mention_index.hit"] += 1
+        return self._mention_indexes[stream_id]
+
+
+realm_rendering_contexts: dict[int, RealmRenderingContext] = {}
+
+
+def get_realm_rendering_context(realm_id: int) -> RealmRenderingContext:
+    version_key = realm_rendering_context_version_cache_key(realm_id)
+    cached_version = cache_get(version_key)
+    if cached_version is None:
+        # Nothing is known about this realm's current version (it was
+        # flushed or evicted), so start a new one; any snapshot held by
+        # any process is stale.
+        version = secrets.token_hex(8)
+        cache_set(version_key, version, timeout=3600 * 24 * 7)
+    else:
+        version = cached_version[0]
+
+    context = realm_rendering_contexts.get(realm_id)
+    if context is None or context.version != version:
+        rendering_context_stats["context.load"] += 1
+        context = RealmRenderingContext(realm_id, version)
+        realm_rendering_contexts[realm_id] = context
+    else:
+        rendering_context_stats["context.hit"] += 1
+    return context
+
+
+def get_rendering_context_stats() -> dict[str, int]:
+    return dict(rendering_context_stats)
@@ -385,6 +385,32 @@ class MentionData:
         self.has_stream_wildcards = mentions.message_has_stream_wildcards
         self.has_topic_wildcards = mentions.message_has_topic_wildcards
 
+    @classmethod
+    def from_fetched_data(
+        cls,
+        mention_backend: MentionBackend,
+        message_sender: UserProfile | None,
+        *,
+        users: list[FullNameInfo],
+        user_groups: list[NamedUserGroup],
+        user_group_members: dict[int, set[int]],
+        has_stream_wildcards: bool,
+        has_topic_wildcards: bool,
+    ) -> "MentionData":
+        """Rebuilds a MentionData from data fetched by another process,
+        so the Markdown rendering service renders exactly the mentions
+        the sending process looked up."""
+        mention_data = cls.__new__(cls)
+        mention_data.mention_backend = mention_backend
+        mention_data.message_sender = message_sender
+        mention_data.full_name_info = {row.full_name.lower(): row for row in users}
+        mention_data.user_id_info = {row.id: row for row in users}
+        mention_data.user_group_name_info = {group.name.lower(): group for group in user_groups}
+        mention_data.user_group_members = defaultdict(set, user_group_members)
+        mention_data.has_stream_wildcards = has_stream_wildcards
+        mention_data.has_topic_wildcards = has_topic_wildcards
+        return mention_data
+
     def message_has_stream_wildcards(self) -> bool:
         return self.has_stream_wildcards
 
@@ -1,3 +1,4 @@
+import copy
 import re
 from collections.abc import Callable, Collection, Mapping, Sequence
 from dataclasses import dataclass, field
@@ -6,7 +7,7 @@ from typing import Any, TypedDict
 
 from django.conf import settings
 from django.db import connection
-from django.db.models import Exists, F, Max, OuterRef, QuerySet, Subquery, Sum
+from django.db.models import Exists, F, Max, OuterRef, Q, QuerySet, Subquery, Sum
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 from django_cte import CTE, with_cte
@@ -14,12 +15,11 @@ from psycopg2.sql import SQL
 
 from analytics.lib.counts import COUNT_STATS
 from analytics.models import RealmCount
-from zerver.lib.cache import generic_bulk_cached_fetch, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient, get_display_recipient_by_id
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
 from zerver.lib.markdown import MessageRenderingResult
 from zerver.lib.mention import MentionData, sender_can_mention_group
-from zerver.lib.message_cache import MessageDict, extract_message_dict, stringify_message_dict
+from zerver.lib.message_cache import MessageDict, bulk_fetch_message_dicts
 from zerver.lib.partial import partial
 from zerver.lib.request import RequestVariableConversionError
 from zerver.lib.stream_subscription import (
@@ -34,6 +34,7 @@ from zerver.lib.streams import (
     is_user_in_groups_granting_content_access,
 )
 from zerver.lib.topic import (
+    DB_TOPIC_NAME,
     MESSAGE__TOPIC,
     RESOLVED_TOPIC_PREFIX,
     TOPIC_NAME,
@@ -41,7 +42,9 @@ from zerver.lib.topic import (
     messages_for_topic,
 )
 from zerver.lib.types import FormattedEditHistoryEvent, UserDisplayRecipient
+from zerver.lib.unread_conversations import update_unread_summary
 from zerver.lib.user_groups import UserGroupMembershipDetails, get_recursive_membership_groups
+from zerver.lib.user_message import get_sparse_unread_messages
 from zerver.lib.user_topics import build_get_topic_visibility_policy, get_topic_visibility_policy
 from zerver.lib.users import get_inaccessible_user_ids
 from zerver.models import (
@@ -281,6 +284,54 @@ def topic_resolve_toggled(topic: str, prev_topic: str) -> bool:
     return False
 
 
+def build_message_dict_variant(
+    message_dict: dict[str, Any],
+    message_edit_history_visibility_policy: int,
+    allow_empty_topic_name: bool,
+) -> dict[str, Any]:
+    """Resolves everything in a message dict that depends only on the
+    message and the arguments, for messages_for_ids to memoize.  The
+    result is shared between requests, so must not be mutated, beyond
+    replacing its top-level keys in a shallow copy."""
+    msg_dict = copy.copy(message_dict)
+    if "edit_history" not in msg_dict:
+        return msg_dict
+
+    # In addition to computing last_moved_timestamp, we recompute
+    # last_edit_timestamp, because the logic powering the database
+    # field updates it on moves as well, and we'd like to show the
+    # correct value for messages that had only been moved.
+    last_moved_timestamp = 0
+    last_edit_timestamp = 0
+    for item in msg_dict["edit_history"]:
+        if "prev_stream" in item:
+            last_moved_timestamp = max(last_moved_timestamp, item["timestamp"])
+        elif "prev_topic" in item and not topic_resolve_toggled(item["topic"], item["prev_topic"]):
+            last_moved_timestamp = max(last_moved_timestamp, item["timestamp"])
+        if "prev_content" in item:
+            last_edit_timestamp = max(last_edit_timestamp, item["timestamp"])
+    if last_moved_timestamp != 0:
+        msg_dict["last_moved_timestamp"] = last_moved_timestamp
+    if last_edit_timestamp != 0:
+        msg_dict["last_edit_timestamp"] = last_edit_timestamp
+    else:
+        # Remove it if it was already present.
+        msg_dict.pop("last_edit_timestamp", None)
+
+    if message_edit_history_visibility_policy == MessageEditHistoryVisibilityPolicyEnum.none.value:
+        del msg_dict["edit_history"]
+    else:
+        # finalize_edit_history copies the events, which
+        # visible_edit_history_for_message then edits in place.
+        msg_dict["edit_history"] = visible_edit_history_for_message(
+            message_edit_history_visibility_policy,
+            MessageDict.finalize_edit_history(
+                msg_dict["edit_history"], allow_empty_topic_name=allow_empty_topic_name
+            ),
+        )
+    return msg_dict
+
+
 def messages_for_ids(
     message_ids: list[int],
     user_message_flags: dict[int, list[str]],
@@ -292,30 +343,33 @@ def messages_for_ids(
     user_profile: UserProfile | None,
     realm: Realm,
 ) -> list[dict[str, Any]]:
-    id_fetcher = lambda row: row["id"]
-
-    message_dicts = generic_bulk_cached_fetch(
-        to_dict_cache_key_id,
-        MessageDict.ids_to_dict,
-        message_ids,
-        id_fetcher=id_fetcher,
-        cache_transformer=lambda obj: obj,
-        extractor=extract_message_dict,
-        setter=stringify_message_dict,
-        pickled_tupled=False,
-    )
+    cached_messages = bulk_fetch_message_dicts(message_ids)
 
     message_list: list[dict[str, Any]] = []
 
-    sender_ids = [message_dicts[message_id]["sender_id"] for message_id in message_ids]
+    sender_ids = [
+        cached_messages[message_id].message_dict["sender_id"] for message_id in message_ids
+    ]
     inaccessible_sender_ids = get_inaccessible_user_ids(sender_ids, user_profile)
 
+    variant_key = (message_edit_history_visibility_policy, allow_empty_topic_name)
     for message_id in message_ids:
-        msg_dict = message_dicts[message_id]
+        cached_message = cached_messages[message_id]
+        variant = cached_message.variants.get(variant_key)
+        if variant is None:
+            variant = build_message_dict_variant(
+                cached_message.message_dict,
+                message_edit_history_visibility_policy,
+                allow_empty_topic_name,
+            )
+            cached_message.variants[variant_key] = variant
+        # Nested values are shared with the cached variant; only
+        # top-level keys may be replaced.
+        msg_dict = copy.copy(variant)
         flags = user_message_flags[message_id]
 
         # Filter submessages by visibility for the requesting user
-        if "submessages" in msg_dict and user_profile is not None:
+        if msg_dict.get("submessages") and user_profile is not None:
             user_id = user_profile.id
             msg_dict["submessages"] = [
                 sm
@@ -333,40 +387,6 @@ def messages_for_ids(
         msg_dict.update(flags=flags)
         if message_id in search_fields:
             msg_dict.update(search_fields[message_id])
-        if "edit_history" in msg_dict:
-            # In addition to computing last_moved_timestamp, we recompute
-            # last_edit_timestamp, because the logic powering the database
-            # field updates it on moves as well, and we'd like to show the
-            # correct value for messages that had only been moved.
-            last_moved_timestamp = 0
-            last_edit_timestamp = 0
-            for item in msg_dict["edit_history"]:
-                if "prev_stream" in item:
-                    last_moved_timestamp = max(last_moved_timestamp, item["timestamp"])
-                elif "prev_topic" in item and not topic_resolve_toggled(
-                    item["topic"], item["prev_topic"]
-                ):
-                    last_moved_timestamp = max(last_moved_timestamp, item["timestamp"])
-                if "prev_content" in item:
-                    last_edit_timestamp = max(last_edit_timestamp, item["timestamp"])
-            if last_moved_timestamp != 0:
-                msg_dict["last_moved_timestamp"] = last_moved_timestamp
-            if last_edit_timestamp != 0:
-                msg_dict["last_edit_timestamp"] = last_edit_timestamp
-            else:
-                # Remove it if it was already present.
-                msg_dict.pop("last_edit_timestamp", None)
-
-            if (
-                message_edit_history_visibility_policy
-                == MessageEditHistoryVisibilityPolicyEnum.none.value
-            ):
-                del msg_dict["edit_history"]
-            else:
-                visible_edit_history = visible_edit_history_for_message(
-                    message_edit_history_visibility_policy, msg_dict["edit_history"]
-                )
-                msg_dict["edit_history"] = visible_edit_history
 
         msg_dict["can_access_sender"] = msg_dict["sender_id"] not in inaccessible_sender_ids
         message_list.append(msg_dict)
@@ -376,6 +396,7 @@ def messages_for_ids(
         apply_markdown=apply_markdown,
         client_gravatar=client_gravatar,
         allow_empty_topic_name=allow_empty_topic_name,
+        edit_history_finalized=True,
         realm=realm,
         user_recipient_id=None if user_profile is None else user_profile.recipient_id,
     )
@@ -836,18 +857,28 @@ def direct_message_group_users(recipient_id: int) -> str:
     return ",".join(str(uid) for uid in user_ids)
 
 
-def get_inactive_recipient_ids(user_profile: UserProfile) -> list[int]:
+def get_unread_subscription_data(user_profile: UserProfile) -> tuple[list[int], bool]:
+    """Returns the recipient IDs of the user's inactive stream
+    subscriptions, and whether they are actively subscribed to any
+    stream using sparse_user_messages, in one query."""
     rows = (
         get_stream_subscriptions_for_user(user_profile)
         .filter(
-            active=False,
+            Q(active=False)
+            | Q(
+                active=True,
+                recipient__stream__sparse_user_messages=True,
+                recipient__stream__history_public_to_subscribers=True,
+            )
         )
         .values(
             "recipient_id",
+            "active",
         )
     )
-    inactive_recipient_ids = [row["recipient_id"] for row in rows]
-    return inactive_recipient_ids
+    inactive_recipient_ids = [row["recipient_id"] for row in rows if not row["active"]]
+    has_sparse_subscriptions = any(row["active"] for row in rows)
+    return inactive_recipient_ids, has_sparse_subscriptions
 
 
 def get_muted_stream_ids(user_profile: UserProfile) -> set[int]:
@@ -883,7 +914,7 @@ def get_starred_message_ids(user_profile: UserProfile) -> list[int]:
 def get_raw_unread_data(
     user_profile: UserProfile, message_ids: list[int] | None = None
 ) -> RawUnreadMessagesResult:
-    excluded_recipient_ids = get_inactive_recipient_ids(user_profile)
+    excluded_recipient_ids, has_sparse_subscriptions = get_unread_subscription_data(user_profile)
     first_visible_message_id = get_first_visible_message_id(user_profile.realm)
     user_msgs = (
         UserMessage.objects.filter(
@@ -966,7 +997,37 @@ def get_raw_unread_data(
             rows = list(user_msgs)
         finally:
             cursor.execute("SET enable_bitmapscan TO on")
-        return extract_unread_data_from_um_rows(rows, user_profile)
+
+    if message_ids is None and settings.UNREAD_CONVERSATIONS_ENABLED:
+        # Users with many unread messages get a summary for finding
+        # their first unread message; see find_first_unread_anchor.
+        update_unread_summary(user_profile, len(rows))
+
+    if message_ids is None and has_sparse_subscriptions:
+        # Messages in streams using sparse_user_messages are mostly
+        # unread without having a UserMessage row at all.
+        sparse_unread_msgs = (
+            get_sparse_unread_messages(user_profile)
+            .filter(id__gte=first_visible_message_id)
+            .values("id", "sender_id", DB_TOPIC_NAME, "recipient_id", "recipient__type_id")
+            .order_by("-id")[:MAX_UNREAD_MESSAGES]
+        )
+        rows.extend(
+            dict(
+                message_id=row["id"],
+                sender_id=row["sender_id"],
+                topic=row[DB_TOPIC_NAME],
+                flags=0,
+                recipient_id=row["recipient_id"],
+                recipient__type=Recipient.STREAM,
+                recipient__type_id=row["recipient__type_id"],
+            )
+            for row in sparse_unread_msgs
+        )
+        rows.sort(key=lambda row: row["message_id"])
+        rows = rows[-MAX_UNREAD_MESSAGES:]
+
+    return extract_unread_data_from_um_rows(rows, user_profile)
 
 
 def extract_unread_data_from_um_rows(
@@ -1,17 +1,29 @@
 import copy
+import secrets
+from collections import Counter, OrderedDict
 from collections.abc import Iterable
 from datetime import datetime
 from email.headerregistry import Address
 from typing import Any, TypedDict
 
 import orjson
+from django.conf import settings
 
+from zerver.lib import user_display_table
 from zerver.lib.avatar import get_avatar_field, get_avatar_for_inaccessible_user
-from zerver.lib.cache import cache_set_many, cache_with_key, to_dict_cache_key, to_dict_cache_key_id
+from zerver.lib.cache import (
+    cache_get_many,
+    cache_set_many,
+    cache_with_key,
+    flush_message_dict_generations,
+    generic_bulk_cached_fetch,
+    message_dict_generation_cache_key,
+    to_dict_cache_key,
+    to_dict_cache_key_id,
+)
 from zerver.lib.display_recipient import bulk_fetch_display_recipients
 from zerver.lib.markdown import render_message_markdown, topic_links
 from zerver.lib.markdown import version as markdown_version
-from zerver.lib.query_helpers import query_for_ids
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.topic import DB_TOPIC_NAME, TOPIC_LINKS, TOPIC_NAME
 from zerver.lib.types import DisplayRecipientT, EditHistoryEvent, UserDisplayRecipient
@@ -62,6 +74,105 @@ def sew_messages_and_submessages(
             message["submessages"].append(submessage)
 
 
+# Decoded message dicts, held in process so that the recent messages
+# that many clients fetch need not be fetched from memcached and
+# decoded each time; see bulk_fetch_message_dicts.
+MESSAGE_DICT_LRU_SIZE = 5000
+
+
+class CachedMessageDict:
+    """A decoded message dict, which is never mutated, along with the
+    variants of it that messages_for_ids has built for each edit
+    history visibility policy and empty topic name setting.  A
+    variant has everything resolved that depends only on the message,
+    so fetching it again is a shallow copy."""
+
+    def __init__(self, message_dict: dict[str, Any]) -> None:
+        self.message_dict = message_dict
+        self.variants: dict[tuple[int, bool], dict[str, Any]] = {}
+
+
+class MessageDictLRU:
+    """A bounded cache of CachedMessageDict objects, each tagged with
+    the generation token (see message_dict_generation_cache_key)
+    current when it was fetched."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[int, tuple[str, CachedMessageDict]] = OrderedDict()
+        self.stats: Counter[str] = Counter()
+
+    def get(self, message_id: int, generation: str) -> CachedMessageDict | None:
+        entry = self.entries.get(message_id)
+        if entry is None or entry[0] != generation:
+            self.stats["miss"] += 1
+            return None
+        self.stats["hit"] += 1
+        self.entries.move_to_end(message_id)
+        return entry[1]
+
+    def set(self, message_id: int, generation: str, cached_message: CachedMessageDict) -> None:
+        self.entries[message_id] = (generation, cached_message)
+        self.entries.move_to_end(message_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["eviction"] += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+message_dict_lru = MessageDictLRU(MESSAGE_DICT_LRU_SIZE)
+
+
+def get_message_dict_generations(message_ids: Iterable[int]) -> dict[str, str]:
+    keys = {message_dict_generation_cache_key(message_id) for message_id in message_ids}
+    generations: dict[str, str] = cache_get_many(list(keys))
+    new_generations = {key: secrets.token_hex(8) for key in keys if key not in generations}
+    if new_generations:
+        # Nothing is known about these messages' generations (they were
+        # flushed or evicted), so any copy of them held by any process
+        # is stale.
+        cache_set_many(new_generations, timeout=3600 * 24)
+        generations.update(new_generations)
+    return generations
+
+
+def bulk_fetch_message_dicts(message_ids: list[int]) -> dict[int, CachedMessageDict]:
+    """Fetches the dicts for messages_for_ids, from the process-local
+    MessageDictLRU if their generation is current, and otherwise from
+    the to_dict cache in memcached (or the database)."""
+    if len(message_ids) == 0:
+        return {}
+
+    generations = get_message_dict_generations(message_ids)
+    cached_messages: dict[int, CachedMessageDict] = {}
+    needed_ids: list[int] = []
+    for message_id in message_ids:
+        generation = generations[message_dict_generation_cache_key(message_id)]
+        cached_message = message_dict_lru.get(message_id, generation)
+        if cached_message is None:
+            needed_ids.append(message_id)
+        else:
+            cached_messages[message_id] = cached_message
+
+    fetched_message_dicts = generic_bulk_cached_fetch(
+        to_dict_cache_key_id,
+        MessageDict.ids_to_dict,
+        needed_ids,
+        id_fetcher=lambda row: row["id"],
+        cache_transformer=lambda obj: obj,
+        extractor=extract_message_dict,
+        setter=stringify_message_dict,
+        pickled_tupled=False,
+    )
+    for message_id, message_dict in fetched_message_dicts.items():
+        generation = generations[message_dict_generation_cache_key(message_id)]
+        cached_messages[message_id] = CachedMessageDict(message_dict)
+        message_dict_lru.set(message_id, generation, cached_messages[message_id])
+    return cached_messages
+
+
 def extract_message_dict(message_bytes: bytes) -> dict[str, Any]:
     return orjson.loads(message_bytes)
 
@@ -86,6 +197,7 @@ def update_message_cache(
         items_for_remote_cache[to_dict_cache_key_id(msg_id)] = msg
 
     cache_set_many(items_for_remote_cache)
+    flush_message_dict_generations(changed_messages_to_dict.keys())
     return list(changed_messages_to_dict.keys())
 
 
@@ -161,6 +273,7 @@ class MessageDict:
         apply_markdown: bool,
         client_gravatar: bool,
         allow_empty_topic_name: bool,
+        edit_history_finalized: bool = False,
         realm: Realm,
         user_recipient_id: int | None,
     ) -> None:
@@ -183,6 +296,7 @@ class MessageDict:
                 client_gravatar=client_gravatar,
                 allow_empty_topic_name=allow_empty_topic_name,
                 skip_copy=True,
+                edit_history_finalized=edit_history_finalized,
                 can_access_sender=can_access_sender,
                 realm_host=realm.host,
                 is_incoming_1_to_1=obj["recipient_id"] == user_recipient_id,
@@ -197,6 +311,7 @@ class MessageDict:
         allow_empty_topic_name: bool,
         keep_rendered_content: bool = False,
         skip_copy: bool = False,
+        edit_history_finalized: bool = False,
         can_access_sender: bool,
         realm_host: str,
         is_incoming_1_to_1: bool,
@@ -204,7 +319,9 @@ class MessageDict:
         """
         By default, we make a shallow copy of the incoming dict to avoid
         mutation-related bugs.  Code paths that are passing a unique object
-        can pass skip_copy=True to avoid this extra work.
+        can pass skip_copy=True to avoid this extra work, and code paths
+        whose edit_history was already passed through
+        finalize_edit_history can pass edit_history_finalized=True.
         """
         if not skip_copy:
             obj = copy.copy(obj)
@@ -267,14 +384,10 @@ class MessageDict:
             # to uniquely represent the set of 2 users in this conversation.
             obj["recipient_id"] = obj["sender_recipient_id"]
 
-        for item in obj.get("edit_history", []):
-            if "prev_rendered_content_version" in item:
-                del item["prev_rendered_content_version"]
-            if not allow_empty_topic_name:
-                if "prev_topic" in item and item["prev_topic"] == "":
-                    item["prev_topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
-                if "topic" in item and item["topic"] == "":
-                    item["topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
+        if "edit_history" in obj and not edit_history_finalized:
+            obj["edit_history"] = MessageDict.finalize_edit_history(
+                obj["edit_history"], allow_empty_topic_name=allow_empty_topic_name
+            )
 
         if not keep_rendered_content:
             del obj["rendered_content"]
@@ -292,6 +405,22 @@ class MessageDict:
             del obj["can_access_sender"]
         return obj
 
+    @staticmethod
+    def finalize_edit_history(
+        edit_history: list[dict[str, Any]], *, allow_empty_topic_name: bool
+    ) -> list[dict[str, Any]]:
+        finalized_edit_history = []
+        for item in edit_history:
+            item = copy.copy(item)
+            item.pop("prev_rendered_content_version", None)
+            if not allow_empty_topic_name:
+                if "prev_topic" in item and item["prev_topic"] == "":
+                    item["prev_topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
+                if "topic" in item and item["topic"] == "":
+                    item["topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
+            finalized_edit_history.append(item)
+        return finalized_edit_history
+
     @staticmethod
     def sew_submessages_and_reactions_to_msgs(
         messages: list[dict[str, Any]],
@@ -544,40 +673,27 @@ class MessageDict:
 
     @staticmethod
     def bulk_hydrate_sender_info(objs: list[dict[str, Any]]) -> None:
-        sender_ids = list({obj["sender_id"] for obj in objs})
+        sender_ids = {obj["sender_id"] for obj in objs}
 
         if not sender_ids:
             return
 
-        query = UserProfile.objects.values(
-            "id",
-            "full_name",
-            "delivery_email",
-            "email",
-            "recipient_id",
-            "realm__string_id",
-            "avatar_source",
-            "avatar_version",
-            "is_mirror_dummy",
-            "email_address_visibility",
+        sender_dict = user_display_table.bulk_fetch_user_display_rows(
+            sender_ids, {obj["sender_realm_id"] for obj in objs}
         )
 
-        rows = query_for_ids(query, sender_ids, "zerver_userprofile.id")
-
-        sender_dict = {row["id"]: row for row in rows}
-
         for obj in objs:
             sender_id = obj["sender_id"]
             user_row = sender_dict[sender_id]
-            obj["sender_recipient_id"] = user_row["recipient_id"]
-            obj["sender_full_name"] = user_row["full_name"]
-            obj["sender_email"] = user_row["email"]
-            obj["sender_delivery_email"] = user_row["delivery_email"]
-            obj["sender_realm_str"] = user_row["realm__string_id"]
-            obj["sender_avatar_source"] = user_row["avatar_source"]
-            obj["sender_avatar_version"] = user_row["avatar_version"]
-            obj["sender_is_mirror_dummy"] = user_row["is_mirror_dummy"]
-            obj["sender_email_address_visibility"] = user_row["email_address_visibility"]
+            obj["sender_recipient_id"] = user_row.recipient_id
+            obj["sender_full_name"] = user_row.full_name
+            obj["sender_email"] = user_row.email
+            obj["sender_delivery_email"] = user_row.delivery_email
+            obj["sender_realm_str"] = user_row.realm_string_id
+            obj["sender_avatar_source"] = user_row.avatar_source
+            obj["sender_avatar_version"] = user_row.avatar_version
+            obj["sender_is_mirror_dummy"] = user_row.is_mirror_dummy
+            obj["sender_email_address_visibility"] = user_row.email_address_visibility
 
     @staticmethod
     def hydrate_recipient_info(obj: dict[str, Any], display_recipient: DisplayRecipientT) -> None:
@@ -631,7 +747,11 @@ class MessageDict:
             )
             for obj in objs
         }
-        display_recipients = bulk_fetch_display_recipients(recipient_tuples)
+        # Direct message recipients are mostly in the sender's realm.
+        realm_ids = None
+        if settings.USER_DISPLAY_TABLE_ENABLED:
+            realm_ids = {obj["sender_realm_id"] for obj in objs}
+        display_recipients = bulk_fetch_display_recipients(recipient_tuples, realm_ids=realm_ids)
 
         for obj in objs:
             MessageDict.hydrate_recipient_info(obj, display_recipients[obj["recipient_id"]])
@@ -1,9 +1,14 @@
+import hashlib
 import re
+import secrets
+import time
+from collections import Counter
 from collections.abc import Callable, Iterable, Sequence
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, Generic, Literal, TypeAlias, TypedDict, TypeVar
 
+import orjson
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError
@@ -29,17 +34,24 @@ from sqlalchemy.sql import (
     true,
     union_all,
 )
-from sqlalchemy.sql.selectable import SelectBase
+from sqlalchemy.sql.selectable import FromClause, SelectBase
 from sqlalchemy.types import ARRAY, Boolean, Integer, Text
 from typing_extensions import override
 
 from zerver.lib.addressee import get_user_profiles, get_user_profiles_by_ids
+from zerver.lib.cache import (
+    cache_get,
+    cache_set,
+    search_result_cache_key,
+    search_result_generation_cache_key,
+)
 from zerver.lib.exceptions import ErrorCode, JsonableError, MissingAuthenticationError
 from zerver.lib.message import (
     access_message,
     access_web_public_message,
     get_first_visible_message_id,
 )
+from zerver.lib.narrow_explain import explain_narrow_query, should_explain_narrow_query
 from zerver.lib.narrow_predicate import channel_operators, channels_operators
 from zerver.lib.recipient_users import recipient_for_user_profiles
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
@@ -55,10 +67,12 @@ from zerver.lib.topic_sqlalchemy import (
     get_followed_topic_condition_sa,
     get_resolved_topic_condition_sa,
     topic_column_sa,
+    topic_id_match_sa,
     topic_match_sa,
 )
 from zerver.lib.types import Validator
 from zerver.lib.user_groups import get_recursive_membership_groups
+from zerver.lib.user_message import get_sparse_subscriptions
 from zerver.lib.user_topics import exclude_stream_and_topic_mutes
 from zerver.lib.validator import (
     check_bool,
@@ -501,7 +515,13 @@ class NarrowBuilder:
     def by_topic(self, query: Select, operand: str, maybe_negate: ConditionTransform) -> Select:
         self.check_not_both_channel_and_dm_narrow(maybe_negate, is_channel_narrow=True)
 
-        cond = topic_match_sa(operand)
+        if maybe_negate is not_:
+            # Excluding a topic must keep direct messages, which have
+            # no topic ID.
+            cond = topic_match_sa(operand)
+        else:
+            # Uses index: zerver_message_topic_id
+            cond = topic_id_match_sa(self.realm.id, operand)
         return query.where(maybe_negate(cond))
 
     def by_sender(
@@ -1102,49 +1122,136 @@ def get_whisper_visibility_condition(
     return or_(*conditions)
 
 
-def get_base_query_for_search(
-    realm_id: int, user_profile: UserProfile | None, need_user_message: bool
-) -> tuple[Select, ColumnElement[Integer]]:
-    # Handle the simple case where user_message isn't involved first.
-    if not need_user_message:
-        # Get user info for whisper visibility
-        user_id: int | None = None
-        user_recursive_group_ids: list[int] = []
-        handled_puppet_ids: list[int] = []
-        owned_persona_ids: list[int] = []
-        if user_profile is not None:
-            user_id = user_profile.id
-            if not user_profile.is_guest:
-                user_recursive_group_ids = sorted(
-                    get_recursive_membership_groups(user_profile).values_list("id", flat=True)
-                )
-            # Get puppets the user handles for whisper visibility
-            from zerver.actions.stream_puppets import get_all_user_handled_puppet_ids
+def get_whisper_visibility_condition_for_user(user_profile: UserProfile | None) -> ClauseElement:
+    # Get user info for whisper visibility
+    user_id: int | None = None
+    user_recursive_group_ids: list[int] = []
+    handled_puppet_ids: list[int] = []
+    owned_persona_ids: list[int] = []
+    if user_profile is not None:
+        user_id = user_profile.id
+        if not user_profile.is_guest:
+            user_recursive_group_ids = sorted(
+                get_recursive_membership_groups(user_profile).values_list("id", flat=True)
+            )
+        # Get puppets the user handles for whisper visibility
+        from zerver.actions.stream_puppets import get_all_user_handled_puppet_ids
 
-            handled_puppet_ids = get_all_user_handled_puppet_ids(user_profile)
+        handled_puppet_ids = get_all_user_handled_puppet_ids(user_profile)
 
-            # Get personas the user owns for whisper visibility
-            from zerver.models.personas import UserPersona
+        # Get personas the user owns for whisper visibility
+        from zerver.models.personas import UserPersona
 
-            owned_persona_ids = list(
-                UserPersona.objects.filter(
-                    user=user_profile, is_active=True
-                ).values_list("id", flat=True)
+        owned_persona_ids = list(
+            UserPersona.objects.filter(user=user_profile, is_active=True).values_list(
+                "id", flat=True
+            )
+        )
+
+    return get_whisper_visibility_condition(
+        user_id,
+        user_recursive_group_ids,
+        handled_puppet_ids or None,
+        owned_persona_ids or None,
+    )
+
+
+def get_user_message_table_sa(user_profile: UserProfile) -> FromClause:
+    """Returns the source of the user's UserMessage rows for
+    get_base_query_for_search.
+
+    For users subscribed to streams using sparse_user_messages, this
+    adds a flag-less row for each message which is unread only by
+    virtue of being newer than the user's sparse_read_message_id (see
+    get_sparse_unread_messages), so that is:unread, the combined feed
+    and first_unread anchors see the same unread messages as the
+    user's unread counts.
+    """
+    if not get_sparse_subscriptions(user_profile).exists():
+        return table("zerver_usermessage")
+
+    subscription = table(
+        "zerver_subscription",
+        column("user_profile_id", Integer),
+        column("recipient_id", Integer),
+        column("active", Boolean),
+        column("sparse_read_message_id", Integer),
+    ).alias("sparse_subscription")
+    stream = table(
+        "zerver_stream",
+        column("recipient_id", Integer),
+        column("sparse_user_messages", Boolean),
+        column("history_public_to_subscribers", Boolean),
+    ).alias("sparse_stream")
+    message = table(
+        "zerver_message",
+        column("id", Integer),
+        column("recipient_id", Integer),
+        column("whisper_recipients"),
+    ).alias("sparse_message")
+    user_message = table(
+        "zerver_usermessage",
+        column("user_profile_id", Integer),
+        column("message_id", Integer),
+    ).alias("sparse_usermessage")
+
+    user_messages = (
+        select(
+            column("user_profile_id", Integer),
+            column("message_id", Integer),
+            column("flags", Integer),
+        )
+        .select_from(table("zerver_usermessage"))
+        .where(column("user_profile_id", Integer) == literal(user_profile.id))
+    )
+    sparse_unread_messages = (
+        select(
+            subscription.c.user_profile_id,
+            message.c.id.label("message_id"),
+            literal_column("0", Integer).label("flags"),
+        )
+        .select_from(
+            subscription.join(stream, stream.c.recipient_id == subscription.c.recipient_id).join(
+                message,
+                and_(
+                    message.c.recipient_id == subscription.c.recipient_id,
+                    message.c.id > subscription.c.sparse_read_message_id,
+                ),
             )
+        )
+        .where(
+            subscription.c.user_profile_id == literal(user_profile.id),
+            subscription.c.active,
+            stream.c.sparse_user_messages,
+            stream.c.history_public_to_subscribers,
+            message.c.whisper_recipients.is_(None),
+            not_(
+                select(1)
+                .select_from(user_message)
+                .where(
+                    user_message.c.user_profile_id == literal(user_profile.id),
+                    user_message.c.message_id == message.c.id,
+                )
+                .exists()
+            ),
+        )
+    )
+    # Named like the table it stands in for, since the narrow
+    # conditions refer to columns as zerver_usermessage.*.
+    return union_all(user_messages, sparse_unread_messages).subquery("zerver_usermessage")
 
+
+def get_base_query_for_search(
+    realm_id: int, user_profile: UserProfile | None, need_user_message: bool
+) -> tuple[Select, ColumnElement[Integer]]:
+    # Handle the simple case where user_message isn't involved first.
+    if not need_user_message:
         query = (
             select(column("id", Integer).label("message_id"))
             .select_from(table("zerver_message"))
             .where(column("realm_id", Integer) == literal(realm_id))
             # Filter whispers based on user visibility
-            .where(
-                get_whisper_visibility_condition(
-                    user_id,
-                    user_recursive_group_ids,
-                    handled_puppet_ids or None,
-                    owned_persona_ids or None,
-                )
-            )
+            .where(get_whisper_visibility_condition_for_user(user_profile))
         )
 
         inner_msg_id_col = literal_column("zerver_message.id", Integer)
@@ -1168,9 +1275,7 @@ def get_base_query_for_search(
     from zerver.models.personas import UserPersona
 
     owned_persona_ids = list(
-        UserPersona.objects.filter(
-            user=user_profile, is_active=True
-        ).values_list("id", flat=True)
+        UserPersona.objects.filter(user=user_profile, is_active=True).values_list("id", flat=True)
     )
 
     query = (
@@ -1180,7 +1285,7 @@ def get_base_query_for_search(
         # usermessage is more selective, and the query planner
         # can't know about that cross-table correlation.
         .where(column("user_profile_id", Integer) == literal(user_profile.id))
-        .select_from(table("zerver_usermessage"))
+        .select_from(get_user_message_table_sa(user_profile))
         .join(
             table("zerver_message"),
             literal_column("zerver_usermessage.message_id", Integer)
@@ -1309,6 +1414,129 @@ def add_narrow_conditions(
     return (query, is_search, builder.is_dm_narrow)
 
 
+def get_first_unread_lower_bound(
+    user_profile: UserProfile,
+    narrow: list[NarrowParameter] | None,
+    muting_conditions: list[ClauseElement],
+) -> ColumnElement[Integer]:
+    """Returns a message ID at or below the first unread message in the
+    narrow, from the user's UnreadConversation rows, or 0 if the user
+    has no summary.
+
+    This is a scalar subquery rather than a value, so that it costs no
+    query of its own for the many users without a summary.  The rows
+    are only trusted through the summary's watermark; past it, any
+    message may be unread, as may any message past the user's
+    sparse_read_message_id for a stream using sparse_user_messages.
+    The rows are restricted by the narrow's channel and topic terms,
+    and by the same muting conditions as the messages themselves;
+    every other term can only move the first unread message later.
+    """
+    unread_summary = table(
+        "zerver_unreadsummary",
+        column("user_profile_id", Integer),
+        column("summarized_through_message_id", Integer),
+    ).alias("unread_summary")
+    unread_conversation = table(
+        "zerver_unreadconversation",
+        column("user_profile_id", Integer),
+        column("recipient_id", Integer),
+        column("topic_name", Text),
+        column("first_unread_message_id", Integer),
+    ).alias("unread_conversation")
+    stream = table(
+        "zerver_stream",
+        column("id", Integer),
+        column("realm_id", Integer),
+        column("name", Text),
+        column("recipient_id", Integer),
+        column("sparse_user_messages", Boolean),
+        column("history_public_to_subscribers", Boolean),
+    )
+    subscription = table(
+        "zerver_subscription",
+        column("user_profile_id", Integer),
+        column("recipient_id", Integer),
+        column("active", Boolean),
+        column("sparse_read_message_id", Integer),
+    ).alias("sparse_subscription")
+
+    # Expose the columns under the names the muting and topic
+    # conditions expect of zerver_message.
+    conversations = (
+        select(
+            unread_conversation.c.recipient_id,
+            unread_conversation.c.topic_name.label("subject"),
+            literal(True, Boolean).label("is_channel_message"),
+            unread_conversation.c.first_unread_message_id,
+        )
+        .where(unread_conversation.c.user_profile_id == literal(user_profile.id))
+        .subquery("unread_conversations")
+    )
+
+    conditions: list[ClauseElement] = list(muting_conditions)
+    for term in narrow or []:
+        if term.negated:
+            continue
+        if term.operator in channel_operators:
+            channel = stream.alias("narrow_stream")
+            if isinstance(term.operand, int):
+                channel_condition = channel.c.id == literal(term.operand)
+            else:
+                channel_condition = func.upper(channel.c.name) == func.upper(literal(term.operand))
+            conditions.append(
+                column("recipient_id", Integer).in_(
+                    select(channel.c.recipient_id).where(
+                        channel.c.realm_id == literal(user_profile.realm_id), channel_condition
+                    )
+                )
+            )
+        elif term.operator == "topic":
+            conditions.append(topic_match_sa(term.operand))
+
+    first_unread_message_id = (
+        select(func.min(column("first_unread_message_id", Integer)))
+        .select_from(conversations)
+        .where(*conditions)
+        .scalar_subquery()
+    )
+
+    # Messages in streams using sparse_user_messages can be unread
+    # without a UserMessage row, and so without being summarized in
+    # UnreadConversation rows.
+    sparse_stream = stream.alias("sparse_stream")
+    sparse_read_message_id = (
+        select(func.min(subscription.c.sparse_read_message_id) + 1)
+        .select_from(
+            subscription.join(
+                sparse_stream, sparse_stream.c.recipient_id == subscription.c.recipient_id
+            )
+        )
+        .where(
+            subscription.c.user_profile_id == literal(user_profile.id),
+            subscription.c.active,
+            sparse_stream.c.sparse_user_messages,
+            sparse_stream.c.history_public_to_subscribers,
+        )
+        .scalar_subquery()
+    )
+
+    # LEAST ignores NULLs, so conversations and sparse subscriptions
+    # which do not exist impose no bound.
+    lower_bound = (
+        select(
+            func.least(
+                unread_summary.c.summarized_through_message_id + 1,
+                first_unread_message_id,
+                sparse_read_message_id,
+            )
+        )
+        .where(unread_summary.c.user_profile_id == literal(user_profile.id))
+        .scalar_subquery()
+    )
+    return func.coalesce(lower_bound, 0)
+
+
 def find_first_unread_anchor(
     sa_conn: Connection,
     user_profile: UserProfile | None,
@@ -1351,6 +1579,7 @@ def find_first_unread_anchor(
 
     # We exclude messages on muted topics when finding the first unread
     # message in this narrow
+    muting_conditions: list[ClauseElement] = []
     if not is_dm_narrow:
         # Since building the channel/topic muting conditions takes
         # extra queries and makes the query potentially much more
@@ -1360,6 +1589,13 @@ def find_first_unread_anchor(
         if muting_conditions:
             condition = and_(condition, *muting_conditions)
 
+    if settings.UNREAD_CONVERSATIONS_ENABLED:
+        # Without a lower bound, PostgreSQL has to walk the user's
+        # unread messages from the start of time, through everything
+        # they have left unread outside this narrow.
+        lower_bound = get_first_unread_lower_bound(user_profile, narrow, muting_conditions)
+        condition = and_(condition, inner_msg_id_col >= lower_bound)
+
     first_unread_query = query.where(condition)
     first_unread_query = first_unread_query.order_by(inner_msg_id_col.asc()).limit(1)
     first_unread_result = list(sa_conn.execute(first_unread_query).fetchall())
@@ -1635,6 +1871,156 @@ class FetchedMessages(LimitedMessages[Row]):
     is_search: bool
 
 
+# Search results are cached for a short time, for clients which
+# repeat identical fetches of a search, e.g. while scrolling back and
+# forth through its results.  Only the IDs
+# of the messages found are cached; they are fetched again with the
+# search's conditions (see fetch_cached_search_result), so cached
+# results never include messages which the user can no longer see,
+# or which no longer match.
+SEARCH_RESULT_CACHE_TIMEOUT = 30
+
+search_result_cache_stats: Counter[str] = Counter()
+
+
+def get_search_result_cache_stats() -> dict[str, int]:
+    return dict(search_result_cache_stats)
+
+
+class CachedSearchResult(TypedDict):
+    message_ids: list[int]
+    history_limited: bool
+
+
+def get_search_result_generation(realm_id: int) -> str:
+    key = search_result_generation_cache_key(realm_id)
+    generation = cache_get(key)
+    if generation is not None:
+        return generation[0]
+    new_generation = secrets.token_hex(8)
+    cache_set(key, new_generation, timeout=3600 * 24)
+    return new_generation
+
+
+def normalize_narrow_term(term: NarrowParameter) -> tuple[str, Any, bool]:
+    operand = term.operand
+    if term.operator == "search" and isinstance(operand, str):
+        # Full-text search ignores case and spacing.
+        operand = " ".join(operand.lower().split())
+    return (term.operator, operand, term.negated)
+
+
+def get_search_result_cache_key(
+    *,
+    narrow: list[NarrowParameter],
+    user_profile: UserProfile | None,
+    realm: Realm,
+    is_web_public_query: bool,
+    anchor: int,
+    include_anchor: bool,
+    num_before: int,
+    num_after: int,
+    first_visible_message_id: int,
+) -> str:
+    # Edits change the realm's generation token, so that cached
+    # results are not reused once the search could find other
+    # messages; new messages are instead found when the cached result
+    # is fetched again.
+    key_data = orjson.dumps(
+        [
+            realm.id,
+            user_profile.id if user_profile is not None else None,
+            is_web_public_query,
+            sorted(normalize_narrow_term(term) for term in narrow),
+            anchor,
+            include_anchor,
+            num_before,
+            num_after,
+            first_visible_message_id,
+            get_search_result_generation(realm.id),
+        ]
+    )
+    return search_result_cache_key(hashlib.sha256(key_data).hexdigest())
+
+
+def fetch_cached_search_result(
+    query: Select,
+    inner_msg_id_col: ColumnElement[Integer],
+    cached_result: CachedSearchResult,
+    *,
+    anchor: int,
+    num_before: int,
+    num_after: int,
+    include_history: bool,
+    first_visible_message_id: int,
+) -> FetchedMessages | None:
+    """Fetches the messages of a cached search result again, returning
+    None if any of them can no longer be seen or no longer matches, as
+    the result would then be missing messages from further out."""
+    message_ids = cached_result["message_ids"]
+    anchored_to_left = anchor == 0
+    anchored_to_right = anchor >= LARGER_THAN_MAX_MESSAGE_ID
+
+    condition = inner_msg_id_col.in_(message_ids)
+    if (
+        anchored_to_right
+        or len([message_id for message_id in message_ids if message_id > anchor]) < num_after
+    ):
+        # The result reached the newest end of the search, so messages
+        # sent since it was cached may belong in it; they are newer
+        # than everything in it.
+        newer_than = max([*message_ids, 0 if anchored_to_right else anchor])
+        condition = or_(condition, inner_msg_id_col > newer_than)
+
+    query = (
+        query.where(condition).order_by(inner_msg_id_col.asc()).prefix_with("/* get_messages */")
+    )
+    with get_sqlalchemy_connection() as sa_conn:
+        rows = list(sa_conn.execute(query).fetchall())
+    if not set(message_ids) <= {row[0] for row in rows}:
+        return None
+
+    query_info = post_process_limited_query(
+        rows=rows,
+        num_before=num_before,
+        num_after=num_after,
+        anchor=anchor,
+        anchored_to_left=anchored_to_left,
+        anchored_to_right=anchored_to_right,
+        first_visible_message_id=first_visible_message_id,
+    )
+    return FetchedMessages(
+        rows=query_info.rows,
+        found_anchor=query_info.found_anchor,
+        found_newest=query_info.found_newest,
+        found_oldest=query_info.found_oldest,
+        history_limited=cached_result["history_limited"],
+        anchor=anchor,
+        include_history=include_history,
+        is_search=True,
+    )
+
+
+def get_narrow_shape(narrow: list[NarrowParameter] | None, include_history: bool) -> str:
+    """A description of a narrow's terms without their operands, for
+    grouping fetches whose queries will have similar plans; operands
+    are kept only for operators with a small set of them, such as
+    "is"."""
+    terms = []
+    for term in narrow or []:
+        term_shape = term.operator
+        if term.operator in ["has", "in", "is"]:
+            term_shape += f":{term.operand}"
+        if term.negated:
+            term_shape = "-" + term_shape
+        terms.append(term_shape)
+    shape = " ".join(sorted(terms)) if terms else "(no narrow)"
+    if include_history:
+        # Such queries do not join zerver_usermessage.
+        shape += " [history]"
+    return shape
+
+
 def fetch_messages(
     *,
     narrow: list[NarrowParameter] | None,
@@ -1689,6 +2075,40 @@ def fetch_messages(
     anchor_type = anchor_info["type"]
     anchor_value = anchor_info["value"]
     first_visible_message_id = get_first_visible_message_id(realm)
+
+    search_cache_key = None
+    if is_search and client_requested_message_ids is None and anchor_type == "message_id":
+        assert narrow is not None
+        assert isinstance(anchor_value, int)
+        assert isinstance(query, Select)
+        search_cache_key = get_search_result_cache_key(
+            narrow=narrow,
+            user_profile=user_profile,
+            realm=realm,
+            is_web_public_query=is_web_public_query,
+            anchor=anchor_value,
+            include_anchor=include_anchor,
+            num_before=num_before,
+            num_after=num_after,
+            first_visible_message_id=first_visible_message_id,
+        )
+        cached_result = cache_get(search_cache_key)
+        if cached_result is not None:
+            cached_messages = fetch_cached_search_result(
+                query,
+                inner_msg_id_col,
+                cached_result[0],
+                anchor=anchor_value,
+                num_before=num_before,
+                num_after=num_after,
+                include_history=include_history,
+                first_visible_message_id=first_visible_message_id,
+            )
+            if cached_messages is not None:
+                search_result_cache_stats["hit"] += 1
+                return cached_messages
+        search_result_cache_stats["miss"] += 1
+
     with get_sqlalchemy_connection() as sa_conn:
         if client_requested_message_ids is not None:
             query = query.filter(inner_msg_id_col.in_(client_requested_message_ids))
@@ -1760,7 +2180,14 @@ def fetch_messages(
 
         # This is a hack to tag the query we use for testing
         query = query.prefix_with("/* get_messages */")
-        rows = list(sa_conn.execute(query).fetchall())
+        start = time.perf_counter()
+        result = sa_conn.execute(query)
+        rows = list(result.fetchall())
+        duration = time.perf_counter() - start
+        if should_explain_narrow_query(duration):
+            explain_narrow_query(
+                sa_conn, result, get_narrow_shape(narrow, include_history), duration
+            )
 
     if client_requested_message_ids is not None:
         # We don't need to do any post-processing in this case.
@@ -1790,6 +2217,16 @@ def fetch_messages(
         first_visible_message_id=first_visible_message_id,
     )
 
+    if search_cache_key is not None:
+        cache_set(
+            search_cache_key,
+            CachedSearchResult(
+                message_ids=[row[0] for row in query_info.rows],
+                history_limited=query_info.history_limited,
+            ),
+            timeout=SEARCH_RESULT_CACHE_TIMEOUT,
+        )
+
     return FetchedMessages(
         rows=query_info.rows,
         found_anchor=query_info.found_anchor,
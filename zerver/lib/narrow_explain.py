@@ -0,0 +1,87 @@
+import logging
+import random
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+import orjson
+from django.conf import settings
+from sqlalchemy.engine import Connection, CursorResult
+
+narrow_explain_logger = logging.getLogger("zulip.narrow_explain")
+
+
+def should_explain_narrow_query(duration: float) -> bool:
+    """Whether to sample a message fetch query which took duration
+    seconds; see NARROW_EXPLAIN_SAMPLE_RATE."""
+    return (
+        settings.NARROW_EXPLAIN_SAMPLE_RATE > 0
+        and duration * 1000 >= settings.NARROW_EXPLAIN_MIN_DURATION_MS
+        and random.random() < settings.NARROW_EXPLAIN_SAMPLE_RATE
+    )
+
+
+def explain_narrow_query(
+    sa_conn: Connection,
+    result: CursorResult[Any],
+    narrow_shape: str,
+    duration: float,
+) -> None:
+    """Re-runs the query which produced result under EXPLAIN ANALYZE, and
+    logs its plan, as one JSON object per line.
+
+    The query is run again with exactly the statement and parameters
+    which were sent to the database, but the timings and buffer reads
+    reported may understate the original run's, since the pages it
+    reads are now likely to be cached."""
+    context = result.context
+    [plan] = sa_conn.exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + context.statement,
+        context.parameters[0],
+    ).one()
+    narrow_explain_logger.info(
+        "%s",
+        orjson.dumps(
+            {
+                "shape": narrow_shape,
+                "duration_ms": round(duration * 1000),
+                "plan": plan,
+            }
+        ).decode(),
+    )
+
+
+@dataclass
+class SlowNarrowShape:
+    shape: str
+    samples: int = 0
+    total_duration_ms: int = 0
+    max_duration_ms: int = 0
+    # The plan of the slowest sample.
+    plan: list[dict[str, Any]] = field(default_factory=list)
+
+
+def get_slow_narrow_shapes(log_lines: Iterable[str]) -> list[SlowNarrowShape]:
+    """Groups the samples logged by explain_narrow_query by narrow
+    shape, slowest in total first."""
+    shapes: dict[str, SlowNarrowShape] = {}
+    for line in log_lines:
+        # Skip the logging prefix; lines which are not samples, such
+        # as tracebacks, are ignored.
+        start = line.find("{")
+        if start == -1:
+            continue
+        try:
+            sample = orjson.loads(line[start:])
+        except orjson.JSONDecodeError:
+            continue
+        if not isinstance(sample, dict) or "shape" not in sample:
+            continue
+
+        slow_narrow = shapes.setdefault(sample["shape"], SlowNarrowShape(sample["shape"]))
+        slow_narrow.samples += 1
+        slow_narrow.total_duration_ms += sample["duration_ms"]
+        if sample["duration_ms"] >= slow_narrow.max_duration_ms:
+            slow_narrow.max_duration_ms = sample["duration_ms"]
+            slow_narrow.plan = sample["plan"]
+    return sorted(shapes.values(), key=lambda shape: -shape.total_duration_ms)
@@ -0,0 +1,194 @@
+import secrets
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from typing import Any, NamedTuple
+
+import orjson
+from django.conf import settings
+
+from zerver.lib.cache import (
+    cache_delete_many,
+    cache_get_many,
+    cache_set_many,
+    realm_state_section_cache_key,
+    realm_state_section_generation_cache_key,
+)
+from zerver.lib.sounds import get_available_notification_sounds
+from zerver.lib.types import LinkifierDict, RealmPlaygroundDict
+from zerver.models import Realm, RealmUserDefault
+from zerver.models.custom_profile_fields import custom_profile_fields_for_realm
+from zerver.models.linkifiers import linkifiers_for_realm
+from zerver.models.realm_emoji import EmojiInfo, get_all_custom_emoji_for_realm
+from zerver.models.realm_playgrounds import get_realm_playgrounds
+from zerver.models.realms import RealmDomainDict, get_realm_domains
+from zerver.models.streams import get_default_stream_groups
+from zerver.models.users import ResolvedTopicNoticeAutoReadPolicyEnum
+
+
+class RealmStateSection(NamedTuple):
+    fetch: Callable[[Realm], Any]
+    # The key of the section in the initial state.
+    state_key: str
+    # Sending an event of one of these types invalidates the realm's
+    # cached copy of the section.
+    event_types: frozenset[str]
+
+
+# Keyed by the fetch_event_types entry which requests the section.
+realm_state_sections: dict[str, RealmStateSection] = {}
+
+
+def realm_state_section(
+    name: str, *, event_types: Iterable[str], state_key: str | None = None
+) -> Callable[[Callable[[Realm], Any]], Callable[[Realm], Any]]:
+    def wrapper(fetch: Callable[[Realm], Any]) -> Callable[[Realm], Any]:
+        realm_state_sections[name] = RealmStateSection(
+            fetch, state_key or name, frozenset(event_types)
+        )
+        return fetch
+
+    return wrapper
+
+
+@realm_state_section("bot_commands", event_types=["bot_command", "realm_bot"])
+def fetch_bot_commands(realm: Realm) -> list[dict[str, Any]]:
+    from zerver.models.bots import get_bot_commands_for_realm
+
+    return [
+        {
+            "id": cmd.id,
+            "name": cmd.name,
+            "description": cmd.description,
+            "options": cmd.options_schema,
+            "bot_id": cmd.bot_profile_id,
+            "bot_name": cmd.bot_profile.full_name,
+        }
+        for cmd in get_bot_commands_for_realm(realm.id)
+    ]
+
+
+@realm_state_section("custom_profile_fields", event_types=["custom_profile_fields"])
+def fetch_custom_profile_fields(realm: Realm) -> list[dict[str, Any]]:
+    return [field.as_dict() for field in custom_profile_fields_for_realm(realm.id)]
+
+
+# The groups' channels are sorted by name, so renaming a channel can
+# reorder them.
+@realm_state_section(
+    "default_stream_groups",
+    event_types=["default_stream_groups", "stream"],
+    state_key="realm_default_stream_groups",
+)
+def fetch_default_stream_groups(realm: Realm) -> list[dict[str, Any]]:
+    from zerver.actions.default_streams import default_stream_groups_to_dicts_sorted
+
+    return default_stream_groups_to_dicts_sorted(get_default_stream_groups(realm))
+
+
+@realm_state_section("realm_domains", event_types=["realm_domains"])
+def fetch_realm_domains(realm: Realm) -> list[RealmDomainDict]:
+    return get_realm_domains(realm)
+
+
+@realm_state_section("realm_emoji", event_types=["realm_emoji"])
+def fetch_realm_emoji(realm: Realm) -> dict[str, EmojiInfo]:
+    return get_all_custom_emoji_for_realm(realm.id)
+
+
+@realm_state_section("realm_linkifiers", event_types=["realm_linkifiers"])
+def fetch_realm_linkifiers(realm: Realm) -> list[LinkifierDict]:
+    return linkifiers_for_realm(realm.id)
+
+
+@realm_state_section("realm_playgrounds", event_types=["realm_playgrounds"])
+def fetch_realm_playgrounds(realm: Realm) -> list[RealmPlaygroundDict]:
+    return get_realm_playgrounds(realm)
+
+
+@realm_state_section("realm_user_settings_defaults", event_types=["realm_user_settings_defaults"])
+def fetch_realm_user_settings_defaults(realm: Realm) -> dict[str, Any]:
+    realm_user_default = RealmUserDefault.objects.get(realm=realm)
+    realm_user_settings_defaults = {}
+    for property_name in RealmUserDefault.property_types:
+        realm_user_settings_defaults[property_name] = getattr(realm_user_default, property_name)
+
+    realm_user_settings_defaults["emojiset_choices"] = RealmUserDefault.emojiset_choices()
+    realm_user_settings_defaults["available_notification_sounds"] = (
+        get_available_notification_sounds()
+    )
+    realm_user_settings_defaults["resolved_topic_notice_auto_read_policy"] = (
+        ResolvedTopicNoticeAutoReadPolicyEnum(
+            realm_user_default.resolved_topic_notice_auto_read_policy
+        ).name
+    )
+    return realm_user_settings_defaults
+
+
+# Time spent fetching each section from the database.
+realm_state_fetch_seconds: defaultdict[str, float] = defaultdict(float)
+
+
+def fetch_realm_state_section_blob(realm: Realm, name: str) -> bytes:
+    start = time.perf_counter()
+    blob = orjson.dumps(realm_state_sections[name].fetch(realm))
+    realm_state_fetch_seconds[name] += time.perf_counter() - start
+    return blob
+
+
+def fetch_realm_state_sections(
+    realm: Realm, names: Iterable[str]
+) -> tuple[dict[str, Any], dict[str, str]]:
+    """Fetches the given realm-wide sections of the initial state, from
+    the cache where its copy's generation is current, and otherwise
+    from the database, along with those generations; a client which
+    presents a section's current generation already has it.
+
+    Each section is decoded afresh for the caller, since apply_events
+    modifies the state it is given."""
+    names = list(names)
+    if not settings.REALM_STATE_CACHE_ENABLED:
+        return {
+            name: orjson.loads(fetch_realm_state_section_blob(realm, name)) for name in names
+        }, {}
+
+    generation_keys = {
+        name: realm_state_section_generation_cache_key(realm.id, name) for name in names
+    }
+    blob_keys = {name: realm_state_section_cache_key(realm.id, name) for name in names}
+    cached = cache_get_many([*generation_keys.values(), *blob_keys.values()])
+    # New generations are set before the sections are fetched, so that
+    # an event sent while we fetch one flushes what we then cache.
+    new_generations = {
+        key: secrets.token_hex(8) for key in generation_keys.values() if key not in cached
+    }
+    if new_generations:
+        cache_set_many(new_generations, timeout=3600 * 24)
+        cached.update(new_generations)
+
+    sections: dict[str, Any] = {}
+    generations: dict[str, str] = {}
+    blobs_to_cache = {}
+    for name in names:
+        generation = generations[name] = cached[generation_keys[name]]
+        cached_blob = cached.get(blob_keys[name])
+        if cached_blob is not None and cached_blob[0] == generation:
+            blob = cached_blob[1]
+        else:
+            blob = fetch_realm_state_section_blob(realm, name)
+            blobs_to_cache[blob_keys[name]] = (generation, blob)
+        sections[name] = orjson.loads(blob)
+    if blobs_to_cache:
+        cache_set_many(blobs_to_cache, timeout=3600 * 24)
+    return sections, generations
+
+
+def flush_realm_state_sections_for_events(realm_id: int, event_types: Iterable[str]) -> None:
+    event_types = set(event_types)
+    generation_keys = [
+        realm_state_section_generation_cache_key(realm_id, name)
+        for name, section in realm_state_sections.items()
+        if not section.event_types.isdisjoint(event_types)
+    ]
+    if generation_keys:
+        cache_delete_many(generation_keys)
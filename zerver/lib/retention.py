@@ -41,6 +41,7 @@ from psycopg2.sql import SQL, Composable, Identifier, Literal
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.message import event_recipient_ids_for_action_on_messages
 from zerver.lib.request import RequestVariableConversionError
+from zerver.lib.unread_conversations import add_unread_conversation_messages
 from zerver.models import (
     ArchivedAttachment,
     ArchivedReaction,
@@ -91,7 +92,11 @@ models_with_message_key: list[dict[str, Any]] = [
     },
 ]
 
-EXCLUDE_FIELDS = {Message._meta.get_field("search_tsvector")}
+EXCLUDE_FIELDS = {
+    Message._meta.get_field("search_tsvector"),
+    # Recomputed by the zerver_message_set_topic_id trigger on restore.
+    Message._meta.get_field("topic"),
+}
 
 
 @transaction.atomic(savepoint=False)
@@ -651,6 +656,7 @@ def restore_data_from_archive(archive_transaction: ArchiveTransaction) -> int:
         restore_models_with_message_key_from_archive(archive_transaction.id)
         restore_attachments_from_archive(archive_transaction.id)
         restore_attachment_messages_from_archive(archive_transaction.id)
+        add_unread_conversation_messages(msg_ids)
 
         archive_transaction.restored = True
         archive_transaction.restored_timestamp = timezone_now()
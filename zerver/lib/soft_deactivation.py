@@ -13,7 +13,7 @@ from django.utils.timezone import now as timezone_now
 
 from zerver.lib.logging_util import log_to_file
 from zerver.lib.queue import queue_event_on_commit
-from zerver.lib.user_message import bulk_insert_all_ums
+from zerver.lib.user_message import bulk_insert_unread_ums
 from zerver.lib.utils import assert_is_not_none
 from zerver.models import (
     Message,
@@ -151,11 +151,24 @@ def add_missing_messages(user_profile: UserProfile) -> None:
 
     """
     assert user_profile.last_active_message_id is not None
-    all_stream_subs = list(
-        Subscription.objects.filter(
+    all_stream_subs = [
+        sub
+        for sub in Subscription.objects.filter(
             user_profile=user_profile, recipient__type=Recipient.STREAM
-        ).values("recipient_id", "recipient__type_id")
-    )
+        ).values(
+            "recipient_id",
+            "recipient__type_id",
+            "recipient__stream__sparse_user_messages",
+            "recipient__stream__history_public_to_subscribers",
+        )
+        # Streams using sparse_user_messages never have UserMessage
+        # rows with the default flags; their unread state comes from
+        # Subscription.sparse_read_message_id instead.
+        if not (
+            sub["recipient__stream__sparse_user_messages"]
+            and sub["recipient__stream__history_public_to_subscribers"]
+        )
+    ]
 
     # For stream messages we need to check messages against data from
     # RealmAuditLog for visibility to user. So we fetch the subscription logs.
@@ -244,7 +257,7 @@ def add_missing_messages(user_profile: UserProfile) -> None:
             message_ids_to_insert[0:BULK_CREATE_BATCH_SIZE],
             message_ids_to_insert[BULK_CREATE_BATCH_SIZE:],
         )
-        bulk_insert_all_ums(user_ids=[user_profile.id], message_ids=message_ids, flags=0)
+        bulk_insert_unread_ums(user_ids=[user_profile.id], message_ids=message_ids)
         UserProfile.objects.filter(id=user_profile.id).update(
             last_active_message_id=Greatest(F("last_active_message_id"), message_ids[-1])
         )
@@ -0,0 +1,197 @@
+from typing import Any
+
+from django.conf import settings
+from django.http import HttpRequest
+
+from zerver.actions.personas import do_get_personas
+from zerver.actions.stream_puppets import get_stream_puppets
+from zerver.lib.avatar import get_avatar_field
+from zerver.lib.events import ClientCapabilities, do_events_register
+from zerver.lib.message import messages_for_ids
+from zerver.lib.narrow import (
+    LARGER_THAN_MAX_MESSAGE_ID,
+    AnchorInfo,
+    NarrowParameter,
+    fetch_messages,
+)
+from zerver.lib.narrow_helpers import NeverNegatedNarrowTerm
+from zerver.lib.request import RequestNotes
+from zerver.lib.user_display_table import bulk_fetch_user_display_rows
+from zerver.lib.user_message import get_user_message_flags_including_history
+from zerver.lib.users import get_inaccessible_user_ids
+from zerver.models import Client, Realm, Stream, UserMessage, UserProfile
+
+# The events the theater frontend handles; it ignores everything else
+# the main app's event queue would receive.
+THEATER_EVENT_TYPES = [
+    "delete_message",
+    "message",
+    "presence",
+    "reaction",
+    "typing",
+    "update_message",
+]
+
+# The parts of the initial state the theater page reads, in place of
+# the main app's whole /register payload.
+THEATER_PAGE_FETCH_EVENT_TYPES = ["presence", "realm_user", "subscription"]
+
+THEATER_CLIENT_CAPABILITIES = ClientCapabilities(
+    notification_settings_null=True,
+    bulk_message_deletion=True,
+    user_avatar_url_field_optional=True,
+    stream_typing_notifications=True,
+    linkifier_url_template=True,
+    user_list_incomplete=True,
+    include_deactivated_groups=True,
+    archived_channels=True,
+    empty_topic_name=True,
+    simplified_presence_events=True,
+)
+
+MAX_THEATER_BOOTSTRAP_MESSAGES = 1000
+
+
+def register_theater_event_queue(
+    user_profile: UserProfile,
+    client: Client,
+    *,
+    fetch_event_types: list[str],
+    narrow: list[NeverNegatedNarrowTerm],
+) -> dict[str, Any]:
+    return do_events_register(
+        user_profile,
+        user_profile.realm,
+        client,
+        apply_markdown=True,
+        client_gravatar=True,
+        slim_presence=True,
+        presence_last_update_id_fetched_by_client=-1,
+        presence_history_limit_days=settings.PRESENCE_HISTORY_LIMIT_DAYS_FOR_WEB_APP,
+        event_types=THEATER_EVENT_TYPES,
+        client_capabilities=THEATER_CLIENT_CAPABILITIES,
+        narrow=narrow,
+        fetch_event_types=fetch_event_types,
+        include_streams=False,
+        include_subscribers=False,
+    )
+
+
+def build_page_params_for_theater_page_load(
+    request: HttpRequest, user_profile: UserProfile
+) -> tuple[str, dict[str, object]]:
+    """Computes page_params for the theater page: an event queue for
+    the events it handles, the user's subscriptions, and the realm's
+    users and their presence."""
+    client = RequestNotes.get_notes(request).client
+    assert client is not None
+    state_data = register_theater_event_queue(
+        user_profile, client, fetch_event_types=THEATER_PAGE_FETCH_EVENT_TYPES, narrow=[]
+    )
+    return state_data["queue_id"], dict(page_type="theater", state_data=state_data)
+
+
+def get_theater_participants(
+    user_profile: UserProfile, realm: Realm, user_ids: set[int]
+) -> list[dict[str, Any]]:
+    user_ids -= get_inaccessible_user_ids(list(user_ids), user_profile)
+    rows = bulk_fetch_user_display_rows(user_ids, {realm.id})
+    return [
+        dict(
+            user_id=row.id,
+            full_name=row.full_name,
+            avatar_url=get_avatar_field(
+                user_id=row.id,
+                realm_id=realm.id,
+                email=row.delivery_email,
+                avatar_source=row.avatar_source,
+                avatar_version=row.avatar_version,
+                medium=False,
+                # Clients can only compute gravatars from email
+                # addresses they can see.
+                client_gravatar=row.email_address_visibility
+                == UserProfile.EMAIL_ADDRESS_VISIBILITY_EVERYONE,
+            ),
+        )
+        for row in sorted(rows.values(), key=lambda row: row.id)
+    ]
+
+
+def fetch_theater_bootstrap(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    stream: Stream,
+    *,
+    topic_name: str | None,
+    num_messages: int,
+) -> dict[str, Any]:
+    """Fetches what the theater frontend needs to render a scene in a
+    channel, or one of its topics: its most recent messages, its
+    puppets, the user's personas, and the users who sent those
+    messages, with their presence.
+
+    The event queue registered here is narrowed to the scene, so that
+    message events for other channels are not sent."""
+    client = RequestNotes.get_notes(request).client
+    assert client is not None
+    realm = user_profile.realm
+
+    event_narrow = [NeverNegatedNarrowTerm(operator="channel", operand=stream.name)]
+    narrow = [NarrowParameter(operator="channel", operand=stream.id)]
+    if topic_name is not None:
+        event_narrow.append(NeverNegatedNarrowTerm(operator="topic", operand=topic_name))
+        narrow.append(NarrowParameter(operator="topic", operand=topic_name))
+    state_data = register_theater_event_queue(
+        user_profile, client, fetch_event_types=["presence"], narrow=event_narrow
+    )
+
+    query_info = fetch_messages(
+        narrow=narrow,
+        user_profile=user_profile,
+        realm=realm,
+        is_web_public_query=False,
+        anchor_info=AnchorInfo(type="message_id", value=LARGER_THAN_MAX_MESSAGE_ID),
+        include_anchor=True,
+        num_before=num_messages,
+        num_after=0,
+    )
+    message_ids = [row[0] for row in query_info.rows]
+    if query_info.include_history:
+        user_message_flags = get_user_message_flags_including_history(user_profile, message_ids)
+    else:
+        user_message_flags = {
+            row[0]: UserMessage.flags_list_for_flags(row[1]) for row in query_info.rows
+        }
+    messages = messages_for_ids(
+        message_ids=message_ids,
+        user_message_flags=user_message_flags,
+        search_fields={},
+        apply_markdown=True,
+        client_gravatar=True,
+        allow_empty_topic_name=True,
+        message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
+        user_profile=user_profile,
+        realm=realm,
+    )
+
+    participants = get_theater_participants(
+        user_profile, realm, {message["sender_id"] for message in messages}
+    )
+    participant_ids = {str(participant["user_id"]) for participant in participants}
+    presences = {
+        user_id: presence
+        for user_id, presence in state_data["presences"].items()
+        if user_id in participant_ids
+    }
+
+    return dict(
+        queue_id=state_data["queue_id"],
+        last_event_id=state_data["last_event_id"],
+        messages=messages,
+        found_oldest=query_info.found_oldest,
+        history_limited=query_info.history_limited,
+        puppets=get_stream_puppets(stream) if stream.enable_puppet_mode else [],
+        personas=do_get_personas(user_profile),
+        participants=participants,
+        presences=presences,
+    )
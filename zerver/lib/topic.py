@@ -11,7 +11,7 @@ from django.utils.translation import override as override_language
 
 from zerver.lib.types import EditHistoryEvent, StreamMessageEditRequest
 from zerver.lib.utils import assert_is_not_none
-from zerver.models import Message, Reaction, UserMessage, UserProfile
+from zerver.models import Message, Reaction, Topic, UserMessage, UserProfile
 
 # Only use these constants for events.
 ORIG_TOPIC = "orig_subject"
@@ -67,15 +67,20 @@ def filter_by_topic_name_via_message(
     return query.filter(message__is_channel_message=True, message__subject__iexact=topic_name)
 
 
+def topic_id_subquery(stream_recipient_id: int, topic_name: str) -> Subquery:
+    # Uses index: zerver_topic_recipient_upper_name
+    return Subquery(
+        Topic.objects.filter(recipient_id=stream_recipient_id, name__iexact=topic_name).values("id")
+    )
+
+
 def messages_for_topic(
     realm_id: int, stream_recipient_id: int, topic_name: str
 ) -> QuerySet[Message]:
     return Message.objects.filter(
-        # Uses index: zerver_message_realm_recipient_upper_subject
+        # Uses index: zerver_message_topic_id
         realm_id=realm_id,
-        recipient_id=stream_recipient_id,
-        subject__iexact=topic_name,
-        is_channel_message=True,
+        topic_id=topic_id_subquery(stream_recipient_id, topic_name),
     )
 
 
@@ -102,9 +107,7 @@ def get_latest_message_for_user_in_topic(
         return (
             UserMessage.objects.filter(
                 user_profile=user_profile,
-                message__recipient_id=recipient_id,
-                message__subject__iexact=topic_name,
-                message__is_channel_message=True,
+                message__topic_id=topic_id_subquery(recipient_id, topic_name),
             )
             .values_list("message_id", flat=True)
             .last()
@@ -160,13 +163,11 @@ def update_messages_for_topic_edit(
     edit_history_event: EditHistoryEvent,
     last_edit_time: datetime,
 ) -> tuple[QuerySet[Message], Callable[[], QuerySet[Message]]]:
-    # Uses index: zerver_message_realm_recipient_upper_subject
     old_stream = message_edit_request.orig_stream
-    messages = Message.objects.filter(
-        realm_id=old_stream.realm_id,
-        recipient_id=assert_is_not_none(old_stream.recipient_id),
-        subject__iexact=message_edit_request.orig_topic_name,
-        is_channel_message=True,
+    messages = messages_for_topic(
+        old_stream.realm_id,
+        assert_is_not_none(old_stream.recipient_id),
+        message_edit_request.orig_topic_name,
     )
     if message_edit_request.propagate_mode == "change_all":
         messages = messages.exclude(id=edited_message.id)
@@ -271,23 +272,29 @@ def get_topic_history_for_public_stream(
     allow_empty_topic_name: bool,
 ) -> list[dict[str, Any]]:
     cursor = connection.cursor()
-    # Uses index: zerver_message_realm_recipient_subject
-    # Note that this is *case-sensitive*, so that we can display the
-    # most recently-used case (in generate_topic_history_from_db_rows)
+    # Uses index: zerver_topic_recipient_upper_name, and
+    # zerver_message_topic_id for each topic's latest message, whose
+    # case is the one displayed (see generate_topic_history_from_db_rows).
+    # Topics whose messages have all been moved or deleted have no
+    # latest message, and are skipped.
     query = """
     SELECT
         "zerver_message"."subject" as topic,
-        max("zerver_message".id) as max_message_id
-    FROM "zerver_message"
-    WHERE (
-        "zerver_message"."realm_id" = %s AND
-        "zerver_message"."recipient_id" = %s AND
-        "zerver_message"."is_channel_message"
+        "latest"."max_message_id"
+    FROM "zerver_topic"
+    CROSS JOIN LATERAL (
+        SELECT max("zerver_message".id) as max_message_id
+        FROM "zerver_message"
+        WHERE "zerver_message"."topic_id" = "zerver_topic"."id"
+    ) AS "latest"
+    INNER JOIN "zerver_message" ON (
+        "zerver_message"."id" = "latest"."max_message_id"
     )
-    GROUP BY (
-        "zerver_message"."subject"
+    WHERE (
+        "zerver_topic"."realm_id" = %s AND
+        "zerver_topic"."recipient_id" = %s
     )
-    ORDER BY max("zerver_message".id) DESC
+    ORDER BY "latest"."max_message_id" DESC
     """
     cursor.execute(query, [realm_id, recipient_id])
     rows = cursor.fetchall()
@@ -310,27 +317,31 @@ def get_topic_history_for_stream(
         )
 
     cursor = connection.cursor()
-    # Uses index: zerver_message_realm_recipient_subject
-    # Note that this is *case-sensitive*, so that we can display the
-    # most recently-used case (in generate_topic_history_from_db_rows)
+    # Uses index: zerver_message_realm_recipient_id
+    # Topics are grouped by ID, and displayed in the case of the
+    # latest message the user received in each.
     query = """
     SELECT
         "zerver_message"."subject" as topic,
-        max("zerver_message".id) as max_message_id
-    FROM "zerver_message"
-    INNER JOIN "zerver_usermessage" ON (
-        "zerver_usermessage"."message_id" = "zerver_message"."id"
-    )
-    WHERE (
-        "zerver_usermessage"."user_profile_id" = %s AND
-        "zerver_message"."realm_id" = %s AND
-        "zerver_message"."recipient_id" = %s AND
-        "zerver_message"."is_channel_message"
-    )
-    GROUP BY (
-        "zerver_message"."subject"
+        "latest"."max_message_id"
+    FROM (
+        SELECT max("zerver_message".id) as max_message_id
+        FROM "zerver_message"
+        INNER JOIN "zerver_usermessage" ON (
+            "zerver_usermessage"."message_id" = "zerver_message"."id"
+        )
+        WHERE (
+            "zerver_usermessage"."user_profile_id" = %s AND
+            "zerver_message"."realm_id" = %s AND
+            "zerver_message"."recipient_id" = %s AND
+            "zerver_message"."is_channel_message"
+        )
+        GROUP BY "zerver_message"."topic_id"
+    ) AS "latest"
+    INNER JOIN "zerver_message" ON (
+        "zerver_message"."id" = "latest"."max_message_id"
     )
-    ORDER BY max("zerver_message".id) DESC
+    ORDER BY "latest"."max_message_id" DESC
     """
     cursor.execute(query, [user_profile.id, user_profile.realm_id, recipient_id])
     rows = cursor.fetchall()
@@ -358,13 +369,7 @@ def participants_for_topic(realm_id: int, recipient_id: int, topic_name: str) ->
     Users who either sent or reacted to the messages in the topic.
     The function is expensive for large numbers of messages in the topic.
     """
-    messages = Message.objects.filter(
-        # Uses index: zerver_message_realm_recipient_upper_subject
-        realm_id=realm_id,
-        recipient_id=recipient_id,
-        subject__iexact=topic_name,
-        is_channel_message=True,
-    )
+    messages = messages_for_topic(realm_id, recipient_id, topic_name)
     participants = set(
         UserProfile.objects.filter(
             Q(id__in=Subquery(messages.values("sender_id")))
@@ -1,5 +1,5 @@
 from sqlalchemy.sql import ColumnElement, and_, column, func, literal, literal_column, select, table
-from sqlalchemy.types import Boolean, Text
+from sqlalchemy.types import Boolean, Integer, Text
 
 from zerver.lib.topic import RESOLVED_TOPIC_PREFIX
 from zerver.models import UserTopic
@@ -15,6 +15,25 @@ def topic_match_sa(topic_name: str) -> ColumnElement[Boolean]:
     return topic_cond
 
 
+def topic_id_match_sa(realm_id: int, topic_name: str) -> ColumnElement[Boolean]:
+    # Matches the same messages as topic_match_sa, via the messages'
+    # topic IDs, rather than their subjects.  Note that direct
+    # messages have no topic ID, so the negation of this condition is
+    # never true for them, unlike that of topic_match_sa.
+    #
+    # Uses index: zerver_topic_realm_upper_name
+    topic_ids = (
+        select(literal_column("zerver_topic.id", Integer))
+        .select_from(table("zerver_topic"))
+        .where(
+            literal_column("zerver_topic.realm_id", Integer) == literal(realm_id),
+            func.upper(literal_column("zerver_topic.name", Text))
+            == func.upper(literal(topic_name)),
+        )
+    )
+    return column("topic_id", Integer).in_(topic_ids)
+
+
 def get_resolved_topic_condition_sa() -> ColumnElement[Boolean]:
     resolved_topic_cond = and_(
         column("subject", Text).startswith(RESOLVED_TOPIC_PREFIX),
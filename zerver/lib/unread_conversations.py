@@ -0,0 +1,324 @@
+from collections import Counter
+from collections.abc import Collection
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.db.models.functions import Upper
+from django.utils.timezone import now as timezone_now
+from psycopg2.sql import SQL, Composable
+
+from zerver.lib.topic import DB_TOPIC_NAME
+from zerver.models import Message, UnreadConversation, UnreadSummary, UserMessage, UserProfile
+
+# Messages sent this recently may belong to transactions which have
+# not committed yet, so summaries stop short of them.
+UNREAD_SUMMARY_SETTLE_INTERVAL = timedelta(minutes=5)
+
+# How long a summary goes before being advanced over the messages
+# sent since.
+UNREAD_SUMMARY_ADVANCE_INTERVAL = timedelta(minutes=10)
+
+# Users with fewer unread messages than this at /register get no
+# summary; finding their first unread message is cheap enough.
+UNREAD_SUMMARY_MIN_UNREAD_MESSAGES = 1000
+
+# Profiling counters: "summary.hit", "summary.rebuild" and
+# "summary.advance" for /register, and "conversation.recompute" for
+# conversations whose first unread message was marked as read.
+unread_conversation_stats: Counter[str] = Counter()
+
+# new_unread is a common table expression, rather than a subquery, so
+# that it may itself be a data-modifying statement with RETURNING.
+UNREAD_CONVERSATION_UPSERT = """
+    WITH new_unread AS ({new_unread})
+    INSERT INTO zerver_unreadconversation (
+        user_profile_id, recipient_id, topic_name, first_unread_message_id, version
+    )
+    SELECT new_unread.user_profile_id,
+           zerver_message.recipient_id,
+           MIN(zerver_message.subject),
+           MIN(zerver_message.id),
+           0
+      FROM new_unread
+      JOIN zerver_message ON zerver_message.id = new_unread.message_id
+     GROUP BY new_unread.user_profile_id, zerver_message.recipient_id, UPPER(zerver_message.subject)
+    ON CONFLICT (user_profile_id, recipient_id, UPPER(topic_name)) DO UPDATE SET
+        first_unread_message_id = LEAST(
+            zerver_unreadconversation.first_unread_message_id, excluded.first_unread_message_id
+        ),
+        version = zerver_unreadconversation.version + 1
+"""
+
+# Moves the first unread message of each of the user's conversations
+# whose first unread message was just read to the next unread one
+# through the summary's watermark, deleting the conversations with
+# none.  Moving it later is only safe if nothing added an earlier one
+# in the meantime; if the version changed, the row is left alone, as
+# it is then merely early.  Returns the number of rows changed.
+UNREAD_CONVERSATION_RECOMPUTE = """
+    WITH affected AS (
+        SELECT zerver_unreadconversation.id,
+               zerver_unreadconversation.version,
+               (
+                   SELECT zerver_usermessage.message_id
+                     FROM zerver_usermessage
+                     JOIN zerver_message ON zerver_message.id = zerver_usermessage.message_id
+                    WHERE zerver_usermessage.user_profile_id = %(user_profile_id)s
+                      AND zerver_usermessage.message_id > zerver_unreadconversation.first_unread_message_id
+                      AND zerver_usermessage.message_id <= zerver_unreadsummary.summarized_through_message_id
+                      AND zerver_message.recipient_id = zerver_unreadconversation.recipient_id
+                      AND UPPER(zerver_message.subject) = UPPER(zerver_unreadconversation.topic_name)
+                      AND {where_unread}
+                    ORDER BY zerver_usermessage.message_id
+                    LIMIT 1
+               ) AS next_unread_message_id
+          FROM zerver_unreadconversation
+          JOIN zerver_unreadsummary
+            ON zerver_unreadsummary.user_profile_id = zerver_unreadconversation.user_profile_id
+         WHERE zerver_unreadconversation.user_profile_id = %(user_profile_id)s
+           AND zerver_unreadconversation.first_unread_message_id = ANY(%(message_ids)s)
+    ),
+    deleted AS (
+        DELETE FROM zerver_unreadconversation
+         USING affected
+         WHERE zerver_unreadconversation.id = affected.id
+           AND zerver_unreadconversation.version = affected.version
+           AND affected.next_unread_message_id IS NULL
+        RETURNING zerver_unreadconversation.id
+    ),
+    updated AS (
+        UPDATE zerver_unreadconversation
+           SET first_unread_message_id = affected.next_unread_message_id,
+               version = zerver_unreadconversation.version + 1
+          FROM affected
+         WHERE zerver_unreadconversation.id = affected.id
+           AND zerver_unreadconversation.version = affected.version
+           AND affected.next_unread_message_id IS NOT NULL
+        RETURNING zerver_unreadconversation.id
+    )
+    SELECT (SELECT COUNT(*) FROM deleted) + (SELECT COUNT(*) FROM updated)
+"""
+
+
+def upsert_unread_conversations(new_unread: Composable, params: dict[str, object]) -> None:
+    """Adds the (user_profile_id, message_id) rows selected by
+    new_unread, which must be unread, to the users' UnreadConversation
+    rows.
+
+    This is safe without any locking: a concurrent rebuild either
+    sees the rows, or merges its own into the ones inserted here.
+    """
+    query = SQL(UNREAD_CONVERSATION_UPSERT).format(new_unread=new_unread)
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+
+
+def add_unread_conversation_messages(
+    message_ids: Collection[int], user_ids: Collection[int] | None = None
+) -> None:
+    """Records that the users' UserMessage rows for these messages may
+    have become unread outside of the send path: by being marked as
+    unread, moved to another conversation, or created after the fact.
+
+    Must be called after the UserMessage rows are updated, in the same
+    transaction.  Only the rows which are actually unread are added.
+    """
+    if not message_ids or (user_ids is not None and not user_ids):
+        return
+
+    new_unread = SQL(
+        """
+        SELECT user_profile_id, message_id
+          FROM zerver_usermessage
+         WHERE message_id = ANY(%(message_ids)s)
+           AND {user_condition}
+           AND {where_unread}
+        """
+    ).format(
+        user_condition=SQL("user_profile_id = ANY(%(user_ids)s)")
+        if user_ids is not None
+        else SQL("TRUE"),
+        where_unread=SQL(UserMessage.where_unread()),
+    )
+    upsert_unread_conversations(
+        new_unread,
+        dict(
+            message_ids=list(message_ids), user_ids=list(user_ids) if user_ids is not None else []
+        ),
+    )
+
+
+def remove_unread_conversation_messages(
+    user_profile: UserProfile, message_ids: Collection[int]
+) -> None:
+    """Updates the user's UnreadConversation rows for these messages
+    having been marked as read.  message_ids must be exactly the
+    messages whose UserMessage rows went from unread to read.
+
+    Must be called after the UserMessage rows are updated, in the same
+    transaction.
+    """
+    if not message_ids:
+        return
+
+    query = SQL(UNREAD_CONVERSATION_RECOMPUTE).format(where_unread=SQL(UserMessage.where_unread()))
+    with connection.cursor() as cursor:
+        cursor.execute(query, dict(user_profile_id=user_profile.id, message_ids=list(message_ids)))
+        [(recomputed,)] = cursor.fetchall()
+    unread_conversation_stats["conversation.recompute"] += recomputed
+
+
+def get_settled_message_id() -> int:
+    """Returns the ID of a message which is old enough that every
+    message with a lower ID has been committed."""
+    settled_message_id = (
+        Message.objects.filter(date_sent__lt=timezone_now() - UNREAD_SUMMARY_SETTLE_INTERVAL)
+        .order_by("-date_sent")
+        .values_list("id", flat=True)
+        .first()
+    )
+    return settled_message_id if settled_message_id is not None else 0
+
+
+def summarize_unread_messages(
+    user_profile: UserProfile, after_message_id: int, through_message_id: int
+) -> None:
+    new_unread = SQL(
+        """
+        SELECT user_profile_id, message_id
+          FROM zerver_usermessage
+         WHERE user_profile_id = %(user_profile_id)s
+           AND message_id > %(after_message_id)s
+           AND message_id <= %(through_message_id)s
+           AND {where_unread}
+        """
+    ).format(where_unread=SQL(UserMessage.where_unread()))
+    upsert_unread_conversations(
+        new_unread,
+        dict(
+            user_profile_id=user_profile.id,
+            after_message_id=after_message_id,
+            through_message_id=through_message_id,
+        ),
+    )
+
+
+def rebuild_unread_conversations(user_profile: UserProfile) -> int:
+    """Recomputes the user's UnreadConversation rows from their
+    UserMessage rows, returning the new summarized_through_message_id."""
+    through_message_id = get_settled_message_id()
+    with transaction.atomic(savepoint=False):
+        # Deleting first waits for any concurrent changes to existing
+        # rows to commit, so that the summary below includes them.
+        UnreadConversation.objects.filter(user_profile=user_profile).delete()
+        summarize_unread_messages(user_profile, 0, through_message_id)
+        UnreadSummary.objects.bulk_create(
+            [
+                UnreadSummary(
+                    user_profile=user_profile,
+                    summarized_through_message_id=through_message_id,
+                    last_summarized=timezone_now(),
+                )
+            ],
+            update_conflicts=True,
+            unique_fields=["user_profile"],
+            update_fields=["summarized_through_message_id", "last_summarized"],
+        )
+    unread_conversation_stats["summary.rebuild"] += 1
+    return through_message_id
+
+
+def advance_unread_conversations(user_profile: UserProfile, summary: UnreadSummary) -> int:
+    """Adds the unread messages sent since the summary was last
+    updated to the user's UnreadConversation rows."""
+    through_message_id = get_settled_message_id()
+    if through_message_id <= summary.summarized_through_message_id:
+        return summary.summarized_through_message_id
+
+    with transaction.atomic(savepoint=False):
+        # Only one process advances a given summary.
+        if not UnreadSummary.objects.filter(
+            id=summary.id, summarized_through_message_id=summary.summarized_through_message_id
+        ).update(summarized_through_message_id=through_message_id, last_summarized=timezone_now()):
+            return summary.summarized_through_message_id
+        summarize_unread_messages(
+            user_profile, summary.summarized_through_message_id, through_message_id
+        )
+    unread_conversation_stats["summary.advance"] += 1
+    return through_message_id
+
+
+def get_first_unread_watermark(user_profile: UserProfile) -> int:
+    """Returns the message ID through which the user's UnreadConversation
+    rows summarize their unread messages, building or advancing the
+    summary first if needed.
+
+    For any conversation, no unread message through the returned ID
+    precedes the conversation's first_unread_message_id, and a
+    conversation without a row has none at all.
+    """
+    summary = UnreadSummary.objects.filter(user_profile=user_profile).first()
+    if summary is None:
+        return rebuild_unread_conversations(user_profile)
+    if timezone_now() - summary.last_summarized >= UNREAD_SUMMARY_ADVANCE_INTERVAL:
+        return advance_unread_conversations(user_profile, summary)
+    unread_conversation_stats["summary.hit"] += 1
+    return summary.summarized_through_message_id
+
+
+def update_unread_summary(user_profile: UserProfile, unread_message_count: int) -> None:
+    """Called at /register with the number of the user's unread
+    UserMessage rows.  Only users with many unread messages get a
+    summary, since for the rest, scanning for the first unread message
+    is cheap."""
+    if unread_message_count >= UNREAD_SUMMARY_MIN_UNREAD_MESSAGES:
+        get_first_unread_watermark(user_profile)
+
+
+def delete_unread_summary(user_profile: UserProfile) -> None:
+    """Drops the user's summary, once they have few unread messages
+    left; it is built again at /register if they pile up."""
+    deleted_count, _ = UnreadSummary.objects.filter(user_profile=user_profile).delete()
+    if deleted_count:
+        UnreadConversation.objects.filter(user_profile=user_profile).delete()
+
+
+def get_unread_conversation_discrepancies(
+    user_profile: UserProfile,
+) -> tuple[list[tuple[int, str]], list[tuple[int, str]]]:
+    """Compares the user's UnreadConversation rows to their UserMessage
+    rows, returning the conversations whose rows are wrong -- missing,
+    or with a first_unread_message_id after the first unread message --
+    and those whose rows are merely stale."""
+    summary = UnreadSummary.objects.filter(user_profile=user_profile).first()
+    if summary is None:
+        return [], []
+
+    actual = {
+        (row["recipient_id"], row["topic_key"]): row["first_unread"]
+        for row in UserMessage.objects.filter(
+            user_profile=user_profile, message_id__lte=summary.summarized_through_message_id
+        )
+        .extra(where=[UserMessage.where_unread()])  # noqa: S610
+        .values(
+            recipient_id=F("message__recipient_id"), topic_key=Upper(f"message__{DB_TOPIC_NAME}")
+        )
+        .annotate(first_unread=Min("message_id"))
+    }
+    summarized = {
+        (row["recipient_id"], row["topic_key"]): row["first_unread_message_id"]
+        for row in UnreadConversation.objects.filter(user_profile=user_profile)
+        .annotate(topic_key=Upper("topic_name"))
+        .values("recipient_id", "topic_key", "first_unread_message_id")
+    }
+
+    wrong: list[tuple[int, str]] = []
+    stale: list[tuple[int, str]] = []
+    for conversation, first_unread_message_id in actual.items():
+        if conversation not in summarized or summarized[conversation] > first_unread_message_id:
+            wrong.append(conversation)
+        elif summarized[conversation] != first_unread_message_id:
+            stale.append(conversation)
+    stale.extend(conversation for conversation in summarized if conversation not in actual)
+    return wrong, stale
@@ -0,0 +1,170 @@
+import secrets
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from zerver.lib.cache import (
+    cache_get_many,
+    cache_set_many,
+    user_display_table_cache_key,
+    user_display_table_generation_cache_key,
+)
+from zerver.models import UserProfile
+
+# Realms with more users than this, or whose user IDs span more IDs
+# than this (so that the table would be mostly empty), are hydrated a
+# user at a time instead.
+USER_DISPLAY_TABLE_MAX_USERS = 10000
+USER_DISPLAY_TABLE_MAX_SPAN = 50000
+
+# Process-local copies of recently used realms' tables.
+USER_DISPLAY_TABLE_LRU_SIZE = 100
+
+
+class UserDisplayRow(NamedTuple):
+    id: int
+    recipient_id: int | None
+    full_name: str
+    email: str
+    delivery_email: str
+    realm_string_id: str
+    avatar_source: str
+    avatar_version: int
+    is_mirror_dummy: bool
+    email_address_visibility: int
+
+
+user_display_row_fields = [
+    "id",
+    "recipient_id",
+    "full_name",
+    "email",
+    "delivery_email",
+    "realm__string_id",
+    "avatar_source",
+    "avatar_version",
+    "is_mirror_dummy",
+    "email_address_visibility",
+]
+
+
+def user_display_rows(query: QuerySet[UserProfile]) -> list[UserDisplayRow]:
+    return [UserDisplayRow(*row) for row in query.values_list(*user_display_row_fields)]
+
+
+class UserDisplayTable:
+    """A realm's users, in an array indexed by user ID less the
+    realm's lowest user ID, with None for IDs belonging to other
+    realms.  A realm too large for a table has an empty one."""
+
+    def __init__(
+        self, generation: str, first_user_id: int, rows: list[UserDisplayRow | None]
+    ) -> None:
+        self.generation = generation
+        self.first_user_id = first_user_id
+        self.rows = rows
+
+    def get(self, user_id: int) -> UserDisplayRow | None:
+        index = user_id - self.first_user_id
+        if 0 <= index < len(self.rows):
+            return self.rows[index]
+        return None
+
+
+def build_user_display_table(realm_id: int, generation: str) -> UserDisplayTable:
+    rows = user_display_rows(
+        UserProfile.objects.filter(realm_id=realm_id).order_by("id")[
+            : USER_DISPLAY_TABLE_MAX_USERS + 1
+        ]
+    )
+    if (
+        not rows
+        or len(rows) > USER_DISPLAY_TABLE_MAX_USERS
+        or rows[-1].id - rows[0].id >= USER_DISPLAY_TABLE_MAX_SPAN
+    ):
+        return UserDisplayTable(generation, 0, [])
+
+    first_user_id = rows[0].id
+    table_rows: list[UserDisplayRow | None] = [None] * (rows[-1].id - first_user_id + 1)
+    for row in rows:
+        table_rows[row.id - first_user_id] = row
+    return UserDisplayTable(generation, first_user_id, table_rows)
+
+
+user_display_tables: OrderedDict[int, UserDisplayTable] = OrderedDict()
+user_display_table_stats: Counter[str] = Counter()
+
+
+def get_user_display_tables(realm_ids: Iterable[int]) -> dict[int, UserDisplayTable]:
+    """Fetches the current user display tables for the given realms,
+    from this process if its copy's generation is current, then from
+    the cache, and otherwise from the database."""
+    generation_keys = {
+        realm_id: user_display_table_generation_cache_key(realm_id) for realm_id in realm_ids
+    }
+    generations: dict[str, str] = cache_get_many(list(generation_keys.values()))
+    new_generations = {
+        key: secrets.token_hex(8) for key in generation_keys.values() if key not in generations
+    }
+    if new_generations:
+        cache_set_many(new_generations, timeout=3600 * 24)
+        generations.update(new_generations)
+
+    tables: dict[int, UserDisplayTable] = {}
+    stale_realm_ids = []
+    for realm_id, generation_key in generation_keys.items():
+        table = user_display_tables.get(realm_id)
+        if table is not None and table.generation == generations[generation_key]:
+            user_display_table_stats["hit"] += 1
+            user_display_tables.move_to_end(realm_id)
+            tables[realm_id] = table
+        else:
+            stale_realm_ids.append(realm_id)
+
+    if stale_realm_ids:
+        cached_tables: dict[str, UserDisplayTable] = cache_get_many(
+            [user_display_table_cache_key(realm_id) for realm_id in stale_realm_ids]
+        )
+        tables_to_cache = {}
+        for realm_id in stale_realm_ids:
+            generation = generations[generation_keys[realm_id]]
+            table = cached_tables.get(user_display_table_cache_key(realm_id))
+            if table is not None and table.generation == generation:
+                user_display_table_stats["remote_hit"] += 1
+            else:
+                user_display_table_stats["miss"] += 1
+                table = build_user_display_table(realm_id, generation)
+                tables_to_cache[user_display_table_cache_key(realm_id)] = table
+            tables[realm_id] = table
+            user_display_tables[realm_id] = table
+            user_display_tables.move_to_end(realm_id)
+            if len(user_display_tables) > USER_DISPLAY_TABLE_LRU_SIZE:
+                user_display_tables.popitem(last=False)
+        if tables_to_cache:
+            cache_set_many(tables_to_cache, timeout=3600 * 24)
+
+    return tables
+
+
+def bulk_fetch_user_display_rows(
+    user_ids: set[int], realm_ids: set[int]
+) -> dict[int, UserDisplayRow]:
+    """Returns the display rows for the given users, who are expected to
+    be mostly in the given realms; users found in none of those realms'
+    tables are fetched from the database."""
+    rows: dict[int, UserDisplayRow] = {}
+    if settings.USER_DISPLAY_TABLE_ENABLED and user_ids:
+        for table in get_user_display_tables(realm_ids).values():
+            for user_id in user_ids - rows.keys():
+                row = table.get(user_id)
+                if row is not None:
+                    rows[user_id] = row
+
+    missing_user_ids = user_ids - rows.keys()
+    if missing_user_ids:
+        for row in user_display_rows(UserProfile.objects.filter(id__in=missing_user_ids)):
+            rows[row.id] = row
+    return rows
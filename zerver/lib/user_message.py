@@ -1,8 +1,18 @@
-from django.db import connection
+import struct
+from collections import defaultdict
+from collections.abc import Collection
+from io import BytesIO
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, QuerySet
 from psycopg2.extras import execute_values
 from psycopg2.sql import SQL, Composable, Literal
 
-from zerver.models import UserMessage
+from zerver.lib.unread_conversations import (
+    add_unread_conversation_messages,
+    upsert_unread_conversations,
+)
+from zerver.models import Message, Recipient, Subscription, UserMessage, UserProfile
 
 
 class UserMessageLite:
@@ -30,6 +40,7 @@ def create_historical_user_messages(
     message_ids: list[int],
     flagattr: int | None = None,
     flag_target: int | None = None,
+    base_flags: int = DEFAULT_HISTORICAL_FLAGS,
 ) -> None:
     # Users can see and interact with messages sent to streams with
     # public history for which they do not have a UserMessage because
@@ -38,17 +49,34 @@ def create_historical_user_messages(
     # those messages, we create UserMessage objects for those messages;
     # these have the special historical flag which keeps track of the
     # fact that the user did not receive the message at the time it was sent.
+    #
+    # Messages which are unread only by virtue of being in a stream
+    # using sparse_user_messages are instead created with base_flags=0,
+    # so that they stay unread.
     if flagattr is not None and flag_target is not None:
         conflict = SQL(
             "(user_profile_id, message_id) DO UPDATE SET flags = excluded.flags & ~ {mask} | {attr}"
         ).format(mask=Literal(flagattr), attr=Literal(flag_target))
-        flags = (DEFAULT_HISTORICAL_FLAGS & ~flagattr) | flag_target
+        flags = (base_flags & ~flagattr) | flag_target
     else:
         conflict = None
-        flags = DEFAULT_HISTORICAL_FLAGS
+        flags = base_flags
     bulk_insert_all_ums([user_id], message_ids, flags, conflict)
 
 
+# Above this many rows, bulk_insert_ums streams the rows to the
+# database with a binary COPY, rather than an INSERT with a VALUES
+# list; this matters for messages to channels with many thousands of
+# subscribers, and for imports.
+BULK_INSERT_UMS_COPY_THRESHOLD = 5000
+
+# See https://www.postgresql.org/docs/current/sql-copy.html
+# for the binary COPY format.
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack("!h", -1)
+COPY_BINARY_USERMESSAGE_ROW = struct.Struct("!hiiiiiq")
+
+
 def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
     """
     Doing bulk inserts this way is much faster than using Django,
@@ -59,6 +87,10 @@ def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
     if not ums:
         return
 
+    if len(ums) >= BULK_INSERT_UMS_COPY_THRESHOLD:
+        copy_insert_ums(ums)
+        return
+
     vals = [(um.user_profile_id, um.message_id, um.flags) for um in ums]
     query = SQL(
         """
@@ -73,6 +105,52 @@ def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
         execute_values(cursor.cursor, query, vals)
 
 
+def copy_insert_ums(ums: list[UserMessageLite]) -> None:
+    """
+    Inserts the rows with a binary COPY, for large batches where
+    building and parsing a VALUES list dominates the insert cost.
+
+    COPY cannot skip conflicting rows, so the rows are copied into a
+    temporary staging table, and moved into zerver_usermessage with
+    the same ON CONFLICT DO NOTHING as bulk_insert_ums.
+    """
+    buf = BytesIO()
+    buf.write(COPY_BINARY_HEADER)
+    pack = COPY_BINARY_USERMESSAGE_ROW.pack
+    for um in ums:
+        buf.write(pack(3, 4, um.user_profile_id, 4, um.message_id, 8, int(um.flags)))
+    buf.write(COPY_BINARY_TRAILER)
+    buf.seek(0)
+
+    # The staging table only lives until the end of the transaction;
+    # it is emptied after each use, since one transaction may insert
+    # several batches.
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE IF NOT EXISTS zerver_usermessage_copy (
+                user_profile_id integer NOT NULL,
+                message_id integer NOT NULL,
+                flags bigint NOT NULL
+            ) ON COMMIT DROP
+            """
+        )
+        cursor.cursor.copy_expert(
+            "COPY zerver_usermessage_copy (user_profile_id, message_id, flags) "
+            "FROM STDIN WITH (FORMAT binary)",
+            buf,
+        )
+        cursor.execute(
+            """
+            INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+            SELECT user_profile_id, message_id, flags
+              FROM zerver_usermessage_copy
+            ON CONFLICT DO NOTHING
+            """
+        )
+        cursor.execute("TRUNCATE zerver_usermessage_copy")
+
+
 def bulk_insert_all_ums(
     user_ids: list[int], message_ids: list[int], flags: int, conflict: Composable | None = None
 ) -> None:
@@ -91,3 +169,200 @@ def bulk_insert_all_ums(
 
     with connection.cursor() as cursor:
         cursor.execute(query, [flags, user_ids, message_ids])
+
+
+def bulk_insert_unread_ums(user_ids: list[int], message_ids: list[int]) -> None:
+    """Like bulk_insert_all_ums for unread rows, which are added to the
+    users' UnreadConversation rows in the same statement."""
+    if not user_ids or not message_ids:
+        return
+
+    new_unread = SQL(
+        """
+        INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+        SELECT user_profile_id, message_id, 0 AS flags
+          FROM UNNEST(%(user_ids)s) user_profile_id
+          CROSS JOIN UNNEST(%(message_ids)s) message_id
+        ON CONFLICT DO NOTHING
+        RETURNING user_profile_id, message_id
+        """
+    )
+    upsert_unread_conversations(new_unread, dict(user_ids=user_ids, message_ids=message_ids))
+
+
+def get_sparse_subscriptions(user_profile: UserProfile) -> QuerySet[Subscription]:
+    """The user's active subscriptions to streams using
+    sparse_user_messages; see Stream.uses_sparse_user_messages."""
+    return Subscription.objects.filter(
+        user_profile_id=user_profile.id,
+        active=True,
+        recipient__type=Recipient.STREAM,
+        recipient__stream__sparse_user_messages=True,
+        recipient__stream__history_public_to_subscribers=True,
+    )
+
+
+def get_sparse_unread_messages(user_profile: UserProfile) -> QuerySet[Message]:
+    """Messages in streams using sparse_user_messages which are unread
+    for the user, despite the user having no UserMessage row for them.
+
+    Such messages are newer than the user's sparse_read_message_id for
+    the stream; see Stream.sparse_user_messages.  Whispers always get
+    UserMessage rows for the users who can see them, so they are never
+    sparse unread.
+    """
+    return Message.objects.alias(
+        has_user_message=Exists(
+            UserMessage.objects.filter(
+                user_profile_id=user_profile.id,
+                message_id=OuterRef("id"),
+            )
+        )
+    ).filter(
+        # Uses index: zerver_message_realm_recipient_id
+        has_user_message=False,
+        realm_id=user_profile.realm_id,
+        recipient__type=Recipient.STREAM,
+        recipient__stream__sparse_user_messages=True,
+        recipient__stream__history_public_to_subscribers=True,
+        recipient__subscription__user_profile_id=user_profile.id,
+        recipient__subscription__active=True,
+        id__gt=F("recipient__subscription__sparse_read_message_id"),
+        whisper_recipients__isnull=True,
+    )
+
+
+def get_user_message_flags_including_history(
+    user_profile: UserProfile, message_ids: list[int]
+) -> dict[int, list[str]]:
+    """The user's flags for message_ids, for a query with
+    include_history.  Messages the user has no UserMessage row for are
+    read and historical, unless they are sparse unread.
+    """
+    # TODO: This could be done with an outer join instead of two queries
+    user_message_flags = {
+        um.message_id: um.flags_list()
+        for um in UserMessage.objects.filter(user_profile=user_profile, message_id__in=message_ids)
+    }
+
+    historical_message_ids = [
+        message_id for message_id in message_ids if message_id not in user_message_flags
+    ]
+    if historical_message_ids:
+        for message_id in (
+            get_sparse_unread_messages(user_profile)
+            .filter(id__in=historical_message_ids)
+            .values_list("id", flat=True)
+        ):
+            user_message_flags[message_id] = []
+
+    for message_id in historical_message_ids:
+        if message_id not in user_message_flags:
+            user_message_flags[message_id] = ["read", "historical"]
+    return user_message_flags
+
+
+def mark_sparse_messages_as_read(
+    user_profile: UserProfile, message_ids: Collection[int]
+) -> list[int]:
+    """Marks as read those of message_ids which are unread only by
+    virtue of being newer than the user's sparse_read_message_id, and
+    returns their IDs.
+
+    Where possible, this just advances sparse_read_message_id; any
+    older messages which are still unread then get explicit unread
+    UserMessage rows.  If that would create more rows than marking the
+    messages read directly, we instead create read UserMessage rows
+    for the messages, leaving sparse_read_message_id alone.
+    """
+    if not message_ids:
+        return []
+
+    sparse_unread = list(
+        get_sparse_unread_messages(user_profile)
+        .filter(id__in=message_ids)
+        .values_list("id", "recipient_id")
+    )
+
+    message_ids_by_recipient: dict[int, list[int]] = defaultdict(list)
+    for message_id, recipient_id in sparse_unread:
+        message_ids_by_recipient[recipient_id].append(message_id)
+
+    for recipient_id, read_message_ids in message_ids_by_recipient.items():
+        new_read_message_id = max(read_message_ids)
+        skipped_message_ids = list(
+            get_sparse_unread_messages(user_profile)
+            .filter(recipient_id=recipient_id, id__lt=new_read_message_id)
+            .exclude(id__in=read_message_ids)
+            .values_list("id", flat=True)
+        )
+        if len(skipped_message_ids) > len(read_message_ids):
+            bulk_insert_ums(
+                [
+                    UserMessageLite(
+                        user_profile_id=user_profile.id,
+                        message_id=message_id,
+                        flags=int(UserMessage.flags.read),
+                    )
+                    for message_id in read_message_ids
+                ]
+            )
+            continue
+
+        bulk_insert_ums(
+            [
+                UserMessageLite(user_profile_id=user_profile.id, message_id=message_id, flags=0)
+                for message_id in skipped_message_ids
+            ]
+        )
+        add_unread_conversation_messages(skipped_message_ids, [user_profile.id])
+        Subscription.objects.filter(user_profile=user_profile, recipient_id=recipient_id).update(
+            sparse_read_message_id=new_read_message_id
+        )
+
+    return [message_id for message_id, recipient_id in sparse_unread]
+
+
+def mark_all_sparse_messages_as_read(user_profile: UserProfile) -> int:
+    """Marks as read all messages which are unread only by virtue of
+    being newer than the user's sparse_read_message_id, and returns how
+    many there were."""
+    sparse_unread = get_sparse_unread_messages(user_profile).aggregate(
+        count=Count("id"), max_id=Max("id")
+    )
+    if sparse_unread["count"] == 0:
+        return 0
+
+    Subscription.objects.filter(
+        user_profile=user_profile,
+        active=True,
+        recipient__type=Recipient.STREAM,
+        sparse_read_message_id__lt=sparse_unread["max_id"],
+    ).update(sparse_read_message_id=sparse_unread["max_id"])
+    return sparse_unread["count"]
+
+
+def materialize_sparse_unread_user_messages(recipient_id: int, realm_id: int) -> None:
+    """Creates unread UserMessage rows for all subscribers' messages
+    which are unread only by virtue of being newer than their
+    sparse_read_message_id; used when a stream stops using
+    sparse_user_messages."""
+    # The rows we create are all unread, so they are added to the
+    # subscribers' UnreadConversation rows in the same statement.
+    new_unread = SQL(
+        """
+        INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+        SELECT zerver_subscription.user_profile_id, zerver_message.id, 0
+          FROM zerver_subscription
+          JOIN zerver_message
+            ON zerver_message.recipient_id = zerver_subscription.recipient_id
+           AND zerver_message.id > zerver_subscription.sparse_read_message_id
+         WHERE zerver_subscription.recipient_id = %(recipient_id)s
+           AND zerver_subscription.active
+           AND zerver_message.realm_id = %(realm_id)s
+           AND zerver_message.whisper_recipients IS NULL
+        ON CONFLICT DO NOTHING
+        RETURNING user_profile_id, message_id
+        """
+    )
+    upsert_unread_conversations(new_unread, dict(recipient_id=recipient_id, realm_id=realm_id))
@@ -1,6 +1,7 @@
 import logging
 from dataclasses import dataclass
 from datetime import timedelta
+from functools import partial
 
 from django.conf import settings
 from django.db import transaction
@@ -13,6 +14,7 @@ from zerver.actions.message_send import (
     do_send_messages,
     internal_prep_group_direct_message,
     internal_prep_stream_message,
+    prep_messages_in_parallel,
 )
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message import SendMessageRequest, remove_single_newlines
@@ -666,15 +668,16 @@ def is_realm_imported_from_other_product(realm: Realm) -> bool:
 def internal_prep_zulip_update_announcements_stream_messages(
     current_level: int, latest_level: int, sender: UserProfile, realm: Realm
 ) -> list[SendMessageRequest | None]:
-    message_requests = []
+    prep_message_functions = []
     stream = realm.zulip_update_announcements_stream
     assert stream is not None
     topic_name = get_topic_name_for_zulip_update_announcements(realm)
 
     while current_level < latest_level:
         content = get_zulip_update_announcements_message_for_level(level=current_level + 1)
-        message_requests.append(
-            internal_prep_stream_message(
+        prep_message_functions.append(
+            partial(
+                internal_prep_stream_message,
                 sender,
                 stream,
                 topic_name,
@@ -682,7 +685,7 @@ def internal_prep_zulip_update_announcements_stream_messages(
             )
         )
         current_level += 1
-    return message_requests
+    return prep_messages_in_parallel(prep_message_functions)
 
 
 @transaction.atomic(savepoint=False)
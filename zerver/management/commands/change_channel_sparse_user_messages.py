@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from django.core.management.base import CommandError
+from typing_extensions import override
+
+from zerver.actions.streams import do_change_stream_sparse_user_messages
+from zerver.lib.management import ZulipBaseCommand
+from zerver.models import Stream
+
+
+class Command(ZulipBaseCommand):
+    help = """Enable or disable sparse UserMessage rows for a channel.
+
+In this mode, messages to the channel only create UserMessage rows for
+subscribers whose flags differ from the default, such as those who
+were mentioned; this saves substantial storage and send latency for
+read-mostly channels with very many subscribers.  Messages without a
+UserMessage row appear in channel and topic views and in unread
+counts, but not in views like the combined feed which are driven by
+UserMessage rows.  Only channels with shared history are affected."""
+
+    @override
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument("-c", "--channel", required=True, help="Name of the channel.")
+        mode = parser.add_mutually_exclusive_group(required=True)
+        mode.add_argument("--enable", action="store_true", help="Enable sparse UserMessage rows.")
+        mode.add_argument("--disable", action="store_true", help="Disable sparse UserMessage rows.")
+        self.add_realm_args(parser, required=True)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None  # Should be ensured by parser
+
+        try:
+            channel = Stream.objects.get(realm=realm, name__iexact=options["channel"])
+        except Stream.DoesNotExist:
+            raise CommandError(f"Channel '{options['channel']}' does not exist")
+
+        if options["enable"] and not channel.is_history_public_to_subscribers():
+            raise CommandError(
+                "Sparse UserMessage rows require the channel's history to be public to subscribers"
+            )
+
+        do_change_stream_sparse_user_messages(channel, options["enable"])
@@ -0,0 +1,53 @@
+import argparse
+from typing import Any
+
+import orjson
+from django.conf import settings
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.narrow_explain import get_slow_narrow_shapes
+
+
+class Command(ZulipBaseCommand):
+    help = """Report the narrows whose message fetches were slowest, from the
+query plans sampled when NARROW_EXPLAIN_SAMPLE_RATE is set.
+
+Narrows are grouped by their shape: their operators, without most
+operands.  Shapes are listed slowest in total first, with the top of
+the plan of their slowest sample."""
+
+    @override
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--log-file",
+            default=settings.NARROW_EXPLAIN_LOG_PATH,
+            help="Log of sampled query plans (default: %(default)s)",
+        )
+        parser.add_argument("--top", default=10, type=int, help="Number of shapes to report")
+        parser.add_argument(
+            "--plans", action="store_true", help="Print the full plan of each slowest sample"
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        with open(options["log_file"]) as f:
+            slow_narrows = get_slow_narrow_shapes(f)
+
+        for slow_narrow in slow_narrows[: options["top"]]:
+            print(
+                f"{slow_narrow.shape}: {slow_narrow.samples} samples, "
+                f"{slow_narrow.total_duration_ms / slow_narrow.samples:.0f} ms mean, "
+                f"{slow_narrow.max_duration_ms} ms max"
+            )
+            if not slow_narrow.plan:
+                continue
+            top_node = slow_narrow.plan[0]["Plan"]
+            print(
+                f"    {top_node['Node Type']}: "
+                f"{top_node.get('Actual Total Time', 0):.0f} ms, "
+                f"{top_node.get('Shared Hit Blocks', 0)} blocks hit, "
+                f"{top_node.get('Shared Read Blocks', 0)} blocks read"
+            )
+            if options["plans"]:
+                print(orjson.dumps(slow_narrow.plan, option=orjson.OPT_INDENT_2).decode())
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+import orjson
+from django.conf import settings
+from django.core.management.base import CommandParser
+from django.db import close_old_connections, connections
+from tornado import httpserver, web
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.markdown.render_server import (
+    RenderingAdmission,
+    check_render_request_secret,
+    render_message_request,
+    warm_up_rendering_process,
+)
+from zerver.lib.per_request_cache import flush_per_request_caches
+
+
+def init_rendering_process() -> None:
+    # Each rendering process opens its own database connections.
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm_up_rendering_process()
+
+
+def render_in_process(request: dict[str, Any]) -> dict[str, Any]:
+    # Like a queue worker, a rendering process is long-lived, so each
+    # render is its own request: it must not see objects cached by an
+    # earlier one, nor use a connection the database has dropped.
+    close_old_connections()
+    try:
+        return render_message_request(request)
+    finally:
+        flush_per_request_caches()
+        close_old_connections()
+
+
+class RenderingPool:
+    def __init__(self, processes: int) -> None:
+        self.processes = processes
+        self.executor = self.start()
+
+    def start(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_rendering_process,
+        )
+        # Forking starts every process, and runs its warm-up, before we
+        # accept any requests.
+        executor.submit(int).result()
+        return executor
+
+    def restart(self, broken_executor: ProcessPoolExecutor) -> None:
+        # Every request that was waiting on the broken pool fails at
+        # once; only the first of them restarts it.
+        if broken_executor is self.executor:
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start()
+
+
+class RenderHandler(web.RequestHandler):
+    def initialize(self, pool: RenderingPool, admission: RenderingAdmission) -> None:
+        self.pool = pool
+        self.admission = admission
+
+    def send_json(self, status: int, data: dict[str, Any]) -> None:
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(orjson.dumps(data))
+
+    async def post(self) -> None:
+        request = orjson.loads(self.request.body)
+        if not check_render_request_secret(request):
+            self.send_json(403, {"result": "error", "msg": "Invalid shared secret"})
+            return
+
+        realm_id = request["realm_id"]
+        if not self.admission.try_admit(realm_id):
+            if self.admission.pending >= self.admission.max_pending:
+                self.send_json(503, {"result": "error", "msg": "Rendering service is busy"})
+            else:
+                self.send_json(429, {"result": "error", "msg": "Too many renders for realm"})
+            return
+
+        executor = self.pool.executor
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                executor, render_in_process, request
+            )
+        except BrokenProcessPool:
+            logging.exception("Markdown rendering process died; restarting the pool")
+            self.pool.restart(executor)
+            self.send_json(500, {"result": "error", "msg": "Rendering process died"})
+            return
+        except Exception:
+            logging.exception("Markdown rendering failed")
+            self.send_json(500, {"result": "error", "msg": "Rendering failed"})
+            return
+        finally:
+            self.admission.release(realm_id)
+        self.send_json(200, result)
+
+
+class Command(ZulipBaseCommand):
+    help = """Starts the Markdown rendering service.
+
+Django processes send messages that need the Markdown processor here,
+to be rendered by a pool of pre-warmed processes, so that expensive
+content cannot tie up a web worker."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--processes", help="Number of rendering processes", default=4, type=int
+        )
+        parser.add_argument(
+            "--max-pending",
+            help="Maximum renders queued or running; more are refused",
+            default=32,
+            type=int,
+        )
+        parser.add_argument(
+            "--max-pending-per-realm",
+            help="Maximum renders queued or running for a single realm",
+            default=8,
+            type=int,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        if settings.DEBUG:
+            logging.basicConfig(
+                level=logging.INFO, format="%(asctime)s %(levelname)-8s %(message)s"
+            )
+
+        pool = RenderingPool(options["processes"])
+        admission = RenderingAdmission(options["max_pending"], options["max_pending_per_realm"])
+        port = int(settings.MARKDOWN_SERVER_PORT)
+
+        async def inner_run() -> None:
+            loop = asyncio.get_running_loop()
+            stop_fut = loop.create_future()
+
+            def stop() -> None:
+                if not stop_fut.done():
+                    stop_fut.set_result(None)
+
+            loop.add_signal_handler(signal.SIGINT, stop)
+            loop.add_signal_handler(signal.SIGTERM, stop)
+
+            application = web.Application(
+                [(r"/", RenderHandler, dict(pool=pool, admission=admission))]
+            )
+            http_server = httpserver.HTTPServer(application)
+            http_server.listen(port, address="127.0.0.1")
+            logging.info("Markdown rendering server started on port %d", port)
+
+            await stop_fut
+            http_server.stop()
+            await http_server.close_all_connections()
+
+        try:
+            asyncio.run(inner_run())
+        finally:
+            pool.executor.shutdown(cancel_futures=True)
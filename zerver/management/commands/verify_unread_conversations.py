@@ -0,0 +1,48 @@
+import argparse
+from typing import Any
+
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.unread_conversations import (
+    get_unread_conversation_discrepancies,
+    rebuild_unread_conversations,
+)
+from zerver.models import UnreadSummary
+
+
+class Command(ZulipBaseCommand):
+    help = """Compare users' per-conversation unread summaries with their UserMessage rows.
+
+Summaries which are merely stale (starting too early, or listing
+conversations with no unread messages left) are harmless, and only
+slow down finding the first unread message; summaries which are wrong
+can hide unread messages.  With --fix, the summaries of users with
+either are rebuilt.
+"""
+
+    @override
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--fix", action="store_true", help="Rebuild the summaries which do not match"
+        )
+        self.add_realm_args(parser, help="The optional name of the realm to limit to")
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        summaries = UnreadSummary.objects.select_related("user_profile").order_by("user_profile_id")
+        if realm is not None:
+            summaries = summaries.filter(user_profile__realm=realm)
+
+        for summary in summaries.iterator():
+            user_profile = summary.user_profile
+            wrong, stale = get_unread_conversation_discrepancies(user_profile)
+            if not wrong and not stale:
+                continue
+            print(
+                f"{user_profile.delivery_email} (id {user_profile.id}): "
+                f"{len(wrong)} wrong, {len(stale)} stale conversations"
+            )
+            if options["fix"]:
+                rebuild_unread_conversations(user_profile)
@@ -31,7 +31,7 @@ from zerver.lib.cache import get_remote_cache_requests, get_remote_cache_time
 from zerver.lib.db_connections import reset_queries
 from zerver.lib.debug import maybe_tracemalloc_listen
 from zerver.lib.exceptions import ErrorCode, JsonableError, MissingAuthenticationError, WebhookError
-from zerver.lib.markdown import get_markdown_requests, get_markdown_time
+from zerver.lib.markdown import get_markdown_cache_hits, get_markdown_requests, get_markdown_time
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.push_notifications import FailedToConnectBouncerError, InternalBouncerServerError
 from zerver.lib.rate_limiter import RateLimitResult
@@ -61,6 +61,7 @@ def record_request_stop_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["remote_cache_requests_stopped"] = get_remote_cache_requests()
     log_data["markdown_time_stopped"] = get_markdown_time()
     log_data["markdown_requests_stopped"] = get_markdown_requests()
+    log_data["markdown_cache_hits_stopped"] = get_markdown_cache_hits()
     if settings.PROFILE_ALL_REQUESTS:
         log_data["prof"].disable()
 
@@ -79,6 +80,7 @@ def record_request_restart_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["remote_cache_requests_restarted"] = get_remote_cache_requests()
     log_data["markdown_time_restarted"] = get_markdown_time()
     log_data["markdown_requests_restarted"] = get_markdown_requests()
+    log_data["markdown_cache_hits_restarted"] = get_markdown_cache_hits()
 
 
 def async_request_timer_restart(request: HttpRequest) -> None:
@@ -102,6 +104,7 @@ def record_request_start_data(log_data: MutableMapping[str, Any]) -> None:
     log_data["remote_cache_requests_start"] = get_remote_cache_requests()
     log_data["markdown_time_start"] = get_markdown_time()
     log_data["markdown_requests_start"] = get_markdown_requests()
+    log_data["markdown_cache_hits_start"] = get_markdown_cache_hits()
     log_data["ai_time_start"] = get_ai_time()
     log_data["ai_requests_start"] = get_ai_time()
 
@@ -177,6 +180,9 @@ def write_log_line(
     if "markdown_time_start" in log_data:
         markdown_time_delta = get_markdown_time() - log_data["markdown_time_start"]
         markdown_count_delta = get_markdown_requests() - log_data["markdown_requests_start"]
+        markdown_cache_hits_delta = (
+            get_markdown_cache_hits() - log_data["markdown_cache_hits_start"]
+        )
         if "markdown_requests_stopped" in log_data:
             # (now - restarted) + (stopped - start) = (now - start) + (stopped - restarted)
             markdown_time_delta += (
@@ -185,11 +191,15 @@ def write_log_line(
             markdown_count_delta += (
                 log_data["markdown_requests_stopped"] - log_data["markdown_requests_restarted"]
             )
+            markdown_cache_hits_delta += (
+                log_data["markdown_cache_hits_stopped"] - log_data["markdown_cache_hits_restarted"]
+            )
 
         if markdown_time_delta > 0.005:
-            markdown_output = (
-                f" (md: {format_timedelta(markdown_time_delta)}/{markdown_count_delta})"
-            )
+            markdown_cache_output = ""
+            if markdown_cache_hits_delta > 0:
+                markdown_cache_output = f", {markdown_cache_hits_delta} cached"
+            markdown_output = f" (md: {format_timedelta(markdown_time_delta)}/{markdown_count_delta}{markdown_cache_output})"
 
     ai_output = ""
     if "ai_time_start" in log_data:
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0784_add_message_puppet_color"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="sparse_user_messages",
+            field=models.BooleanField(db_default=False, default=False),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="sparse_read_message_id",
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+    ]
@@ -0,0 +1,71 @@
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0785_stream_sparse_user_messages"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("summarized_through_message_id", models.IntegerField()),
+                ("last_summarized", models.DateTimeField()),
+                (
+                    "user_profile",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UnreadConversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("topic_name", models.CharField(default="", max_length=60)),
+                ("unread_count", models.IntegerField()),
+                ("first_unread_message_id", models.IntegerField()),
+                ("version", models.IntegerField(default=0)),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="zerver.recipient"
+                    ),
+                ),
+                (
+                    "user_profile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        models.F("user_profile"),
+                        models.F("recipient"),
+                        django.db.models.functions.text.Upper("topic_name"),
+                        name="zerver_unreadconversation_user_recipient_upper_topic",
+                    )
+                ],
+            },
+        ),
+    ]
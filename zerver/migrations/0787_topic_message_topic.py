@@ -0,0 +1,168 @@
+import time
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import connection, migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import StateApps
+from django.db.models import Max, Min
+from psycopg2.sql import SQL
+
+BATCH_SIZE = 10000
+
+
+def sql_assign_topic_ids(id_range_lower_bound: int, id_range_upper_bound: int) -> None:
+    bounds = {"lower_bound": id_range_lower_bound, "upper_bound": id_range_upper_bound}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SQL(
+                """
+                INSERT INTO zerver_topic (realm_id, recipient_id, name)
+                SELECT DISTINCT ON (recipient_id, upper(subject)) realm_id, recipient_id, subject
+                FROM zerver_message
+                WHERE id BETWEEN %(lower_bound)s AND %(upper_bound)s
+                AND is_channel_message
+                AND topic_id IS NULL
+                ORDER BY recipient_id, upper(subject), id
+                ON CONFLICT DO NOTHING
+                """
+            ),
+            bounds,
+        )
+        cursor.execute(
+            SQL(
+                """
+                UPDATE zerver_message
+                SET topic_id = zerver_topic.id
+                FROM zerver_topic
+                WHERE zerver_message.id BETWEEN %(lower_bound)s AND %(upper_bound)s
+                AND zerver_message.is_channel_message
+                AND zerver_message.topic_id IS NULL
+                AND zerver_topic.recipient_id = zerver_message.recipient_id
+                AND upper(zerver_topic.name) = upper(zerver_message.subject)
+                """
+            ),
+            bounds,
+        )
+
+
+def assign_topic_ids(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:
+    Message = apps.get_model("zerver", "Message")
+    # Messages sent from here on are assigned a topic by the trigger.
+    id_range = Message.objects.aggregate(Min("id"), Max("id"))
+    if id_range["id__min"] is None:
+        # Nothing to do
+        return
+
+    id_range_lower_bound = id_range["id__min"]
+    last_id = id_range["id__max"]
+    while id_range_lower_bound <= last_id:
+        id_range_upper_bound = min(id_range_lower_bound + BATCH_SIZE - 1, last_id)
+        sql_assign_topic_ids(id_range_lower_bound, id_range_upper_bound)
+        id_range_lower_bound = id_range_upper_bound + 1
+        time.sleep(0.1)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+    dependencies = [
+        ("zerver", "0786_unreadsummary_unreadconversation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Topic",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("name", models.CharField(max_length=60)),
+                (
+                    "realm",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="zerver.realm"
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="zerver.recipient"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        models.F("realm"),
+                        django.db.models.functions.text.Upper("name"),
+                        name="zerver_topic_realm_upper_name",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        models.F("recipient"),
+                        django.db.models.functions.text.Upper("name"),
+                        name="zerver_topic_recipient_upper_name",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="topic",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="zerver.topic",
+            ),
+        ),
+        migrations.RunSQL(
+            """
+        CREATE FUNCTION zerver_message_set_topic_id_trigger_function()
+        RETURNS trigger AS $$
+        BEGIN
+            IF NOT NEW.is_channel_message THEN
+                NEW.topic_id = NULL;
+                RETURN NEW;
+            END IF;
+
+            SELECT id INTO NEW.topic_id FROM zerver_topic
+            WHERE recipient_id = NEW.recipient_id AND upper(name) = upper(NEW.subject);
+            IF NEW.topic_id IS NULL THEN
+                INSERT INTO zerver_topic (realm_id, recipient_id, name)
+                VALUES (NEW.realm_id, NEW.recipient_id, NEW.subject)
+                ON CONFLICT DO NOTHING
+                RETURNING id INTO NEW.topic_id;
+            END IF;
+            IF NEW.topic_id IS NULL THEN
+                -- A concurrent transaction created the topic first.
+                SELECT id INTO NEW.topic_id FROM zerver_topic
+                WHERE recipient_id = NEW.recipient_id AND upper(name) = upper(NEW.subject);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE 'plpgsql';
+
+        CREATE TRIGGER zerver_message_set_topic_id
+        BEFORE INSERT OR UPDATE OF subject, recipient_id, is_channel_message ON zerver_message
+        FOR EACH ROW
+        EXECUTE PROCEDURE zerver_message_set_topic_id_trigger_function();
+        """,
+            reverse_sql="""
+        DROP TRIGGER zerver_message_set_topic_id ON zerver_message;
+        DROP FUNCTION zerver_message_set_topic_id_trigger_function();
+        """,
+        ),
+        migrations.RunPython(
+            assign_topic_ids, reverse_code=migrations.RunPython.noop, elidable=True
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(models.F("topic"), models.F("id"), name="zerver_message_topic_id"),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0787_topic_message_topic"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="unreadconversation",
+            name="unread_count",
+        ),
+    ]
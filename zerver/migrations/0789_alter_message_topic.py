@@ -0,0 +1,21 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("zerver", "0788_remove_unreadconversation_unread_count"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="topic",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                to="zerver.topic",
+            ),
+        ),
+    ]
@@ -33,6 +33,9 @@ from zerver.models.messages import Message as Message
 from zerver.models.messages import OnboardingUserMessage as OnboardingUserMessage
 from zerver.models.messages import Reaction as Reaction
 from zerver.models.messages import SubMessage as SubMessage
+from zerver.models.messages import Topic as Topic
+from zerver.models.messages import UnreadConversation as UnreadConversation
+from zerver.models.messages import UnreadSummary as UnreadSummary
 from zerver.models.messages import UserMessage as UserMessage
 from zerver.models.muted_users import MutedUser as MutedUser
 from zerver.models.navigation_views import NavigationView as NavigationView
@@ -7,7 +7,7 @@ from bitfield.types import Bit, BitHandler
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-from django.db.models import CASCADE, F, Q, QuerySet
+from django.db.models import CASCADE, DO_NOTHING, F, Q, QuerySet
 from django.db.models.functions import Upper
 from django.db.models.signals import post_delete, post_save
 from django.utils.timezone import now as timezone_now
@@ -22,6 +22,45 @@ from zerver.models.recipients import Recipient
 from zerver.models.users import UserProfile
 
 
+class Topic(models.Model):
+    """A topic in a channel, which messages reference by ID, so that
+    narrowing to a topic, or listing a channel's topics, is an integer
+    index lookup rather than a case-insensitive scan of message
+    subjects.
+
+    Topic names are compared case-insensitively; name has the case
+    of the first message sent to the topic.  Rows are created by the
+    zerver_message_set_topic_id trigger whenever a message is sent to, or
+    moved into, a topic, and are never deleted when a topic is
+    emptied, so a topic row does not imply the topic has messages.
+    """
+
+    realm = models.ForeignKey(Realm, on_delete=CASCADE)
+    recipient = models.ForeignKey(Recipient, on_delete=CASCADE)
+    name = models.CharField(max_length=MAX_TOPIC_NAME_LENGTH)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                "recipient",
+                Upper("name"),
+                name="zerver_topic_recipient_upper_name",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                # For topic narrows without a channel.
+                "realm",
+                Upper("name"),
+                name="zerver_topic_realm_upper_name",
+            ),
+        ]
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.recipient.label()} / {self.name}"
+
+
 class AbstractMessage(models.Model):
     id = models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")
     sender = models.ForeignKey(UserProfile, on_delete=CASCADE)
@@ -205,6 +244,12 @@ class Message(AbstractMessage):
 
     search_tsvector = SearchVectorField(null=True)
 
+    # The message's topic, for channel messages; always kept in sync
+    # with subject by the zerver_message_set_topic_id database trigger,
+    # and so never set by application code.  Topic is only an index,
+    # so deleting a Topic row must never delete messages.
+    topic = models.ForeignKey(Topic, null=True, on_delete=DO_NOTHING, db_index=False)
+
     DEFAULT_SELECT_RELATED = ["sender", "realm", "recipient", "sending_client"]
 
     # Name to be used for the empty topic with clients that have not
@@ -280,6 +325,14 @@ class Message(AbstractMessage):
                 name="zerver_message_realm_recipient_subject",
                 condition=Q(is_channel_message=True),
             ),
+            models.Index(
+                # For topic narrows and topic lists, via Topic.  The
+                # "id" at the end makes it easy to scan the resulting
+                # messages in order.
+                "topic",
+                "id",
+                name="zerver_message_topic_id",
+            ),
             models.Index(
                 # Only used by update_first_visible_message_id
                 "realm_id",
@@ -723,6 +776,50 @@ def get_usermessage_by_message_id(user_profile: UserProfile, message_id: int) ->
         return None
 
 
+class UnreadSummary(models.Model):
+    """Marks that a user's UnreadConversation rows summarize their
+    unread UserMessage rows through summarized_through_message_id.
+
+    Only users with many unread messages have a summary.  Messages
+    sent since are not summarized; the summary is advanced over them
+    at /register from time to time.  See
+    zerver/lib/unread_conversations.py.
+    """
+
+    user_profile = models.OneToOneField(UserProfile, on_delete=CASCADE)
+    summarized_through_message_id = models.IntegerField()
+    last_summarized = models.DateTimeField()
+
+
+class UnreadConversation(models.Model):
+    """A user's unread UserMessage rows in one conversation (a channel
+    topic, or a direct message conversation, whose topic_name is "").
+
+    first_unread_message_id is never later than the first unread
+    message in the conversation, though it may be earlier after races,
+    moves or message deletions; the verify_unread_conversations
+    management command reports and repairs such drift.
+    """
+
+    user_profile = models.ForeignKey(UserProfile, on_delete=CASCADE)
+    recipient = models.ForeignKey(Recipient, on_delete=CASCADE)
+    topic_name = models.CharField(max_length=MAX_TOPIC_NAME_LENGTH, default="")
+    first_unread_message_id = models.IntegerField()
+    # Incremented by every change to the row, so that recomputing
+    # first_unread_message_id can detect concurrent changes.
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                "user_profile",
+                "recipient",
+                Upper("topic_name"),
+                name="zerver_unreadconversation_user_recipient_upper_topic",
+            ),
+        ]
+
+
 class ArchivedUserMessage(AbstractUserMessage):
     """Used as a temporary holding place for deleted UserMessages objects
     before they are permanently deleted.  This is an important part of
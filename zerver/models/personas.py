@@ -2,9 +2,12 @@ from typing import Any
 
 from django.db import models
 from django.db.models import CASCADE
+from django.db.models.signals import post_delete, post_save
 from django.utils.timezone import now as timezone_now
 from typing_extensions import override
 
+from zerver.lib.cache import flush_realm_rendering_context
+
 
 class UserPersona(models.Model):
     """User-owned character identities for roleplay.
@@ -49,3 +52,11 @@ class UserPersona(models.Model):
             "is_active": self.is_active,
             "date_created": int(self.created_at.timestamp()),
         }
+
+
+def flush_user_persona(*, instance: UserPersona, **kwargs: object) -> None:
+    flush_realm_rendering_context(instance.user.realm_id)
+
+
+post_save.connect(flush_user_persona, sender=UserPersona)
+post_delete.connect(flush_user_persona, sender=UserPersona)
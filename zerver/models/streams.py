@@ -1,4 +1,5 @@
 import secrets
+from collections.abc import Sequence
 from enum import Enum
 from typing import Any
 
@@ -10,7 +11,7 @@ from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext_lazy
 from typing_extensions import override
 
-from zerver.lib.cache import flush_stream
+from zerver.lib.cache import flush_realm_rendering_context, flush_stream
 from zerver.lib.types import GroupPermissionSetting
 from zerver.models.channel_folders import ChannelFolder
 from zerver.models.groups import SystemGroups, UserGroup
@@ -90,6 +91,16 @@ class Stream(models.Model):
     # Tulip: Default to True for agent-friendly puppet support
     enable_puppet_mode = models.BooleanField(default=True)
 
+    # Whether messages to this stream only create UserMessage rows for
+    # subscribers whose flags differ from the default (e.g. mentions,
+    # alert words, or the sender's own read flag), rather than for
+    # every subscriber.  Intended for read-mostly channels with very
+    # many subscribers; unread state for the other subscribers is
+    # tracked by Subscription.sparse_read_message_id.  Only takes
+    # effect for streams with history_public_to_subscribers, since
+    # access to messages in other streams requires a UserMessage row.
+    sparse_user_messages = models.BooleanField(default=False, db_default=False)
+
     # These values are used to map the can_send_message_group setting value
     # to the corresponding stream_post_policy value for legacy API clients
     # in get_stream_post_policy_value_based_on_group_setting defined in
@@ -263,6 +274,9 @@ class Stream(models.Model):
     def is_history_public_to_subscribers(self) -> bool:
         return self.history_public_to_subscribers
 
+    def uses_sparse_user_messages(self) -> bool:
+        return self.sparse_user_messages and self.is_history_public_to_subscribers()
+
     # Stream fields included whenever a Stream object is provided to
     # Zulip clients via the API.  A few details worth noting:
     # * "id" is represented as "stream_id" in most API interfaces.
@@ -428,6 +442,13 @@ class Subscription(models.Model):
     email_notifications = models.BooleanField(null=True, default=None)
     wildcard_mentions_notify = models.BooleanField(null=True, default=None)
 
+    # For streams using sparse_user_messages: messages in the stream
+    # with IDs up to this one, for which the user has no UserMessage
+    # row, are read; later ones without a row are unread.  Set to the
+    # latest message ID when the user subscribes, and advanced as the
+    # user reads messages.
+    sparse_read_message_id = models.IntegerField(default=0, db_default=0)
+
     class Meta:
         unique_together = ("user_profile", "recipient")
         indexes = [
@@ -548,6 +569,23 @@ class StreamPuppet(models.Model):
         return f"{self.name} in {self.stream.name}"
 
 
+def flush_stream_puppet(
+    *,
+    instance: StreamPuppet,
+    created: bool = False,
+    update_fields: Sequence[str] | None = None,
+    **kwargs: object,
+) -> None:
+    # Puppets are re-saved on every puppet message to bump last_used;
+    # only a new or renamed puppet changes who can be @-mentioned.
+    if created or update_fields is None or "name" in update_fields:
+        flush_realm_rendering_context(instance.stream.realm_id)
+
+
+post_save.connect(flush_stream_puppet, sender=StreamPuppet)
+post_delete.connect(flush_stream_puppet, sender=StreamPuppet)
+
+
 class PuppetHandler(models.Model):
     """Tracks users/bots that can receive whispers directed at a puppet.
 
@@ -1,4 +1,5 @@
 import time
+import tracemalloc
 from collections.abc import Callable, Collection
 from typing import Any
 from unittest import mock
@@ -14,6 +15,7 @@ from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.cache import cache_delete, get_muting_users_cache_key
+from zerver.lib.event_delta import delta_decode_events, delta_encode_events
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import HostRequestMock, dummy_handler, mock_queue_publish
 from zerver.models import PushDevice, Recipient, Subscription, UserProfile, UserTopic
@@ -1527,3 +1529,106 @@ class EventQueueTest(ZulipTestCase):
 
         queue.prune(1)
         self.verify_to_dict_end_to_end(client)
+
+    def test_client_descriptor_capabilities(self) -> None:
+        client = self.get_client_descriptor()
+        self.assertFalse(client.apply_markdown)
+        self.assertTrue(client.client_gravatar)
+        self.assertTrue(client.pronouns_field_type_supported)
+        self.assertFalse(client.is_bot)
+
+        client.is_bot = True
+        self.assertTrue(client.is_bot)
+        self.assertTrue(client.client_gravatar)
+        client.client_gravatar = False
+        self.assertFalse(client.client_gravatar)
+        self.assertTrue(client.is_bot)
+        self.verify_to_dict_end_to_end(client)
+
+        # Descriptors don't carry a per-object __dict__, and share
+        # their narrow, compiled narrow predicate and event_types with
+        # other queues that requested the same ones.
+        self.assertFalse(hasattr(client, "__dict__"))
+        other_client = self.get_client_descriptor()
+        self.assertIs(client.narrow, other_client.narrow)
+        self.assertIs(client.narrow_predicate, other_client.narrow_predicate)
+        self.assertIs(client.client_type_name, other_client.client_type_name)
+
+        narrow_client = ClientDescriptor.from_dict(
+            {**client.to_dict(), "narrow": [["stream", "Denmark"]], "event_types": ["message"]}
+        )
+        other_narrow_client = ClientDescriptor.from_dict(
+            {**client.to_dict(), "narrow": [["stream", "Denmark"]], "event_types": ["message"]}
+        )
+        self.assertEqual(narrow_client.narrow, [["stream", "Denmark"]])
+        self.assertIs(narrow_client.narrow_predicate, other_narrow_client.narrow_predicate)
+        self.assertIs(narrow_client.event_types, other_narrow_client.event_types)
+
+    def test_idle_queue_memory(self) -> None:
+        # Tracks the memory cost of an idle event queue, including its
+        # entries in Tornado's lookup tables.  If this starts failing,
+        # make sure the added per-queue memory is worth it: production
+        # shards host very many mostly idle queues.
+        bytes_per_idle_queue_budget = 2560
+        queue_count = 1000
+
+        hamlet = self.example_user("hamlet")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=0,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+        )
+        allocate_client_descriptor(dict(queue_data))
+
+        tracemalloc.start()
+        try:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            clients = [allocate_client_descriptor(dict(queue_data)) for _ in range(queue_count)]
+            bytes_per_queue = (tracemalloc.get_traced_memory()[0] - start_bytes) / queue_count
+        finally:
+            tracemalloc.stop()
+
+        self.assert_length(clients, queue_count)
+        self.assertLess(bytes_per_queue, bytes_per_idle_queue_budget)
+
+    def test_delta_encoded_events(self) -> None:
+        events: list[dict[str, Any]] = [
+            {"id": 0, "type": "stream", "op": "update", "stream_id": 7, "property": "name"},
+            {"id": 1, "type": "stream", "op": "update", "stream_id": 7, "property": "color"},
+            {"id": 2, "type": "typing", "op": "start", "stream_id": 7},
+            {"id": 3, "type": "typing", "op": "start", "stream_id": 7},
+            {"id": 4, "type": "typing", "op": "stop", "stream_id": 8},
+        ]
+        encoded_events = delta_encode_events(events)
+        self.assertEqual(
+            encoded_events,
+            [
+                events[0],
+                {
+                    "id": 1,
+                    "type": "stream",
+                    "property": "color",
+                    "repeated_keys": ["op", "stream_id"],
+                },
+                events[2],
+                {"id": 3, "type": "typing", "repeated_keys": ["op", "stream_id"]},
+                events[4],
+            ],
+        )
+        self.assertEqual(delta_decode_events(encoded_events), events)
+        self.assertEqual(delta_decode_events(delta_encode_events([])), [])
+
+        client = self.get_client_descriptor()
+        for event in events:
+            client.event_queue.push(event)
+        self.assertEqual(client.get_events_for_response(), events)
+
+        client.delta_encoded_events = True
+        self.assertEqual(client.get_events_for_response(), encoded_events)
+        self.verify_to_dict_end_to_end(client)
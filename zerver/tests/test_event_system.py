@@ -1,11 +1,13 @@
 import time
 from collections.abc import Callable
+from contextlib import suppress
 from typing import Any
 from unittest import mock
 from urllib.parse import urlsplit
 
 import orjson
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpRequest, HttpResponse
 from django.test import override_settings
 from django.utils.timezone import now as timezone_now
@@ -15,6 +17,7 @@ from zerver.actions.channel_folders import check_add_channel_folder
 from zerver.actions.custom_profile_fields import try_update_realm_custom_profile_field
 from zerver.actions.message_send import check_send_message
 from zerver.actions.presence import do_update_user_presence
+from zerver.actions.realm_domains import do_add_realm_domain
 from zerver.actions.streams import do_change_stream_folder
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.lib.event_schema import check_web_reload_client_event
@@ -34,12 +37,19 @@ from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 from zerver.models.streams import get_stream
 from zerver.models.users import get_system_bot
+from zerver.tornado.django_api import send_event_on_commit
 from zerver.tornado.event_queue import (
+    ClientDescriptor,
     allocate_client_descriptor,
     clear_client_event_queues_for_testing,
+    get_client_descriptors_for_users,
     get_client_info_for_message_event,
     mark_clients_to_reload,
+    process_event,
     process_message_event,
+    realm_clients_by_narrow,
+    realm_event_type_clients,
+    realm_user_ids,
     send_web_reload_client_events,
 )
 from zerver.tornado.exceptions import BadEventQueueIdError
@@ -161,6 +171,60 @@ class EventsEndpointTest(ZulipTestCase):
         self.assertEqual(result_dict["realm_emoji"], {})
         self.assertEqual(result_dict["queue_id"], "15:13")
 
+    def test_events_register_resume(self) -> None:
+        user = self.example_user("hamlet")
+        othello = self.example_user("othello")
+
+        def register(resume: dict[str, Any], user_events: list[dict[str, Any]]) -> dict[str, Any]:
+            with stub_event_queue_user_events("15:11", user_events):
+                result = self.api_post(
+                    user,
+                    "/api/v1/register",
+                    dict(
+                        fetch_event_types=orjson.dumps(
+                            ["presence", "realm_domains", "realm_emoji"]
+                        ).decode(),
+                        resume=orjson.dumps(resume).decode(),
+                    ),
+                )
+            return self.assert_json_success(result)
+
+        result_dict = register({}, [])
+        self.assertEqual(result_dict["unchanged_realm_state_sections"], [])
+        self.assertIn("realm_domains", result_dict)
+        self.assertIn("realm_emoji", result_dict)
+        versions = result_dict["realm_state_versions"]
+        self.assertEqual(set(versions), {"realm_domains", "realm_emoji"})
+
+        do_update_user_presence(
+            othello, get_client("website"), timezone_now(), UserPresence.LEGACY_STATUS_ACTIVE_INT
+        )
+        with self.capture_send_event_calls(expected_num_events=1):
+            do_add_realm_domain(user.realm, "example.org", False, acting_user=None)
+
+        # Only what changed since the client's previous registration is
+        # sent.
+        resume = dict(
+            presence_last_update_id=result_dict["presence_last_update_id"],
+            realm_state_versions=versions,
+        )
+        result_dict = register(resume, [])
+        self.assertEqual(result_dict["unchanged_realm_state_sections"], ["realm_emoji"])
+        self.assertNotIn("realm_emoji", result_dict)
+        self.assertIn(
+            {"domain": "example.org", "allow_subdomains": False}, result_dict["realm_domains"]
+        )
+        self.assertEqual(list(result_dict["presences"]), [str(othello.id)])
+        self.assertEqual(
+            result_dict["realm_state_versions"]["realm_emoji"], versions["realm_emoji"]
+        )
+
+        # A section is sent if an event applied to the state changed it.
+        emoji_event = dict(id=6, type="realm_emoji", realm_emoji={})
+        result_dict = register(dict(realm_state_versions=versions), [emoji_event])
+        self.assertEqual(result_dict["unchanged_realm_state_sections"], [])
+        self.assertEqual(result_dict["realm_emoji"], {})
+
     def test_events_register_spectators(self) -> None:
         # Verify that POST /register works for spectators, but not for
         # normal users.
@@ -961,6 +1025,149 @@ class ClientDescriptorsTest(ZulipTestCase):
         test_get_info(apply_markdown=False, client_gravatar=True)
         test_get_info(apply_markdown=True, client_gravatar=True)
 
+    def test_get_client_info_for_narrowed_queues(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+        clear_client_event_queues_for_testing()
+
+        def allocate(narrow: list[list[str]]) -> ClientDescriptor:
+            return allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="website",
+                    event_types=["message"],
+                    last_connection_time=time.time(),
+                    queue_timeout=0,
+                    realm_id=realm.id,
+                    user_profile_id=hamlet.id,
+                    narrow=narrow,
+                )
+            )
+
+        topic_client = allocate([["stream", "Denmark"], ["topic", "lunch"]])
+        stream_client = allocate([["channel", "Verona"]])
+        mentioned_client = allocate([["is", "mentioned"]])
+        self.assertEqual(topic_client.narrow_index_key, ("denmark", "lunch"))
+        self.assertEqual(stream_client.narrow_index_key, ("verona", None))
+        self.assertIsNone(mentioned_client.narrow_index_key)
+        self.assertEqual(
+            realm_clients_by_narrow,
+            {
+                (realm.id, "denmark", "lunch"): [topic_client],
+                (realm.id, "verona", None): [stream_client],
+            },
+        )
+
+        def get_clients(
+            stream_name: str, topic_name: str, users: list[dict[str, Any]]
+        ) -> set[ClientDescriptor]:
+            message_event = dict(
+                realm_id=realm.id,
+                stream_name=stream_name,
+                message_dict=dict(type="stream", display_recipient=stream_name, subject=topic_name),
+            )
+            client_info = get_client_info_for_message_event(message_event, users, realm.id)
+            return {info["client"] for info in client_info.values()}
+
+        # Queues narrowed to a channel are only visited for messages
+        # sent to that channel (and topic).
+        self.assertEqual(
+            get_clients("Denmark", "Lunch", users=[]), {topic_client, mentioned_client}
+        )
+        self.assertEqual(get_clients("Denmark", "dinner", users=[]), {mentioned_client})
+        self.assertEqual(
+            get_clients("Verona", "dinner", users=[dict(id=hamlet.id)]),
+            {stream_client, mentioned_client},
+        )
+
+        topic_client.cleanup()
+        self.assertEqual(realm_clients_by_narrow, {(realm.id, "verona", None): [stream_client]})
+
+    def test_realm_event_type_index(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        realm = hamlet.realm
+        clear_client_event_queues_for_testing()
+
+        def allocate(user: UserProfile, event_types: list[str] | None) -> ClientDescriptor:
+            return allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="website",
+                    event_types=event_types,
+                    last_connection_time=time.time(),
+                    queue_timeout=0,
+                    realm_id=realm.id,
+                    user_profile_id=user.id,
+                )
+            )
+
+        hamlet_client = allocate(hamlet, ["realm_user"])
+        cordelia_client = allocate(cordelia, None)
+        allocate(cordelia, ["message"])
+        self.assertEqual(
+            list(realm_event_type_clients[(realm.id, "realm_user")].values()), [hamlet_client]
+        )
+        self.assertEqual(
+            list(realm_event_type_clients[(realm.id, None)].values()), [cordelia_client]
+        )
+
+        # A realm-wide event walks the index rather than every user id.
+        user_ids = [user.id for user in realm.get_active_users()]
+        self.assertGreater(len(user_ids), 3)
+        self.assertEqual(
+            set(get_client_descriptors_for_users(user_ids, "realm_user", realm.id)),
+            {hamlet_client, cordelia_client},
+        )
+        # Without a realm, we fall back to per-user lookups.
+        self.assertEqual(
+            {
+                client
+                for client in get_client_descriptors_for_users(user_ids, "realm_user", None)
+                if client.accepts_event({"type": "realm_user"})
+            },
+            {hamlet_client, cordelia_client},
+        )
+
+        event = dict(type="realm_user", op="update", person=dict(user_id=hamlet.id))
+        process_event(event, user_ids, realm.id)
+        self.assert_length(hamlet_client.event_queue.contents(), 1)
+        self.assert_length(cordelia_client.event_queue.contents(), 1)
+
+        # Queues of users outside the realm (e.g. cross-realm bots) are
+        # still found.
+        notification_bot = get_system_bot(settings.NOTIFICATION_BOT, realm.id)
+        bot_client = allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=0,
+                realm_id=notification_bot.realm_id,
+                user_profile_id=notification_bot.id,
+            )
+        )
+        self.assertIn(
+            bot_client,
+            set(
+                get_client_descriptors_for_users(
+                    [*user_ids, notification_bot.id], "realm_user", realm.id
+                )
+            ),
+        )
+
+        hamlet_client.cleanup()
+        self.assertNotIn((realm.id, "realm_user"), realm_event_type_clients)
+        self.assertNotIn(hamlet.id, realm_user_ids[realm.id])
+        self.assertIn(cordelia.id, realm_user_ids[realm.id])
+
     def test_process_message_event_with_mocked_client_info(self) -> None:
         hamlet = self.example_user("hamlet")
 
@@ -1166,6 +1373,61 @@ class ClientDescriptorsTest(ZulipTestCase):
         )
 
 
+class TornadoEventBatchTest(ZulipTestCase):
+    def test_events_batched_per_transaction(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        realm = hamlet.realm
+
+        with (
+            self.captureOnCommitCallbacks(execute=True),
+            mock.patch("zerver.tornado.django_api.queue_json_publish_rollback_unsafe") as m,
+            transaction.atomic(savepoint=False),
+        ):
+            send_event_on_commit(realm, dict(type="test", value=1), [hamlet.id])
+            send_event_on_commit(realm, dict(type="test", value=2), [cordelia.id])
+            with suppress(AssertionError), transaction.atomic(savepoint=True):
+                # Events in a savepoint which gets rolled back are
+                # not sent.
+                send_event_on_commit(realm, dict(type="test", value=3), [hamlet.id])
+                raise AssertionError
+            send_event_on_commit(realm, dict(type="test", value=4), [hamlet.id])
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(
+            m.call_args.args[1],
+            dict(
+                notices=[
+                    dict(event=dict(type="test", value=1), users=[hamlet.id], realm_id=realm.id),
+                    dict(event=dict(type="test", value=2), users=[cordelia.id], realm_id=realm.id),
+                    dict(event=dict(type="test", value=4), users=[hamlet.id], realm_id=realm.id),
+                ]
+            ),
+        )
+
+        # Batched notices are processed one event at a time.
+        with self.capture_send_event_calls(expected_num_events=2) as events:
+            send_event_on_commit(realm, dict(type="test", value=1), [hamlet.id])
+            send_event_on_commit(realm, dict(type="test", value=2), [cordelia.id])
+        self.assertEqual([event["event"]["value"] for event in events], [1, 2])
+
+    def test_event_order_across_savepoints(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+
+        # Events sent before capturing are not sent along with the
+        # captured ones, since the test transaction never commits.
+        send_event_on_commit(realm, dict(type="test", value=0), [hamlet.id])
+        with self.capture_send_event_calls(expected_num_events=3) as events:
+            send_event_on_commit(realm, dict(type="test", value=1), [hamlet.id])
+            with transaction.atomic(savepoint=True):
+                send_event_on_commit(realm, dict(type="test", value=2), [hamlet.id])
+            # Not batched with the first event, since that would send
+            # it after the event from the savepoint.
+            send_event_on_commit(realm, dict(type="test", value=3), [hamlet.id])
+        self.assertEqual([event["event"]["value"] for event in events], [1, 2, 3])
+
+
 class ReloadWebClientsTest(ZulipTestCase):
     def test_web_reload_clients(self) -> None:
         hamlet = self.example_user("hamlet")
@@ -12,27 +12,30 @@ from bs4 import BeautifulSoup
 from django.conf import settings
 from django.test import override_settings
 from markdown import Markdown
+from requests.models import PreparedRequest
 from responses import matchers
 from typing_extensions import override
 
 from zerver.actions.alert_words import do_add_alert_words
 from zerver.actions.create_realm import do_create_realm
+from zerver.actions.personas import do_create_persona, do_delete_persona
 from zerver.actions.realm_emoji import do_remove_realm_emoji
 from zerver.actions.realm_settings import do_set_realm_property
+from zerver.actions.stream_puppets import register_stream_puppet
 from zerver.actions.streams import do_change_stream_group_based_setting
 from zerver.actions.user_groups import (
     add_subgroups_to_user_group,
     check_add_user_group,
     do_deactivate_user_group,
 )
-from zerver.actions.user_settings import do_change_user_setting
+from zerver.actions.user_settings import do_change_full_name, do_change_user_setting
 from zerver.actions.users import change_user_is_active
 from zerver.lib.alert_words import get_alert_word_automaton
 from zerver.lib.camo import get_camo_url
 from zerver.lib.create_user import create_user
 from zerver.lib.emoji import codepoint_to_name, get_emoji_url
 from zerver.lib.emoji_utils import hex_codepoint_to_emoji
-from zerver.lib.exceptions import JsonableError, MarkdownRenderingError
+from zerver.lib.exceptions import JsonableError, MarkdownRenderingBusyError, MarkdownRenderingError
 from zerver.lib.markdown import (
     POSSIBLE_EMOJI_RE,
     InlineInterestingLinkProcessor,
@@ -40,7 +43,9 @@ from zerver.lib.markdown import (
     MessageRenderingResult,
     clear_web_link_regex_for_testing,
     content_has_emoji_syntax,
+    get_markdown_cache_hits,
     image_preview_enabled,
+    is_plain_text_content,
     markdown_convert,
     possible_linked_stream_names,
     render_message_markdown,
@@ -49,6 +54,17 @@ from zerver.lib.markdown import (
     url_to_a,
 )
 from zerver.lib.markdown.fenced_code import FencedBlockPreprocessor
+from zerver.lib.markdown.incremental import (
+    incremental_rendering_stats,
+    split_into_blocks,
+    split_rendered_content,
+)
+from zerver.lib.markdown.render_server import RenderingAdmission, render_message_request
+from zerver.lib.markdown.rendering_context import (
+    MentionIndex,
+    MentionTarget,
+    get_rendering_context_stats,
+)
 from zerver.lib.mdiff import diff_strings
 from zerver.lib.mention import (
     FullNameInfo,
@@ -654,6 +670,63 @@ class MarkdownFixtureTest(ZulipTestCase):
             converted = markdown_convert_wrapper(inline_url)
             self.assertEqual(match, converted)
 
+    def test_plain_text_prescan(self) -> None:
+        realm = get_realm("zulip")
+        othello = self.example_user("othello")
+        RealmFilter(
+            realm=realm,
+            pattern=r"ZUL-(?P<id>[0-9]+)",
+            url_template=r"https://trac.example.com/ticket/{id}",
+        ).save()
+        do_add_alert_words(othello, ["alertword"])
+
+        format_tests, linkify_tests = self.load_markdown_tests()
+        inputs = [
+            test["input"]
+            for test in format_tests.values()
+            if not test.get("translate_emoticons", False)
+        ]
+        inputs += [inline_url for inline_url, reference, url in linkify_tests]
+        inputs += [
+            "Hello world",
+            'Nobody said: "it\'s (mostly) plain text", right?',
+            "Line one\nline two\nline three",
+            "\nFirst paragraph.\n\n\nSecond paragraph; it's well-known!\n",
+            "The ALERTWORD goes here",
+            "Fixed in ZUL-123 yesterday",
+            "- not a paragraph",
+            "2. not a paragraph",
+            "    not a paragraph",
+            "trailing spaces  \nare special",
+        ]
+
+        def render(content: str) -> MessageRenderingResult:
+            msg = Message(sender=othello, sending_client=get_client("test"), realm=realm)
+            return render_message_markdown(
+                msg, content, realm_alert_words_automaton=get_alert_word_automaton(realm)
+            )
+
+        plain_text_inputs = []
+        for content in inputs:
+            with self.subTest(content=content):
+                with override_settings(PLAIN_TEXT_PRESCAN_ENABLED=False):
+                    expected = render(content)
+                self.assertEqual(render(content), expected)
+                if is_plain_text_content(content, linkifiers_for_realm(realm.id)):
+                    plain_text_inputs.append(content)
+
+        self.assertEqual(
+            plain_text_inputs[-5:],
+            [
+                "Hello world",
+                'Nobody said: "it\'s (mostly) plain text", right?',
+                "Line one\nline two\nline three",
+                "\nFirst paragraph.\n\n\nSecond paragraph; it's well-known!\n",
+                "The ALERTWORD goes here",
+            ],
+        )
+        self.assertEqual(render("The ALERTWORD goes here").user_ids_with_alert_words, {othello.id})
+
 
 class MarkdownLinkTest(ZulipTestCase):
     def test_url_to_a(self) -> None:
@@ -3687,13 +3760,310 @@ class MarkdownApiTests(ZulipTestCase):
         )
 
 
+class MarkdownRenderingCacheTest(ZulipTestCase):
+    def test_bot_message_rendering_cache(self) -> None:
+        bot = self.example_user("default_bot")
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        content = "@**King Hamlet** rolled a **6** on https://dice.example.com for the ALERTWORD"
+
+        def render(sender: UserProfile) -> tuple[Message, MessageRenderingResult]:
+            msg = Message(sender=sender, sending_client=get_client("test"), realm=sender.realm)
+            rendering_result = render_message_markdown(
+                msg,
+                content,
+                realm_alert_words_automaton=get_alert_word_automaton(sender.realm),
+            )
+            return msg, rendering_result
+
+        cache_hits = get_markdown_cache_hits()
+        msg, rendering_result = render(bot)
+        self.assertEqual(get_markdown_cache_hits(), cache_hits)
+        self.assertTrue(msg.has_link)
+
+        cached_msg, cached_rendering_result = render(bot)
+        self.assertEqual(get_markdown_cache_hits(), cache_hits + 1)
+        self.assertEqual(cached_rendering_result, rendering_result)
+        self.assertEqual(cached_rendering_result.mentions_user_ids, {hamlet.id})
+        self.assertTrue(cached_msg.has_link)
+
+        # Alert words are matched against the current set of alert
+        # words, even when the rendering comes from the cache.
+        do_add_alert_words(othello, ["ALERTWORD"])
+        _, cached_rendering_result = render(bot)
+        self.assertEqual(get_markdown_cache_hits(), cache_hits + 2)
+        self.assertEqual(cached_rendering_result.user_ids_with_alert_words, {othello.id})
+
+        # Renaming the mentioned user changes the mention data, and
+        # so misses the cache.
+        do_change_full_name(hamlet, "Prince Hamlet", acting_user=None, notify=False)
+        _, rendering_result = render(bot)
+        self.assertEqual(get_markdown_cache_hits(), cache_hits + 2)
+        self.assertEqual(rendering_result.mentions_user_ids, set())
+        self.assertNotIn("user-mention", rendering_result.rendered_content)
+
+        # Messages sent by humans are never cached.
+        render(othello)
+        render(othello)
+        self.assertEqual(get_markdown_cache_hits(), cache_hits + 2)
+
+
+class RealmRenderingContextTest(ZulipTestCase):
+    def test_realm_rendering_context(self) -> None:
+        hamlet = self.example_user("hamlet")
+        stream = get_stream("Denmark", hamlet.realm)
+
+        def render(content: str) -> MessageRenderingResult:
+            msg = Message(
+                sender=hamlet,
+                sending_client=get_client("test"),
+                realm=hamlet.realm,
+                recipient=stream.recipient,
+            )
+            return render_message_markdown(msg, content)
+
+        def stats_delta(before: dict[str, int]) -> dict[str, int]:
+            after = get_rendering_context_stats()
+            return {
+                key: after[key] - before.get(key, 0)
+                for key in after
+                if after[key] != before.get(key, 0)
+            }
+
+        # Content without mention syntax never looks up puppets or personas.
+        stats = get_rendering_context_stats()
+        render("*emphasized* content")
+        self.assertEqual(stats_delta(stats), {"context.load": 1})
+
+        stats = get_rendering_context_stats()
+        rendering_result = render("@**Mordred** meets @**Joker**")
+        self.assertEqual(
+            stats_delta(stats),
+            {"context.hit": 1, "mention_index.load": 1, "personas.load": 1, "puppets.load": 1},
+        )
+        self.assertNotIn("mention", rendering_result.rendered_content)
+
+        stats = get_rendering_context_stats()
+        render("@**Mordred** meets @**Joker**")
+        self.assertEqual(stats_delta(stats), {"context.hit": 1, "mention_index.hit": 1})
+
+        # Creating a persona or a puppet invalidates the snapshot.
+        persona = do_create_persona(hamlet, "Joker")
+        register_stream_puppet(stream, "Mordred", None, hamlet)
+        stats = get_rendering_context_stats()
+        rendering_result = render("@**Mordred** meets @**joker**")
+        self.assertEqual(
+            stats_delta(stats),
+            {"context.load": 1, "mention_index.load": 1, "personas.load": 1, "puppets.load": 1},
+        )
+        self.assertIn('class="puppet-mention"', rendering_result.rendered_content)
+        self.assertIn('class="persona-mention"', rendering_result.rendered_content)
+        self.assertEqual(rendering_result.mentions_persona_ids, {persona.id})
+
+        # Reusing an existing puppet does not.
+        register_stream_puppet(stream, "Mordred", None, hamlet)
+        stats = get_rendering_context_stats()
+        render("@**Mordred**")
+        self.assertEqual(stats_delta(stats), {"context.hit": 1, "mention_index.hit": 1})
+
+        do_delete_persona(persona.id, hamlet)
+        rendering_result = render("@**Joker**")
+        self.assertNotIn("persona-mention", rendering_result.rendered_content)
+
+    def test_mention_index(self) -> None:
+        mention_index = MentionIndex(
+            puppets=[(1, "Gandalf"), (2, "Gimli")],
+            personas=[(10, "Galadriel", 100), (11, "Gandalf", 101), (12, "Straße", 102)],
+        )
+        self.assertEqual(mention_index.lookup("gandalf"), MentionTarget("puppet", 1))
+        self.assertEqual(mention_index.lookup("GALADRIEL"), MentionTarget("persona", 10, 100))
+        self.assertEqual(mention_index.lookup("STRASSE"), MentionTarget("persona", 12, 102))
+        self.assertIsNone(mention_index.lookup("Frodo"))
+
+        self.assertEqual(mention_index.search_prefix("g", "puppet"), [1, 2])
+        self.assertEqual(mention_index.search_prefix("Ga", "persona"), [10])
+        self.assertEqual(mention_index.search_prefix("Gimlis", "puppet"), [])
+
+        # The owner of a shadowed persona is still known, since a
+        # message rendered before the puppet was created can mention it.
+        self.assertEqual(mention_index.get_persona_owner_ids({10, 11, 13}), {100, 101})
+
+
+class IncrementalRenderingTest(ZulipTestCase):
+    def test_split_rendered_content(self) -> None:
+        self.assertEqual(
+            split_rendered_content("<h1>Title</h1>\n<p>a<br>\nb</p>\n<hr>\n<p>c</p>"),
+            ["<h1>Title</h1>", "<p>a<br>\nb</p>", "<hr>", "<p>c</p>"],
+        )
+        self.assertIsNone(split_rendered_content("<p>a</p>\ntext"))
+        self.assertIsNone(split_rendered_content("<p>a</p><p>b</p>"))
+        self.assertIsNone(split_into_blocks("* one\n\n* two"))
+        self.assertIsNone(split_into_blocks("```\ncode\n\nmore\n```"))
+        self.assertEqual(split_into_blocks("\none\n\n\ntwo\nthree\n"), ["one", "two\nthree"])
+
+    def test_blocks_render_independently(self) -> None:
+        hamlet = self.example_user("hamlet")
+        format_tests, _linkify_tests = self.load_markdown_tests()
+
+        def render(content: str) -> str:
+            msg = Message(sender=hamlet, sending_client=get_client("test"), realm=hamlet.realm)
+            return render_message_markdown(msg, content).rendered_content
+
+        # Whenever a message's rendering has one top-level element per
+        # block, each is what the block renders to on its own.
+        for test in format_tests.values():
+            blocks = split_into_blocks(test["input"])
+            if blocks is None or len(blocks) < 2 or test.get("translate_emoticons", False):
+                continue
+            with self.subTest(content=test["input"]):
+                rendered_blocks = split_rendered_content(render(test["input"]))
+                if rendered_blocks is not None and len(rendered_blocks) == len(blocks):
+                    self.assertEqual(rendered_blocks, [render(block) for block in blocks])
+
+    def test_edit_renders_changed_blocks(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        self.login_user(hamlet)
+        content = (
+            "# Nightly build\n\n"
+            "Status: **running**\n\n"
+            "| Job | Result |\n| --- | --- |\n| lint | *passed* |\n\n"
+            "Details at https://ci.example.com/builds"
+        )
+        msg_id = self.send_stream_message(hamlet, "Denmark", content)
+
+        def edit(new_content: str) -> tuple[Message, dict[str, int]]:
+            before = dict(incremental_rendering_stats)
+            result = self.client_patch(f"/json/messages/{msg_id}", {"content": new_content})
+            self.assert_json_success(result)
+            after = dict(incremental_rendering_stats)
+            message = Message.objects.get(id=msg_id)
+            self.assertEqual(
+                message.rendered_content,
+                render_message_markdown(message, new_content).rendered_content,
+            )
+            return message, {
+                key: after[key] - before.get(key, 0)
+                for key in after
+                if after[key] != before.get(key, 0)
+            }
+
+        # The heading and table are reused; the link is re-rendered,
+        # since it is needed for the message's links.
+        content = content.replace("running", "passed")
+        message, stats = edit(content)
+        self.assertEqual(stats, {"blocks.reused": 2, "blocks.rendered": 2})
+        self.assertTrue(message.has_link)
+
+        # Mentions in edited blocks still notify.
+        content += "\n\n@**Cordelia, Lear's daughter** please take a look"
+        _message, stats = edit(content)
+        self.assertEqual(stats, {"blocks.reused": 3, "blocks.rendered": 2})
+        user_message = UserMessage.objects.get(user_profile=cordelia, message_id=msg_id)
+        self.assertTrue(user_message.flags.mentioned)
+
+        # Lists can join blocks together, so they are rendered in full.
+        _message, stats = edit(content + "\n\n* one\n\n* two")
+        self.assertEqual(stats, {"fallback": 1})
+
+
+class MarkdownRenderServerTest(ZulipTestCase):
+    def test_rendering_admission(self) -> None:
+        admission = RenderingAdmission(max_pending=3, max_pending_per_realm=2)
+        self.assertTrue(admission.try_admit(1))
+        self.assertTrue(admission.try_admit(1))
+        self.assertFalse(admission.try_admit(1))
+        self.assertTrue(admission.try_admit(2))
+        self.assertFalse(admission.try_admit(3))
+
+        admission.release(1)
+        self.assertTrue(admission.try_admit(3))
+        admission.release(1)
+        admission.release(2)
+        admission.release(3)
+        self.assertEqual((admission.pending, admission.pending_by_realm), (0, {}))
+
+    @responses.activate
+    @override_settings(MARKDOWN_SERVER=True)
+    def test_render_message_remotely(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = get_stream("Denmark", hamlet.realm)
+        content = "**Bold** words for @**Othello, the Moor of Venice**, see https://zulip.com"
+
+        def render(
+            content: str, mention_data: MentionData | None = None
+        ) -> tuple[Message, MessageRenderingResult]:
+            msg = Message(
+                sender=hamlet,
+                sending_client=get_client("test"),
+                realm=hamlet.realm,
+                recipient=stream.recipient,
+            )
+            # The test case's transaction would otherwise keep the
+            # message in-process.
+            with mock.patch("zerver.lib.markdown.connection") as mock_connection:
+                mock_connection.in_atomic_block = False
+                return msg, render_message_markdown(msg, content, mention_data=mention_data)
+
+        def render_callback(request: PreparedRequest) -> tuple[int, dict[str, str], bytes]:
+            assert isinstance(request.body, bytes)
+            return (200, {}, orjson.dumps(render_message_request(orjson.loads(request.body))))
+
+        responses.add_callback(responses.POST, "http://localhost:9701/", callback=render_callback)
+        msg, rendering_result = render(content)
+        self.assert_length(responses.calls, 1)
+        self.assertTrue(msg.has_link)
+        self.assertEqual(rendering_result.mentions_user_ids, {othello.id})
+        with override_settings(MARKDOWN_SERVER=False):
+            self.assertEqual(render(content)[1], rendering_result)
+
+        # Plain text is cheap enough to render in-process.
+        render("just words")
+        self.assert_length(responses.calls, 1)
+
+        # Mention data the caller already fetched is used by the
+        # service, rather than looked up again.
+        mention_data = MentionData(MentionBackend(hamlet.realm_id), content, hamlet)
+        self.assertEqual(render(content, mention_data)[1], rendering_result)
+        self.assert_length(responses.calls, 2)
+        request_body = responses.calls[1].request.body
+        assert isinstance(request_body, bytes)
+        self.assertEqual(
+            orjson.loads(request_body)["mention_data"]["users"],
+            [[othello.id, othello.full_name, True]],
+        )
+
+        # Renders refused by admission control can be retried.
+        responses.replace(responses.POST, "http://localhost:9701/", status=429, json={})
+        with self.assertRaises(MarkdownRenderingBusyError), self.assertLogs(level="WARNING") as m:
+            render(content)
+        self.assertEqual(
+            m.output,
+            [f"WARNING:root:Markdown rendering service refused render for realm {hamlet.realm_id}"],
+        )
+
+        # If the service is down, we render in-process.
+        responses.replace(
+            responses.POST,
+            "http://localhost:9701/",
+            body=requests.exceptions.ConnectionError("Connection refused"),
+        )
+        with self.assertLogs(level="WARNING") as m:
+            self.assertEqual(render(content)[1], rendering_result)
+        self.assertEqual(
+            m.output, ["WARNING:root:Markdown rendering service failed: ConnectionError"]
+        )
+
+
 class MarkdownErrorTests(ZulipTestCase):
     def test_markdown_error_handling(self) -> None:
         with self.simulated_markdown_failure(), self.assertRaises(MarkdownRenderingError):
             markdown_convert_wrapper("")
 
     def test_send_message_errors(self) -> None:
-        message = "whatever"
+        # Plain text skips the Markdown processor, so use some syntax.
+        message = "*whatever*"
         with (
             self.simulated_markdown_failure(),
             # We don't use assertRaisesRegex because it seems to not
@@ -3713,7 +4083,7 @@ class MarkdownErrorTests(ZulipTestCase):
             mock.patch("zerver.lib.markdown.markdown_logger"),
             self.assertRaises(MarkdownRenderingError),
         ):
-            markdown_convert_wrapper(msg)
+            markdown_convert_wrapper("*" + msg)
 
     def test_curl_code_block_validation(self) -> None:
         processor = SimulatedFencedBlockPreprocessor(Markdown())
@@ -3,16 +3,22 @@ from unittest import mock
 
 from django.utils.timezone import now as timezone_now
 
+from zerver.actions.user_settings import do_change_avatar_fields, do_change_full_name
 from zerver.lib.cache import cache_delete, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient
 from zerver.lib.markdown import version as markdown_version
 from zerver.lib.message import messages_for_ids
-from zerver.lib.message_cache import MessageDict, sew_messages_and_reactions
+from zerver.lib.message_cache import MessageDict, message_dict_lru, sew_messages_and_reactions
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import make_client
 from zerver.lib.topic import TOPIC_LINKS, TOPIC_NAME
 from zerver.lib.types import DisplayRecipientT, UserDisplayRecipient
+from zerver.lib.user_display_table import (
+    bulk_fetch_user_display_rows,
+    user_display_table_stats,
+    user_display_tables,
+)
 from zerver.models import Message, Reaction, Realm, RealmFilter, Recipient, Stream, UserProfile
 from zerver.models.realms import MessageEditHistoryVisibilityPolicyEnum, get_realm
 from zerver.models.recipients import get_or_create_direct_message_group
@@ -177,7 +183,7 @@ class MessageDictTest(ZulipTestCase):
         num_ids = len(ids)
         self.assertTrue(num_ids >= 600)
 
-        with self.assert_database_query_count(7):
+        with self.assert_database_query_count(6):
             objs = MessageDict.ids_to_dict(ids)
             MessageDict.post_process_dicts(
                 objs,
@@ -482,6 +488,180 @@ class MessageHydrationTest(ZulipTestCase):
             inaccessible_sender_msg["avatar_url"].endswith("images/unknown-user-avatar.png")
         )
 
+    def test_message_dict_lru(self) -> None:
+        hamlet = self.example_user("hamlet")
+        message_id = self.send_stream_message(hamlet, "Denmark", "original")
+
+        def fetch() -> tuple[dict[str, Any], dict[str, int]]:
+            before = dict(message_dict_lru.stats)
+            messages = messages_for_ids(
+                message_ids=[message_id],
+                user_message_flags={message_id: ["read"]},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_empty_topic_name=True,
+                message_edit_history_visibility_policy=MessageEditHistoryVisibilityPolicyEnum.all.value,
+                user_profile=hamlet,
+                realm=hamlet.realm,
+            )
+            after = dict(message_dict_lru.stats)
+            return messages[0], {
+                key: after[key] - before.get(key, 0)
+                for key in after
+                if after[key] != before.get(key, 0)
+            }
+
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1})
+        # Fetching code replaces rendered_content with content; the
+        # cached copy is unaffected.
+        message, stats = fetch()
+        self.assertEqual(stats, {"hit": 1})
+        self.assertEqual(message["content"], "<p>original</p>")
+
+        # Editing the message invalidates the cached copy in every
+        # process.
+        self.login_user(hamlet)
+        result = self.client_patch(f"/json/messages/{message_id}", {"content": "edited"})
+        self.assert_json_success(result)
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1})
+        self.assertEqual(message["content"], "<p>edited</p>")
+        message, stats = fetch()
+        self.assertEqual(stats, {"hit": 1})
+        self.assertEqual(message["edit_history"][0]["prev_content"], "original")
+
+        # So does a reaction, which updates the to_dict cache in place.
+        self.api_post(hamlet, f"/api/v1/messages/{message_id}/reactions", {"emoji_name": "smile"})
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1})
+        self.assert_length(message["reactions"], 1)
+
+        other_message_id = self.send_stream_message(hamlet, "Denmark", "other")
+        with mock.patch.object(message_dict_lru, "max_size", 1):
+            messages_for_ids(
+                message_ids=[other_message_id],
+                user_message_flags={other_message_id: ["read"]},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_empty_topic_name=True,
+                message_edit_history_visibility_policy=MessageEditHistoryVisibilityPolicyEnum.none.value,
+                user_profile=hamlet,
+                realm=hamlet.realm,
+            )
+        message, stats = fetch()
+        self.assertEqual(stats["miss"], 1)
+
+    def test_message_dict_variants(self) -> None:
+        hamlet = self.example_user("hamlet")
+        message_id = self.send_stream_message(hamlet, "Denmark", "original", topic_name="")
+        self.login_user(hamlet)
+        result = self.client_patch(f"/json/messages/{message_id}", {"content": "edited"})
+        self.assert_json_success(result)
+
+        def fetch(policy: int, allow_empty_topic_name: bool) -> dict[str, Any]:
+            (message,) = messages_for_ids(
+                message_ids=[message_id],
+                user_message_flags={message_id: ["read"]},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_empty_topic_name=allow_empty_topic_name,
+                message_edit_history_visibility_policy=policy,
+                user_profile=hamlet,
+                realm=hamlet.realm,
+            )
+            return message
+
+        all_policy = MessageEditHistoryVisibilityPolicyEnum.all.value
+        moves_only_policy = MessageEditHistoryVisibilityPolicyEnum.moves.value
+        none_policy = MessageEditHistoryVisibilityPolicyEnum.none.value
+
+        message = fetch(all_policy, True)
+        self.assertEqual(message["edit_history"][0]["prev_content"], "original")
+        self.assertNotIn("prev_rendered_content_version", message["edit_history"][0])
+        self.assertIn("last_edit_timestamp", message)
+        # Each variant is built from the cached dict, not from another
+        # request's variant.
+        self.assertEqual(fetch(moves_only_policy, True)["edit_history"], [])
+        self.assertNotIn("edit_history", fetch(none_policy, True))
+        self.assertEqual(fetch(all_policy, True)["edit_history"], message["edit_history"])
+
+        # Per-request fields are set on a copy of the shared variant.
+        message["flags"].append("starred")
+        message = fetch(all_policy, False)
+        self.assertEqual(message["subject"], Message.EMPTY_TOPIC_FALLBACK_NAME)
+        self.assertEqual(message["flags"], ["read"])
+        self.assertEqual(fetch(all_policy, True)["subject"], "")
+
+    def test_user_display_table(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        message_id = self.send_personal_message(othello, hamlet, "hello")
+
+        def fetch() -> tuple[dict[str, Any], dict[str, int]]:
+            before = dict(user_display_table_stats)
+            (message,) = messages_for_ids(
+                message_ids=[message_id],
+                user_message_flags={message_id: ["read"]},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=False,
+                allow_empty_topic_name=True,
+                message_edit_history_visibility_policy=MessageEditHistoryVisibilityPolicyEnum.all.value,
+                user_profile=hamlet,
+                realm=hamlet.realm,
+            )
+            after = dict(user_display_table_stats)
+            return message, {
+                key: after[key] - before.get(key, 0)
+                for key in after
+                if after[key] != before.get(key, 0)
+            }
+
+        # The sender and the recipients are both hydrated from the
+        # realm's table, which is built once.
+        user_display_tables.clear()
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1, "hit": 1})
+        self.assertEqual(message["sender_full_name"], othello.full_name)
+        self.assertEqual(
+            [recipient["id"] for recipient in message["display_recipient"]],
+            [hamlet.id, othello.id],
+        )
+
+        # Another process finds the table in the cache.
+        user_display_tables.clear()
+        message, stats = fetch()
+        self.assertEqual(stats, {"remote_hit": 1, "hit": 1})
+
+        # Changing a user's name invalidates the table everywhere.
+        do_change_full_name(othello, "Othello, the Moor", acting_user=None, notify=False)
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1, "hit": 1})
+        self.assertEqual(message["sender_full_name"], "Othello, the Moor")
+        self.assertEqual(message["display_recipient"][1]["full_name"], "Othello, the Moor")
+
+        do_change_avatar_fields(othello, UserProfile.AVATAR_FROM_GRAVATAR, acting_user=None)
+        message, stats = fetch()
+        self.assertEqual(stats, {"miss": 1, "hit": 1})
+        self.assertIn(f"version={othello.avatar_version}", message["avatar_url"])
+
+        # Users outside the realms being hydrated, like cross-realm
+        # bots, are fetched from the database.
+        notification_bot = self.notification_bot(hamlet.realm)
+        self.assertNotEqual(notification_bot.realm_id, hamlet.realm_id)
+        rows = bulk_fetch_user_display_rows({notification_bot.id, hamlet.id}, {hamlet.realm_id})
+        self.assertEqual(rows[notification_bot.id].full_name, notification_bot.full_name)
+        self.assertEqual(rows[hamlet.id].realm_string_id, "zulip")
+
+        with mock.patch("zerver.lib.user_display_table.USER_DISPLAY_TABLE_MAX_USERS", 1):
+            user_display_tables.clear()
+            message, stats = fetch()
+            self.assertEqual(message["sender_full_name"], "Othello, the Moor")
+
     def test_display_recipient_up_to_date(self) -> None:
         """
         This is a test for a bug where due to caching of message_dicts,
@@ -1,10 +1,14 @@
+import tempfile
 from collections.abc import Sequence
+from contextlib import redirect_stdout
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from io import StringIO
 from typing import TYPE_CHECKING, Any
 from unittest import mock
 
 import orjson
+from django.core.management import call_command
 from django.db import connection
 from django.test import override_settings
 from django.utils.timezone import now as timezone_now
@@ -17,6 +21,7 @@ from analytics.models import RealmCount
 from zerver.actions.message_edit import build_message_edit_request, do_update_message
 from zerver.actions.reactions import check_add_reaction
 from zerver.actions.realm_settings import do_set_realm_property
+from zerver.actions.submessage import do_add_submessage
 from zerver.actions.uploads import do_claim_attachments
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.users import do_deactivate_user
@@ -40,10 +45,12 @@ from zerver.lib.narrow import (
     exclude_muting_conditions,
     find_first_unread_anchor,
     get_base_query_for_search,
+    get_search_result_cache_stats,
     is_spectator_compatible,
     ok_to_include_history,
     post_process_limited_query,
 )
+from zerver.lib.narrow_explain import get_slow_narrow_shapes
 from zerver.lib.narrow_helpers import NeverNegatedNarrowTerm
 from zerver.lib.narrow_predicate import build_narrow_predicate
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
@@ -317,7 +324,8 @@ class NarrowBuilderTest(ZulipTestCase):
     def test_add_term_using_topic_operator_and_lunch_operand(self) -> None:
         term = NarrowParameter(operator="topic", operand="lunch")
         self._do_add_term_test(
-            term, "WHERE upper(subject) = upper(%(param_1)s) AND is_channel_message"
+            term,
+            "WHERE topic_id IN (SELECT zerver_topic.id \nFROM zerver_topic \nWHERE zerver_topic.realm_id = %(param_1)s AND upper(zerver_topic.name) = upper(%(param_2)s))",
         )
 
     def test_add_term_using_topic_operator_lunch_operand_and_negated(self) -> None:  # NEGATED
@@ -329,7 +337,8 @@ class NarrowBuilderTest(ZulipTestCase):
     def test_add_term_using_topic_operator_and_personal_operand(self) -> None:
         term = NarrowParameter(operator="topic", operand="personal")
         self._do_add_term_test(
-            term, "WHERE upper(subject) = upper(%(param_1)s) AND is_channel_message"
+            term,
+            "WHERE topic_id IN (SELECT zerver_topic.id \nFROM zerver_topic \nWHERE zerver_topic.realm_id = %(param_1)s AND upper(zerver_topic.name) = upper(%(param_2)s))",
         )
 
     def test_add_term_using_topic_operator_personal_operand_and_negated(self) -> None:  # NEGATED
@@ -3382,6 +3391,88 @@ class GetOldMessagesTest(ZulipTestCase):
         narrow = [dict(operator="search", operand="Hogwart's")]
         self.message_visibility_test(narrow, message_ids, 2)
 
+    @override_settings(USING_PGROONGA=False)
+    def test_search_result_cache(self) -> None:
+        self.login("cordelia")
+        cordelia = self.example_user("cordelia")
+        message_ids = [
+            self.send_stream_message(cordelia, "Verona", content="a tarantula in the bath"),
+            self.send_stream_message(cordelia, "Verona", content="another tarantula"),
+        ]
+        self._update_tsvector_index()
+
+        def search(operand: str) -> list[int]:
+            result = self.get_and_check_messages(
+                dict(
+                    narrow=orjson.dumps([dict(operator="search", operand=operand)]).decode(),
+                    anchor="newest",
+                    num_before=10,
+                    num_after=0,
+                )
+            )
+            return [message["id"] for message in result["messages"]]
+
+        def get_cache_stats() -> tuple[int, int]:
+            stats = get_search_result_cache_stats()
+            return stats.get("hit", 0), stats.get("miss", 0)
+
+        hits, misses = get_cache_stats()
+        self.assertEqual(search("tarantula"), message_ids)
+        self.assertEqual(get_cache_stats(), (hits, misses + 1))
+
+        # Searches differing only in case and spacing share results.
+        self.assertEqual(search("  Tarantula "), message_ids)
+        self.assertEqual(get_cache_stats(), (hits + 1, misses + 1))
+
+        # New messages are found in cached results.
+        third_id = self.send_stream_message(cordelia, "Verona", content="one more tarantula")
+        self._update_tsvector_index()
+        self.assertEqual(search("tarantula"), [*message_ids, third_id])
+        self.assertEqual(get_cache_stats(), (hits + 2, misses + 1))
+
+        # Cached results are checked against the search's conditions,
+        # and searched again if a message no longer matches.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE zerver_message SET search_tsvector = NULL WHERE id = %s",
+                [message_ids[0]],
+            )
+        self.assertEqual(search("tarantula"), [message_ids[1], third_id])
+        self.assertEqual(get_cache_stats(), (hits + 2, misses + 2))
+
+        # Edits invalidate cached results.
+        result = self.client_patch(f"/json/messages/{message_ids[1]}", {"content": "a spider"})
+        self.assert_json_success(result)
+        self._update_tsvector_index()
+        self.assertEqual(search("tarantula"), [message_ids[0], third_id])
+        self.assertEqual(get_cache_stats(), (hits + 2, misses + 3))
+
+    @override_settings(NARROW_EXPLAIN_SAMPLE_RATE=1.0, NARROW_EXPLAIN_MIN_DURATION_MS=0)
+    def test_narrow_explain_sampling(self) -> None:
+        self.login("hamlet")
+        narrow = [
+            dict(operator="channel", operand="Verona"),
+            dict(operator="topic", operand="test"),
+            dict(operator="is", operand="starred", negated=True),
+        ]
+        with self.assertLogs("zulip.narrow_explain", level="INFO") as logs:
+            for _ in range(2):
+                self.get_and_check_messages(
+                    dict(narrow=orjson.dumps(narrow).decode(), anchor="newest", num_before=10)
+                )
+
+        [slow_narrow] = get_slow_narrow_shapes(logs.output)
+        self.assertEqual(slow_narrow.shape, "-is:starred channel topic")
+        self.assertEqual(slow_narrow.samples, 2)
+        self.assertIn("Node Type", slow_narrow.plan[0]["Plan"])
+
+        with tempfile.NamedTemporaryFile("w") as log_file:
+            log_file.write("\n".join(logs.output))
+            log_file.flush()
+            with redirect_stdout(StringIO()) as stdout:
+                call_command("report_slow_narrows", f"--log-file={log_file.name}")
+        self.assertTrue(stdout.getvalue().startswith("-is:starred channel topic: 2 samples"))
+
     @override_settings(USING_PGROONGA=False)
     def test_get_messages_with_search_not_subscribed(self) -> None:
         """Verify support for searching a channel you're not subscribed to"""
@@ -4333,14 +4424,15 @@ class GetOldMessagesTest(ZulipTestCase):
             return anchor, queries
 
         anchor, queries = test_find_first_unread_anchor([], need_user_message=False)
-        self.assert_length(queries, 4)
+        self.assert_length(queries, 5)
         self.assertEqual(anchor, first_message_id)
 
         # If need_user_message is set to True, we don't need to call
         # get_base_query_for_search inside find_first_unread_anchor.
-        # This saves us an extra call that get_base_query_for_search
-        # makes to get_recursive_membership_groups in case of
-        # need_user_message being True.
+        # This saves us the extra calls that get_base_query_for_search
+        # makes to get_recursive_membership_groups and, via
+        # get_user_message_table_sa, to check for sparse
+        # subscriptions in case of need_user_message being True.
         anchor, queries = test_find_first_unread_anchor([], need_user_message=True)
         self.assert_length(queries, 3)
         self.assertEqual(anchor, first_message_id)
@@ -5271,7 +5363,9 @@ WHERE user_profile_id = {hamlet_id} AND (zerver_recipient.type != 2 OR (EXISTS (
 FROM zerver_stream \n\
 WHERE zerver_stream.recipient_id = zerver_recipient.id AND (NOT zerver_stream.invite_only OR zerver_stream.can_subscribe_group_id IN {hamlet_groups} OR zerver_stream.can_add_subscribers_group_id IN {hamlet_groups}))) OR (EXISTS (SELECT  \n\
 FROM zerver_subscription \n\
-WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.recipient_id = zerver_recipient.id AND zerver_subscription.active))) AND upper(subject) = upper('blah') AND is_channel_message ORDER BY message_id ASC \n\
+WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.recipient_id = zerver_recipient.id AND zerver_subscription.active))) AND topic_id IN (SELECT zerver_topic.id \n\
+FROM zerver_topic \n\
+WHERE zerver_topic.realm_id = 2 AND upper(zerver_topic.name) = upper('blah')) ORDER BY message_id ASC \n\
  LIMIT 10) AS anon_1 ORDER BY message_id ASC\
 """
         sql = sql_template.format(**query_ids)
@@ -5283,7 +5377,9 @@ WHERE zerver_subscription.user_profile_id = {hamlet_id} AND zerver_subscription.
 SELECT anon_1.message_id \n\
 FROM (SELECT id AS message_id \n\
 FROM zerver_message \n\
-WHERE realm_id = 2 AND recipient_id = {scotland_recipient} AND upper(subject) = upper('blah') AND is_channel_message ORDER BY zerver_message.id ASC \n\
+WHERE realm_id = 2 AND recipient_id = {scotland_recipient} AND topic_id IN (SELECT zerver_topic.id \n\
+FROM zerver_topic \n\
+WHERE zerver_topic.realm_id = 2 AND upper(zerver_topic.name) = upper('blah')) ORDER BY zerver_message.id ASC \n\
  LIMIT 10) AS anon_1 ORDER BY message_id ASC\
 """
         sql = sql_template.format(**query_ids)
@@ -5927,3 +6023,92 @@ class PersonalMessagesTest(ZulipTestCase):
             conversation_link=True,
         )
         self.assertEqual(url, "http://zulip.testserver/#narrow/dm/77,80/with/555")
+
+
+class ChannelHistoryTest(ZulipTestCase):
+    def get_channel_history(self, user: UserProfile, **params: Any) -> list[dict[str, Any]]:
+        result = self.api_get(
+            user,
+            "/api/v1/messages/channel_history",
+            {key: orjson.dumps(value).decode() for key, value in params.items()},
+        )
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result["Content-Type"], "application/x-ndjson")
+        return [orjson.loads(line) for line in result.getvalue().splitlines()]
+
+    def test_channel_history(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        stream = self.make_stream("Elsinore")
+        for user in [hamlet, cordelia, othello]:
+            self.subscribe(user, "Elsinore")
+
+        first_id = self.send_stream_message(cordelia, "Elsinore", "**Who is there?**", "ghost")
+        second_id = self.send_stream_message(cordelia, "Elsinore", "Nay, answer me", "watch")
+        third_id = self.send_stream_message(cordelia, "Elsinore", "Long live the king", "ghost")
+        whisper_id = self.send_stream_message(cordelia, "Elsinore", "Psst", "ghost")
+        Message.objects.filter(id=whisper_id).update(
+            whisper_recipients={"user_ids": [othello.id], "group_ids": []}
+        )
+        do_add_submessage(hamlet.realm, cordelia.id, first_id, "widget", '{"type": "vote"}')
+        do_add_submessage(
+            hamlet.realm,
+            cordelia.id,
+            first_id,
+            "widget",
+            '{"type": "secret"}',
+            visible_user_ids=[othello.id],
+        )
+
+        messages = self.get_channel_history(hamlet, channel_id=stream.id)
+        self.assertEqual([message["id"] for message in messages], [first_id, second_id, third_id])
+        self.assertEqual(messages[0]["content"], "<p><strong>Who is there?</strong></p>")
+        self.assertEqual(messages[0]["content_type"], "text/html")
+        self.assertEqual(messages[0][TOPIC_NAME], "ghost")
+        self.assertEqual(messages[0]["sender_id"], cordelia.id)
+        self.assertEqual(
+            [submessage["content"] for submessage in messages[0]["submessages"]],
+            ['{"type": "vote"}'],
+        )
+
+        messages = self.get_channel_history(othello, channel_id=stream.id)
+        self.assertEqual(
+            [message["id"] for message in messages], [first_id, second_id, third_id, whisper_id]
+        )
+        self.assert_length(messages[0]["submessages"], 2)
+
+        messages = self.get_channel_history(
+            hamlet, channel_id=stream.id, topic="GHOST", apply_markdown=False
+        )
+        self.assertEqual([message["id"] for message in messages], [first_id, third_id])
+        self.assertEqual(messages[0]["content"], "**Who is there?**")
+        self.assertEqual(messages[0]["content_type"], "text/x-markdown")
+
+        # Each batch resumes after the last message of the previous one.
+        with mock.patch("zerver.lib.channel_history.CHANNEL_HISTORY_BATCH_SIZE", 1):
+            messages = self.get_channel_history(hamlet, channel_id=stream.id, after_id=first_id)
+        self.assertEqual([message["id"] for message in messages], [second_id, third_id])
+
+        messages = self.get_channel_history(hamlet, channel_id=stream.id, limit=2)
+        self.assertEqual([message["id"] for message in messages], [first_id, second_id])
+
+    def test_channel_history_protected_history(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        stream = self.make_stream("Elsinore", invite_only=True, history_public_to_subscribers=False)
+        self.subscribe(cordelia, "Elsinore")
+        self.send_stream_message(cordelia, "Elsinore", "Before Hamlet")
+        self.subscribe(hamlet, "Elsinore")
+        message_id = self.send_stream_message(cordelia, "Elsinore", "After Hamlet")
+
+        messages = self.get_channel_history(hamlet, channel_id=stream.id)
+        self.assertEqual([message["id"] for message in messages], [message_id])
+
+        self.unsubscribe(hamlet, "Elsinore")
+        result = self.api_get(
+            hamlet,
+            "/api/v1/messages/channel_history",
+            {"channel_id": orjson.dumps(stream.id).decode()},
+        )
+        self.assert_json_error(result, "Invalid channel ID")
@@ -7,7 +7,11 @@ from django.test import override_settings
 from typing_extensions import override
 
 from zerver.actions.message_flags import do_update_message_flags
-from zerver.actions.streams import do_change_stream_group_based_setting, do_change_stream_permission
+from zerver.actions.streams import (
+    do_change_stream_group_based_setting,
+    do_change_stream_permission,
+    do_change_stream_sparse_user_messages,
+)
 from zerver.actions.user_groups import check_add_user_group
 from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
@@ -2911,3 +2915,231 @@ class MarkUnreadTest(ZulipTestCase):
                 message_id=message_id,
             )
             self.assertTrue(um.flags.read)
+
+
+class SparseUserMessagesTest(ZulipTestCase):
+    def get_unread_message_ids(self, user_profile: UserProfile, stream: Stream) -> set[int]:
+        stream_dict = get_raw_unread_data(user_profile)["stream_dict"]
+        return {
+            message_id
+            for message_id, details in stream_dict.items()
+            if details["stream_id"] == stream.id
+        }
+
+    def get_channel_message_flags(self, stream_name: str) -> dict[int, list[str]]:
+        result = self.client_get(
+            "/json/messages",
+            {
+                "anchor": "newest",
+                "num_before": 100,
+                "num_after": 0,
+                "narrow": orjson.dumps([dict(operator="channel", operand=stream_name)]).decode(),
+            },
+        )
+        return {
+            message["id"]: message["flags"]
+            for message in self.assert_json_success(result)["messages"]
+        }
+
+    def test_sparse_user_messages(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        stream = self.make_stream("announcements")
+        for user in [hamlet, cordelia, othello]:
+            self.subscribe(user, stream.name)
+        do_change_stream_sparse_user_messages(stream, True)
+
+        # Only users with non-default flags get UserMessage rows.
+        first_message_id = self.send_stream_message(othello, stream.name, "hello")
+        mention_message_id = self.send_stream_message(
+            othello, stream.name, "@**Cordelia, Lear's daughter**"
+        )
+        self.assertEqual(
+            set(
+                UserMessage.objects.filter(message_id=first_message_id).values_list(
+                    "user_profile_id", flat=True
+                )
+            ),
+            {othello.id},
+        )
+        self.assertEqual(
+            set(
+                UserMessage.objects.filter(message_id=mention_message_id).values_list(
+                    "user_profile_id", flat=True
+                )
+            ),
+            {othello.id, cordelia.id},
+        )
+
+        # Messages without rows are nonetheless unread.
+        self.assertEqual(
+            self.get_unread_message_ids(hamlet, stream), {first_message_id, mention_message_id}
+        )
+        self.assertEqual(
+            self.get_unread_message_ids(cordelia, stream),
+            {first_message_id, mention_message_id},
+        )
+        self.assertEqual(get_raw_unread_data(cordelia)["mentions"], {mention_message_id})
+        self.assertEqual(self.get_unread_message_ids(othello, stream), set())
+
+        # A new subscriber does not see earlier messages as unread.
+        iago = self.example_user("iago")
+        self.subscribe(iago, stream.name)
+        self.assertEqual(self.get_unread_message_ids(iago, stream), set())
+
+        # Reading a later message advances the read watermark, giving
+        # the skipped message an explicit unread row.
+        self.login_user(hamlet)
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps([mention_message_id]).decode(), "op": "add", "flag": "read"},
+        )
+        self.assertEqual(self.assert_json_success(result)["messages"], [mention_message_id])
+        self.assertEqual(
+            get_subscription(stream.name, hamlet).sparse_read_message_id, mention_message_id
+        )
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=hamlet, message_id=first_message_id).flags_list(),
+            [],
+        )
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), {first_message_id})
+
+        latest_message_id = self.send_stream_message(othello, stream.name, "later")
+        flags = self.get_channel_message_flags(stream.name)
+        self.assertEqual(flags[first_message_id], [])
+        self.assertEqual(flags[mention_message_id], ["read", "historical"])
+        self.assertEqual(flags[latest_message_id], [])
+
+        # Marking the channel as read covers messages with and without rows.
+        with self.capture_send_event_calls(expected_num_events=1) as events:
+            result = self.client_post("/json/mark_stream_as_read", {"stream_id": stream.id})
+        self.assert_json_success(result)
+        self.assertEqual(set(events[0]["event"]["messages"]), {first_message_id, latest_message_id})
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), set())
+
+        # Disabling the mode creates rows for messages still unread.
+        unread_message_id = self.send_stream_message(othello, stream.name, "unread")
+        do_change_stream_sparse_user_messages(stream, False)
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=hamlet, message_id=unread_message_id).flags_list(),
+            [],
+        )
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=hamlet, message_id=latest_message_id).exists()
+        )
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), {unread_message_id})
+
+    def test_mark_all_as_read(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = self.make_stream("announcements")
+        for user in [hamlet, othello]:
+            self.subscribe(user, stream.name)
+        do_change_stream_sparse_user_messages(stream, True)
+        self.send_stream_message(othello, stream.name, "hello")
+        self.assert_length(self.get_unread_message_ids(hamlet, stream), 1)
+
+        self.login_user(hamlet)
+        self.assert_json_success(self.client_post("/json/mark_all_as_read"))
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), set())
+        self.assertFalse(
+            UserMessage.objects.filter(
+                user_profile=hamlet, flags__andz=UserMessage.flags.read.mask
+            ).exists()
+        )
+
+    def test_whispers(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        stream = self.make_stream("announcements")
+        for user in [hamlet, cordelia, othello]:
+            self.subscribe(user, stream.name)
+        do_change_stream_sparse_user_messages(stream, True)
+
+        self.login_user(othello)
+        result = self.client_post(
+            "/json/messages",
+            {
+                "type": "stream",
+                "to": orjson.dumps(stream.name).decode(),
+                "content": "psst",
+                "topic": "secrets",
+                "whisper_to_user_ids": orjson.dumps([cordelia.id]).decode(),
+            },
+        )
+        message_id = self.assert_json_success(result)["id"]
+
+        # Whispers are never sparse; users who can see them get rows,
+        # and they are not unread for anyone else.
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=cordelia, message_id=message_id).flags_list(),
+            [],
+        )
+        self.assertEqual(self.get_unread_message_ids(cordelia, stream), {message_id})
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), set())
+
+        # Nor does disabling the mode give anyone else a row.
+        do_change_stream_sparse_user_messages(stream, False)
+        self.assertFalse(
+            UserMessage.objects.filter(user_profile=hamlet, message_id=message_id).exists()
+        )
+
+    def test_star_sparse_unread_message(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = self.make_stream("announcements")
+        for user in [hamlet, othello]:
+            self.subscribe(user, stream.name)
+        do_change_stream_sparse_user_messages(stream, True)
+        message_id = self.send_stream_message(othello, stream.name, "hello")
+
+        self.login_user(hamlet)
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps([message_id]).decode(), "op": "add", "flag": "starred"},
+        )
+        self.assertEqual(self.assert_json_success(result)["messages"], [message_id])
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=hamlet, message_id=message_id).flags_list(),
+            ["starred"],
+        )
+        self.assertEqual(self.get_unread_message_ids(hamlet, stream), {message_id})
+
+        # Marking it as unread again is a no-op.
+        result = self.client_post(
+            "/json/messages/flags",
+            {"messages": orjson.dumps([message_id]).decode(), "op": "remove", "flag": "read"},
+        )
+        self.assertEqual(self.assert_json_success(result)["messages"], [])
+
+    def test_unread_narrow(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = self.make_stream("announcements")
+        for user in [hamlet, othello]:
+            self.subscribe(user, stream.name)
+        do_change_stream_sparse_user_messages(stream, True)
+        message_id = self.send_stream_message(othello, stream.name, "hello")
+
+        self.login_user(hamlet)
+        narrow = [
+            dict(operator="channel", operand=stream.name),
+            dict(operator="is", operand="unread"),
+        ]
+        result = self.client_get(
+            "/json/messages",
+            {
+                "anchor": "first_unread",
+                "num_before": 0,
+                "num_after": 10,
+                "narrow": orjson.dumps(narrow).decode(),
+            },
+        )
+        result_dict = self.assert_json_success(result)
+        self.assertEqual(result_dict["anchor"], message_id)
+        self.assertEqual(
+            [(message["id"], message["flags"]) for message in result_dict["messages"]],
+            [(message_id, [])],
+        )
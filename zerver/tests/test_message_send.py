@@ -1,5 +1,6 @@
 from datetime import timedelta
 from email.headerregistry import Address
+from functools import partial
 from typing import Any
 from unittest import mock
 
@@ -13,6 +14,7 @@ from zerver.actions.create_realm import do_create_realm
 from zerver.actions.create_user import do_create_user
 from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.message_send import (
+    PARALLEL_PREP_MIN_BATCH_SIZE,
     build_message_send_dict,
     check_message,
     check_send_stream_message,
@@ -25,6 +27,7 @@ from zerver.actions.message_send import (
     internal_send_private_message,
     internal_send_stream_message,
     internal_send_stream_message_by_name,
+    prep_messages_in_parallel,
     send_rate_limited_pm_notification_to_bot_owner,
 )
 from zerver.actions.realm_settings import (
@@ -51,6 +54,7 @@ from zerver.lib.exceptions import (
 from zerver.lib.message import get_raw_unread_data, get_recent_private_conversations
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.per_request_cache import flush_per_request_caches
+from zerver.lib.rate_limiter import RateLimitedUser
 from zerver.lib.stream_subscription import create_stream_subscription
 from zerver.lib.streams import create_stream_if_needed
 from zerver.lib.test_classes import ZulipTestCase
@@ -60,10 +64,12 @@ from zerver.lib.test_helpers import (
     message_stream_count,
     most_recent_message,
     most_recent_usermessage,
+    ratelimit_rule,
     reset_email_visibility_to_everyone_in_zulip_realm,
 )
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.types import UserGroupMembersData
+from zerver.lib.user_message import UserMessageLite, copy_insert_ums
 from zerver.models import (
     Message,
     NamedUserGroup,
@@ -1693,6 +1699,45 @@ class StreamMessagesTest(ZulipTestCase):
         self.assertEqual(old_non_subscriber_messages, new_non_subscriber_messages)
         self.assertEqual(new_subscriber_messages, [elt + 1 for elt in old_subscriber_messages])
 
+    def test_copy_insert_user_messages(self) -> None:
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        subscribers = self.users_subscribed_to_stream("Denmark", realm)
+        self.assertIn(cordelia, subscribers)
+
+        # Force even this small fan-out through the COPY path.
+        with mock.patch("zerver.lib.user_message.BULK_INSERT_UMS_COPY_THRESHOLD", 1):
+            message_id = self.send_stream_message(
+                hamlet, "Denmark", content="Hello @**Cordelia, Lear's daughter**"
+            )
+
+        user_messages = UserMessage.objects.filter(message_id=message_id)
+        self.assertEqual(
+            {um.user_profile_id for um in user_messages},
+            {user.id for user in subscribers},
+        )
+        self.assertEqual(user_messages.get(user_profile=cordelia).flags_list(), ["mentioned"])
+        self.assertEqual(user_messages.get(user_profile=hamlet).flags_list(), ["read"])
+
+        # Conflicting rows are skipped, as with the INSERT path, and
+        # the staging table can be reused within the transaction.
+        othello = self.example_user("othello")
+        other_message_id = self.send_personal_message(hamlet, othello)
+        copy_insert_ums(
+            [
+                UserMessageLite(user_profile_id=cordelia.id, message_id=message_id, flags=0),
+                UserMessageLite(user_profile_id=cordelia.id, message_id=other_message_id, flags=0),
+            ]
+        )
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=cordelia, message_id=message_id).flags_list(),
+            ["mentioned"],
+        )
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=cordelia, message_id=other_message_id).exists()
+        )
+
     def test_performance(self) -> None:
         """
         This test is part of the automated test suite, but
@@ -3055,6 +3100,145 @@ class PersonalMessageSendTest(ZulipTestCase):
         )
 
 
+class BulkSendMessagesTest(ZulipTestCase):
+    def send_bulk(self, user: UserProfile, messages: list[str]) -> list[dict[str, Any]]:
+        result = self.api_post(
+            user,
+            "/api/v1/messages/bulk",
+            "\n".join(messages),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result["Content-Type"], "application/x-ndjson")
+        return [orjson.loads(line) for line in result.getvalue().splitlines()]
+
+    def test_send_messages_bulk(self) -> None:
+        bot = self.example_user("default_bot")
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        stream = get_stream("Denmark", bot.realm)
+        self.subscribe(bot, "Denmark")
+
+        lines = [
+            orjson.dumps(
+                {
+                    "type": "channel",
+                    "to": "Denmark",
+                    "topic": "scene",
+                    "content": "The curtain rises.",
+                }
+            ).decode(),
+            "",
+            orjson.dumps(
+                {"type": "stream", "to": stream.id, "topic": "scene", "content": "A dice roll: 6"}
+            ).decode(),
+            orjson.dumps(
+                {"type": "channel", "to": "nonexistent", "topic": "scene", "content": "Lost"}
+            ).decode(),
+            orjson.dumps(
+                {"type": "direct", "to": [hamlet.id, othello.id], "content": "Psst"}
+            ).decode(),
+        ]
+        results = self.send_bulk(bot, lines)
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+        self.assertEqual(
+            [result["result"] for result in results], ["success", "success", "error", "success"]
+        )
+        self.assertEqual(results[2]["msg"], "Channel 'nonexistent' does not exist")
+        self.assertEqual(results[2]["code"], "STREAM_DOES_NOT_EXIST")
+
+        sent_messages = {
+            message.id: message
+            for message in Message.objects.filter(
+                id__in=[result["id"] for result in results if "id" in result]
+            )
+        }
+        self.assertEqual(sent_messages[results[0]["id"]].content, "The curtain rises.")
+        self.assertEqual(sent_messages[results[1]["id"]].topic_name(), "scene")
+        self.assertEqual(sent_messages[results[3]["id"]].content, "Psst")
+        self.assertTrue(
+            UserMessage.objects.filter(user_profile=othello, message_id=results[3]["id"]).exists()
+        )
+
+    def test_send_messages_bulk_sent_before_response(self) -> None:
+        bot = self.example_user("default_bot")
+        message_count = Message.objects.count()
+
+        result = self.api_post(
+            bot,
+            "/api/v1/messages/bulk",
+            orjson.dumps(
+                {"type": "channel", "to": "Verona", "topic": "scene", "content": "Eager"}
+            ).decode(),
+            content_type="application/x-ndjson",
+        )
+        # The message is sent before any of the response is read, so
+        # a client disconnecting early cannot drop it.
+        self.assertEqual(Message.objects.count(), message_count + 1)
+        self.assert_length(result.getvalue().splitlines(), 1)
+
+    def test_send_messages_bulk_invalid_batch(self) -> None:
+        bot = self.example_user("default_bot")
+        message_count = Message.objects.count()
+
+        lines = [
+            orjson.dumps(
+                {"type": "channel", "to": "Verona", "topic": "scene", "content": "Valid"}
+            ).decode(),
+            orjson.dumps({"type": "channel", "to": "Verona", "topic": "scene"}).decode(),
+        ]
+        result = self.api_post(
+            bot, "/api/v1/messages/bulk", "\n".join(lines), content_type="application/x-ndjson"
+        )
+        self.assert_json_error(result, "Invalid message on line 2: content: Field required")
+
+        result = self.api_post(
+            bot, "/api/v1/messages/bulk", "not json", content_type="application/x-ndjson"
+        )
+        self.assert_json_error_contains(result, "Invalid message on line 1: Invalid JSON")
+
+        result = self.api_post(
+            bot, "/api/v1/messages/bulk", "", content_type="application/x-ndjson"
+        )
+        self.assert_json_error(result, "No messages to send")
+
+        with mock.patch("zerver.views.message_send.BULK_SEND_MAX_MESSAGES", 1):
+            result = self.api_post(
+                bot,
+                "/api/v1/messages/bulk",
+                "\n".join([lines[0]] * 2),
+                content_type="application/x-ndjson",
+            )
+        self.assert_json_error(result, "Too many messages; at most 1 can be sent at once.")
+
+        self.assertEqual(Message.objects.count(), message_count)
+
+    def test_send_messages_bulk_rate_limited(self) -> None:
+        bot = self.example_user("default_bot")
+        line = orjson.dumps(
+            {"type": "channel", "to": "Verona", "topic": "scene", "content": "Again"}
+        ).decode()
+        RateLimitedUser(bot).clear_history()
+
+        # Each message counts as an API call, so a batch of 4 does
+        # not fit under a limit of 3 requests, and nothing is sent.
+        message_count = Message.objects.count()
+        with ratelimit_rule(86400, 3):
+            result = self.api_post(
+                bot,
+                "/api/v1/messages/bulk",
+                "\n".join([line] * 4),
+                content_type="application/x-ndjson",
+            )
+        self.assertEqual(result.status_code, 429)
+        self.assertEqual(Message.objects.count(), message_count)
+
+        RateLimitedUser(bot).clear_history()
+        with ratelimit_rule(86400, 3):
+            results = self.send_bulk(bot, [line] * 3)
+        self.assertEqual([result["result"] for result in results], ["success"] * 3)
+
+
 class ExtractTest(ZulipTestCase):
     def test_extract_stream_indicator(self) -> None:
         self.assertEqual(
@@ -3235,6 +3419,46 @@ class InternalPrepTest(ZulipTestCase):
             ),
         )
 
+    def test_prep_messages_in_parallel(self) -> None:
+        realm = get_realm("zulip")
+        cordelia = self.example_user("cordelia")
+        contents = [f"batch message {i}" for i in range(PARALLEL_PREP_MIN_BATCH_SIZE)]
+        contents[3] = ""
+
+        # Tests run inside a transaction, so this takes the serial
+        # path; the results should be the same either way.
+        with self.assertLogs(level="ERROR"):
+            send_requests = prep_messages_in_parallel(
+                [
+                    partial(
+                        internal_prep_stream_message_by_name,
+                        realm,
+                        cordelia,
+                        "Verona",
+                        "batch",
+                        content,
+                    )
+                    for content in contents
+                ]
+            )
+        self.assertEqual(
+            [
+                send_request.message.content if send_request is not None else ""
+                for send_request in send_requests
+            ],
+            contents,
+        )
+
+        sent_message_ids = [result.message_id for result in do_send_messages(send_requests)]
+        self.assertEqual(
+            list(
+                Message.objects.filter(id__in=sent_message_ids)
+                .order_by("id")
+                .values_list("content", flat=True)
+            ),
+            [content for content in contents if content],
+        )
+
     def test_error_handling(self) -> None:
         sender = self.example_user("cordelia")
         recipient_user = self.example_user("hamlet")
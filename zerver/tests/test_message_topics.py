@@ -8,8 +8,9 @@ from zerver.actions.streams import do_change_stream_permission
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.events import ClientCapabilities, do_events_register
 from zerver.lib.test_classes import ZulipTestCase
+from zerver.lib.topic import get_topic_history_for_public_stream, messages_for_topic
 from zerver.lib.user_topics import set_topic_visibility_policy, topic_has_visibility_policy
-from zerver.models import Message, UserMessage, UserTopic
+from zerver.models import Message, Topic, UserMessage, UserTopic
 from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
 from zerver.models.streams import get_stream
@@ -852,3 +853,118 @@ class EmptyTopicNameTest(ZulipTestCase):
             result = self.client_get(f"/json/users/me/{channel_id}/topics", params)
             data = self.assert_json_success(result)
             self.assertEqual(data["topics"][0]["name"], "")
+
+
+class TopicTableTest(ZulipTestCase):
+    def test_topic_ids(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        stream = self.make_stream("Elsinore")
+        other_stream = self.make_stream("Wittenberg")
+        for user_profile in (hamlet, cordelia):
+            self.subscribe(user_profile, "Elsinore")
+            self.subscribe(user_profile, "Wittenberg")
+
+        first_id = self.send_stream_message(hamlet, "Elsinore", topic_name="ghost")
+        second_id = self.send_stream_message(hamlet, "Elsinore", topic_name="GHOST")
+        other_id = self.send_stream_message(hamlet, "Wittenberg", topic_name="ghost")
+        dm_id = self.send_personal_message(hamlet, cordelia)
+
+        # The different casings of a topic share one topic, named
+        # after its first message; the same name in another channel
+        # is a different topic, and direct messages have none.
+        topic = Topic.objects.get(recipient_id=stream.recipient_id)
+        self.assertEqual(topic.name, "ghost")
+        self.assertEqual(topic.realm_id, stream.realm_id)
+        self.assertEqual(Message.objects.get(id=first_id).topic_id, topic.id)
+        self.assertEqual(Message.objects.get(id=second_id).topic_id, topic.id)
+        self.assertNotEqual(Message.objects.get(id=other_id).topic_id, topic.id)
+        self.assertIsNone(Message.objects.get(id=dm_id).topic_id)
+        self.assertEqual(
+            list(
+                messages_for_topic(stream.realm_id, stream.recipient_id, "Ghost").values_list(
+                    "id", flat=True
+                )
+            ),
+            [first_id, second_id],
+        )
+
+        # Moving a message to a new topic, or channel, creates the
+        # topic it is moved to.
+        self.login("hamlet")
+        result = self.client_patch(
+            f"/json/messages/{second_id}",
+            {
+                "topic": "the ghost",
+                "propagate_mode": "change_one",
+                "send_notification_to_old_thread": "false",
+                "send_notification_to_new_thread": "false",
+            },
+        )
+        self.assert_json_success(result)
+        moved_topic = Topic.objects.get(recipient_id=stream.recipient_id, name="the ghost")
+        self.assertEqual(Message.objects.get(id=second_id).topic_id, moved_topic.id)
+
+        result = self.client_patch(
+            f"/json/messages/{first_id}",
+            {
+                "stream_id": other_stream.id,
+                "propagate_mode": "change_all",
+                "send_notification_to_old_thread": "false",
+                "send_notification_to_new_thread": "false",
+            },
+        )
+        self.assert_json_success(result)
+        self.assertEqual(
+            Message.objects.get(id=first_id).topic_id,
+            Message.objects.get(id=other_id).topic_id,
+        )
+
+        # The emptied topic remains, but is no longer listed.
+        self.assertTrue(Topic.objects.filter(id=topic.id).exists())
+        self.assertEqual(
+            get_topic_history_for_public_stream(
+                stream.realm_id, stream.recipient_id, allow_empty_topic_name=True
+            ),
+            [dict(name="the ghost", max_id=second_id)],
+        )
+
+    def test_topic_narrow(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        self.subscribe(hamlet, "Denmark")
+        message_ids = [
+            self.send_stream_message(hamlet, "Denmark", topic_name="Hamlet"),
+            self.send_stream_message(hamlet, "Denmark", topic_name="hamlet"),
+        ]
+        self.send_stream_message(hamlet, "Denmark", topic_name="Ophelia")
+        self.send_personal_message(hamlet, self.example_user("othello"))
+
+        def fetch(narrow: list[dict[str, object]]) -> list[int]:
+            result = self.client_get(
+                "/json/messages",
+                dict(
+                    anchor="newest",
+                    num_before=100,
+                    num_after=0,
+                    narrow=orjson.dumps(narrow).decode(),
+                ),
+            )
+            return [message["id"] for message in self.assert_json_success(result)["messages"]]
+
+        self.assertEqual(
+            fetch(
+                [
+                    dict(operator="channel", operand="Denmark"),
+                    dict(operator="topic", operand="HAMLET"),
+                ]
+            ),
+            message_ids,
+        )
+        self.assertEqual(fetch([dict(operator="topic", operand="hamlet")])[-2:], message_ids)
+        self.assertEqual(fetch([dict(operator="topic", operand="no such topic")]), [])
+
+        # Excluding a topic keeps direct messages, which have no topic.
+        excluded = fetch([dict(operator="topic", operand="hamlet", negated=True)])
+        self.assertTrue(set(excluded).isdisjoint(message_ids))
+        self.assertTrue(Message.objects.filter(id__in=excluded, is_channel_message=False).exists())
@@ -20,6 +20,7 @@ class SlowQueryTest(ZulipTestCase):
         "extra": "[transport=websocket]",
         "time_started": 0,
         "markdown_requests_start": 0,
+        "markdown_cache_hits_start": 0,
         "markdown_time_start": 0,
         "remote_cache_time_start": 0,
         "remote_cache_requests_start": 0,
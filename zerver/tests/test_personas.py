@@ -72,7 +72,8 @@ class PersonaTest(ZulipTestCase):
             {"name": "One Too Many", "bio": "Should fail"},
         )
         self.assert_json_error(
-            result, f"You have reached the maximum number of personas ({UserPersona.MAX_PERSONAS_PER_USER})."
+            result,
+            f"You have reached the maximum number of personas ({UserPersona.MAX_PERSONAS_PER_USER}).",
         )
 
     def test_get_personas(self) -> None:
@@ -264,6 +265,13 @@ class PersonaMentionTest(ZulipTestCase):
         names = [p["name"] for p in response["personas"]]
         self.assertIn("Legolas", names)
 
+        self.client_post("/json/users/me/personas", {"name": "Lego Builder"})
+        self.client_post("/json/users/me/personas", {"name": "Elrond"})
+        result = self.client_get("/json/realm/personas", {"query": "lEgO"})
+        response = self.assert_json_success(result)
+        names = {p["name"] for p in response["personas"]}
+        self.assertEqual(names, {"Legolas", "Lego Builder"})
+
 
 class PersonaEventTest(ZulipTestCase):
     def test_persona_create_event(self) -> None:
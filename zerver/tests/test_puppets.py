@@ -307,6 +307,10 @@ class StreamPuppetsAPITest(ZulipTestCase):
         puppet_names = {p["name"] for p in puppets}
         self.assertEqual(puppet_names, {"Gandalf", "Frodo"})
 
+        result = self.client_get(f"/json/streams/{stream.id}/puppets", {"query": "gan"})
+        data = self.assert_json_success(result)
+        self.assertEqual([p["name"] for p in data["puppets"]], ["Gandalf"])
+
     def test_get_puppets_non_puppet_stream(self) -> None:
         """Getting puppets for a non-puppet stream should fail."""
         user = self.example_user("hamlet")
@@ -0,0 +1,76 @@
+from django.test import override_settings
+
+from zerver.actions.realm_domains import do_add_realm_domain
+from zerver.lib.events import fetch_initial_state_data
+from zerver.lib.realm_state import fetch_realm_state_sections, realm_state_sections
+from zerver.lib.test_classes import ZulipTestCase
+from zerver.models import CustomProfileField
+
+
+class RealmStateTest(ZulipTestCase):
+    def test_realm_state_sections_cached(self) -> None:
+        realm = self.example_user("hamlet").realm
+        names = list(realm_state_sections)
+
+        sections, versions = fetch_realm_state_sections(realm, names)
+        self.assertEqual(versions.keys(), sections.keys())
+        with self.assert_database_query_count(0, keep_cache_warm=True):
+            self.assertEqual(fetch_realm_state_sections(realm, names), (sections, versions))
+
+        with override_settings(REALM_STATE_CACHE_ENABLED=False):
+            self.assertEqual(fetch_realm_state_sections(realm, names), (sections, {}))
+
+    def test_realm_state_flushed_by_event(self) -> None:
+        realm = self.example_user("hamlet").realm
+        _sections, old_versions = fetch_realm_state_sections(
+            realm, ["realm_domains", "realm_emoji"]
+        )
+
+        with self.capture_send_event_calls(expected_num_events=1):
+            do_add_realm_domain(realm, "example.org", False, acting_user=None)
+
+        # Only the section the event changes is fetched again.
+        with self.assert_database_query_count(1, keep_cache_warm=True):
+            sections, versions = fetch_realm_state_sections(realm, ["realm_domains", "realm_emoji"])
+        self.assertIn(
+            {"domain": "example.org", "allow_subdomains": False}, sections["realm_domains"]
+        )
+        self.assertNotEqual(versions["realm_domains"], old_versions["realm_domains"])
+        self.assertEqual(versions["realm_emoji"], old_versions["realm_emoji"])
+
+    def test_initial_state_unchanged(self) -> None:
+        hamlet = self.example_user("hamlet")
+        realm = hamlet.realm
+        with override_settings(REALM_STATE_CACHE_ENABLED=False):
+            uncached_state = fetch_initial_state_data(hamlet, realm=realm)
+            uncached_spectator_state = fetch_initial_state_data(
+                None, realm=realm, spectator_requested_language="en"
+            )
+
+        for _ in range(2):
+            state = fetch_initial_state_data(hamlet, realm=realm)
+            spectator_state = fetch_initial_state_data(
+                None, realm=realm, spectator_requested_language="en"
+            )
+            for key in realm_state_sections:
+                self.assertEqual(state.get(key), uncached_state.get(key))
+                self.assertEqual(spectator_state.get(key), uncached_spectator_state.get(key))
+            self.assertEqual(
+                state["realm_default_stream_groups"], uncached_state["realm_default_stream_groups"]
+            )
+
+        # Clients modify the state they're given without changing the
+        # cached copy.
+        state = fetch_initial_state_data(
+            hamlet,
+            realm=realm,
+            event_types=["custom_profile_fields"],
+            pronouns_field_type_supported=False,
+        )
+        self.assertNotIn(
+            CustomProfileField.PRONOUNS, [field["type"] for field in state["custom_profile_fields"]]
+        )
+        state = fetch_initial_state_data(hamlet, realm=realm, event_types=["custom_profile_fields"])
+        self.assertIn(
+            CustomProfileField.PRONOUNS, [field["type"] for field in state["custom_profile_fields"]]
+        )
@@ -0,0 +1,102 @@
+from typing import TYPE_CHECKING, Any
+from unittest import mock
+
+from zerver.actions.personas import do_create_persona
+from zerver.lib.test_classes import ZulipTestCase
+from zerver.models.streams import get_stream
+
+if TYPE_CHECKING:
+    from django.test.client import _MonkeyPatchedWSGIResponse as TestHttpResponse
+
+
+class TheaterTest(ZulipTestCase):
+    def get_with_event_queue(
+        self, url: str, info: dict[str, Any]
+    ) -> tuple["TestHttpResponse", list[str], list[list[str]]]:
+        """Fetches url, returning the response along with the event types
+        and narrow of the event queue it registered."""
+        with (
+            mock.patch("zerver.lib.events.request_event_queue", return_value="theater") as m,
+            mock.patch("zerver.lib.events.get_user_events", return_value=[]),
+        ):
+            result = self.client_get(url, info)
+        return result, m.call_args.args[6], m.call_args.kwargs["narrow"]
+
+    def test_theater_page(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        result, event_types, _narrow = self.get_with_event_queue("/theater/", {})
+        self.assertEqual(result.status_code, 200)
+
+        state_data = self._get_page_params(result)["state_data"]
+        self.assertEqual(state_data["queue_id"], "theater")
+        self.assertIn("Denmark", [sub["name"] for sub in state_data["subscriptions"]])
+        self.assertIn(hamlet.id, [user["user_id"] for user in state_data["realm_users"]])
+        self.assertIn("presences", state_data)
+        # None of the main app's other state is fetched.
+        self.assertNotIn("unread_msgs", state_data)
+        self.assertNotIn("realm_emoji", state_data)
+
+        # The event queue is limited to the events the theater handles.
+        self.assertIn("message", event_types)
+        self.assertNotIn("realm_user", event_types)
+
+    def test_theater_bootstrap(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        self.login_user(hamlet)
+        stream = get_stream("Denmark", hamlet.realm)
+        do_create_persona(hamlet, "Prince", None, None, "")
+
+        self.send_stream_message(othello, "Denmark", "other scene", topic_name="elsewhere")
+        message_ids = [
+            self.send_stream_message(hamlet, "Denmark", "to be", topic_name="scene"),
+            self.send_stream_message(othello, "Denmark", "or not", topic_name="scene"),
+        ]
+
+        result, _event_types, narrow = self.get_with_event_queue(
+            "/json/theater/bootstrap",
+            {"channel_id": stream.id, "topic": "scene", "num_messages": 10},
+        )
+        data = self.assert_json_success(result)
+        self.assertEqual(data["queue_id"], "theater")
+        self.assertEqual(narrow, [["channel", "Denmark"], ["topic", "scene"]])
+        self.assertEqual([message["id"] for message in data["messages"]], message_ids)
+        self.assertEqual(
+            [participant["user_id"] for participant in data["participants"]],
+            sorted([hamlet.id, othello.id]),
+        )
+        self.assertEqual(data["puppets"], [])
+        self.assertEqual([persona["name"] for persona in data["personas"]], ["Prince"])
+        self.assertTrue(set(data["presences"]) <= {str(hamlet.id), str(othello.id)})
+
+        result, _event_types, narrow = self.get_with_event_queue(
+            "/json/theater/bootstrap", {"channel_id": stream.id, "num_messages": 1}
+        )
+        data = self.assert_json_success(result)
+        self.assertEqual(narrow, [["channel", "Denmark"]])
+        self.assertEqual([message["id"] for message in data["messages"]], message_ids[-1:])
+        self.assertFalse(data["found_oldest"])
+
+    def test_theater_bootstrap_private_channel(self) -> None:
+        hamlet = self.example_user("hamlet")
+        othello = self.example_user("othello")
+        self.login_user(hamlet)
+        stream = self.make_stream(
+            "backstage", invite_only=True, history_public_to_subscribers=False
+        )
+        self.subscribe(othello, "backstage")
+        self.send_stream_message(othello, "backstage", "before hamlet")
+        result = self.client_get("/json/theater/bootstrap", {"channel_id": stream.id})
+        self.assert_json_error(result, "Invalid channel ID")
+
+        # Without access to the channel's history, only the messages
+        # the user received are returned.
+        self.subscribe(hamlet, "backstage")
+        message_id = self.send_stream_message(othello, "backstage", "after hamlet")
+        result, _event_types, _narrow = self.get_with_event_queue(
+            "/json/theater/bootstrap", {"channel_id": stream.id}
+        )
+        data = self.assert_json_success(result)
+        self.assertEqual([message["id"] for message in data["messages"]], [message_id])
+        self.assertEqual(data["messages"][0]["flags"], [])
@@ -20,6 +20,7 @@ from typing_extensions import override
 from zerver.lib.cache import user_profile_narrow_by_id_cache_key
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import cache_tries_captured, queries_captured
+from zerver.lib.zstd_level9 import decompress as zstd_decompress
 from zerver.models import UserProfile
 from zerver.tornado import event_queue
 from zerver.tornado.application import create_tornado_application
@@ -135,6 +136,44 @@ class EventsTestCase(TornadoWebTestCase):
             )
             self.assertEqual(data["result"], "success")
 
+    async def test_events_compression(self) -> None:
+        async with self.with_tornado():
+            user_profile = await sync_to_async(lambda: self.example_user("hamlet"))()
+            await sync_to_async(lambda: self.login_user(user_profile))()
+            event_queue_id = await self.create_queue()
+            data = {
+                "queue_id": event_queue_id,
+                "last_event_id": -1,
+            }
+
+            path = f"/json/events?{urlencode(data)}"
+            event = {"type": "test", "data": "test data " * 200}
+
+            with self.mocked_events(user_profile, event):
+                response = await self.fetch_async(
+                    "GET", path, headers={"Accept-Encoding": "gzip, zstd"}
+                )
+
+            self.assertEqual(response.headers["Content-Encoding"], "zstd")
+            self.assertEqual(response.headers["Vary"], "Accept-Language, Cookie, Accept-Encoding")
+            data = orjson.loads(zstd_decompress(response.body))
+            self.assertEqual(data["events"], [{**event, "id": 0}])
+
+            # Clients which don't accept zstd get the plain response.
+            data = {
+                "queue_id": event_queue_id,
+                "last_event_id": 0,
+            }
+            path = f"/json/events?{urlencode(data)}"
+            with self.mocked_events(user_profile, event):
+                response = await self.fetch_async(
+                    "GET", path, headers={"Accept-Encoding": "zstd;q=0"}
+                )
+
+            self.assertNotIn("Content-Encoding", response.headers)
+            data = orjson.loads(response.body)
+            self.assertEqual(data["events"], [{**event, "id": 1}])
+
     async def test_events_caching(self) -> None:
         async with self.with_tornado():
             user_profile = await sync_to_async(lambda: self.example_user("hamlet"))()
@@ -0,0 +1,166 @@
+from datetime import timedelta
+from typing import Any
+from unittest import mock
+
+import orjson
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.actions.message_flags import do_mark_stream_messages_as_read, do_update_message_flags
+from zerver.lib import unread_conversations
+from zerver.lib.message import get_raw_unread_data
+from zerver.lib.narrow import LARGER_THAN_MAX_MESSAGE_ID
+from zerver.lib.test_classes import ZulipTestCase
+from zerver.lib.unread_conversations import (
+    get_first_unread_watermark,
+    get_unread_conversation_discrepancies,
+    rebuild_unread_conversations,
+)
+from zerver.models import UnreadConversation, UnreadSummary, UserProfile
+
+
+@mock.patch("zerver.lib.unread_conversations.UNREAD_SUMMARY_SETTLE_INTERVAL", timedelta(0))
+class UnreadConversationTest(ZulipTestCase):
+    @override
+    def setUp(self) -> None:
+        super().setUp()
+        self.hamlet = self.example_user("hamlet")
+        self.cordelia = self.example_user("cordelia")
+        self.stream = self.make_stream("Elsinore")
+        self.subscribe(self.hamlet, "Elsinore")
+        self.subscribe(self.cordelia, "Elsinore")
+
+    def get_conversations(self, user_profile: UserProfile) -> dict[str, int]:
+        return {
+            row.topic_name: row.first_unread_message_id
+            for row in UnreadConversation.objects.filter(
+                user_profile=user_profile, recipient_id=self.stream.recipient_id
+            )
+        }
+
+    def get_first_unread_anchor(self, narrow: list[dict[str, Any]]) -> int:
+        result = self.client_get(
+            "/json/messages",
+            dict(
+                anchor="first_unread",
+                num_before=0,
+                num_after=0,
+                narrow=orjson.dumps(narrow).decode(),
+            ),
+        )
+        return self.assert_json_success(result)["anchor"]
+
+    def test_rebuild(self) -> None:
+        first_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        other_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="play")
+        self.send_stream_message(self.hamlet, "Elsinore", topic_name="play")
+
+        watermark = get_first_unread_watermark(self.hamlet)
+        self.assertGreaterEqual(watermark, other_id)
+        self.assertEqual(
+            self.get_conversations(self.hamlet),
+            {"ghost": first_id, "play": other_id},
+        )
+        self.assertEqual(
+            UnreadSummary.objects.get(user_profile=self.hamlet).summarized_through_message_id,
+            watermark,
+        )
+        self.assertEqual(get_unread_conversation_discrepancies(self.hamlet), ([], []))
+
+        # Messages sent after the summary are only added when it is
+        # advanced.
+        self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        self.assertEqual(get_first_unread_watermark(self.hamlet), watermark)
+        self.assertEqual(self.get_conversations(self.hamlet)["ghost"], first_id)
+        with mock.patch(
+            "zerver.lib.unread_conversations.UNREAD_SUMMARY_ADVANCE_INTERVAL", timedelta(0)
+        ):
+            self.assertGreater(get_first_unread_watermark(self.hamlet), watermark)
+        self.assertEqual(self.get_conversations(self.hamlet)["ghost"], first_id)
+
+    def test_mark_read_and_unread(self) -> None:
+        first_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        second_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        rebuild_unread_conversations(self.hamlet)
+
+        recompute_count = unread_conversations.unread_conversation_stats["conversation.recompute"]
+        do_update_message_flags(self.hamlet, "add", "read", [first_id])
+        self.assertEqual(self.get_conversations(self.hamlet), {"ghost": second_id})
+        self.assertEqual(
+            unread_conversations.unread_conversation_stats["conversation.recompute"],
+            recompute_count + 1,
+        )
+
+        do_update_message_flags(self.hamlet, "add", "read", [second_id])
+        self.assertEqual(self.get_conversations(self.hamlet), {})
+
+        do_update_message_flags(self.hamlet, "remove", "read", [first_id, second_id])
+        self.assertEqual(self.get_conversations(self.hamlet), {"ghost": first_id})
+
+        do_mark_stream_messages_as_read(self.hamlet, self.stream.recipient_id, "ghost")
+        self.assertEqual(self.get_conversations(self.hamlet), {})
+        self.assertEqual(get_unread_conversation_discrepancies(self.hamlet), ([], []))
+
+    def test_move_messages(self) -> None:
+        first_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        second_id = self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        rebuild_unread_conversations(self.hamlet)
+
+        self.login("cordelia")
+        result = self.client_patch(
+            f"/json/messages/{first_id}",
+            {"topic": "the ghost", "propagate_mode": "change_one"},
+        )
+        self.assert_json_success(result)
+
+        # The original conversation's row is merely stale.
+        self.assertEqual(
+            self.get_conversations(self.hamlet),
+            {"ghost": first_id, "the ghost": first_id},
+        )
+        wrong, stale = get_unread_conversation_discrepancies(self.hamlet)
+        self.assertEqual(wrong, [])
+        self.assertEqual(stale, [(self.stream.recipient_id, "GHOST")])
+
+        do_update_message_flags(self.hamlet, "add", "read", [second_id])
+        self.assertEqual(self.get_conversations(self.hamlet), {"the ghost": first_id})
+
+    def test_update_unread_summary(self) -> None:
+        self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+
+        # Users with few unread messages get no summary.
+        get_raw_unread_data(self.hamlet)
+        self.assertFalse(UnreadSummary.objects.filter(user_profile=self.hamlet).exists())
+
+        with mock.patch("zerver.lib.unread_conversations.UNREAD_SUMMARY_MIN_UNREAD_MESSAGES", 1):
+            get_raw_unread_data(self.hamlet)
+        self.assertTrue(UnreadSummary.objects.filter(user_profile=self.hamlet).exists())
+        self.assertEqual(get_unread_conversation_discrepancies(self.hamlet), ([], []))
+
+    def test_first_unread_anchor(self) -> None:
+        self.send_stream_message(self.cordelia, "Elsinore", topic_name="ghost")
+        self.send_stream_message(self.cordelia, "Elsinore", topic_name="play")
+        self.send_stream_message(self.cordelia, "Denmark", topic_name="ghost")
+        self.send_personal_message(self.cordelia, self.hamlet)
+        rebuild_unread_conversations(self.hamlet)
+        self.login("hamlet")
+
+        narrows: list[list[dict[str, Any]]] = [
+            [],
+            [dict(operator="channel", operand="Elsinore")],
+            [dict(operator="channel", operand=self.stream.id)],
+            [dict(operator="channel", operand="Elsinore"), dict(operator="topic", operand="play")],
+            [dict(operator="topic", operand="ghost")],
+            [dict(operator="is", operand="dm")],
+        ]
+        for narrow in narrows:
+            with override_settings(UNREAD_CONVERSATIONS_ENABLED=False):
+                expected_anchor = self.get_first_unread_anchor(narrow)
+            self.assertEqual(self.get_first_unread_anchor(narrow), expected_anchor)
+
+        # Marking everything read drops the summary.
+        self.client_post("/json/mark_all_as_read")
+        self.assertFalse(UnreadSummary.objects.filter(user_profile=self.hamlet).exists())
+        self.assertFalse(UnreadConversation.objects.filter(user_profile=self.hamlet).exists())
+        self.assertEqual(self.get_first_unread_anchor([]), LARGER_THAN_MAX_MESSAGE_ID)
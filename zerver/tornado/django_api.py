@@ -1,5 +1,8 @@
+import threading
+import weakref
 from collections import defaultdict
 from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass
 from functools import lru_cache
 from typing import Any
 from urllib.parse import urlsplit
@@ -13,8 +16,10 @@ from requests.models import PreparedRequest, Response
 from typing_extensions import override
 from urllib3.util import Retry
 
+from zerver.lib.event_delta import delta_decode_events
 from zerver.lib.partial import partial
 from zerver.lib.queue import queue_json_publish_rollback_unsafe
+from zerver.lib.realm_state import flush_realm_state_sections_for_events
 from zerver.models import Client, Realm, UserProfile
 from zerver.models.users import get_user_profile_narrow_by_id
 from zerver.tornado.sharding import (
@@ -94,6 +99,7 @@ def request_event_queue(
     archived_channels: bool = False,
     empty_topic_name: bool = False,
     simplified_presence_events: bool = False,
+    delta_encoded_events: bool = False,
 ) -> str | None:
     if not settings.USING_TORNADO:
         return None
@@ -125,6 +131,7 @@ def request_event_queue(
         "archived_channels": orjson.dumps(archived_channels),
         "empty_topic_name": orjson.dumps(empty_topic_name),
         "simplified_presence_events": orjson.dumps(simplified_presence_events),
+        "delta_encoded_events": orjson.dumps(delta_encoded_events),
     }
 
     if event_types is not None:
@@ -156,7 +163,9 @@ def get_user_events(
         "client": "internal",
     }
     resp = requests_client().post(tornado_url + "/api/v1/events/internal", data=post_data)
-    return resp.json()["events"]
+    # The queue may have been registered with the delta_encoded_events
+    # client capability; apply_events needs the full events.
+    return delta_decode_events(resp.json()["events"])
 
 
 def send_notification_http(port: int, data: Mapping[str, Any]) -> None:
@@ -172,7 +181,10 @@ def send_notification_http(port: int, data: Mapping[str, Any]) -> None:
         # from creating import cycles.
         from zerver.tornado.event_queue import process_notification
 
-        process_notification(data)
+        # Batched notices are unpacked here, so that tests see one
+        # process_notification call per event.
+        for notice in data.get("notices", [data]):
+            process_notification(notice)
     else:
         # This codepath is only used when running full-stack puppeteer
         # tests, which don't have RabbitMQ but do have a separate
@@ -184,6 +196,20 @@ def send_notification_http(port: int, data: Mapping[str, Any]) -> None:
         )
 
 
+def get_port_user_map(
+    realm: Realm, users: Iterable[int] | Iterable[Mapping[str, Any]]
+) -> dict[int, list[Any]]:
+    realm_ports = get_realm_tornado_ports(realm)
+    if len(realm_ports) == 1:
+        return {realm_ports[0]: list(users)}
+
+    port_user_map: dict[int, list[Any]] = defaultdict(list)
+    for user in users:
+        user_id = user if isinstance(user, int) else user["id"]
+        port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
+    return port_user_map
+
+
 # The core function for sending an event from Django to Tornado (which
 # will then push it to web and mobile clients for the target users).
 #
@@ -205,23 +231,126 @@ def send_event_rollback_unsafe(
 ) -> None:
     """`users` is a list of user IDs, or in some special cases like message
     send/update or embeds, dictionaries containing extra data."""
-    realm_ports = get_realm_tornado_ports(realm)
-    if len(realm_ports) == 1:
-        port_user_map = {realm_ports[0]: list(users)}
-    else:
-        port_user_map = defaultdict(list)
-        for user in users:
-            user_id = user if isinstance(user, int) else user["id"]
-            port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
-
-    for port, port_users in port_user_map.items():
+    flush_realm_state_sections_for_events(realm.id, [event["type"]])
+    for port, port_users in get_port_user_map(realm, users).items():
         queue_json_publish_rollback_unsafe(
             notify_tornado_queue_name(port),
-            dict(event=event, users=port_users),
+            dict(event=event, users=port_users, realm_id=realm.id),
             partial(send_notification_http, port),
         )
 
 
+@dataclass(eq=False)
+class BatchedTornadoEvent:
+    realm: Realm
+    event: Mapping[str, Any]
+    users: Iterable[int] | Iterable[Mapping[str, Any]]
+    committed: bool = False
+    batched: bool = True
+
+
+class TornadoEventBatch:
+    """Events sent by `send_event_on_commit` calls in the same
+    transaction (and savepoint), which are delivered to each Tornado
+    port as a single batched notice when the transaction commits.
+
+    Bulk operations (e.g. moving a topic with many messages) can send
+    hundreds of events in a single transaction; batching them saves
+    a RabbitMQ publish (or HTTP request) per event, and lets Tornado
+    process them all in a single IOLoop callback.
+
+    Each event still registers its own on-commit callback, so Django
+    decides which events are committed, exactly as for unbatched
+    events.  The callback for the last event in the batch sends all
+    of the batch's committed events; all events in the batch are
+    registered in the same savepoint, so they share its fate.
+    """
+
+    def __init__(self) -> None:
+        self.events: list[BatchedTornadoEvent] = []
+
+    def add(
+        self,
+        realm: Realm,
+        event: Mapping[str, Any],
+        users: Iterable[int] | Iterable[Mapping[str, Any]],
+    ) -> None:
+        batched_event = BatchedTornadoEvent(realm, event, users)
+        self.events.append(batched_event)
+        transaction.on_commit(partial(self.commit_event, batched_event))
+
+    def commit_event(self, batched_event: BatchedTornadoEvent) -> None:
+        batched_event.committed = True
+        if not batched_event.batched:
+            # Another event's callback already sent the batch without
+            # this event, which had not been committed at the time;
+            # this only happens in tests, which capture the callbacks
+            # of a transaction that never commits.
+            self.send([batched_event])
+            return
+        if batched_event is not self.events[-1]:
+            return
+
+        events = [event for event in self.events if event.committed]
+        for event in self.events:
+            event.batched = False
+        self.events = []
+        self.send(events)
+
+    def send(self, events: list[BatchedTornadoEvent]) -> None:
+        realm_event_types: dict[int, set[str]] = defaultdict(set)
+        port_notices: dict[int, list[dict[str, Any]]] = defaultdict(list)
+        for batched_event in events:
+            realm, event = batched_event.realm, batched_event.event
+            realm_event_types[realm.id].add(event["type"])
+            for port, port_users in get_port_user_map(realm, batched_event.users).items():
+                port_notices[port].append(dict(event=event, users=port_users, realm_id=realm.id))
+
+        # Flush the realm-wide state these events change, which another
+        # request may have cached from before the commit, before clients
+        # see them, so that a client reloading in response to one fetches
+        # the new state.
+        for realm_id, event_types in realm_event_types.items():
+            flush_realm_state_sections_for_events(realm_id, event_types)
+
+        for port, notices in port_notices.items():
+            queue_json_publish_rollback_unsafe(
+                notify_tornado_queue_name(port),
+                notices[0] if len(notices) == 1 else dict(notices=notices),
+                partial(send_notification_http, port),
+            )
+
+
+class PendingTornadoEventBatches(threading.local):
+    def __init__(self) -> None:
+        # Batches are only referenced weakly here; their events'
+        # on-commit callbacks keep them alive until they are run, or
+        # discarded by a rollback.
+        self.by_savepoint_ids: weakref.WeakValueDictionary[
+            tuple[str | None, ...], TornadoEventBatch
+        ] = weakref.WeakValueDictionary()
+        self.last_batch: weakref.ref[TornadoEventBatch] | None = None
+
+
+pending_tornado_event_batches = PendingTornadoEventBatches()
+
+
+def get_tornado_event_batch() -> TornadoEventBatch:
+    """Returns the batch to add an event sent now to: the batch for
+    the current savepoint, unless events have since been added to a
+    batch for another savepoint which might still be committed, in
+    which case adding to it would reorder events."""
+    pending = pending_tornado_event_batches
+    savepoint_ids = tuple(transaction.get_connection().savepoint_ids)
+    batch = pending.by_savepoint_ids.get(savepoint_ids)
+    last_batch = pending.last_batch() if pending.last_batch is not None else None
+    if batch is None or (last_batch is not None and last_batch is not batch):
+        batch = TornadoEventBatch()
+        pending.by_savepoint_ids[savepoint_ids] = batch
+    pending.last_batch = weakref.ref(batch)
+    return batch
+
+
 def send_event_on_commit(
     realm: Realm, event: Mapping[str, Any], users: Iterable[int] | Iterable[Mapping[str, Any]]
 ) -> None:
@@ -236,4 +365,10 @@ def send_event_on_commit(
         except TypeError:
             print(event)
             raise
-    transaction.on_commit(lambda: send_event_rollback_unsafe(realm, event, users))
+
+    # The realm-wide state this event changes is flushed when the
+    # batch is sent, too; flushing it now as well means the rest of
+    # the transaction doesn't read the old state from the cache.
+    flush_realm_state_sections_for_events(realm.id, [event["type"]])
+
+    get_tornado_event_batch().add(realm, event, users)
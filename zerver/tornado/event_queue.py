@@ -1,18 +1,28 @@
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html for
 # high-level documentation on how this system works.
 import copy
+import itertools
 import logging
 import os
 import random
+import sys
 import time
 import traceback
 import uuid
 from collections import deque
-from collections.abc import Callable, Collection, Iterable, Mapping, MutableMapping, Sequence
+from collections.abc import (
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Sequence,
+)
 from collections.abc import Set as AbstractSet
 from contextlib import suppress
-from functools import cache
-from typing import Any, Literal, TypedDict, cast
+from functools import cache, lru_cache
+from typing import Any, Literal, TypedDict, TypeVar, cast
 
 import orjson
 import tornado.ioloop
@@ -22,10 +32,11 @@ from tornado import autoreload
 from typing_extensions import override
 
 from version import API_FEATURE_LEVEL, ZULIP_MERGE_BASE, ZULIP_VERSION
+from zerver.lib.event_delta import delta_encode_events
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
-from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_predicate import NarrowPredicate, build_narrow_predicate, channel_operators
 from zerver.lib.notification_data import UserMessageNotificationsData
 from zerver.lib.queue import queue_json_publish_rollback_unsafe, retry_event
 from zerver.lib.topic import ORIG_TOPIC, TOPIC_NAME
@@ -54,12 +65,137 @@ MAX_QUEUE_TIMEOUT_SECS = 7 * 24 * 60 * 60
 # wireless routers that kill "inactive" http connections.
 HEARTBEAT_MIN_FREQ_SECS = 45
 
+KeyT = TypeVar("KeyT")
+
 
 def create_heartbeat_event() -> dict[str, str]:
     return dict(type="heartbeat")
 
 
+# Boolean client capabilities, which ClientDescriptor packs into a
+# single int to keep the per-queue memory footprint small; a Tornado
+# shard can host hundreds of thousands of mostly-idle queues.
+CLIENT_CAPABILITY_FLAGS = (
+    "apply_markdown",
+    "client_gravatar",
+    "slim_presence",
+    "all_public_streams",
+    "bulk_message_deletion",
+    "stream_typing_notifications",
+    "pronouns_field_type_supported",
+    "linkifier_url_template",
+    "user_list_incomplete",
+    "include_deactivated_groups",
+    "archived_channels",
+    "empty_topic_name",
+    "simplified_presence_events",
+    "is_bot",
+    "delta_encoded_events",
+)
+
+
+class CapabilityFlag:
+    """Descriptor exposing one bit of ClientDescriptor.capabilities as a
+    boolean attribute."""
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.mask = 1 << CLIENT_CAPABILITY_FLAGS.index(name)
+
+    def __get__(self, client: "ClientDescriptor", owner: type | None = None) -> bool:
+        return client.capabilities & self.mask != 0
+
+    def __set__(self, client: "ClientDescriptor", value: bool) -> None:
+        if value:
+            client.capabilities |= self.mask
+        else:
+            client.capabilities &= ~self.mask
+
+
+NarrowIndexKey = tuple[str, str | None]
+
+
+def get_narrow_index_key(narrow: Collection[Sequence[str]]) -> NarrowIndexKey | None:
+    """Returns the (channel name, topic name) pair, case-folded, that
+    every message matching the narrow must be sent to, if the narrow
+    restricts to a channel; the topic is None if the narrow doesn't
+    restrict to a topic.  Message events only need to visit queues
+    with such a narrow if they match this key; see
+    get_message_narrow_index_keys."""
+    channel_name = None
+    topic_name = None
+    for term in narrow:
+        operator, operand = term[0], term[1]
+        if operator in channel_operators and channel_name is None:
+            channel_name = operand.lower()
+        elif operator == "topic" and topic_name is None:
+            topic_name = operand.lower()
+    if channel_name is None:
+        return None
+    return (channel_name, topic_name)
+
+
+def get_message_narrow_index_keys(message: Mapping[str, Any]) -> set[NarrowIndexKey]:
+    if message["type"] != "stream":
+        return set()
+    channel_name = message["display_recipient"].lower()
+    return {(channel_name, None), (channel_name, message[TOPIC_NAME].lower())}
+
+
+@lru_cache(maxsize=4096)
+def get_interned_narrow(
+    narrow_json: bytes,
+) -> tuple[list[list[str]], NarrowPredicate, NarrowIndexKey | None]:
+    # Most queues share one of a handful of narrows (usually the
+    # empty one), so we share both the narrow and its compiled
+    # predicate between the ClientDescriptors that use it.
+    narrow = orjson.loads(narrow_json)
+    return (
+        narrow,
+        build_narrow_predicate(narrow_dataclasses_from_tuples(narrow)),
+        get_narrow_index_key(narrow),
+    )
+
+
+@lru_cache(maxsize=4096)
+def get_interned_event_types(event_types: tuple[str, ...]) -> list[str]:
+    return list(event_types)
+
+
 class ClientDescriptor:
+    __slots__ = (
+        "_timeout_handle",
+        "capabilities",
+        "client_type_name",
+        "current_client_name",
+        "current_handler_id",
+        "event_queue",
+        "event_types",
+        "last_connection_time",
+        "narrow",
+        "narrow_index_key",
+        "narrow_predicate",
+        "queue_timeout",
+        "realm_id",
+        "user_profile_id",
+        "user_recipient_id",
+    )
+
+    apply_markdown = CapabilityFlag()
+    client_gravatar = CapabilityFlag()
+    slim_presence = CapabilityFlag()
+    all_public_streams = CapabilityFlag()
+    bulk_message_deletion = CapabilityFlag()
+    stream_typing_notifications = CapabilityFlag()
+    pronouns_field_type_supported = CapabilityFlag()
+    linkifier_url_template = CapabilityFlag()
+    user_list_incomplete = CapabilityFlag()
+    include_deactivated_groups = CapabilityFlag()
+    archived_channels = CapabilityFlag()
+    empty_topic_name = CapabilityFlag()
+    simplified_presence_events = CapabilityFlag()
+    is_bot = CapabilityFlag()
+    delta_encoded_events = CapabilityFlag()
+
     def __init__(
         self,
         *,
@@ -85,11 +221,8 @@ class ClientDescriptor:
         empty_topic_name: bool,
         simplified_presence_events: bool,
         is_bot: bool = False,
+        delta_encoded_events: bool = False,
     ) -> None:
-        # TODO: We eventually want to upstream this code to the caller, but
-        # serialization concerns make it a bit difficult.
-        modern_narrow = narrow_dataclasses_from_tuples(narrow)
-
         # These objects are serialized on shutdown and restored on restart.
         # If fields are added or semantics are changed, temporary code must be
         # added to load_event_queues() to update the restored objects.
@@ -100,26 +233,39 @@ class ClientDescriptor:
         self.current_handler_id: int | None = None
         self.current_client_name: str | None = None
         self.event_queue = event_queue
-        self.event_types = event_types
+        self.event_types = (
+            None if event_types is None else get_interned_event_types(tuple(event_types))
+        )
         self.last_connection_time = time.time()
-        self.apply_markdown = apply_markdown
-        self.client_gravatar = client_gravatar
-        self.slim_presence = slim_presence
-        self.all_public_streams = all_public_streams
-        self.client_type_name = client_type_name
+        self.client_type_name = sys.intern(client_type_name)
         self._timeout_handle: Any = None  # TODO: should be return type of ioloop.call_later
-        self.narrow = narrow
-        self.narrow_predicate = build_narrow_predicate(modern_narrow)
-        self.bulk_message_deletion = bulk_message_deletion
-        self.stream_typing_notifications = stream_typing_notifications
-        self.pronouns_field_type_supported = pronouns_field_type_supported
-        self.linkifier_url_template = linkifier_url_template
-        self.user_list_incomplete = user_list_incomplete
-        self.include_deactivated_groups = include_deactivated_groups
-        self.archived_channels = archived_channels
-        self.empty_topic_name = empty_topic_name
-        self.simplified_presence_events = simplified_presence_events
-        self.is_bot = is_bot
+        # TODO: We eventually want to upstream the conversion to narrow
+        # dataclasses to the caller, but serialization concerns make it
+        # a bit difficult.
+        self.narrow, self.narrow_predicate, self.narrow_index_key = get_interned_narrow(
+            orjson.dumps(narrow)
+        )
+
+        capabilities = dict(
+            apply_markdown=apply_markdown,
+            client_gravatar=client_gravatar,
+            slim_presence=slim_presence,
+            all_public_streams=all_public_streams,
+            bulk_message_deletion=bulk_message_deletion,
+            stream_typing_notifications=stream_typing_notifications,
+            pronouns_field_type_supported=pronouns_field_type_supported,
+            linkifier_url_template=linkifier_url_template,
+            user_list_incomplete=user_list_incomplete,
+            include_deactivated_groups=include_deactivated_groups,
+            archived_channels=archived_channels,
+            empty_topic_name=empty_topic_name,
+            simplified_presence_events=simplified_presence_events,
+            is_bot=is_bot,
+            delta_encoded_events=delta_encoded_events,
+        )
+        self.capabilities = sum(
+            1 << bit for bit, name in enumerate(CLIENT_CAPABILITY_FLAGS) if capabilities[name]
+        )
 
         # Default for lifespan_secs is DEFAULT_EVENT_QUEUE_TIMEOUT_SECS;
         # but users can set it as high as MAX_QUEUE_TIMEOUT_SECS.
@@ -154,6 +300,7 @@ class ClientDescriptor:
             empty_topic_name=self.empty_topic_name,
             simplified_presence_events=self.simplified_presence_events,
             is_bot=self.is_bot,
+            delta_encoded_events=self.delta_encoded_events,
         )
 
     @override
@@ -195,6 +342,7 @@ class ClientDescriptor:
             empty_topic_name=d.get("empty_topic_name", False),
             simplified_presence_events=d.get("simplified_presence_events", False),
             is_bot=d.get("is_bot", False),
+            delta_encoded_events=d.get("delta_encoded_events", False),
         )
         ret.last_connection_time = d["last_connection_time"]
         return ret
@@ -216,7 +364,7 @@ class ClientDescriptor:
             finish_handler(
                 self.current_handler_id,
                 self.event_queue.id,
-                self.event_queue.contents(),
+                self.get_events_for_response(),
             )
         except Exception:
             logging.exception(
@@ -226,6 +374,12 @@ class ClientDescriptor:
             self.disconnect_handler()
         return True
 
+    def get_events_for_response(self) -> list[dict[str, Any]]:
+        events = self.event_queue.contents()
+        if self.delta_encoded_events:
+            return delta_encode_events(events)
+        return events
+
     def accepts_event(self, event: Mapping[str, Any]) -> bool:
         if self.event_types is not None:
             if event["type"] not in self.event_types:
@@ -331,6 +485,8 @@ def compute_full_event_type(event: Mapping[str, Any]) -> str:
 
 
 class EventQueue:
+    __slots__ = ("id", "newest_pruned_id", "next_event_id", "queue", "virtual_events")
+
     def __init__(self, id: str) -> None:
         # When extending this list of properties, one must be sure to
         # update to_dict and from_dict.
@@ -469,8 +625,20 @@ web_reload_clients: dict[str, Literal[True]] = {}
 clients: dict[str, ClientDescriptor] = {}
 # maps user id to list of client descriptors
 user_clients: dict[int, list[ClientDescriptor]] = {}
-# maps realm id to list of client descriptors with all_public_streams=True
+# maps realm id to list of client descriptors with all_public_streams=True,
+# or with a narrow that isn't restricted to a channel
 realm_clients_all_streams: dict[int, list[ClientDescriptor]] = {}
+# maps (realm id, *narrow_index_key) to list of client descriptors with a
+# narrow restricted to that channel (and topic, if not None)
+realm_clients_by_narrow: dict[tuple[int, str, str | None], list[ClientDescriptor]] = {}
+# Inverted index mapping (realm id, event type) to the client
+# descriptors, keyed by queue id, that want that event type; clients
+# with event_types=None are indexed under the event type None.  This
+# lets us deliver events addressed to many users in a realm by
+# walking only the queues that could accept them.
+realm_event_type_clients: dict[tuple[int, str | None], dict[str, ClientDescriptor]] = {}
+# maps realm id to the set of user ids with queues in that realm
+realm_user_ids: dict[int, set[int]] = {}
 
 # list of registered gc hooks.
 # each one will be called with a user profile id, queue, and bool
@@ -486,6 +654,9 @@ def clear_client_event_queues_for_testing() -> None:
     web_reload_clients.clear()
     user_clients.clear()
     realm_clients_all_streams.clear()
+    realm_clients_by_narrow.clear()
+    realm_event_type_clients.clear()
+    realm_user_ids.clear()
     gc_hooks.clear()
 
 
@@ -516,10 +687,77 @@ def get_client_descriptors_for_realm_all_streams(realm_id: int) -> list[ClientDe
     return realm_clients_all_streams.get(realm_id, [])
 
 
+def get_client_descriptors_for_realm_narrow(
+    realm_id: int, narrow_index_key: NarrowIndexKey
+) -> list[ClientDescriptor]:
+    return realm_clients_by_narrow.get((realm_id, *narrow_index_key), [])
+
+
+def get_client_descriptors_for_users(
+    user_ids: Collection[int], event_type: str, realm_id: int | None
+) -> Iterator[ClientDescriptor]:
+    """Yields the client descriptors belonging to user_ids that may
+    want an event of type event_type.  Callers still need to check
+    accepts_event on each client.
+
+    For events addressed to many users (e.g. realm-wide `realm_user`
+    or `user_group` events), we walk the realm's inverted index
+    instead of doing a lookup per user, whenever the index is the
+    smaller of the two.
+    """
+    if realm_id is not None:
+        typed_clients = realm_event_type_clients.get((realm_id, event_type), {})
+        untyped_clients = realm_event_type_clients.get((realm_id, None), {})
+        if len(typed_clients) + len(untyped_clients) < len(user_ids):
+            user_id_set = set(user_ids)
+            for indexed_clients in (typed_clients, untyped_clients):
+                for client in indexed_clients.values():
+                    if client.user_profile_id in user_id_set:
+                        yield client
+
+            # Users whose queues live in another realm (e.g. cross-realm
+            # bots) are not in this realm's index; look them up directly.
+            other_realm_user_ids = (
+                user_id_set - realm_user_ids.get(realm_id, set())
+            ) & user_clients.keys()
+            for user_profile_id in other_realm_user_ids:
+                yield from get_client_descriptors_for_user(user_profile_id)
+            return
+
+    for user_profile_id in user_ids:
+        yield from get_client_descriptors_for_user(user_profile_id)
+
+
 def add_to_client_dicts(client: ClientDescriptor) -> None:
     user_clients.setdefault(client.user_profile_id, []).append(client)
-    if client.all_public_streams or client.narrow != []:
+    if client.narrow_index_key is not None:
+        realm_clients_by_narrow.setdefault((client.realm_id, *client.narrow_index_key), []).append(
+            client
+        )
+    elif client.all_public_streams or client.narrow != []:
         realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
+    realm_user_ids.setdefault(client.realm_id, set()).add(client.user_profile_id)
+    event_types: Iterable[str | None] = (
+        [None] if client.event_types is None else set(client.event_types)
+    )
+    for event_type in event_types:
+        realm_event_type_clients.setdefault((client.realm_id, event_type), {})[
+            client.event_queue.id
+        ] = client
+
+
+def remove_from_realm_event_type_index(client: ClientDescriptor) -> None:
+    event_types: Iterable[str | None] = (
+        [None] if client.event_types is None else set(client.event_types)
+    )
+    for event_type in event_types:
+        key = (client.realm_id, event_type)
+        indexed_clients = realm_event_type_clients.get(key)
+        if indexed_clients is None:
+            continue
+        indexed_clients.pop(client.event_queue.id, None)
+        if len(indexed_clients) == 0:
+            del realm_event_type_clients[key]
 
 
 def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> ClientDescriptor:
@@ -543,7 +781,7 @@ def do_gc_event_queues(
     to_remove: AbstractSet[str], affected_users: AbstractSet[int], affected_realms: AbstractSet[int]
 ) -> None:
     def filter_client_dict(
-        client_dict: MutableMapping[int, list[ClientDescriptor]], key: int
+        client_dict: MutableMapping[KeyT, list[ClientDescriptor]], key: KeyT
     ) -> None:
         if key not in client_dict:
             return
@@ -560,6 +798,23 @@ def do_gc_event_queues(
     for realm_id in affected_realms:
         filter_client_dict(realm_clients_all_streams, realm_id)
 
+    for narrow_key in {
+        (clients[id].realm_id, *narrow_index_key)
+        for id in to_remove
+        if (narrow_index_key := clients[id].narrow_index_key) is not None
+    }:
+        filter_client_dict(realm_clients_by_narrow, narrow_key)
+
+    for id in to_remove:
+        client = clients[id]
+        remove_from_realm_event_type_index(client)
+        if client.user_profile_id not in user_clients:
+            user_ids = realm_user_ids.get(client.realm_id)
+            if user_ids is not None:
+                user_ids.discard(client.user_profile_id)
+                if len(user_ids) == 0:
+                    del realm_user_ids[client.realm_id]
+
     for id in to_remove:
         web_reload_clients.pop(id, None)
         for cb in gc_hooks:
@@ -779,7 +1034,7 @@ def fetch_events(
 
         if not client.event_queue.empty() or dont_block:
             response: dict[str, Any] = dict(
-                events=client.event_queue.contents(),
+                events=client.get_events_for_response(),
             )
             if orig_queue_id is None:
                 response["queue_id"] = queue_id
@@ -1023,7 +1278,9 @@ class ClientInfo(TypedDict):
 
 
 def get_client_info_for_message_event(
-    event_template: Mapping[str, Any], users: Iterable[Mapping[str, Any]]
+    event_template: Mapping[str, Any],
+    users: Iterable[Mapping[str, Any]],
+    realm_id: int | None = None,
 ) -> dict[str, ClientInfo]:
     """
     Return client info for all the clients interested in a message.
@@ -1039,39 +1296,59 @@ def get_client_info_for_message_event(
     def is_sender_client(client: ClientDescriptor) -> bool:
         return (sender_queue_id is not None) and client.event_queue.id == sender_queue_id
 
+    # Queues with a narrow restricted to a channel (and perhaps topic)
+    # only need to be visited for messages matching that narrow.
+    message_narrow_keys: set[NarrowIndexKey] = set()
+    if "message_dict" in event_template:
+        message_narrow_keys = get_message_narrow_index_keys(event_template["message_dict"])
+
     # If we're on a public stream, look for clients (typically belonging to
-    # bots) that are registered to get events for ALL streams.
+    # bots) that are registered to get events for ALL streams, or for
+    # narrows this message may match.
     if "stream_name" in event_template and not event_template.get("invite_only"):
-        realm_id = event_template["realm_id"]
-        for client in get_client_descriptors_for_realm_all_streams(realm_id):
+        public_stream_realm_id: int = event_template["realm_id"]
+        public_stream_clients = [
+            get_client_descriptors_for_realm_all_streams(public_stream_realm_id),
+            *(
+                get_client_descriptors_for_realm_narrow(public_stream_realm_id, narrow_key)
+                for narrow_key in message_narrow_keys
+            ),
+        ]
+        for client in itertools.chain.from_iterable(public_stream_clients):
             send_to_clients[client.event_queue.id] = dict(
                 client=client,
                 flags=[],
                 is_sender=is_sender_client(client),
             )
 
-    for user_data in users:
-        user_profile_id: int = user_data["id"]
-        flags: Collection[str] = user_data.get("flags", [])
-
-        for client in get_client_descriptors_for_user(user_profile_id):
-            send_to_clients[client.event_queue.id] = dict(
-                client=client,
-                flags=flags,
-                is_sender=is_sender_client(client),
-            )
+    flags_by_user_id: dict[int, Collection[str]] = {
+        user_data["id"]: user_data.get("flags", []) for user_data in users
+    }
+    for client in get_client_descriptors_for_users(flags_by_user_id.keys(), "message", realm_id):
+        if (
+            client.narrow_index_key is not None
+            and client.narrow_index_key not in message_narrow_keys
+        ):
+            continue
+        send_to_clients[client.event_queue.id] = dict(
+            client=client,
+            flags=flags_by_user_id[client.user_profile_id],
+            is_sender=is_sender_client(client),
+        )
 
     return send_to_clients
 
 
 def process_message_event(
-    event_template: Mapping[str, Any], users: Collection[Mapping[str, Any]]
+    event_template: Mapping[str, Any],
+    users: Collection[Mapping[str, Any]],
+    realm_id: int | None = None,
 ) -> None:
     """See
     https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html
     for high-level documentation on this subsystem.
     """
-    send_to_clients = get_client_info_for_message_event(event_template, users)
+    send_to_clients = get_client_info_for_message_event(event_template, users, realm_id)
 
     presence_idle_user_ids = set(event_template.get("presence_idle_user_ids", []))
     online_push_user_ids = set(event_template.get("online_push_user_ids", []))
@@ -1285,7 +1562,9 @@ def process_message_event(
         client.add_event(user_event)
 
 
-def process_presence_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_presence_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     if "user_id" not in event:
         # We only recently added `user_id` to presence data.
         # Any old events in our queue can just be dropped,
@@ -1312,49 +1591,50 @@ def process_presence_event(event: Mapping[str, Any], users: Iterable[int]) -> No
         presences={str(event["user_id"]): event["modern_presence"]},
     )
 
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(event):
-                if client.simplified_presence_events:
-                    client.add_event(modern_event)
-                elif client.slim_presence:
-                    client.add_event(slim_event)
-                else:
-                    client.add_event(legacy_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(event):
+            if client.simplified_presence_events:
+                client.add_event(modern_event)
+            elif client.slim_presence:
+                client.add_event(slim_event)
+            else:
+                client.add_event(legacy_event)
 
 
-def process_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(event):
-                client.add_event(event)
+def process_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(event):
+            client.add_event(event)
 
 
-def process_deletion_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if not client.accepts_event(event):
-                continue
+def process_deletion_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if not client.accepts_event(event):
+            continue
 
-            deletion_event = event
-            if deletion_event.get("topic") == "" and not client.empty_topic_name:
-                deletion_event = dict(event)
-                deletion_event["topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
-
-            # For clients which support message deletion in bulk, we
-            # send a list of msgs_ids together, otherwise we send a
-            # delete event for each message.  All clients will be
-            # required to support bulk_message_deletion in the future;
-            # this logic is intended for backwards-compatibility only.
-            if client.bulk_message_deletion:
-                client.add_event(deletion_event)
-                continue
+        deletion_event = event
+        if deletion_event.get("topic") == "" and not client.empty_topic_name:
+            deletion_event = dict(event)
+            deletion_event["topic"] = Message.EMPTY_TOPIC_FALLBACK_NAME
+
+        # For clients which support message deletion in bulk, we
+        # send a list of msgs_ids together, otherwise we send a
+        # delete event for each message.  All clients will be
+        # required to support bulk_message_deletion in the future;
+        # this logic is intended for backwards-compatibility only.
+        if client.bulk_message_deletion:
+            client.add_event(deletion_event)
+            continue
 
-            for message_id in deletion_event["message_ids"]:
-                compatibility_event = dict(deletion_event)
-                compatibility_event["message_id"] = message_id
-                del compatibility_event["message_ids"]
-                client.add_event(compatibility_event)
+        for message_id in deletion_event["message_ids"]:
+            compatibility_event = dict(deletion_event)
+            compatibility_event["message_id"] = message_id
+            del compatibility_event["message_ids"]
+            client.add_event(compatibility_event)
 
 
 def process_message_update_event(
@@ -1498,7 +1778,9 @@ def process_message_update_event(
                 client.add_event(user_event_copy)
 
 
-def process_custom_profile_fields_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_custom_profile_fields_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     pronouns_type_unsupported_fields = copy.deepcopy(event["fields"])
     for field in pronouns_type_unsupported_fields:
         if field["type"] == CustomProfileField.PRONOUNS:
@@ -1508,24 +1790,24 @@ def process_custom_profile_fields_event(event: Mapping[str, Any], users: Iterabl
         type="custom_profile_fields", fields=pronouns_type_unsupported_fields
     )
 
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(event):
-                if not client.pronouns_field_type_supported:
-                    client.add_event(pronouns_type_unsupported_event)
-                    continue
-                client.add_event(event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(event):
+            if not client.pronouns_field_type_supported:
+                client.add_event(pronouns_type_unsupported_event)
+                continue
+            client.add_event(event)
 
 
-def process_realm_user_add_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_realm_user_add_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     user_add_event = dict(event)
     event_for_inaccessible_user = user_add_event.pop("inaccessible_user", False)
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(user_add_event):
-                if event_for_inaccessible_user and client.user_list_incomplete:
-                    continue
-                client.add_event(user_add_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(user_add_event):
+            if event_for_inaccessible_user and client.user_list_incomplete:
+                continue
+            client.add_event(user_add_event)
 
 
 def maybe_enqueue_notifications_for_message_update(
@@ -1592,59 +1874,65 @@ def maybe_enqueue_notifications_for_message_update(
     )
 
 
-def process_user_group_creation_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_user_group_creation_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     group_creation_event = dict(event)
     # 'for_reactivation' field is no longer needed and can be popped, as we now
     # know whether this event was sent for creating the group or reactivating
     # the group and we can avoid sending the reactivation event to client with
     # `include_deactivated_groups` client capability set to true.
     event_for_reactivation = group_creation_event.pop("for_reactivation", False)
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(group_creation_event):
-                if event_for_reactivation and client.include_deactivated_groups:
-                    continue
-                client.add_event(group_creation_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(group_creation_event):
+            if event_for_reactivation and client.include_deactivated_groups:
+                continue
+            client.add_event(group_creation_event)
 
 
-def process_user_group_name_update_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_user_group_name_update_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     user_group_event = dict(event)
     # 'deactivated' field is no longer needed and can be popped, as we now
     # know whether the group that was renamed is deactivated or not and can
     # avoid sending the event to client with 'include_deactivated_groups'
     # client capability set to false.
     event_for_deactivated_group = user_group_event.pop("deactivated", False)
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(user_group_event):
-                if event_for_deactivated_group and not client.include_deactivated_groups:
-                    continue
-                client.add_event(user_group_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(user_group_event):
+            if event_for_deactivated_group and not client.include_deactivated_groups:
+                continue
+            client.add_event(user_group_event)
 
 
-def process_stream_creation_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_stream_creation_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     stream_create_event = dict(event)
     event_for_unarchiving_stream = stream_create_event.pop("for_unarchiving", False)
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(stream_create_event):
-                if event_for_unarchiving_stream and client.archived_channels:
-                    continue
-                client.add_event(stream_create_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(stream_create_event):
+            if event_for_unarchiving_stream and client.archived_channels:
+                continue
+            client.add_event(stream_create_event)
 
 
-def process_stream_deletion_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_stream_deletion_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     stream_delete_event = dict(event)
     event_for_archiving_stream = stream_delete_event.pop("for_archiving", False)
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if client.accepts_event(stream_delete_event):
-                if event_for_archiving_stream and client.archived_channels:
-                    continue
-                client.add_event(stream_delete_event)
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if client.accepts_event(stream_delete_event):
+            if event_for_archiving_stream and client.archived_channels:
+                continue
+            client.add_event(stream_delete_event)
 
 
-def process_user_topic_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_user_topic_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     empty_topic_name_fallback_event: Mapping[str, Any] | dict[str, Any]
     if event.get("topic_name") == "":
         empty_topic_name_fallback_event = dict(event)
@@ -1652,19 +1940,18 @@ def process_user_topic_event(event: Mapping[str, Any], users: Iterable[int]) ->
     else:
         empty_topic_name_fallback_event = event
 
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if not client.accepts_event(event):
-                continue
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if not client.accepts_event(event):
+            continue
 
-            if client.empty_topic_name:
-                client.add_event(event)
-            else:
-                client.add_event(empty_topic_name_fallback_event)
+        if client.empty_topic_name:
+            client.add_event(event)
+        else:
+            client.add_event(empty_topic_name_fallback_event)
 
 
 def process_stream_typing_notification_event(
-    event: Mapping[str, Any], users: Iterable[int]
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
 ) -> None:
     empty_topic_name_fallback_event: Mapping[str, Any] | dict[str, Any]
     if event.get("topic") == "":
@@ -1673,18 +1960,19 @@ def process_stream_typing_notification_event(
     else:
         empty_topic_name_fallback_event = event
 
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if not client.accepts_event(event):
-                continue
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if not client.accepts_event(event):
+            continue
 
-            if client.empty_topic_name:
-                client.add_event(event)
-            else:
-                client.add_event(empty_topic_name_fallback_event)
+        if client.empty_topic_name:
+            client.add_event(event)
+        else:
+            client.add_event(empty_topic_name_fallback_event)
 
 
-def process_mark_message_unread_event(event: Mapping[str, Any], users: Iterable[int]) -> None:
+def process_mark_message_unread_event(
+    event: Mapping[str, Any], users: Collection[int], realm_id: int | None = None
+) -> None:
     empty_topic_name_fallback_event = copy.deepcopy(dict(event))
     for message_id, message_detail in empty_topic_name_fallback_event["message_details"].items():
         if message_detail["type"] == "stream" and message_detail.get("topic") == "":
@@ -1692,55 +1980,62 @@ def process_mark_message_unread_event(event: Mapping[str, Any], users: Iterable[
                 Message.EMPTY_TOPIC_FALLBACK_NAME
             )
 
-    for user_profile_id in users:
-        for client in get_client_descriptors_for_user(user_profile_id):
-            if not client.accepts_event(event):
-                continue
+    for client in get_client_descriptors_for_users(users, event["type"], realm_id):
+        if not client.accepts_event(event):
+            continue
 
-            if client.empty_topic_name:
-                client.add_event(event)
-            else:
-                client.add_event(empty_topic_name_fallback_event)
+        if client.empty_topic_name:
+            client.add_event(event)
+        else:
+            client.add_event(empty_topic_name_fallback_event)
 
 
 def process_notification(notice: Mapping[str, Any]) -> None:
+    if "notices" in notice:
+        # A batch of notices, sent by TornadoEventBatch.
+        for batched_notice in notice["notices"]:
+            process_notification(batched_notice)
+        return
+
     event: Mapping[str, Any] = notice["event"]
     users: list[int] | list[Mapping[str, Any]] = notice["users"]
+    # Notices queued by older servers don't include realm_id.
+    realm_id: int | None = notice.get("realm_id")
     start_time = time.perf_counter()
 
     if event["type"] == "message":
-        process_message_event(event, cast(list[Mapping[str, Any]], users))
+        process_message_event(event, cast(list[Mapping[str, Any]], users), realm_id)
     elif event["type"] == "update_message":
         process_message_update_event(event, cast(list[Mapping[str, Any]], users))
     elif event["type"] == "delete_message":
-        process_deletion_event(event, cast(list[int], users))
+        process_deletion_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "presence":
-        process_presence_event(event, cast(list[int], users))
+        process_presence_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "custom_profile_fields":
-        process_custom_profile_fields_event(event, cast(list[int], users))
+        process_custom_profile_fields_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "realm_user" and event["op"] == "add":
-        process_realm_user_add_event(event, cast(list[int], users))
+        process_realm_user_add_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "user_group" and event["op"] == "update" and "name" in event["data"]:
         # Only name can be changed for deactivated groups, so we handle the
         # event sent for updating name separately for clients with different
         # capabilities.
-        process_user_group_name_update_event(event, cast(list[int], users))
+        process_user_group_name_update_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "user_group" and event["op"] == "add":
-        process_user_group_creation_event(event, cast(list[int], users))
+        process_user_group_creation_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "user_topic":
-        process_user_topic_event(event, cast(list[int], users))
+        process_user_topic_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "typing" and event["message_type"] == "stream":
-        process_stream_typing_notification_event(event, cast(list[int], users))
+        process_stream_typing_notification_event(event, cast(list[int], users), realm_id)
     elif (
         event["type"] == "update_message_flags"
         and event["op"] == "remove"
         and event["flag"] == "read"
     ):
-        process_mark_message_unread_event(event, cast(list[int], users))
+        process_mark_message_unread_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "stream" and event["op"] == "create":
-        process_stream_creation_event(event, cast(list[int], users))
+        process_stream_creation_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "stream" and event["op"] == "delete":
-        process_stream_deletion_event(event, cast(list[int], users))
+        process_stream_deletion_event(event, cast(list[int], users), realm_id)
     elif event["type"] == "cleanup_queue":
         # cleanup_event_queue may generate this event to forward cleanup
         # requests to the right shard.
@@ -1754,7 +2049,7 @@ def process_notification(notice: Mapping[str, Any]) -> None:
         else:
             client.cleanup()
     else:
-        process_event(event, cast(list[int], users))
+        process_event(event, cast(list[int], users), realm_id)
     logging.debug(
         "Tornado: Event %s for %s users took %sms",
         event["type"],
@@ -1772,10 +2067,13 @@ def get_wrapped_process_notification(queue_name: str) -> Callable[[list[dict[str
         )
 
     def wrapped_process_notification(notices: list[dict[str, Any]]) -> None:
-        for notice in notices:
-            try:
-                process_notification(notice)
-            except Exception:
-                retry_event(queue_name, notice, failure_processor)
+        for notice_or_batch in notices:
+            # Unpack batched notices, so that a failure only retries
+            # the notice that failed.
+            for notice in notice_or_batch.get("notices", [notice_or_batch]):
+                try:
+                    process_notification(notice)
+                except Exception:
+                    retry_event(queue_name, notice, failure_processor)
 
     return wrapped_process_notification
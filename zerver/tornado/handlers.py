@@ -18,6 +18,7 @@ from tornado.wsgi import WSGIContainer
 from typing_extensions import override
 
 from zerver.lib.response import AsynchronousResponse, json_response
+from zerver.lib.zstd_level9 import compress as zstd_compress
 from zerver.tornado.descriptors import get_descriptor_by_handler_id
 
 current_handler_id = 0
@@ -25,6 +26,21 @@ handlers: dict[int, "AsyncDjangoHandler"] = {}
 fake_wsgi_container = WSGIContainer(lambda environ, start_response: [])
 
 
+# Long-poll responses smaller than this are not worth compressing;
+# most are a handful of heartbeat or presence events.
+EVENTS_COMPRESSION_MIN_BYTES = 1024
+
+
+def accepts_zstd_encoding(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "zstd":
+            continue
+        params = params.replace(" ", "")
+        return params not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
 def get_handler_by_id(handler_id: int) -> Optional["AsyncDjangoHandler"]:
     return handlers.get(handler_id)
 
@@ -149,6 +165,22 @@ class AsyncDjangoHandler(tornado.web.RequestHandler):
         # tornado.web.RequestHandler (which is how Tornado prepares a
         # response to write).
 
+        # Compress the response content if the client accepts zstd.
+        # Batches of events are highly repetitive JSON, so this
+        # substantially reduces bytes on the wire for long-polling
+        # clients.
+        content = response.content
+        if (
+            len(content) >= EVENTS_COMPRESSION_MIN_BYTES
+            and not response.has_header("Content-Encoding")
+            and accepts_zstd_encoding(self.request.headers.get("Accept-Encoding", ""))
+        ):
+            content = zstd_compress(content)
+            response["Content-Encoding"] = "zstd"
+            if response.has_header("Content-Length"):
+                response["Content-Length"] = str(len(content))
+            patch_vary_headers(response, ("Accept-Encoding",))
+
         # Copy the HTTP status code.
         self.set_status(response.status_code)
 
@@ -163,7 +195,7 @@ class AsyncDjangoHandler(tornado.web.RequestHandler):
         self._new_cookies.append(response.cookies)
 
         # Copy the response content
-        self.write(response.content)
+        self.write(content)
 
         # Close the connection.
         # While writing the response, we might realize that the
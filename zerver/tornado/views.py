@@ -218,6 +218,10 @@ def get_events_backend(
         Json[bool],
         ApiParamConfig(documentation_status=DocumentationStatus.INTENTIONALLY_UNDOCUMENTED),
     ] = False,
+    delta_encoded_events: Annotated[
+        Json[bool],
+        ApiParamConfig(documentation_status=DocumentationStatus.INTENTIONALLY_UNDOCUMENTED),
+    ] = False,
 ) -> HttpResponse:
     if narrow is None:
         narrow = []
@@ -260,6 +264,7 @@ def get_events_backend(
             empty_topic_name=empty_topic_name,
             simplified_presence_events=simplified_presence_events,
             is_bot=user_profile.is_bot,
+            delta_encoded_events=delta_encoded_events,
         )
 
     result = in_tornado_thread(fetch_events)(
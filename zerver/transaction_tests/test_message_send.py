@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
+
+from zerver.actions.message_send import (
+    PARALLEL_PREP_MAX_WORKERS,
+    PARALLEL_PREP_MIN_BATCH_SIZE,
+    SendMessageRequest,
+    internal_prep_stream_message_by_name,
+    prep_messages_in_parallel,
+)
+from zerver.lib.test_classes import ZulipTransactionTestCase
+from zerver.models.realms import get_realm
+
+
+class PrepMessagesInParallelTest(ZulipTransactionTestCase):
+    def test_prep_messages_in_parallel(self) -> None:
+        # Outside a transaction, large batches are prepared in
+        # threads, each with its own database connection.
+        realm = get_realm("zulip")
+        cordelia = self.example_user("cordelia")
+        contents = [f"batch message {i}" for i in range(PARALLEL_PREP_MIN_BATCH_SIZE * 2)]
+        contents[3] = ""
+
+        thread_ids: set[int] = set()
+
+        def prep_message(content: str) -> SendMessageRequest | None:
+            thread_ids.add(threading.get_ident())
+            return internal_prep_stream_message_by_name(realm, cordelia, "Verona", "batch", content)
+
+        with (
+            mock.patch(
+                "zerver.actions.message_send.ThreadPoolExecutor", wraps=ThreadPoolExecutor
+            ) as executor,
+            self.assertLogs(level="ERROR"),
+        ):
+            send_requests = prep_messages_in_parallel(
+                [partial(prep_message, content) for content in contents]
+            )
+
+        executor.assert_called_once_with(max_workers=PARALLEL_PREP_MAX_WORKERS)
+        self.assertNotIn(threading.get_ident(), thread_ids)
+        self.assertEqual(
+            [
+                send_request.message.content if send_request is not None else ""
+                for send_request in send_requests
+            ],
+            contents,
+        )
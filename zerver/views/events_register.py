@@ -9,7 +9,12 @@ from pydantic import Json
 
 from zerver.context_processors import get_valid_realm_from_request
 from zerver.lib.compatibility import is_pronouns_field_type_supported
-from zerver.lib.events import DEFAULT_CLIENT_CAPABILITIES, ClientCapabilities, do_events_register
+from zerver.lib.events import (
+    DEFAULT_CLIENT_CAPABILITIES,
+    ClientCapabilities,
+    ResumeState,
+    do_events_register,
+)
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
 from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
 from zerver.lib.request import RequestNotes
@@ -53,6 +58,7 @@ def events_register_backend(
     queue_lifespan_secs: Annotated[
         Json[int], ApiParamConfig(documentation_status=DocumentationStatus.DOCUMENTATION_PENDING)
     ] = 0,
+    resume: Json[ResumeState] | None = None,
     slim_presence: Json[bool] = False,
 ) -> HttpResponse:
     if narrow is None:
@@ -132,5 +138,6 @@ def events_register_backend(
         fetch_event_types=fetch_event_types,
         spectator_requested_language=spectator_requested_language,
         pronouns_field_type_supported=pronouns_field_type_supported,
+        resume=resume,
     )
     return json_success(request, data=ret)
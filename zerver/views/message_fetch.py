@@ -1,16 +1,18 @@
 from collections.abc import Iterable
 from typing import Annotated
 
+import orjson
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.db import connection, transaction
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseBase, StreamingHttpResponse
 from django.utils.translation import gettext as _
-from pydantic import Json, NonNegativeInt
+from pydantic import Json, NonNegativeInt, PositiveInt
 from sqlalchemy.sql import column, func
 from sqlalchemy.types import Integer, Text
 
 from zerver.context_processors import get_valid_realm_from_request
+from zerver.lib.channel_history import iter_channel_history
 from zerver.lib.exceptions import (
     IncompatibleParametersError,
     JsonableError,
@@ -31,9 +33,11 @@ from zerver.lib.narrow import (
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
-from zerver.lib.topic import MATCH_TOPIC
+from zerver.lib.streams import access_stream_by_id
+from zerver.lib.topic import MATCH_TOPIC, maybe_rename_general_chat_to_empty_topic
 from zerver.lib.topic_sqlalchemy import topic_column_sa
 from zerver.lib.typed_endpoint import ApiParamConfig, typed_endpoint
+from zerver.lib.user_message import get_user_message_flags_including_history
 from zerver.models import UserMessage, UserProfile
 
 MAX_MESSAGES_PER_FETCH = 5000
@@ -274,15 +278,9 @@ def get_messages_backend(
             assert user_profile is not None
             result_message_ids = [row[0] for row in rows]
 
-            # TODO: This could be done with an outer join instead of two queries
-            um_rows = UserMessage.objects.filter(
-                user_profile=user_profile, message_id__in=result_message_ids
+            user_message_flags = get_user_message_flags_including_history(
+                user_profile, result_message_ids
             )
-            user_message_flags = {um.message_id: um.flags_list() for um in um_rows}
-
-            for message_id in result_message_ids:
-                if message_id not in user_message_flags:
-                    user_message_flags[message_id] = ["read", "historical"]
         else:
             for row in rows:
                 message_id = row[0]
@@ -386,3 +384,43 @@ def messages_in_narrow_backend(
             )
 
     return json_success(request, data={"messages": search_fields})
+
+
+@typed_endpoint
+def get_channel_history_backend(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    after_id: Json[NonNegativeInt] = 0,
+    apply_markdown: Json[bool] = True,
+    channel_id: Json[int],
+    limit: Json[PositiveInt] | None = None,
+    topic_name: Annotated[str | None, ApiParamConfig("topic")] = None,
+) -> HttpResponseBase:
+    """Streams the messages in a channel, or one of its topics, with
+    an ID greater than after_id, as one JSON message object per line
+    in increasing order of ID.
+
+    This is intended for bots which replay a channel's whole history;
+    a client that is interrupted can resume by passing the last ID it
+    received as after_id.
+    """
+    stream, _sub = access_stream_by_id(user_profile, channel_id)
+    if topic_name is not None:
+        topic_name = maybe_rename_general_chat_to_empty_topic(topic_name)
+
+    messages = iter_channel_history(
+        user_profile,
+        stream,
+        topic_name=topic_name,
+        after_message_id=after_id,
+        limit=limit,
+        apply_markdown=apply_markdown,
+    )
+    response = StreamingHttpResponse(
+        (orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE) for message in messages),
+        content_type="application/x-ndjson",
+    )
+    # Let clients process messages as soon as they are sent.
+    response["X-Accel-Buffering"] = "no"
+    return response
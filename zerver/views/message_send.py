@@ -1,23 +1,34 @@
 from collections.abc import Iterable, Sequence
 from email.headerregistry import Address
+from functools import partial
 from typing import Annotated, Literal, cast
 
+import orjson
 from django.core import validators
 from django.core.exceptions import ValidationError
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseBase, StreamingHttpResponse
 from django.utils.translation import gettext as _
-from pydantic import Json, StringConstraints
+from pydantic import BaseModel, ConfigDict, Json, StringConstraints
+from pydantic import ValidationError as PydanticValidationError
 
 from zerver.actions.message_send import (
+    check_message,
     check_send_message,
     compute_irc_user_fullname,
     compute_jabber_user_fullname,
     create_mirror_user_if_needed,
+    do_send_messages,
     extract_private_recipients,
     extract_stream_indicator,
+    get_validated_emails,
+    get_validated_user_ids,
+    prep_messages_in_parallel,
 )
+from zerver.lib.addressee import Addressee
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.markdown import render_message_markdown
+from zerver.lib.message import SendMessageRequest
+from zerver.lib.rate_limiter import rate_limit_user
 from zerver.lib.request import RequestNotes
 from zerver.lib.response import json_success
 from zerver.lib.typed_endpoint import (
@@ -268,6 +279,185 @@ def send_message_backend(
     return json_success(request, data=data)
 
 
+# Each message in a bulk send counts against the sender's API rate
+# limit; we also bound how many messages one request can contain.
+BULK_SEND_MAX_MESSAGES = 500
+# Messages are sent, and their results streamed back, in chunks of
+# this size, each in its own do_send_messages transaction.
+BULK_SEND_CHUNK_SIZE = 100
+
+
+class BulkSendMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["direct", "private", "stream", "channel"]
+    to: int | str | list[int] | list[str]
+    topic: Annotated[str | None, StringConstraints(strip_whitespace=True)] = None
+    content: str
+    puppet_display_name: Annotated[str | None, StringConstraints(max_length=100)] = None
+    puppet_avatar_url: Annotated[
+        str | None, StringConstraints(max_length=500, pattern=r"^(|https://[^\s]+)$")
+    ] = None
+    puppet_color: Annotated[
+        str | None, StringConstraints(pattern=r"^(|#([0-9a-fA-F]{3}|[0-9a-fA-F]{6}))$")
+    ] = None
+    persona_id: int | None = None
+    whisper_to_user_ids: list[int] | None = None
+    whisper_to_group_ids: list[int] | None = None
+    whisper_to_puppet_ids: list[int] | None = None
+    whisper_to_persona_ids: list[int] | None = None
+
+
+def get_bulk_send_message_to(
+    recipient_type_name: str, to: int | str | list[int] | list[str]
+) -> Sequence[int] | Sequence[str]:
+    if recipient_type_name == "stream":
+        if isinstance(to, list):
+            raise JsonableError(_("Expected exactly one channel"))
+        if isinstance(to, int):
+            return [to]
+        return [extract_stream_indicator(to)]
+
+    if isinstance(to, int):
+        return [to]
+    if isinstance(to, str):
+        return extract_private_recipients(to)
+    if all(isinstance(to_item, int) for to_item in to):
+        return get_validated_user_ids(cast(list[int], to))
+    return get_validated_emails(cast(list[str], to))
+
+
+@typed_endpoint
+def send_messages_bulk_backend(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    messages_ndjson: Annotated[str, ApiParamConfig(argument_type_is_body=True)],
+    read_by_sender: Json[bool] | None = None,
+) -> HttpResponseBase:
+    """Sends a batch of messages, given as a request body with one JSON
+    message object per line, and streams back one JSON result per
+    line, in the same order.
+
+    The whole batch is validated before anything is sent; errors
+    that only show up while sending a specific message (e.g. a
+    channel the sender cannot post in) are reported in that
+    message's result line, without affecting the rest of the batch.
+    """
+    messages: list[BulkSendMessage] = []
+    for line_number, line in enumerate(messages_ndjson.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            messages.append(BulkSendMessage.model_validate_json(line))
+        except PydanticValidationError as e:
+            error = e.errors()[0]
+            error_msg = error["msg"]
+            if error["loc"]:
+                error_msg = ".".join(str(loc) for loc in error["loc"]) + ": " + error_msg
+            raise JsonableError(
+                _("Invalid message on line {line_number}: {error}").format(
+                    line_number=line_number, error=error_msg
+                )
+            )
+    if not messages:
+        raise JsonableError(_("No messages to send"))
+    if len(messages) > BULK_SEND_MAX_MESSAGES:
+        raise JsonableError(
+            _("Too many messages; at most {max_messages} can be sent at once.").format(
+                max_messages=BULK_SEND_MAX_MESSAGES
+            )
+        )
+
+    # The request itself was charged as one API call; charge the rest
+    # of the batch before sending any of it, so that a bulk send costs
+    # the same as sending its messages one at a time.
+    for _message in messages[1:]:
+        rate_limit_user(request, user_profile, domain="api_by_user")
+
+    client = RequestNotes.get_notes(request).client
+    assert client is not None
+    if read_by_sender is None:
+        read_by_sender = client.default_read_by_sender()
+
+    def prep_message(
+        index: int, message: BulkSendMessage, errors: dict[int, JsonableError]
+    ) -> SendMessageRequest | None:
+        recipient_type_name = message.type
+        if recipient_type_name == "direct":
+            recipient_type_name = "private"
+        elif recipient_type_name == "channel":
+            recipient_type_name = "stream"
+        try:
+            message_to = get_bulk_send_message_to(recipient_type_name, message.to)
+            addressee = Addressee.legacy_build(
+                user_profile, recipient_type_name, message_to, message.topic
+            )
+            return check_message(
+                user_profile,
+                client,
+                addressee,
+                message.content,
+                user_profile.realm,
+                puppet_display_name=message.puppet_display_name,
+                puppet_avatar_url=message.puppet_avatar_url,
+                puppet_color=message.puppet_color,
+                persona_id=message.persona_id,
+                whisper_to_user_ids=message.whisper_to_user_ids,
+                whisper_to_group_ids=message.whisper_to_group_ids,
+                whisper_to_puppet_ids=message.whisper_to_puppet_ids,
+                whisper_to_persona_ids=message.whisper_to_persona_ids,
+            )
+        except JsonableError as e:
+            errors[index] = e
+            return None
+
+    # The messages are all sent before the response starts, so that a
+    # client disconnecting cannot cut the batch short, and errors are
+    # handled (and the request logged) like any other request's.
+    result_lines: list[bytes] = []
+    for chunk_start in range(0, len(messages), BULK_SEND_CHUNK_SIZE):
+        chunk = messages[chunk_start : chunk_start + BULK_SEND_CHUNK_SIZE]
+        errors: dict[int, JsonableError] = {}
+        send_requests = prep_messages_in_parallel(
+            [
+                partial(prep_message, index, message, errors)
+                for index, message in enumerate(chunk, start=chunk_start)
+            ]
+        )
+        try:
+            sent_message_results = iter(
+                do_send_messages(
+                    send_requests,
+                    mark_as_read=[user_profile.id] if read_by_sender else [],
+                )
+            )
+        except JsonableError as e:
+            for index, send_request in enumerate(send_requests, start=chunk_start):
+                if send_request is not None:
+                    errors[index] = e
+            sent_message_results = iter([])
+
+        for index, send_request in enumerate(send_requests, start=chunk_start):
+            result: dict[str, object]
+            if index in errors:
+                error = errors[index]
+                result = {"index": index, "result": "error", "msg": error.msg, **error.data}
+            else:
+                assert send_request is not None
+                result = {
+                    "index": index,
+                    "result": "success",
+                    "id": next(sent_message_results).message_id,
+                }
+            result_lines.append(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
+
+    response = StreamingHttpResponse(result_lines, content_type="application/x-ndjson")
+    # Let clients start processing results while the rest arrive.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @typed_endpoint
 def zcommand_backend(
     request: HttpRequest, user_profile: UserProfile, *, command: str
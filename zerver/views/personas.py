@@ -9,6 +9,7 @@ from zerver.actions.personas import (
     do_get_personas,
     do_update_persona,
 )
+from zerver.lib.markdown.rendering_context import get_realm_rendering_context
 from zerver.lib.response import json_success
 from zerver.lib.typed_endpoint import PathOnly, typed_endpoint
 from zerver.models import UserProfile
@@ -126,24 +127,28 @@ def delete_persona(
     return json_success(request)
 
 
+@typed_endpoint
 def get_realm_personas(
     request: HttpRequest,
     user_profile: UserProfile,
+    *,
+    query: str | None = None,
 ) -> HttpResponse:
-    """Get active personas in the realm for @-mention typeahead.
+    """Get active personas in the realm for @-mention typeahead; with
+    query, only those whose names start with it.
 
     Limited to 200 most recently created personas to prevent
     performance issues in large realms.
     """
-    personas = (
-        UserPersona.objects.filter(
-            user__realm=user_profile.realm,
-            user__is_active=True,
-            is_active=True,
-        )
-        .select_related("user")
-        .order_by("-created_at")[:200]
+    personas = UserPersona.objects.filter(
+        user__realm=user_profile.realm,
+        user__is_active=True,
+        is_active=True,
     )
+    if query is not None:
+        mention_index = get_realm_rendering_context(user_profile.realm_id).get_mention_index(None)
+        personas = personas.filter(id__in=mention_index.search_prefix(query, "persona"))
+    personas = personas.select_related("user").order_by("-created_at")[:200]
 
     return json_success(
         request,
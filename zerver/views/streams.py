@@ -60,6 +60,7 @@ from zerver.lib.exceptions import (
     JsonableError,
     OrganizationOwnerRequiredError,
 )
+from zerver.lib.markdown.rendering_context import get_realm_rendering_context
 from zerver.lib.mention import MentionBackend, silent_mention_syntax_for_user
 from zerver.lib.message import bulk_access_stream_messages_query
 from zerver.lib.response import json_success
@@ -1428,8 +1429,10 @@ def get_stream_puppets(
     user_profile: UserProfile,
     *,
     stream_id: Annotated[NonNegativeInt, ApiParamConfig("stream", path_only=True)],
+    query: str | None = None,
 ) -> HttpResponse:
-    """Get all puppet names registered in a stream for @-mention autocomplete."""
+    """Get the puppet names registered in a stream for @-mention
+    autocomplete; with query, only those starting with it."""
     from zerver.actions.stream_puppets import get_stream_puppets
 
     (stream, _sub) = access_stream_by_id(user_profile, stream_id)
@@ -1437,7 +1440,13 @@ def get_stream_puppets(
     if not stream.enable_puppet_mode:
         raise JsonableError(_("Puppet mode is not enabled for this channel"))
 
-    puppets = get_stream_puppets(stream)
+    puppet_ids = None
+    if query is not None:
+        mention_index = get_realm_rendering_context(user_profile.realm_id).get_mention_index(
+            stream.id
+        )
+        puppet_ids = mention_index.search_prefix(query, "puppet")
+    puppets = get_stream_puppets(stream, puppet_ids)
     return json_success(request, data={"puppets": puppets})
 
 
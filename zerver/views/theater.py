@@ -1,33 +1,38 @@
 import secrets
+from typing import Annotated
 
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
 from django.utils.cache import patch_cache_control
+from pydantic import Json, NonNegativeInt
 
 from zerver.decorator import zulip_login_required
-from zerver.lib.home import build_page_params_for_home_page_load, get_user_permission_info
+from zerver.lib.home import get_user_permission_info
 from zerver.lib.request import RequestNotes
+from zerver.lib.response import json_success
+from zerver.lib.streams import access_stream_by_id
+from zerver.lib.theater import (
+    MAX_THEATER_BOOTSTRAP_MESSAGES,
+    build_page_params_for_theater_page_load,
+    fetch_theater_bootstrap,
+)
+from zerver.lib.topic import maybe_rename_general_chat_to_empty_topic
+from zerver.lib.typed_endpoint import ApiParamConfig, typed_endpoint
+from zerver.models import UserProfile
 
 
 @zulip_login_required
 def theater_view(request: HttpRequest) -> HttpResponse:
     """
     Theater Mode view - an immersive, narrative-focused frontend for RP sessions.
-    Reuses the same state hydration as the main app but renders through a Svelte
+    Registers an event queue for just the events and state it renders,
+    rather than the main app's full state, and renders through a Svelte
     frontend with theatrical styling.
     """
     user_profile = request.user
-    realm = user_profile.realm
-
-    queue_id, page_params = build_page_params_for_home_page_load(
-        request=request,
-        user_profile=user_profile,
-        realm=realm,
-        insecure_desktop_app=False,
-        narrow=[],
-        narrow_stream=None,
-        narrow_topic_name=None,
-    )
+    assert isinstance(user_profile, UserProfile)
+
+    queue_id, page_params = build_page_params_for_theater_page_load(request, user_profile)
 
     log_data = RequestNotes.get_notes(request).log_data
     if log_data is not None:
@@ -48,3 +53,28 @@ def theater_view(request: HttpRequest) -> HttpResponse:
     )
     patch_cache_control(response, no_cache=True, no_store=True, must_revalidate=True)
     return response
+
+
+@typed_endpoint
+def theater_bootstrap(
+    request: HttpRequest,
+    user_profile: UserProfile,
+    *,
+    channel_id: Json[int],
+    num_messages: Json[NonNegativeInt] = 100,
+    topic_name: Annotated[str | None, ApiParamConfig("topic")] = None,
+) -> HttpResponse:
+    """Everything the theater frontend needs to render a scene, with an
+    event queue narrowed to it, in one request."""
+    stream, _sub = access_stream_by_id(user_profile, channel_id)
+    if topic_name is not None:
+        topic_name = maybe_rename_general_chat_to_empty_topic(topic_name)
+
+    data = fetch_theater_bootstrap(
+        request,
+        user_profile,
+        stream,
+        topic_name=topic_name,
+        num_messages=min(num_messages, MAX_THEATER_BOOTSTRAP_MESSAGES),
+    )
+    return json_success(request, data=data)
@@ -0,0 +1,96 @@
+import time
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.channel_history import iter_channel_history
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message import messages_for_ids
+from zerver.lib.narrow import AnchorInfo, NarrowParameter, fetch_messages
+from zerver.lib.streams import access_stream_by_name
+from zerver.models import UserMessage
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the messages per second a user can read a channel's
+history at, paging through GET /messages versus streaming it from
+GET /messages/channel_history."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user reading history", required=True)
+        parser.add_argument("--channel", help="Name of the channel to read", required=True)
+        parser.add_argument(
+            "--page-size", help="Messages per GET /messages", default=1000, type=int
+        )
+        parser.add_argument("--limit", help="Messages to read per mode", default=20000, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        stream, _sub = access_stream_by_name(user_profile, options["channel"])
+        narrow = [NarrowParameter(operator="channel", operand=stream.id)]
+
+        start = time.perf_counter()
+        paged_count = 0
+        anchor = 0
+        while paged_count < options["limit"]:
+            query_info = fetch_messages(
+                narrow=narrow,
+                user_profile=user_profile,
+                realm=realm,
+                is_web_public_query=False,
+                anchor_info=AnchorInfo(type="message_id", value=anchor),
+                include_anchor=False,
+                num_before=0,
+                num_after=min(options["page_size"], options["limit"] - paged_count),
+            )
+            message_ids = [row[0] for row in query_info.rows]
+            if not message_ids:
+                break
+            user_message_flags: dict[int, list[str]] = {
+                message_id: ["read", "historical"] for message_id in message_ids
+            }
+            for um in UserMessage.objects.filter(
+                user_profile=user_profile, message_id__in=message_ids
+            ):
+                user_message_flags[um.message_id] = um.flags_list()
+            for message in messages_for_ids(
+                message_ids=message_ids,
+                user_message_flags=user_message_flags,
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_empty_topic_name=True,
+                message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
+                user_profile=user_profile,
+                realm=realm,
+            ):
+                orjson.dumps(message)
+            paged_count += len(message_ids)
+            anchor = message_ids[-1]
+        paged_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        streamed_count = 0
+        for message in iter_channel_history(
+            user_profile,
+            stream,
+            topic_name=None,
+            after_message_id=0,
+            limit=options["limit"],
+            apply_markdown=True,
+        ):
+            orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+            streamed_count += 1
+        streamed_elapsed = time.perf_counter() - start
+
+        print(f"   paged: {paged_count} messages, {paged_count / paged_elapsed:.0f} messages/s")
+        print(
+            f"streamed: {streamed_count} messages, {streamed_count / streamed_elapsed:.0f} messages/s"
+        )
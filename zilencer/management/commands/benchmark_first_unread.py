@@ -0,0 +1,59 @@
+import time
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib import unread_conversations
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.narrow import AnchorInfo, NarrowParameter, fetch_messages
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures how long finding a user's first unread message takes,
+with and without their per-conversation unread summary."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user fetching messages", required=True)
+        parser.add_argument(
+            "--narrow", help="Narrow to fetch, as JSON", default="[]", type=orjson.loads
+        )
+        parser.add_argument("--iterations", help="Fetches per mode", default=20, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        narrow = [NarrowParameter.model_validate(term) for term in options["narrow"]]
+
+        # Build the summary up front, so both modes time the steady state.
+        unread_conversations.get_first_unread_watermark(user_profile)
+
+        timings = {}
+        anchors = set()
+        for enabled in (False, True):
+            with override_settings(UNREAD_CONVERSATIONS_ENABLED=enabled):
+                start = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    query_info = fetch_messages(
+                        narrow=narrow,
+                        user_profile=user_profile,
+                        realm=realm,
+                        is_web_public_query=False,
+                        anchor_info=AnchorInfo(type="first_unread", value=None),
+                        include_anchor=True,
+                        num_before=0,
+                        num_after=0,
+                    )
+                    anchors.add(query_info.anchor)
+                timings["summary" if enabled else "scan"] = time.perf_counter() - start
+
+        if len(anchors) != 1:
+            print(f"Anchors differ between modes: {sorted(anchors)}")
+        for mode, elapsed in timings.items():
+            print(f"{mode:>8}: {elapsed * 1000 / options['iterations']:.2f} ms per fetch")
@@ -0,0 +1,83 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.markdown import render_message_markdown
+from zerver.lib.markdown import version as markdown_version
+from zerver.lib.markdown.incremental import render_edited_message_markdown
+from zerver.lib.mention import MentionBackend, MentionData
+from zerver.models import Message
+from zerver.models.clients import get_client
+from zerver.models.streams import get_stream
+
+
+def status_message_content(blocks: int, edit_number: int) -> str:
+    sections = [f"# Deployment status\n\nLast updated: edit **{edit_number}**"]
+    sections.extend(
+        f"## Service {i}\n\n"
+        f"| Check | Result |\n| --- | --- |\n| health | *ok* |\n| latency | {i % 7 + 3}ms |\n\n"
+        f"Owner team {i % 5}, on call until the end of the week, escalate if **degraded**"
+        for i in range(blocks)
+    )
+    return "\n\n".join(sections)
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the time to re-render a large message that is edited
+repeatedly, like a bot's status message, with and without incremental
+rendering of the changed blocks."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--channel", help="Channel to render messages for", required=True)
+        parser.add_argument("--blocks", help="Sections in the status message", default=50, type=int)
+        parser.add_argument("--edits", help="Edits per mode", default=100, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        stream = get_stream(options["channel"], realm)
+        sender = realm.get_active_users().first()
+        assert sender is not None
+        mention_backend = MentionBackend(realm.id)
+
+        timings = {}
+        for mode in ("full", "incremental"):
+            content = status_message_content(options["blocks"], 0)
+            message = Message(
+                sender=sender,
+                sending_client=get_client("benchmark_incremental_edit"),
+                realm=realm,
+                recipient=stream.recipient,
+                content=content,
+                rendered_content_version=markdown_version,
+            )
+            message.rendered_content = render_message_markdown(
+                message, content, realm
+            ).rendered_content
+            start = time.perf_counter()
+            for edit_number in range(1, options["edits"] + 1):
+                content = status_message_content(options["blocks"], edit_number)
+                mention_data = MentionData(mention_backend, content, sender)
+                if mode == "incremental":
+                    rendering_result = render_edited_message_markdown(
+                        message, content, realm, mention_data
+                    )
+                    assert rendering_result is not None
+                else:
+                    rendering_result = render_message_markdown(
+                        message, content, realm, mention_data=mention_data
+                    )
+                message.content = content
+                message.rendered_content = rendering_result.rendered_content
+            timings[mode] = time.perf_counter() - start
+
+        print(f"{len(content)} character message, {options['blocks']} sections:")
+        for mode, elapsed in timings.items():
+            print(f"{mode:>12}: {elapsed / options['edits'] * 1000:.1f}ms per edit")
+        print(f"speed-up: {timings['full'] / timings['incremental']:.1f}x")
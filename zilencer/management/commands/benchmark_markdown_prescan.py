@@ -0,0 +1,68 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib.alert_words import get_alert_word_automaton
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.markdown import render_message_markdown
+from zerver.models import Message
+from zerver.models.clients import get_client
+from zerver.models.streams import get_stream
+
+PLAIN_TEXT_MESSAGES = [
+    "ok",
+    "Sounds good to me",
+    "She draws her sword and steps forward, eyes fixed on the gate.",
+    "Wait, what? I thought we agreed on Tuesday",
+    'The innkeeper shrugs: "Rooms are two silver a night, meals extra" and turns away.',
+    "Line one of a longer reply\nand a second line\n\nplus another paragraph!",
+]
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the time to render plain-text channel messages, with and
+without the pre-scan that lets them skip the Markdown processor."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--channel", help="Channel to render messages for", required=True)
+        parser.add_argument(
+            "--iterations", help="Times to render each message per mode", default=1000, type=int
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        stream = get_stream(options["channel"], realm)
+        sender = realm.get_active_users().first()
+        assert sender is not None
+        message = Message(
+            sender=sender,
+            sending_client=get_client("benchmark_markdown_prescan"),
+            realm=realm,
+            recipient=stream.recipient,
+        )
+        realm_alert_words_automaton = get_alert_word_automaton(realm)
+
+        timings = {}
+        for mode, enabled in (("markdown", False), ("prescan", True)):
+            with override_settings(PLAIN_TEXT_PRESCAN_ENABLED=enabled):
+                start = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    for content in PLAIN_TEXT_MESSAGES:
+                        render_message_markdown(
+                            message,
+                            content,
+                            realm_alert_words_automaton=realm_alert_words_automaton,
+                        )
+                timings[mode] = time.perf_counter() - start
+
+        renders = options["iterations"] * len(PLAIN_TEXT_MESSAGES)
+        for mode, elapsed in timings.items():
+            print(f"{mode:>8}: {elapsed / renders * 1000000:.0f}us per message")
+        print(f"speed-up: {timings['markdown'] / timings['prescan']:.1f}x")
@@ -0,0 +1,60 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message import messages_for_ids
+from zerver.lib.message_cache import message_dict_lru
+from zerver.models import UserMessage
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the messages per second that GET /messages can build
+payloads for, from the per-process message cache, for a user's most
+recent messages."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user fetching messages", required=True)
+        parser.add_argument("--batch-size", help="Messages per fetch", default=1000, type=int)
+        parser.add_argument("--iterations", help="Fetches per mode", default=20, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        rows = UserMessage.objects.filter(user_profile=user_profile).order_by("-message_id")[
+            : options["batch_size"]
+        ]
+        user_message_flags = {row.message_id: row.flags_list() for row in rows}
+        message_ids = sorted(user_message_flags)
+
+        timings = {}
+        for mode in ("cold", "warm"):
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                if mode == "cold":
+                    message_dict_lru.clear()
+                messages_for_ids(
+                    message_ids=message_ids,
+                    user_message_flags={
+                        message_id: list(flags) for message_id, flags in user_message_flags.items()
+                    },
+                    search_fields={},
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    allow_empty_topic_name=True,
+                    message_edit_history_visibility_policy=realm.message_edit_history_visibility_policy,
+                    user_profile=user_profile,
+                    realm=realm,
+                )
+            timings[mode] = time.perf_counter() - start
+
+        fetched = options["iterations"] * len(message_ids)
+        print(f"{len(message_ids)} messages per fetch:")
+        for mode, elapsed in timings.items():
+            print(f"{mode:>6}: {fetched / elapsed:.0f} messages/s")
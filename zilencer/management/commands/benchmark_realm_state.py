@@ -0,0 +1,61 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib import realm_state
+from zerver.lib.events import fetch_initial_state_data
+from zerver.lib.management import ZulipBaseCommand
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures how long fetching a user's initial state takes, with
+and without the realm-wide sections cached, and how long fetching each
+of those sections from the database takes."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user fetching state", required=True)
+        parser.add_argument("--iterations", help="Fetches per mode", default=20, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        event_types = list(realm_state.realm_state_sections)
+
+        timings = {}
+        fetch_seconds: dict[str, float] = {}
+        for enabled in (False, True):
+            with override_settings(REALM_STATE_CACHE_ENABLED=enabled):
+                realm_state.realm_state_fetch_seconds.clear()
+                # Warm the cache, so that the cached mode times the steady state.
+                fetch_initial_state_data(
+                    user_profile, realm=realm, event_types=event_types, linkifier_url_template=True
+                )
+                for mode, fetch_event_types in (("sections", event_types), ("full", None)):
+                    start = time.perf_counter()
+                    for _ in range(options["iterations"]):
+                        fetch_initial_state_data(
+                            user_profile,
+                            realm=realm,
+                            event_types=fetch_event_types,
+                            linkifier_url_template=True,
+                        )
+                    elapsed = time.perf_counter() - start
+                    timings[f"{mode}, {'cached' if enabled else 'uncached'}"] = elapsed
+                if not enabled:
+                    fetch_seconds = dict(realm_state.realm_state_fetch_seconds)
+
+        for mode, elapsed in timings.items():
+            print(f"{mode:>18}: {elapsed * 1000 / options['iterations']:.2f} ms per fetch")
+        print("Fetching each section from the database:")
+        for name, seconds in sorted(fetch_seconds.items()):
+            # Every uncached fetch, including the warming one, fetched
+            # each section.
+            fetches = 2 * options["iterations"] + 1
+            print(f"{name:>30}: {seconds * 1000 / fetches:.3f} ms")
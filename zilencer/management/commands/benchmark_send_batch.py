@@ -0,0 +1,74 @@
+import time
+from functools import partial
+from typing import Any
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.actions import message_send
+from zerver.actions.message_send import (
+    do_send_messages,
+    internal_prep_stream_message,
+    prep_messages_in_parallel,
+)
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.streams import create_stream_if_needed
+from zerver.models.users import get_system_bot
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the throughput of sending batches of channel messages,
+comparing serial and parallel preparation (rendering and recipient
+resolution) of the batch before do_send_messages.
+
+Creates the benchmark channel on first use; only run this in a
+development environment."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument(
+            "--batch-sizes",
+            help="Batch sizes to benchmark",
+            default=[100, 1000],
+            nargs="+",
+            type=int,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        sender = get_system_bot(settings.NOTIFICATION_BOT, realm.id)
+        stream, _ = create_stream_if_needed(realm, "batch send benchmark", acting_user=None)
+
+        for batch_size in options["batch_sizes"]:
+            for mode, min_batch_size in (("serial", batch_size + 1), ("parallel", 0)):
+                prep_message_functions = [
+                    partial(
+                        internal_prep_stream_message,
+                        sender,
+                        stream,
+                        f"{mode} {batch_size}",
+                        f"Benchmark message **{i}** with a [link](https://zulip.com) :smile:",
+                    )
+                    for i in range(batch_size)
+                ]
+
+                start = time.perf_counter()
+                with mock.patch.object(
+                    message_send, "PARALLEL_PREP_MIN_BATCH_SIZE", min_batch_size
+                ):
+                    send_requests = prep_messages_in_parallel(prep_message_functions)
+                prepared = time.perf_counter()
+                do_send_messages(send_requests)
+                sent = time.perf_counter()
+
+                print(
+                    f"{batch_size:>5} messages, {mode:>8}: "
+                    f"prep {(prepared - start) * 1000:.0f}ms, "
+                    f"send {(sent - prepared) * 1000:.0f}ms, "
+                    f"{batch_size / (sent - start):.0f} messages/s"
+                )
@@ -0,0 +1,79 @@
+import statistics
+import sys
+import time
+from typing import Any
+from unittest import mock
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.actions.message_send import check_send_stream_message
+from zerver.lib import user_message
+from zerver.lib.bulk_create import bulk_create_users
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.streams import create_stream_if_needed
+from zerver.models import Subscription, UserProfile
+from zerver.models.clients import get_client
+
+
+class Command(ZulipBaseCommand):
+    help = """Times sending messages to channels with many subscribers, comparing
+the VALUES-list and COPY paths for inserting UserMessage rows.
+
+Creates the benchmark users and channels on first use; only run this
+in a development environment."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument(
+            "--subscribers",
+            help="Channel sizes to benchmark",
+            default=[1000, 10000, 50000],
+            nargs="+",
+            type=int,
+        )
+        parser.add_argument(
+            "--messages", help="Messages to send per channel and mode", default=5, type=int
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        sizes = sorted(options["subscribers"])
+
+        print(f"Creating {sizes[-1]} users...")
+        emails = [f"fanout-benchmark-{i}@zulip.com" for i in range(sizes[-1])]
+        bulk_create_users(realm, {(email, email, True) for email in emails})
+        users = list(UserProfile.objects.filter(realm=realm, delivery_email__in=emails))
+        sender = users[0]
+        client = get_client("benchmark_stream_fanout")
+
+        for size in sizes:
+            stream_name = f"fanout benchmark {size}"
+            stream, created = create_stream_if_needed(realm, stream_name, acting_user=None)
+            if created:
+                Subscription.objects.bulk_create(
+                    Subscription(
+                        user_profile=user,
+                        recipient_id=stream.recipient_id,
+                        is_user_active=True,
+                    )
+                    for user in users[:size]
+                )
+
+            for mode, threshold in (("insert", sys.maxsize), ("copy", 0)):
+                latencies = []
+                with mock.patch.object(user_message, "BULK_INSERT_UMS_COPY_THRESHOLD", threshold):
+                    for i in range(options["messages"]):
+                        start = time.perf_counter()
+                        check_send_stream_message(
+                            sender, client, stream_name, mode, f"Benchmark message {i}"
+                        )
+                        latencies.append(time.perf_counter() - start)
+                print(
+                    f"{size:>6} subscribers, {mode:>6}: "
+                    f"median {statistics.median(latencies) * 1000:.1f}ms, "
+                    f"max {max(latencies) * 1000:.1f}ms"
+                )
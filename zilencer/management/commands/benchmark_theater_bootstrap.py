@@ -0,0 +1,75 @@
+import time
+from collections.abc import Callable
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.home import build_page_params_for_home_page_load
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.streams import access_stream_by_name
+from zerver.lib.test_helpers import HostRequestMock
+from zerver.lib.theater import build_page_params_for_theater_page_load, fetch_theater_bootstrap
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the time, and payload size, for the server's part of
+rendering a theater scene: the theater page's page_params as they were
+built from the main app's state, versus the slim theater page_params
+along with the scene's bootstrap.
+
+Each iteration registers an event queue, so Tornado must be running."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user loading the page", required=True)
+        parser.add_argument("--channel", help="Name of the channel for the scene", required=True)
+        parser.add_argument("--topic", help="Name of the topic for the scene")
+        parser.add_argument("--num-messages", help="Messages in the scene", default=100, type=int)
+        parser.add_argument("--iterations", help="Page loads per mode", default=10, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        stream, _sub = access_stream_by_name(user_profile, options["channel"])
+        request = HostRequestMock(
+            user_profile=user_profile, client_name="website", host=realm.host, path="/theater/"
+        )
+
+        def full_page_load() -> int:
+            _queue_id, page_params = build_page_params_for_home_page_load(
+                request=request,
+                user_profile=user_profile,
+                realm=realm,
+                insecure_desktop_app=False,
+                narrow=[],
+                narrow_stream=None,
+                narrow_topic_name=None,
+            )
+            return len(orjson.dumps(page_params))
+
+        def slim_page_load() -> int:
+            _queue_id, page_params = build_page_params_for_theater_page_load(request, user_profile)
+            bootstrap = fetch_theater_bootstrap(
+                request,
+                user_profile,
+                stream,
+                topic_name=options["topic"],
+                num_messages=options["num_messages"],
+            )
+            return len(orjson.dumps(page_params)) + len(orjson.dumps(bootstrap))
+
+        modes: dict[str, Callable[[], int]] = {"full": full_page_load, "slim": slim_page_load}
+        for mode, page_load in modes.items():
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                payload_size = page_load()
+            elapsed = time.perf_counter() - start
+            print(
+                f"{mode:>4}: {elapsed * 1000 / options['iterations']:.1f} ms per page load, "
+                f"{payload_size / 1024:.0f} KiB"
+            )
@@ -0,0 +1,110 @@
+import time
+from collections.abc import Callable
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.db import connection
+from sqlalchemy.sql import ColumnElement, column, literal, select, table
+from sqlalchemy.types import Boolean, Integer
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.sqlalchemy_utils import get_sqlalchemy_connection
+from zerver.lib.topic import get_topic_history_for_public_stream
+from zerver.lib.topic_sqlalchemy import topic_id_match_sa, topic_match_sa
+from zerver.models import Realm, Stream
+from zerver.models.streams import get_stream
+
+# The topic list query from before topics had IDs.
+SUBJECT_TOPIC_HISTORY_QUERY = """
+SELECT
+    "zerver_message"."subject" as topic,
+    max("zerver_message".id) as max_message_id
+FROM "zerver_message"
+WHERE (
+    "zerver_message"."realm_id" = %s AND
+    "zerver_message"."recipient_id" = %s AND
+    "zerver_message"."is_channel_message"
+)
+GROUP BY (
+    "zerver_message"."subject"
+)
+ORDER BY max("zerver_message".id) DESC
+"""
+
+
+class Command(ZulipBaseCommand):
+    help = """Compares fetching a channel topic's messages, and listing a
+channel's topics, by topic ID with doing so by topic name."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--channel", help="Name of the channel", required=True)
+        parser.add_argument("--topic", help="Name of the topic to narrow to", required=True)
+        parser.add_argument("--num-messages", help="Messages per fetch", default=1000, type=int)
+        parser.add_argument("--iterations", help="Queries per mode", default=20, type=int)
+
+    def time_narrow(
+        self, realm: Realm, stream: Stream, cond: ColumnElement[Boolean], options: dict[str, Any]
+    ) -> tuple[float, list[int]]:
+        query = (
+            select(column("id", Integer))
+            .select_from(table("zerver_message"))
+            .where(
+                column("realm_id", Integer) == literal(realm.id),
+                column("recipient_id", Integer) == literal(stream.recipient_id),
+                cond,
+            )
+            .order_by(column("id", Integer).desc())
+            .limit(options["num_messages"])
+        )
+        start = time.perf_counter()
+        for _ in range(options["iterations"]):
+            with get_sqlalchemy_connection() as sa_conn:
+                message_ids = [row[0] for row in sa_conn.execute(query)]
+        return time.perf_counter() - start, message_ids
+
+    def time_topic_list(self, fetch: Callable[[], int], iterations: int) -> tuple[float, int]:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            num_topics = fetch()
+        return time.perf_counter() - start, num_topics
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        stream = get_stream(options["channel"], realm)
+        assert stream.recipient_id is not None
+        iterations = options["iterations"]
+
+        by_name_elapsed, by_name_ids = self.time_narrow(
+            realm, stream, topic_match_sa(options["topic"]), options
+        )
+        by_id_elapsed, by_id_ids = self.time_narrow(
+            realm, stream, topic_id_match_sa(realm.id, options["topic"]), options
+        )
+        if by_name_ids != by_id_ids:
+            print("Topic narrows differ between modes")
+        print(f"narrow by name: {by_name_elapsed * 1000 / iterations:.2f} ms per fetch")
+        print(f"  narrow by ID: {by_id_elapsed * 1000 / iterations:.2f} ms per fetch")
+
+        def fetch_by_subject() -> int:
+            with connection.cursor() as cursor:
+                cursor.execute(SUBJECT_TOPIC_HISTORY_QUERY, [realm.id, stream.recipient_id])
+                return len({row[0].lower() for row in cursor.fetchall()})
+
+        def fetch_by_topic() -> int:
+            return len(
+                get_topic_history_for_public_stream(
+                    realm.id, stream.recipient_id, allow_empty_topic_name=True
+                )
+            )
+
+        by_name_elapsed, by_name_topics = self.time_topic_list(fetch_by_subject, iterations)
+        by_id_elapsed, by_id_topics = self.time_topic_list(fetch_by_topic, iterations)
+        if by_name_topics != by_id_topics:
+            print(f"Topic counts differ between modes: {by_name_topics} != {by_id_topics}")
+        print(f"topics by name: {by_name_elapsed * 1000 / iterations:.2f} ms per list")
+        print(f"  topics by ID: {by_id_elapsed * 1000 / iterations:.2f} ms per list")
@@ -0,0 +1,54 @@
+import time
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib import user_display_table
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message_cache import MessageDict
+from zerver.models import UserMessage
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures how long hydrating the senders and recipients of a
+user's most recent messages takes, with and without the realm's user
+display table."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--user", help="Email of the user fetching messages", required=True)
+        parser.add_argument("--batch-size", help="Messages per fetch", default=1000, type=int)
+        parser.add_argument("--iterations", help="Fetches per mode", default=20, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        user_profile = self.get_user(options["user"], realm)
+        message_ids = list(
+            UserMessage.objects.filter(user_profile=user_profile)
+            .order_by("-message_id")
+            .values_list("message_id", flat=True)[: options["batch_size"]]
+        )
+        message_dicts = MessageDict.ids_to_dict(message_ids)
+        num_senders = len({message_dict["sender_id"] for message_dict in message_dicts})
+
+        # Build the table up front, so both modes time the steady state.
+        user_display_table.get_user_display_tables({realm.id})
+
+        timings = {}
+        for enabled in (False, True):
+            with override_settings(USER_DISPLAY_TABLE_ENABLED=enabled):
+                start = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    objs = [dict(message_dict) for message_dict in message_dicts]
+                    MessageDict.bulk_hydrate_sender_info(objs)
+                    MessageDict.bulk_hydrate_recipient_info(objs)
+                timings["table" if enabled else "per-user"] = time.perf_counter() - start
+
+        print(f"{len(message_ids)} messages from {num_senders} senders per fetch:")
+        for mode, elapsed in timings.items():
+            print(f"{mode:>8}: {elapsed * 1000 / options['iterations']:.2f} ms per fetch")
@@ -0,0 +1,52 @@
+import gzip
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.event_delta import delta_decode_events, delta_encode_events
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.zstd_level9 import compress as zstd_compress
+from zerver.tornado.handlers import EVENTS_COMPRESSION_MIN_BYTES
+
+
+class Command(ZulipBaseCommand):
+    help = """Measures the bytes on the wire for a recorded trace of GET /events
+responses, with and without delta encoding and compression.
+
+The trace file should contain one JSON object per line, each being the
+body of a GET /events response (i.e. with an `events` array)."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("trace", help="Path to the NDJSON event trace")
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        with open(options["trace"], "rb") as f:
+            responses = [orjson.loads(line) for line in f if line.strip()]
+
+        def zstd_size(body: bytes) -> int:
+            # Tornado leaves small responses uncompressed.
+            if len(body) >= EVENTS_COMPRESSION_MIN_BYTES:
+                return len(zstd_compress(body))
+            return len(body)
+
+        totals = {"raw": 0, "gzip": 0, "zstd": 0, "delta": 0, "delta+zstd": 0}
+        for response in responses:
+            raw = orjson.dumps(response)
+            delta_events = delta_encode_events(response["events"])
+            assert delta_decode_events(delta_events) == response["events"]
+            delta = orjson.dumps({**response, "events": delta_events})
+
+            totals["raw"] += len(raw)
+            totals["gzip"] += len(gzip.compress(raw))
+            totals["zstd"] += zstd_size(raw)
+            totals["delta"] += len(delta)
+            totals["delta+zstd"] += zstd_size(delta)
+
+        print(f"{len(responses)} responses")
+        for encoding, size in totals.items():
+            ratio = size / totals["raw"] if totals["raw"] else 0
+            print(f"{encoding:>12}: {size:>12} bytes ({ratio:.1%} of raw)")
@@ -745,6 +745,7 @@ ERROR_FILE_LOG_PATH = zulip_path("/var/log/zulip/errors.log")
 MANAGEMENT_LOG_PATH = zulip_path("/var/log/zulip/manage.log")
 WORKER_LOG_PATH = zulip_path("/var/log/zulip/workers.log")
 SLOW_QUERIES_LOG_PATH = zulip_path("/var/log/zulip/slow_queries.log")
+NARROW_EXPLAIN_LOG_PATH = zulip_path("/var/log/zulip/narrow_explain.log")
 JSON_PERSISTENT_QUEUE_FILENAME_PATTERN = zulip_path("/home/zulip/tornado/event_queues%s.json")
 EMAIL_LOG_PATH = zulip_path("/var/log/zulip/send_email.log")
 EMAIL_MIRROR_LOG_PATH = zulip_path("/var/log/zulip/email_mirror.log")
@@ -874,6 +875,7 @@ LOGGING: dict[str, Any] = {
         "ldap_file": file_handler(LDAP_LOG_PATH),
         "scim_file": file_handler(SCIM_LOG_PATH),
         "slow_queries_file": file_handler(SLOW_QUERIES_LOG_PATH, level="INFO"),
+        "narrow_explain_file": file_handler(NARROW_EXPLAIN_LOG_PATH, level="INFO"),
         "registration_file": file_handler(REGISTRATION_LOG_PATH, level="INFO"),
         "webhook_anomalous_file": file_handler(
             WEBHOOK_ANOMALOUS_PAYLOADS_LOG_PATH, formatter="webhook_request_data"
@@ -1031,6 +1033,11 @@ LOGGING: dict[str, Any] = {
             "handlers": ["slow_queries_file"],
             "propagate": False,
         },
+        "zulip.narrow_explain": {
+            "level": "INFO",
+            "handlers": ["narrow_explain_file"],
+            "propagate": False,
+        },
         "zulip.soft_deactivation": {
             "handlers": ["file", "errors_file"],
             "propagate": False,
@@ -140,6 +140,32 @@ ERROR_REPORTING = True
 LOGGING_SHOW_MODULE = False
 LOGGING_SHOW_PID = False
 
+# Opt-in sampling of slow message fetches: this fraction of the
+# fetches taking at least NARROW_EXPLAIN_MIN_DURATION_MS are re-run
+# under EXPLAIN ANALYZE, and their plans logged to
+# NARROW_EXPLAIN_LOG_PATH; see the report_slow_narrows management
+# command.
+NARROW_EXPLAIN_SAMPLE_RATE = 0.0
+NARROW_EXPLAIN_MIN_DURATION_MS = 1000
+
+# Whether Markdown rendering skips the Markdown processor for
+# plain-text messages; see zerver.lib.markdown.is_plain_text_content.
+PLAIN_TEXT_PRESCAN_ENABLED = True
+
+# Whether finding the first unread message consults the users'
+# UnreadConversation rows; see get_first_unread_watermark.
+UNREAD_CONVERSATIONS_ENABLED = True
+
+# Whether message senders and direct message recipients are hydrated
+# from a per-realm table, fetched as a single cache entry, rather
+# than a cache key (or a database row) per user.
+USER_DISPLAY_TABLE_ENABLED = True
+
+# Whether the sections of the initial state which are the same for
+# every user in a realm are cached as serialized blobs shared by all
+# of them, rather than fetched for every /register request.
+REALM_STATE_CACHE_ENABLED = True
+
 # Sentry.io error defaults to off
 SENTRY_DSN: str | None = get_config("sentry", "project_dsn", None)
 SENTRY_TRACE_WORKER_RATE: float | dict[str, float] = 0.0
@@ -205,6 +231,8 @@ BOT_CONFIG_SIZE_LIMIT = 10000
 CAMO_URI = ""
 KATEX_SERVER = get_config("application_server", "katex_server", True)
 KATEX_SERVER_PORT = get_config("application_server", "katex_server_port", "9700")
+MARKDOWN_SERVER = get_config("application_server", "markdown_server", False)
+MARKDOWN_SERVER_PORT = get_config("application_server", "markdown_server_port", "9701")
 MEMCACHED_LOCATION = "127.0.0.1:11211"
 MEMCACHED_USERNAME = None if get_secret("memcached_password") is None else "zulip@localhost"
 RABBITMQ_HOST = "127.0.0.1"
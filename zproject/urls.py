@@ -80,7 +80,7 @@ from zerver.views.drafts import create_drafts, delete_draft, edit_draft, fetch_d
 from zerver.views.events_register import events_register_backend
 from zerver.views.health import health
 from zerver.views.home import accounts_accept_terms, desktop_home, doc_permalinks_view, home
-from zerver.views.theater import theater_view
+from zerver.views.theater import theater_bootstrap, theater_view
 from zerver.views.invite import (
     generate_multiuse_invite_backend,
     get_user_invites,
@@ -95,7 +95,11 @@ from zerver.views.message_edit import (
     json_fetch_raw_message,
     update_message_backend,
 )
-from zerver.views.message_fetch import get_messages_backend, messages_in_narrow_backend
+from zerver.views.message_fetch import (
+    get_channel_history_backend,
+    get_messages_backend,
+    messages_in_narrow_backend,
+)
 from zerver.views.message_flags import (
     mark_all_as_read,
     mark_stream_as_read,
@@ -104,7 +108,12 @@ from zerver.views.message_flags import (
     update_message_flags_for_narrow,
 )
 from zerver.views.message_report import report_message_backend
-from zerver.views.message_send import render_message_backend, send_message_backend, zcommand_backend
+from zerver.views.message_send import (
+    render_message_backend,
+    send_message_backend,
+    send_messages_bulk_backend,
+    zcommand_backend,
+)
 from zerver.views.message_summary import get_messages_summary
 from zerver.views.muted_users import mute_user, unmute_user
 from zerver.views.navigation_views import (
@@ -434,6 +443,16 @@ v1_api_and_json_patterns = [
         PATCH=update_persona,
     ),
     rest_path("realm/personas", GET=get_realm_personas),  # For @-mention typeahead
+    # theater -> zerver.views.theater
+    rest_path(
+        "theater/bootstrap",
+        GET=(
+            theater_bootstrap,
+            # Not documented, since it is only used by the theater
+            # frontend, and its response may change with it.
+            {"intentionally_undocumented"},
+        ),
+    ),
     rest_path("reminders", GET=fetch_reminders, POST=create_reminders_message_backend),
     rest_path(
         "reminders/<int:reminder_id>",
@@ -469,6 +488,24 @@ v1_api_and_json_patterns = [
         ),
     ),
     rest_path("messages/render", POST=render_message_backend),
+    rest_path(
+        "messages/channel_history",
+        GET=(
+            get_channel_history_backend,
+            # Not documented, since the response is an NDJSON stream,
+            # which our OpenAPI tooling doesn't support.
+            {"intentionally_undocumented"},
+        ),
+    ),
+    rest_path(
+        "messages/bulk",
+        POST=(
+            send_messages_bulk_backend,
+            # Not documented, since both the request and response are
+            # NDJSON streams, which our OpenAPI tooling doesn't support.
+            {"intentionally_undocumented"},
+        ),
+    ),
     rest_path("messages/flags", POST=update_message_flags),
     rest_path("messages/flags/narrow", POST=update_message_flags_for_narrow),
     rest_path("messages/<int:message_id>/history", GET=get_message_edit_history),